@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark loading tasks as columns and aggregating them, against reading Task objects.
+
+Run from the repository root: python -m benchmark.bench_columns [task_count ...]
+"""
+
+import os
+import sys
+import time
+import uuid
+
+from benchmark.common import temp_db_path, remove_db, measure, report
+from my_todo_app.engine import task_columns
+from my_todo_app.engine.order_key import key_from_number
+from my_todo_app.engine.task import Task
+from my_todo_app.engine.task_snapshot import SnapshotTaskDatabase, write_snapshot
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+_DAY = 24 * 60 * 60
+_WEEK = 7 * _DAY
+
+
+def main() -> None:
+    task_counts = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    for task_count in task_counts:
+        path = temp_db_path('bench_columns')
+        db = SQLite3TaskDatabase(path)
+        list_ids = [str(uuid.uuid4()) for _ in range(10)]
+        start = time.perf_counter()
+        db.load_tasks(Task(str(uuid.uuid4()), list_ids[i % 10], '', 'Task {}'.format(i), '', '', i % 3 == 0,
+                           i % 7 == 0, i * 60, i * 60, i * 60 + _WEEK if i % 3 == 0 else 0,
+                           key_from_number(i))
+                      for i in range(task_count))
+        print('{} tasks: loaded in {:.1f} s'.format(task_count, time.perf_counter() - start))
+
+        snapshot_path = path + '.snapshot'
+        write_snapshot(db, snapshot_path)
+        snapshot_db = SnapshotTaskDatabase(snapshot_path)
+
+        def report_by_columns(use_numpy: bool, source=db) -> None:
+            columns = source.get_task_columns(use_numpy=use_numpy)
+            columns.filter(completed=True).count_by('list_id', 'completed_at', width=_WEEK)
+            columns.filter(completed=False, archived=False).top_k('created_at', 20)
+
+        def report_by_tasks() -> None:
+            counts = {}
+            for task in db.get_tasks(with_memo=False):
+                if task.completed:
+                    key = (task.list_id, task.completed_at // _WEEK * _WEEK)
+                    counts[key] = counts.get(key, 0) + 1
+
+        report('  Task objects, completions per week per list', measure(report_by_tasks, 1, repeat=3))
+        report('  array columns, per week per list and top 20', measure(lambda: report_by_columns(False), 1, 3))
+        if task_columns.numpy is not None:
+            report('  NumPy columns, load only', measure(lambda: db.get_task_columns(use_numpy=True), 1, 3))
+            report('  NumPy columns, per week per list and top 20', measure(lambda: report_by_columns(True), 1, 3))
+            report('  NumPy columns of a snapshot, per week per list and top 20',
+                   measure(lambda: report_by_columns(True, snapshot_db), 1, 3))
+        snapshot_db.close()
+        os.remove(snapshot_path)
+        db.close()
+        remove_db(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark streaming import and export of a JSON Lines file.
+
+Run from the repository root: python -m benchmark.bench_io [task_count] [processes]
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+from benchmark.common import temp_db_path, remove_db
+from my_todo_app.engine.task_io import export_tasks, import_tasks
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return float('nan')
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main() -> None:
+    task_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    rand = random.Random(0)
+    jsonl_path = os.path.join(tempfile.gettempdir(), 'my_todo_benchmark', 'bench_io.jsonl')
+    os.makedirs(os.path.dirname(jsonl_path), exist_ok=True)
+
+    # A forest of lists with roots and up to three levels below them, written without holding the tasks
+    list_ids = [str(uuid.uuid4()) for _ in range(20)]
+    with open(jsonl_path, 'w', encoding='utf-8') as file:
+        for i, list_id in enumerate(list_ids):
+            file.write(json.dumps({'type': 'tasklist', 'id': list_id, 'name': 'List {}'.format(i), 'sort_key': i}))
+            file.write('\n')
+        # Ids of the last tasks at each depth, a task goes under one of them or is a root
+        recent_ids = [[] for _ in range(4)]
+        for i in range(task_count):
+            id_ = str(uuid.uuid4())
+            depth = rand.choice([0, 1, 1, 2, 2, 3])
+            while depth > 0 and not recent_ids[depth - 1]:
+                depth -= 1
+            parent_id = rand.choice(recent_ids[depth - 1]) if depth > 0 else ''
+            recent_ids[depth] = (recent_ids[depth] + [id_])[-20:]
+            file.write(json.dumps({'type': 'task', 'id': id_, 'list_id': rand.choice(list_ids),
+                                   'parent_task_id': parent_id, 'name': 'Task {}'.format(i),
+                                   'memo': 'memo {}'.format(i) if i % 5 == 0 else '',
+                                   'completed': i % 3 == 0, 'created_at': 1600000000 + i, 'sort_key': i}))
+            file.write('\n')
+    print('{} tasks, {:.1f} MB file, {:.0f} MB peak RSS after writing it'.format(
+        task_count, os.path.getsize(jsonl_path) / 1e6, peak_rss_mb()))
+
+    db_path = temp_db_path('bench_io')
+    db = SQLite3TaskDatabase(db_path)
+    start = time.perf_counter()
+    with open(jsonl_path, encoding='utf-8') as file:
+        import_tasks(db, file, processes=processes)
+    print('import: {:.1f} s, {:.0f} MB peak RSS'.format(time.perf_counter() - start, peak_rss_mb()))
+
+    start = time.perf_counter()
+    with open(jsonl_path, 'w', encoding='utf-8') as file:
+        export_tasks(db, file)
+    print('export: {:.1f} s, {:.0f} MB peak RSS'.format(time.perf_counter() - start, peak_rss_mb()))
+    db.close()
+    remove_db(db_path)
+    os.remove(jsonl_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark file size and row scans with plain and compressed memos.
+
+Run from the repository root: python -m benchmark.bench_memo [task_count]
+"""
+
+import itertools
+import os
+import random
+import string
+import sys
+import uuid
+
+from benchmark.common import temp_db_path, remove_db, measure, report
+from my_todo_app.engine import task_sqlite3
+from my_todo_app.engine.order_key import key_from_number
+from my_todo_app.engine.task import Task, TaskList
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+
+def main() -> None:
+    task_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rand = random.Random(0)
+    vocabulary = [''.join(rand.choices(string.ascii_lowercase, k=rand.randint(2, 9))) for _ in range(5000)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+
+    def memo() -> str:
+        # Most tasks have no memo, some a line or two, a few long notes of 2-20 KB
+        kind = rand.random()
+        if kind < 0.6:
+            return ''
+        word_count = rand.randint(5, 40) if kind < 0.85 else rand.randint(300, 3000)
+        lines = []
+        for start in range(0, word_count, 12):
+            lines.append(' '.join(rand.choices(vocabulary, cum_weights=cum_weights, k=min(12, word_count - start))))
+        return '\n'.join(lines)
+
+    tasklists = [TaskList(str(uuid.uuid4()), 'List {}'.format(i), key_from_number(i)) for i in range(10)]
+    tasks = [Task(str(uuid.uuid4()), rand.choice(tasklists).id, '', 'Task {}'.format(i), '', memo(),
+                  False, False, 0, 0, 0, key_from_number(i)) for i in range(task_count)]
+    print('{} tasks, {:.1f} MB of memos'.format(task_count, sum(len(t.memo.encode('utf-8')) for t in tasks) / 1e6))
+
+    threshold = task_sqlite3._MEMO_COMPRESSION_THRESHOLD
+    for label, compression_threshold in (('Plain memos', sys.maxsize), ('Compressed memos', threshold)):
+        task_sqlite3._MEMO_COMPRESSION_THRESHOLD = compression_threshold
+        path = temp_db_path('bench_memo')
+        db = SQLite3TaskDatabase(path)
+        for tasklist in tasklists:
+            db.upsert_tasklist(tasklist)
+        db.upsert_tasks(tasks)
+        db.close()
+        print('{}: {:.1f} MB file'.format(label, os.path.getsize(path) / 1e6))
+
+        db = SQLite3TaskDatabase(path)
+        report('  shown tasks of a list, memos on demand',
+               measure(lambda: db.get_tasks(list_id=tasklists[0].id, with_memo=False), number=20))
+        report('  shown tasks of a list, with memos',
+               measure(lambda: db.get_tasks(list_id=tasklists[0].id), number=20))
+        report('  full scan of the tasks table',
+               measure(lambda: db._conn.execute('select count(*) from tasks where completed = 1').fetchone(),
+                       number=20))
+        db.close()
+        remove_db(path)
+    task_sqlite3._MEMO_COMPRESSION_THRESHOLD = threshold
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark the memory taken by loaded tasks, the slotted Task against the former class with a __dict__.
+
+Run from the repository root: python -m benchmark.bench_memory [task_count ...]
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+import uuid
+from typing import *
+
+from my_todo_app.engine.task import Task
+
+
+class _DictTask:
+    """Task as it was before __slots__ and interned ids."""
+
+    def __init__(self, id_: str, list_id: str, parent_task_id: str, name: str, tags: str, memo: str, completed: bool,
+                 archived: bool, created_at: int, updated_at: int, completed_at: int, sort_key: float):
+        self.id: str = id_
+        self.list_id: str = list_id
+        self.parent_task_id: str = parent_task_id
+        self.name: str = name
+        self.tags: str = tags
+        self._memo: Optional[str] = memo
+        self._memo_loader: Optional[Callable[[], str]] = None
+        self.completed: bool = completed
+        self.archived: bool = archived
+        self.created_at: int = created_at
+        self.updated_at: int = updated_at
+        self.completed_at: int = completed_at
+        self.sort_key: float = sort_key
+
+
+def load(task_type: type, task_count: int) -> Tuple[List[Any], int, float]:
+    """Create tasks as a database read does, every row with strings of its own; return them, bytes and seconds."""
+    list_ids = [uuid.uuid4() for _ in range(10)]
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    tasks = []
+    root_id = ''
+    for i in range(task_count):
+        id_ = str(uuid.uuid4())
+        # Roots with nine children each in ten lists, ids are decoded anew per row
+        parent_id = (root_id + ' ')[:-1] if i % 10 else ''
+        tasks.append(task_type(id_, str(list_ids[i // 10 % 10]), parent_id, 'Task {}'.format(i), '', None,
+                               False, False, 1600000000, 1600000000, 0, float(i)))
+        root_id = id_ if i % 10 == 0 else root_id
+    seconds = time.perf_counter() - start
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return tasks, size, seconds
+
+
+def main() -> None:
+    task_counts = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    for task_count in task_counts:
+        print('{} tasks'.format(task_count))
+        for label, task_type in [('dict', _DictTask), ('slots', Task)]:
+            tasks, size, seconds = load(task_type, task_count)
+            print('  {:<8} {:>10.1f} MB {:>8.0f} bytes/task {:>8.2f} s'.format(
+                label, size / 1e6, size / task_count, seconds))
+            del tasks
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark per-call overhead of the engine's hot queries.
+
+Run from the repository root: python -m benchmark.bench_queries
+"""
+
+from typing import *
+
+from benchmark.common import temp_db_path, remove_db, populate, measure, report
+from my_todo_app.engine.engine import TaskEngine, TaskTreeTraversal, _TrySelect
+from my_todo_app.engine.task import Task, TaskDatabase
+from my_todo_app.engine.task_memory import InMemoryTaskDatabase
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+
+class _ConcatenatingSQLite3TaskDatabase(SQLite3TaskDatabase):
+    """The query path used before query shapes were cached: SQL built per call, select *, positional decoding."""
+
+    def get_tasks(self, id_: Optional[str] = None, list_id: Optional[str] = None, parent_task_id: Optional[str] = None,
+                  completed: Optional[bool] = None, archived: Optional[bool] = None,
+                  with_memo: bool = True) -> List[Task]:
+        select_sql = 'select * from tasks'
+        select_params = []
+        for column, value in (('id', id_), ('list_id', list_id), ('parent_task_id', parent_task_id)):
+            if value is not None:
+                select_sql += ' and' if select_params else ' where'
+                select_sql += ' {} = ?'.format(column)
+                select_params.append(value)
+        for column, value in (('completed', completed), ('archived', archived)):
+            if value is not None:
+                select_sql += ' and' if select_params else ' where'
+                select_sql += ' {} = ?'.format(column)
+                select_params.append(int(value))
+        select_sql += ' order by sort_key'
+        return self._select_rows(select_sql, select_params)
+
+    def get_first_task(self, parent_task_id: Optional[str] = None,
+                       sort_key_after: Optional[float] = None) -> Optional[Task]:
+        select_sql = 'select * from tasks'
+        select_params = []
+        if parent_task_id is not None:
+            select_sql += ' and' if select_params else ' where'
+            select_sql += ' parent_task_id = ?'
+            select_params.append(parent_task_id)
+        if sort_key_after is not None:
+            select_sql += ' and' if select_params else ' where'
+            select_sql += ' sort_key > ?'
+            select_params.append(sort_key_after)
+        select_sql += ' order by sort_key limit 1'
+        tasks = self._select_rows(select_sql, select_params)
+        return tasks[0] if tasks else None
+
+    def get_last_task(self, parent_task_id: Optional[str] = None,
+                      sort_key_before: Optional[float] = None) -> Optional[Task]:
+        select_sql = 'select * from tasks'
+        select_params = []
+        if parent_task_id is not None:
+            select_sql += ' and' if select_params else ' where'
+            select_sql += ' parent_task_id = ?'
+            select_params.append(parent_task_id)
+        if sort_key_before is not None:
+            select_sql += ' and' if select_params else ' where'
+            select_sql += ' sort_key < ?'
+            select_params.append(sort_key_before)
+        select_sql += ' order by sort_key desc limit 1'
+        tasks = self._select_rows(select_sql, select_params)
+        return tasks[0] if tasks else None
+
+    def _select_rows(self, select_sql: str, select_params: List[Any]) -> List[Task]:
+        tasks = []
+        with self._reading() as conn:
+            for row in conn.execute(select_sql, select_params):
+                tasks.append(Task(row[0], row[1], row[2], row[3], row[4], row[5], bool(int(row[6])),
+                                  bool(int(row[7])), row[8], row[9], row[10], row[11]))
+        return tasks
+
+
+def _run(label: str, db: TaskDatabase, list_id: str) -> None:
+    engine = TaskEngine(db)
+    engine.select_tasklist(list_id)
+    traversal = TaskTreeTraversal(db)
+    root = engine.shown_tasks[0]
+
+    print(label)
+    report('  TaskEngine._update_shown_tasks (500 tasks)',
+           measure(lambda: engine._update_shown_tasks(try_select=_TrySelect.SAME_ID), number=50))
+    report('  TaskTreeTraversal.children (4 children)',
+           measure(lambda: traversal.children(root), number=2000))
+    report('  get_first_task(parent_task_id, sort_key_after)',
+           measure(lambda: db.get_first_task(parent_task_id='', sort_key_after=root.sort_key), number=2000))
+    report('  get_last_task(sort_key_before)',
+           measure(lambda: db.get_last_task(sort_key_before=root.sort_key), number=2000))
+
+
+def main() -> None:
+    path = temp_db_path('bench_queries')
+    db = SQLite3TaskDatabase(path)
+    tasklists = populate(db, list_count=20, root_count=100, child_count=4)
+    db.close()
+
+    db = _ConcatenatingSQLite3TaskDatabase(path)
+    _run('Before: concatenated SQL, select *, positional decoding', db, tasklists[10].id)
+    db.close()
+
+    db = SQLite3TaskDatabase(path)
+    _run('After: cached query shapes, explicit columns, row factory', db, tasklists[10].id)
+    db.close()
+    remove_db(path)
+
+    db = InMemoryTaskDatabase()
+    tasklists = populate(db, list_count=20, root_count=100, child_count=4)
+    _run('Baseline without I/O: InMemoryTaskDatabase', db, tasklists[10].id)
+
+
+if __name__ == '__main__':
+    main()
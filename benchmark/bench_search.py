@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark full-text search on a large database.
+
+Run from the repository root: python -m benchmark.bench_search [task_count]
+"""
+
+import itertools
+import random
+import string
+import sys
+import time
+import uuid
+
+from benchmark.common import temp_db_path, remove_db, measure, report
+from my_todo_app.engine.order_key import key_from_number
+from my_todo_app.engine.task import Task, TaskList, TaskDatabase
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase, SQLite3Profile
+
+
+def main() -> None:
+    task_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    rand = random.Random(0)
+    # Random words with a Zipf-like frequency, so that a few words are common and most are rare
+    vocabulary = [''.join(rand.choices(string.ascii_lowercase, k=rand.randint(4, 9))) for _ in range(50000)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+
+    def words(k: int) -> str:
+        return ' '.join(rand.choices(vocabulary, cum_weights=cum_weights, k=k))
+
+    path = temp_db_path('bench_search')
+    db = SQLite3TaskDatabase(path, profile=SQLite3Profile.FAST)
+    tasklists = [TaskList(str(uuid.uuid4()), 'List {}'.format(i), i) for i in range(50)]
+    for tasklist in tasklists:
+        db.upsert_tasklist(tasklist)
+    start = time.perf_counter()
+    chunk_size = 50000
+    for chunk_start in range(0, task_count, chunk_size):
+        db.upsert_tasks(Task(str(uuid.uuid4()), rand.choice(tasklists).id, '',
+                             words(4), words(1), words(30), False, rand.random() < 0.3,
+                             0, 0, 0, key_from_number(i))
+                        for i in range(chunk_start, min(task_count, chunk_start + chunk_size)))
+    print('Inserted {} tasks in {:.1f} s'.format(task_count, time.perf_counter() - start))
+
+    rare, uncommon, common = vocabulary[40000], vocabulary[500], vocabulary[3]
+    report('search, rare word', measure(lambda: db.search(rare), number=20))
+    report('search, uncommon word', measure(lambda: db.search(uncommon), number=20))
+    report('search, common and uncommon word', measure(lambda: db.search(common + ' ' + uncommon), number=20))
+    report('search, prefix being typed', measure(lambda: db.search(uncommon[:4]), number=5))
+    report('search, uncommon word in one list',
+           measure(lambda: db.search(uncommon, list_id=tasklists[0].id), number=20))
+    report('search, common word', measure(lambda: db.search(common), number=1, repeat=3))
+    report('scan of the base class, rare word',
+           measure(lambda: TaskDatabase.search(db, rare), number=1, repeat=1))
+
+    db.close()
+    remove_db(path)
+
+
+if __name__ == '__main__':
+    main()
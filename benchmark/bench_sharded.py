@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark a small daily list next to a huge reference list, in one database file and in shards.
+
+Run from the repository root: python -m benchmark.bench_sharded [reference_task_count ...]
+"""
+
+import os
+import shutil
+import sys
+import uuid
+
+from benchmark.common import temp_db_path, remove_db, measure, report
+from my_todo_app.engine.order_key import key_from_number
+from my_todo_app.engine.task import Task, TaskList, TaskDatabase
+from my_todo_app.engine.task_sharded import ShardedTaskDatabase
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+
+def populate(db: TaskDatabase, reference_task_count: int) -> None:
+    db.upsert_tasklist(TaskList('reference', 'Reference', 'a0'))
+    db.upsert_tasklist(TaskList('daily', 'Daily', 'a1'))
+    db.load_tasks(Task(str(uuid.uuid4()), 'reference', '', 'Item {}'.format(i), '', 'imported ' * 20,
+                       False, False, 0, 0, 0, key_from_number(i)) for i in range(reference_task_count))
+    db.upsert_tasks(Task('daily{}'.format(i), 'daily', '', 'Daily {}'.format(i), '', '', False, False, 0, 0, 0,
+                         key_from_number(-i))
+                    for i in range(20))
+
+
+def main() -> None:
+    reference_task_counts = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    for reference_task_count in reference_task_counts:
+        print('{} reference tasks'.format(reference_task_count))
+        path = temp_db_path('bench_sharded')
+        directory = os.path.splitext(path)[0]
+        shutil.rmtree(directory, ignore_errors=True)
+        for label, db_type, db_path in [('one file', SQLite3TaskDatabase, path),
+                                        ('sharded', ShardedTaskDatabase, directory)]:
+            db = db_type(db_path)
+            populate(db, reference_task_count)
+            task = db.get_tasks(id_='daily0')[0]
+
+            def edit() -> None:
+                task.name += '.'
+                db.upsert_task(task)
+
+            report('  {} edit a daily task'.format(label), measure(edit, 100))
+            report('  {} daily tasks'.format(label),
+                   measure(lambda: db.get_tasks(list_id='daily', archived=False, with_memo=False), 100))
+            db.close()
+
+            def open_and_show() -> None:
+                cold_db = db_type(db_path)
+                cold_db.get_tasks(list_id='daily', archived=False, with_memo=False)
+                cold_db.close()
+
+            report('  {} open and daily tasks'.format(label), measure(open_and_show, 20))
+        remove_db(path)
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
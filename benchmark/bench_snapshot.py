@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark cold open and first queries of a snapshot against the SQLite3 database it was written from.
+
+Run from the repository root: python -m benchmark.bench_snapshot [root_count ...]
+"""
+
+import os
+import sys
+import time
+
+from benchmark.common import temp_db_path, remove_db, populate, measure, report
+from my_todo_app.engine.task_snapshot import SnapshotTaskDatabase, write_snapshot
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+
+def main() -> None:
+    root_counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]
+    for root_count in root_counts:
+        path = temp_db_path('bench_snapshot')
+        snapshot_path = path + '.snapshot'
+        db = SQLite3TaskDatabase(path)
+        tasklists = populate(db, 10, root_count // 10, 9)
+        root = db.get_first_task(parent_task_id='')
+        start = time.perf_counter()
+        write_snapshot(db, snapshot_path)
+        print('{} tasks: snapshot written in {:.2f} s, {:.1f} MB'.format(
+            root_count * 10, time.perf_counter() - start, os.path.getsize(snapshot_path) / 1e6))
+        db.close()
+
+        def open_and_show(db_type: type, db_path: str) -> None:
+            cold_db = db_type(db_path)
+            cold_db.get_tasks(parent_task_id=root.id, with_memo=False)
+            cold_db.close()
+
+        report('  SQLite3 open and children of a task', measure(lambda: open_and_show(SQLite3TaskDatabase, path), 20))
+        report('  snapshot open and children of a task',
+               measure(lambda: open_and_show(SnapshotTaskDatabase, snapshot_path), 20))
+        snapshot = SnapshotTaskDatabase(snapshot_path)
+        report('  snapshot shown tasks of a list',
+               measure(lambda: snapshot.get_tasks(list_id=tasklists[0].id, archived=False, with_memo=False), 5))
+        snapshot.close()
+        os.remove(snapshot_path)
+        remove_db(path)
+
+
+if __name__ == '__main__':
+    main()
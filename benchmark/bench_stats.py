@@ -0,0 +1,54 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark the statistics read from the aggregates, against the base class that scans all tasks.
+
+Run from the repository root: python -m benchmark.bench_stats [task_count ...]
+"""
+
+import sys
+import time
+import uuid
+
+from benchmark.common import temp_db_path, remove_db, measure, report
+from my_todo_app.engine.engine import DEFAULT_AGE_EDGES
+from my_todo_app.engine.order_key import key_from_number
+from my_todo_app.engine.task import Task, TaskDatabase
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+_HOUR = 60 * 60
+_DAY = 24 * _HOUR
+_WEEK = 7 * _DAY
+
+
+def main() -> None:
+    task_counts = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    for task_count in task_counts:
+        path = temp_db_path('bench_stats')
+        db = SQLite3TaskDatabase(path)
+        list_ids = [str(uuid.uuid4()) for _ in range(10)]
+        # One task a minute, every third completed a week later, every seventh archived
+        start = time.perf_counter()
+        db.load_tasks(Task(str(uuid.uuid4()), list_ids[i % 10], '', 'Task {}'.format(i), '', '', i % 3 == 0,
+                           i % 7 == 0, i * 60, i * 60, i * 60 + _WEEK if i % 3 == 0 else 0,
+                           key_from_number(i))
+                      for i in range(task_count))
+        print('{} tasks: loaded in {:.1f} s'.format(task_count, time.perf_counter() - start))
+        now = task_count * 60 // _DAY * _DAY
+        # A local midnight of a time zone 9 hours ahead of UTC
+        origin = -9 * _HOUR
+
+        report('  counts by list', measure(db.get_list_stats, 1))
+        report('  completions per day', measure(lambda: db.get_completion_stats(origin=origin), 1))
+        report('  completions per week of a list, last 8 weeks', measure(
+            lambda: db.get_completion_stats(_WEEK, origin=origin, list_id=list_ids[0], since=now - 8 * _WEEK), 1))
+        report('  open tasks by age', measure(lambda: db.get_age_stats(now, DEFAULT_AGE_EDGES), 1))
+        report('  scanning tasks, counts by list', measure(lambda: TaskDatabase.get_list_stats(db), 1, repeat=1))
+        report('  scanning tasks, completions per day', measure(
+            lambda: TaskDatabase.get_completion_stats(db, origin=origin), 1, repeat=1))
+        db.close()
+        remove_db(path)
+
+
+if __name__ == '__main__':
+    main()
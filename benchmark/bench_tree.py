@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark subtree and ancestor traversal on deep and wide trees.
+
+Run from the repository root: python -m benchmark.bench_tree
+"""
+
+import uuid
+from typing import *
+
+from benchmark.common import temp_db_path, remove_db, measure, report
+from my_todo_app.engine.engine import TaskTreeTraversal
+from my_todo_app.engine.order_key import key_from_number
+from my_todo_app.engine.task import Task, TaskList, TaskDatabase
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+from my_todo_app.engine.tree import TreeTraversal
+
+
+class _PerNodeTaskTreeTraversal(TreeTraversal):
+    """The traversal used before subtree queries: one query per visited node."""
+
+    def __init__(self, db: TaskDatabase) -> None:
+        super().__init__()
+        self._db: TaskDatabase = db
+
+    def children(self, self_: Any) -> List[Any]:
+        return self._db.get_tasks(parent_task_id=self_.id, with_memo=False)
+
+    def parent(self, self_: Any) -> Optional[Any]:
+        if not self_.parent_task_id:
+            return None
+        parent_task = self._db.get_tasks(id_=self_.parent_task_id, with_memo=False)
+        return parent_task[0] if parent_task else None
+
+
+def _insert_deep_tree(db: TaskDatabase, list_id: str, depth: int, fanout: int) -> Tuple[Task, Task]:
+    """Insert a tree of the passed depth where every node has fanout children; return the root and a deepest leaf."""
+    root = Task(str(uuid.uuid4()), list_id, '', 'Deep', '', '', False, False, 0, 0, 0, 'a0')
+    tasks = [root]
+    level = [root]
+    for _ in range(depth - 1):
+        next_level = []
+        for parent in level:
+            for _ in range(fanout):
+                next_level.append(Task(str(uuid.uuid4()), list_id, parent.id, '', '', '', False, False, 0, 0, 0,
+                                       key_from_number(len(tasks))))
+                tasks.append(next_level[-1])
+        level = next_level
+    db.upsert_tasks(tasks)
+    return root, level[-1]
+
+
+def _insert_wide_tree(db: TaskDatabase, list_id: str, width: int) -> Task:
+    root = Task(str(uuid.uuid4()), list_id, '', 'Wide', '', '', False, False, 0, 0, 0, 'a0')
+    db.upsert_tasks([root] + [Task(str(uuid.uuid4()), list_id, root.id, '', '', '', False, False, 0, 0, 0,
+                                   key_from_number(i + 1))
+                              for i in range(width)])
+    return root
+
+
+def main() -> None:
+    path = temp_db_path('bench_tree')
+    db = SQLite3TaskDatabase(path)
+    tasklist = TaskList(str(uuid.uuid4()), 'Benchmark', 0)
+    db.upsert_tasklist(tasklist)
+    chain_root, chain_leaf = _insert_deep_tree(db, tasklist.id, depth=10, fanout=1)
+    deep_root, deep_leaf = _insert_deep_tree(db, tasklist.id, depth=10, fanout=2)
+    wide_root = _insert_wide_tree(db, tasklist.id, width=10000)
+
+    per_node = _PerNodeTaskTreeTraversal(db)
+    indexed = TaskTreeTraversal(db)
+    for label, traversal in (('Per-node queries', per_node), ('Materialized path', indexed)):
+        print(label)
+        report('  descendants_and_self, 10-level chain',
+               measure(lambda: traversal.descendants_and_self(chain_root), number=200))
+        report('  descendants_and_self, 10-level binary (1023)',
+               measure(lambda: traversal.descendants_and_self(deep_root), number=5))
+        report('  descendants_and_self, 10,000 wide',
+               measure(lambda: traversal.descendants_and_self(wide_root), number=2, repeat=3))
+        report('  ancestors, 10-level chain leaf',
+               measure(lambda: traversal.ancestors(chain_leaf), number=200))
+        report('  ancestors, 10-level binary leaf',
+               measure(lambda: traversal.ancestors(deep_leaf), number=200))
+
+    db.close()
+    remove_db(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Helpers shared by the benchmark scripts."""
+
+import os
+import tempfile
+import timeit
+import uuid
+from typing import *
+
+from my_todo_app.engine.order_key import key_from_number
+from my_todo_app.engine.task import Task, TaskList, TaskDatabase
+
+
+def temp_db_path(name: str) -> str:
+    path = os.path.join(tempfile.gettempdir(), 'my_todo_benchmark', '{}.sqlite3'.format(name))
+    remove_db(path)
+    return path
+
+
+def remove_db(path: str) -> None:
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def populate(db: TaskDatabase, list_count: int, root_count: int, child_count: int,
+             memo: str = '') -> List[TaskList]:
+    """Insert lists of root tasks with children, keeping sort keys in preorder."""
+    tasklists = []
+    sort_key = 0
+    for list_index in range(list_count):
+        tasklist = TaskList(str(uuid.uuid4()), 'List {}'.format(list_index), key_from_number(list_index))
+        db.upsert_tasklist(tasklist)
+        tasklists.append(tasklist)
+        tasks = []
+        for root_index in range(root_count):
+            root = Task(str(uuid.uuid4()), tasklist.id, '', 'Task {}'.format(root_index), '', memo,
+                        False, False, 0, 0, 0, key_from_number(sort_key))
+            sort_key += 1
+            tasks.append(root)
+            for child_index in range(child_count):
+                tasks.append(Task(str(uuid.uuid4()), tasklist.id, root.id, 'Sub {}'.format(child_index), '', memo,
+                                  False, False, 0, 0, 0, key_from_number(sort_key)))
+                sort_key += 1
+        db.upsert_tasks(tasks)
+    return tasklists
+
+
+def measure(func: Callable[[], Any], number: int, repeat: int = 5) -> float:
+    """Return the best seconds per call."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def report(label: str, seconds: float) -> None:
+    print('{:<48} {:>12.1f} us'.format(label, seconds * 1e6))
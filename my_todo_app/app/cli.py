@@ -0,0 +1,191 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""The command line entry point for work without the window.
+
+Run as: python -m my_todo_app.app.cli <command> ...
+"""
+
+import argparse
+import time
+from datetime import date, datetime, timedelta
+from typing import *
+
+from my_todo_app.app.paths import get_db_path, get_backup_dir_path
+from my_todo_app.engine.engine import DEFAULT_AGE_EDGES
+from my_todo_app.engine.task import TaskDatabase
+from my_todo_app.engine.task_backup import backup_database
+from my_todo_app.engine.task_io import TaskFileFormat, export_tasks, import_tasks
+from my_todo_app.engine.task_maintenance import run_maintenance
+from my_todo_app.engine.task_renormalize import DEFAULT_MAX_KEY_LENGTH, renormalize_sort_keys
+from my_todo_app.engine.task_sharded import ShardedTaskDatabase
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+_DAY = 24 * 60 * 60
+
+
+def _open_db(args: argparse.Namespace) -> TaskDatabase:
+    if args.shards_dir:
+        return ShardedTaskDatabase(args.shards_dir)
+    return SQLite3TaskDatabase(args.db, archive_path=args.archive_db)
+
+
+def _get_format(args: argparse.Namespace) -> TaskFileFormat:
+    return TaskFileFormat(args.format) if args.format else TaskFileFormat.from_path(args.path)
+
+
+def _export(args: argparse.Namespace) -> None:
+    format_ = _get_format(args)
+    db = _open_db(args)
+    try:
+        with open(args.path, 'w', encoding='utf-8', newline='' if format_ == TaskFileFormat.CSV else None) as file:
+            tasklist_count, task_count = export_tasks(db, file, format_)
+    finally:
+        db.close()
+    print('Exported {} task lists and {} tasks'.format(tasklist_count, task_count))
+
+
+def _import(args: argparse.Namespace) -> None:
+    format_ = _get_format(args)
+    db = _open_db(args)
+    try:
+        with open(args.path, encoding='utf-8', newline='' if format_ == TaskFileFormat.CSV else None) as file:
+            tasklist_count, task_count = import_tasks(db, file, format_, processes=args.processes)
+    finally:
+        db.close()
+    print('Imported {} task lists and {} tasks'.format(tasklist_count, task_count))
+
+
+def _backup(args: argparse.Namespace) -> None:
+    print(backup_database(args.db, args.dir, generations=args.generations, pages_per_step=args.pages_per_step,
+                          archive_path=args.archive_db))
+
+
+def _maintain(args: argparse.Namespace) -> None:
+    db = SQLite3TaskDatabase(args.db, archive_path=args.archive_db)
+    try:
+        if args.enable_incremental_vacuum and db.enable_incremental_vacuum():
+            print('Enabled incremental vacuum')
+        print(run_maintenance(db, purge_archived_after_days=args.purge_archived_after_days,
+                              vacuum_pages=args.vacuum_pages, analyze=args.analyze))
+    finally:
+        db.close()
+
+
+def _renormalize(args: argparse.Namespace) -> None:
+    db = _open_db(args)
+    try:
+        print(renormalize_sort_keys(db, max_key_length=args.max_key_length))
+    finally:
+        db.close()
+
+
+def _format_age(seconds: int) -> str:
+    for unit_seconds, unit in ((365 * _DAY, 'year'), (_DAY, 'day'), (60 * 60, 'hour')):
+        if seconds >= unit_seconds and seconds % unit_seconds == 0:
+            count = seconds // unit_seconds
+            return '{} {}{}'.format(count, unit, 's' if count > 1 else '')
+    return '{} s'.format(seconds)
+
+
+def _stats(args: argparse.Namespace) -> None:
+    # Periods start at local midnight, weeks on Monday
+    today = datetime.combine(date.today(), datetime.min.time())
+    width = _DAY if args.period == 'day' else 7 * _DAY
+    origin = int((today if args.period == 'day' else today - timedelta(days=today.weekday())).timestamp())
+    since = origin - (args.periods - 1) * width
+    now = int(time.time())
+
+    db = _open_db(args)
+    try:
+        start = time.perf_counter()
+        list_stats = db.get_list_stats()
+        completion_stats = db.get_completion_stats(width=width, origin=origin, since=since)
+        age_stats = db.get_age_stats(now, DEFAULT_AGE_EDGES)
+        seconds = time.perf_counter() - start
+        list_names = {tasklist.id: tasklist.name for tasklist in db.get_tasklists()}
+    finally:
+        db.close()
+
+    print('{:<30} {:>10} {:>10} {:>10}'.format('Tasks by list', 'open', 'completed', 'archived'))
+    list_ids = [id_ for id_ in list_names if id_ in list_stats] + \
+        sorted(id_ for id_ in list_stats if id_ not in list_names)
+    for list_id in list_ids:
+        stats = list_stats[list_id]
+        print('  {:<28} {:>10} {:>10} {:>10}'.format(list_names.get(list_id, list_id)[:28], stats.open_count,
+                                                     stats.completed_count, stats.archived_count))
+    print('Completions per {}'.format(args.period))
+    for period_start in range(since, origin + 1, width):
+        print('  {:<28} {:>10}'.format(datetime.fromtimestamp(period_start).strftime('%Y-%m-%d'),
+                                       completion_stats.get(period_start, 0)))
+    print('Open tasks by age')
+    for i, edge in enumerate(DEFAULT_AGE_EDGES):
+        if i + 1 == len(DEFAULT_AGE_EDGES):
+            label = '{} or more'.format(_format_age(edge))
+        elif edge == 0:
+            label = 'under {}'.format(_format_age(DEFAULT_AGE_EDGES[i + 1]))
+        else:
+            label = '{} to {}'.format(_format_age(edge), _format_age(DEFAULT_AGE_EDGES[i + 1]))
+        print('  {:<28} {:>10}'.format(label, age_stats[edge]))
+    print('Read in {:.3f} s'.format(seconds))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m my_todo_app.app.cli')
+    parser.add_argument('--db', default=get_db_path(), help='database file (default: the application database)')
+    parser.add_argument('--archive-db', help='archive database file of the cold-storage mode')
+    parser.add_argument('--shards-dir', help='directory of a database sharded by task list, used instead of --db')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    formats = [f.value for f in TaskFileFormat]
+    export_parser = subparsers.add_parser('export', help='write task lists and tasks to a file')
+    export_parser.add_argument('path', help='JSON Lines or CSV file to write')
+    export_parser.add_argument('--format', choices=formats, help='file format (default: by extension)')
+    export_parser.set_defaults(func=_export)
+
+    import_parser = subparsers.add_parser('import', help='upsert task lists and tasks from a file')
+    import_parser.add_argument('path', help='JSON Lines or CSV file to read')
+    import_parser.add_argument('--format', choices=formats, help='file format (default: by extension)')
+    import_parser.add_argument('--processes', type=int, help='parser processes (default: one per CPU)')
+    import_parser.set_defaults(func=_import)
+
+    backup_parser = subparsers.add_parser('backup', help='copy the database to a new backup while it is in use')
+    backup_parser.add_argument('--dir', default=get_backup_dir_path(), help='backup directory')
+    backup_parser.add_argument('--generations', type=int, default=7, help='backups to keep (default: 7)')
+    backup_parser.add_argument('--pages-per-step', type=int, default=256,
+                               help='database pages copied at a time (default: 256)')
+    backup_parser.set_defaults(func=_backup)
+
+    maintenance_parser = subparsers.add_parser('maintenance', help='purge, reclaim free pages and optimize')
+    maintenance_parser.add_argument('--purge-archived-after-days', type=int, default=0,
+                                    help='delete archived tasks untouched for this many days (default: never)')
+    maintenance_parser.add_argument('--vacuum-pages', type=int, default=4096,
+                                    help='free pages to reclaim at most (default: 4096)')
+    maintenance_parser.add_argument('--analyze', action='store_true', help='analyze all tables from scratch')
+    maintenance_parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                                    help='switch an older file to incremental vacuum first, with a full VACUUM')
+    maintenance_parser.set_defaults(func=_maintain)
+
+    renormalize_parser = subparsers.add_parser('renormalize',
+                                               help='rewrite sort keys to short ones if any task list has long ones')
+    renormalize_parser.add_argument('--max-key-length', type=int, default=DEFAULT_MAX_KEY_LENGTH,
+                                    help='longer sort keys are crowded (default: {}; 0 rewrites any keys)'.format(
+                                        DEFAULT_MAX_KEY_LENGTH))
+    renormalize_parser.set_defaults(func=_renormalize)
+
+    stats_parser = subparsers.add_parser('stats', help='report task counts by list, completions and ages')
+    stats_parser.add_argument('--period', choices=['day', 'week'], default='week',
+                              help='completions are counted per period (default: week)')
+    stats_parser.add_argument('--periods', type=int, default=8,
+                              help='periods to report up to the current one (default: 8)')
+    stats_parser.set_defaults(func=_stats)
+
+    args = parser.parse_args(argv)
+    if args.shards_dir and args.func in (_backup, _maintain):
+        parser.error('{} works on one database file, not on shards'.format(args.command))
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
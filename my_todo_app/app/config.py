@@ -15,6 +15,13 @@ class Config:
         self.main_window_zoomed: bool = False
         self.theme_fontfamily: str = 'Arial'
         self.theme_monospaced_fontfamily: str = 'Courier'
+        self.backup_interval_minutes: int = 60
+        self.backup_generations: int = 7
+        self.archive_in_cold_storage: bool = False
+        # Tasks are kept in a file per task list in the shards directory instead of the database file
+        self.shard_tasks_by_list: bool = False
+        # Archived tasks untouched for this many days are deleted by the maintenance on idle, never if 0
+        self.purge_archived_after_days: int = 0
         self._path: str = path
         self._load()
 
@@ -24,6 +31,11 @@ class Config:
         values['main_window_zoomed'] = self.main_window_zoomed
         values['theme_fontfamily'] = self.theme_fontfamily
         values['theme_monospaced_fontfamily'] = self.theme_monospaced_fontfamily
+        values['backup_interval_minutes'] = self.backup_interval_minutes
+        values['backup_generations'] = self.backup_generations
+        values['archive_in_cold_storage'] = self.archive_in_cold_storage
+        values['shard_tasks_by_list'] = self.shard_tasks_by_list
+        values['purge_archived_after_days'] = self.purge_archived_after_days
         values_str = json.dumps(values, indent=2)
         if not os.path.exists(self._path):
             os.makedirs(os.path.dirname(self._path), exist_ok=True)
@@ -44,4 +56,14 @@ class Config:
             self.theme_fontfamily = values['theme_fontfamily']
         if 'theme_monospaced_fontfamily' in values:
             self.theme_monospaced_fontfamily = values['theme_monospaced_fontfamily']
+        if 'backup_interval_minutes' in values:
+            self.backup_interval_minutes = values['backup_interval_minutes']
+        if 'backup_generations' in values:
+            self.backup_generations = values['backup_generations']
+        if 'archive_in_cold_storage' in values:
+            self.archive_in_cold_storage = values['archive_in_cold_storage']
+        if 'shard_tasks_by_list' in values:
+            self.shard_tasks_by_list = values['shard_tasks_by_list']
+        if 'purge_archived_after_days' in values:
+            self.purge_archived_after_days = values['purge_archived_after_days']
 
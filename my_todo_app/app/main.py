@@ -3,6 +3,8 @@
 
 """The application entry point."""
 
+import argparse
+import logging
 import os
 from datetime import datetime
 
@@ -11,42 +13,98 @@ import uuid
 from my_todo_app.app.config import Config
 from my_todo_app.app.main_window import MainWindow
 from my_todo_app.app.my_image_set import MyImageSet
+from my_todo_app.app.paths import get_db_path, get_config_path, get_backup_dir_path, get_archive_db_path, \
+    get_shards_dir_path
 from my_todo_app.engine.task import TaskList, TaskDatabase, Task
+from my_todo_app.engine.task_backup import BackupScheduler
+from my_todo_app.engine.task_maintenance import MaintenanceScheduler
+from my_todo_app.engine.task_cache import CachingTaskDatabase
+from my_todo_app.engine.task_memory import InMemoryTaskDatabase
+from my_todo_app.engine.task_renormalize import SortKeyCheckScheduler
+from my_todo_app.engine.task_sharded import ShardedTaskDatabase
 from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
-
-
-def get_db_path():
-    appdata = os.getenv('APPDATA')
-    if appdata is not None:
-        return os.path.join(appdata, 'lpubsppop01', 'my_todo', 'db.sqlite3')
-    return '~/.lpubsppop01/my_todo/db.sqlite3'
-
-
-def get_config_path():
-    appdata = os.getenv('APPDATA')
-    if appdata is not None:
-        return os.path.join(appdata, 'lpubsppop01', 'my_todo', 'config.json')
-    return '~/.lpubsppop01/my_todo/config.json'
+from my_todo_app.engine.task_write_behind import WriteBehindTaskDatabase
 
 
 def insert_sample_if_empty(db: TaskDatabase):
     if db.get_tasklists():
         return
-    db.upsert_tasklist(TaskList('inbox', 'Inbox', 0))
-    db.upsert_tasklist(TaskList('next_action', 'Next Action', 1))
-    db.upsert_tasklist(TaskList('someday', 'Someday', 2))
+    db.upsert_tasklist(TaskList('inbox', 'Inbox', 'a0'))
+    db.upsert_tasklist(TaskList('next_action', 'Next Action', 'a1'))
+    db.upsert_tasklist(TaskList('someday', 'Someday', 'a2'))
     timestamp = int(datetime.now().timestamp())
-    db.upsert_task(Task(str(uuid.uuid4()), 'inbox', '', 'Foo', '', '', False, False, timestamp, timestamp, 0, 0))
-    db.upsert_task(Task(str(uuid.uuid4()), 'inbox', '', 'Bar', '', '', False, True, timestamp, timestamp, 0, 1))
+    db.upsert_task(Task(str(uuid.uuid4()), 'inbox', '', 'Foo', '', '', False, False, timestamp, timestamp, 0, 'a0'))
+    db.upsert_task(Task(str(uuid.uuid4()), 'inbox', '', 'Bar', '', '', False, True, timestamp, timestamp, 0, 'a1'))
+
+
+def copy_into_shards_if_empty(sharded_db: ShardedTaskDatabase, db: SQLite3TaskDatabase):
+    """Copy the task lists and tasks of the single-file database into shards that have none, as on the first start."""
+    if sharded_db.get_tasklists() or not db.get_tasklists():
+        return
+    for tasklist in db.get_tasklists():
+        sharded_db.upsert_tasklist(tasklist)
+    count = sharded_db.load_tasks(db.iter_tasks())
+    logging.getLogger(__name__).info('Copied %d tasks of %s into the shards in %s; the file is left as it was',
+                                     count, db.path, sharded_db.directory)
+
+
+def log_write_behind_error(error: BaseException):
+    logging.getLogger(__name__).error('Held task edits could not be written, trying again: %s', error)
+
+
+def open_sqlite3_db(config: Config) -> SQLite3TaskDatabase:
+    # Archived tasks may be kept in a database of their own, so that the active one stays small;
+    # an archive left by cold storage that has been turned off is moved back into the main database
+    archive_path = get_archive_db_path()
+    if not config.archive_in_cold_storage and not os.path.exists(archive_path):
+        archive_path = None
+    return SQLite3TaskDatabase(get_db_path(), archive_path=archive_path, cold_storage=config.archive_in_cold_storage)
 
 
 def main():
-    db_path = get_db_path()
-    db = SQLite3TaskDatabase(db_path)
-    insert_sample_if_empty(db)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--in-memory', action='store_true', help='use a database that is discarded on exit')
+    parser.add_argument('--sharded', action='store_true',
+                        help='keep the tasks of each task list in a file of its own (default: by the config)')
+    args = parser.parse_args()
+    # What idle jobs have done is logged to stderr
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s: %(message)s')
     config = Config(get_config_path())
+    idle_schedulers = []
+    if args.in_memory:
+        db = InMemoryTaskDatabase()
+    elif args.sharded or config.shard_tasks_by_list:
+        # Huge task lists do not slow down the others; backups and maintenance work on one file, so they are not run
+        sharded_db = ShardedTaskDatabase(get_shards_dir_path())
+        if os.path.exists(get_db_path()):
+            single_db = open_sqlite3_db(config)
+            try:
+                copy_into_shards_if_empty(sharded_db, single_db)
+            finally:
+                single_db.close()
+        logging.getLogger(__name__).info('Tasks are sharded by task list in %s; backups and maintenance are off',
+                                         sharded_db.directory)
+        db = CachingTaskDatabase(WriteBehindTaskDatabase(sharded_db, on_error=log_write_behind_error))
+        idle_schedulers.append(SortKeyCheckScheduler(sharded_db))
+    else:
+        sqlite3_db = open_sqlite3_db(config)
+        archive_path = sqlite3_db.archive_path
+        # Edits are committed once typing pauses rather than on every focus change,
+        # switching back to a task list that has not changed reads it from the cache
+        write_behind_db = WriteBehindTaskDatabase(sqlite3_db, on_error=log_write_behind_error)
+        db = CachingTaskDatabase(write_behind_db)
+        idle_schedulers.append(BackupScheduler(get_db_path(), get_backup_dir_path(),
+                                               interval_s=config.backup_interval_minutes * 60,
+                                               generations=config.backup_generations, archive_path=archive_path))
+        # The window refreshes the cache after every idle job, since the jobs write to the database beneath it
+        idle_schedulers.append(MaintenanceScheduler(sqlite3_db,
+                                                    purge_archived_after_days=config.purge_archived_after_days,
+                                                    flush=write_behind_db.flush))
+        # Crowded sort keys found on idle are rewritten by the engine of the main window
+        idle_schedulers.append(SortKeyCheckScheduler(sqlite3_db))
+    insert_sample_if_empty(db)
     images = MyImageSet()
-    window = MainWindow(db, config, images)
+    window = MainWindow(db, config, images, idle_schedulers)
     window.show()
     db.close()
 
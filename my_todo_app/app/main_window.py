@@ -3,11 +3,13 @@
 
 """The main window."""
 
+import logging
 import math
 import tkinter as tk
 import tkinter.messagebox as ttk_messagebox
 import tkinter.scrolledtext as tk_scrolledtext
 import webbrowser
+from concurrent.futures import CancelledError
 from tkinter import ttk
 from typing import *
 
@@ -17,20 +19,34 @@ from tk_html_widgets import HTMLScrolledText
 from my_todo_app.app.config import Config
 from my_todo_app.app.movetask_dialog import MoveTaskDialog
 from my_todo_app.app.my_image_set import MyImageSet
+from my_todo_app.app.searchtask_dialog import SearchTaskDialog
 from my_todo_app.app.tasklist_dialog import AddOrEditTaskListDialog
 from my_todo_app.app.theme import Theme
+from my_todo_app.engine.async_engine import AsyncTaskEngine
 from my_todo_app.engine.engine import TaskEngine, InsertTo
 from my_todo_app.engine.task import TaskDatabase
+from my_todo_app.engine.idle import IdleJobScheduler
+from my_todo_app.engine.task_renormalize import SortKeyCheckResult, RenormalizeResult
+
+_logger = logging.getLogger(__name__)
 
 
 class MainWindow:
     """A main window."""
 
-    def __init__(self, db: TaskDatabase, config: Config, images: MyImageSet) -> None:
+    def __init__(self, db: TaskDatabase, config: Config, images: MyImageSet,
+                 idle_schedulers: Sequence[IdleJobScheduler] = ()) -> None:
         self._engine: TaskEngine = TaskEngine(db)
         self._config: Config = config
         self._images = images
         self._layout()
+        self._async_engine: AsyncTaskEngine = AsyncTaskEngine(self._engine, self._root.after,
+                                                              on_busy_changed=self._busy_changed)
+        self._idle_schedulers: Sequence[IdleJobScheduler] = idle_schedulers
+        for scheduler in self._idle_schedulers:
+            scheduler.on_done = self._idle_job_done
+            scheduler.on_error = self._idle_job_failed
+            scheduler.start(self._root.after)
         self._update_tasklist_treeview()
 
     def _layout(self) -> None:
@@ -44,7 +60,11 @@ class MainWindow:
         self._root.grid_columnconfigure(1, weight=0, minsize=700)
         self._root.grid_columnconfigure(2, weight=1)
         self._root.bind('<Any-KeyPress>', self._key_pressed)
+        self._root.bind('<Any-ButtonPress>', self._button_pressed)
         self._root.bind("<Configure>", self._configure)
+        self._root.bind('<FocusIn>', self._focus_in)
+        self._root.bind('<FocusOut>', self._focus_out)
+        self._has_focus: bool = True
 
         STYLE_TASKLIST_TREEVIEW = 'tasklist_treeview.Treeview'
         STYLE_TASK_TREEVIEW = 'task_treeview.Treeview'
@@ -184,6 +204,9 @@ class MainWindow:
                                                       command=self._toggle_shows_archive_button_clicked)
         self._toggle_shows_archive_button.grid(row=0, column=8, sticky=tk.E)
 
+        self._search_task_entry = tk.Entry(center_top_frame, font=self._theme.normal_font, borderwidth=0, width=20)
+        self._search_task_entry.grid(row=0, column=9, sticky=(tk.E, tk.W), padx=(self._theme.margin, 0))
+
         self._task_treeview = ttk.Treeview(center_frame, show='tree', style=STYLE_TASK_TREEVIEW)
         self._task_treeview.column('#0', width=300)
         self._task_treeview.tag_configure('completed',
@@ -260,6 +283,21 @@ class MainWindow:
         )
         self._task_memo_html_text_grid_remember()
 
+        # Shown over the window while a bulk operation runs on the engine thread
+        self._busy_frame = ttk.Frame(self._root, style=STYLE_RIGHT_FRAME, padding=self._theme.margin_double)
+        self._busy_label = tk.Label(self._busy_frame, font=self._theme.normal_font,
+                                    background=self._theme.sub_background)
+        self._busy_label.grid(row=0, column=0, sticky=tk.W)
+        self._busy_cancel_button = tk.Button(self._busy_frame, text='Cancel',
+                                             **self._theme.text_button_kwargs(),
+                                             **self._theme.sub_color_kwargs(),
+                                             command=self._busy_cancel_button_clicked)
+        self._busy_cancel_button.grid(row=0, column=1, sticky=tk.E, padx=(self._theme.margin, 0))
+        # Indeterminate until the operation reports its counts; moving and removing a task never do
+        self._busy_progressbar = ttk.Progressbar(self._busy_frame, orient=tk.HORIZONTAL, length=240)
+        self._busy_progressbar.grid(row=1, column=0, columnspan=2, sticky=(tk.E, tk.W),
+                                    pady=(self._theme.margin, 0))
+
     def _add_tasklist_button_clicked(self) -> None:
         dialog = AddOrEditTaskListDialog(self._root, self._theme)
         if dialog.show_dialog():
@@ -333,8 +371,10 @@ class MainWindow:
 
         dialog = MoveTaskDialog(self._root, self._theme, candidate_tasklists)
         if dialog.show_dialog():
-            self._engine.move_selected_task(list_id=dialog.result_tasklist.id)
-            self._update_task_treeview()
+            self._async_engine.move_selected_task(list_id=dialog.result_tasklist.id,
+                                                  on_done=self._bulk_operation_done,
+                                                  on_error=self._bulk_operation_failed,
+                                                  on_progress=self._bulk_operation_progressed)
 
     def _remove_task_button_clicked(self) -> None:
         if self._engine.selected_task is None:
@@ -343,8 +383,9 @@ class MainWindow:
 
         message = 'Really remove {} and its descendants?'.format(self._engine.selected_task.name)
         if ttk_messagebox.askokcancel('Confirm', message):
-            self._engine.remove_selected_task()
-            self._update_task_treeview()
+            self._async_engine.remove_selected_task(on_done=self._bulk_operation_done,
+                                                    on_error=self._bulk_operation_failed,
+                                                    on_progress=self._bulk_operation_progressed)
 
     def _complete_task_button_clicked(self) -> None:
         if self._engine.selected_task is None:
@@ -375,11 +416,98 @@ class MainWindow:
             ttk_messagebox.showerror('Error', 'No task is selected.')
             return
 
+        callbacks = dict(on_done=self._bulk_operation_done, on_error=self._bulk_operation_failed,
+                         on_progress=self._bulk_operation_progressed)
         if self._engine.selected_task.archived:
-            self._engine.unarchive_selected_task()
+            self._async_engine.unarchive_selected_task(**callbacks)
         else:
-            self._engine.archive_selected_task()
+            self._async_engine.archive_selected_task(**callbacks)
+
+    # noinspection PyUnusedLocal
+    def _bulk_operation_done(self, result) -> None:
+        self._update_task_treeview()
+
+    def _bulk_operation_failed(self, error: BaseException) -> None:
+        # The engine has read its tasks again after the rollback
         self._update_task_treeview()
+        if not isinstance(error, CancelledError):
+            ttk_messagebox.showerror('Error', str(error))
+
+    def _idle_job_done(self, result: Any) -> None:
+        self._refresh()
+        # Crowded sort keys are rewritten through the engine, which must not be used meanwhile
+        if isinstance(result, SortKeyCheckResult):
+            if result.crowded_list_ids and not self._async_engine.busy:
+                self._async_engine.renormalize_sort_keys(result.max_key_length, on_done=self._renormalize_done,
+                                                         on_error=self._bulk_operation_failed)
+            return
+        # Backups and maintenance report what they have done
+        _logger.info('%s', result)
+
+    def _renormalize_done(self, result: RenormalizeResult) -> None:
+        _logger.info('%s', result)
+        self._update_tasklist_treeview()
+
+    def _idle_job_failed(self, error: BaseException) -> None:
+        # A failed job may have written part of its work
+        self._refresh()
+        ttk_messagebox.showerror('Error', str(error))
+
+    def _refresh(self) -> None:
+        # Writes made beside the engine, by idle jobs or other processes, are not seen through its cache until then
+        if self._async_engine.busy:
+            return
+        self._engine.refresh()
+        self._update_tasklist_treeview()
+
+    # noinspection PyUnusedLocal
+    def _focus_in(self, event) -> None:
+        # Back from another application, such as the command line interface on the same database
+        if not self._has_focus:
+            self._has_focus = True
+            self._refresh()
+
+    # noinspection PyUnusedLocal
+    def _focus_out(self, event) -> None:
+        # Focus moving between the widgets of the window leaves a widget focused once settled
+        self._root.after_idle(self._check_focus_lost)
+
+    def _check_focus_lost(self) -> None:
+        try:
+            self._has_focus = self._root.focus_get() is not None
+        except KeyError:
+            # A dialog of tkinter itself has the focus
+            pass
+
+    def _bulk_operation_progressed(self, done: int, total: int) -> None:
+        self._busy_label.config(text='Working... {} / {}'.format(done, total))
+        self._busy_progressbar.stop()
+        self._busy_progressbar.config(mode='determinate', maximum=max(total, 1), value=done)
+        self._update_busy_cancel_button()
+
+    def _busy_changed(self, busy: bool) -> None:
+        # The engine must not be used until the operation finishes, so the busy frame takes all input
+        if busy:
+            self._busy_label.config(text='Working...')
+            self._busy_progressbar.config(mode='indeterminate', value=0)
+            self._busy_progressbar.start()
+            self._update_busy_cancel_button()
+            self._busy_frame.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
+            self._busy_frame.grab_set()
+            self._root.config(cursor='watch')
+        else:
+            self._busy_progressbar.stop()
+            self._busy_frame.grab_release()
+            self._busy_frame.place_forget()
+            self._root.config(cursor='')
+
+    def _update_busy_cancel_button(self) -> None:
+        # Moving and removing a task can not be stopped once started
+        self._busy_cancel_button.config(state=tk.NORMAL if self._async_engine.cancellable else tk.DISABLED)
+
+    def _busy_cancel_button_clicked(self) -> None:
+        self._async_engine.cancel()
+        self._update_busy_cancel_button()
 
     def _toggle_shows_archive_button_clicked(self) -> None:
         self._engine.shows_archive = not self._engine.shows_archive
@@ -395,9 +523,17 @@ class MainWindow:
     def _open_github_button_clicked() -> None:
         webbrowser.open('https://github.com/lpubsppop01/my_todo_app')
 
+    def _button_pressed(self, _) -> None:
+        for scheduler in self._idle_schedulers:
+            scheduler.notify_activity()
+
     def _key_pressed(self, event) -> None:
+        for scheduler in self._idle_schedulers:
+            scheduler.notify_activity()
         if event.widget == self._task_name_entry:
             self._task_name_entry_key_pressed(event)
+        if event.widget == self._search_task_entry:
+            self._search_task_entry_key_pressed(event)
         if event.widget == self._task_memo_text:
             self._task_memo_text_key_pressed(event)
 
@@ -421,6 +557,27 @@ class MainWindow:
         self._engine.edit_selected_task(name=self._task_name_entry.get())
         self._update_task_treeview()
 
+    def _search_task_entry_key_pressed(self, event) -> None:
+        if event.keysym == 'Return':
+            self._search_task_entry_entered()
+        elif event.keysym == 'Escape':
+            self._search_task_entry.delete(0, tk.END)
+
+    def _search_task_entry_entered(self) -> None:
+        query = self._search_task_entry.get()
+        if not query.strip():
+            return
+
+        results = self._engine.search_tasks(query)
+        if not results:
+            ttk_messagebox.showinfo('Search', 'No task matches {}.'.format(query))
+            return
+
+        dialog = SearchTaskDialog(self._root, self._theme, results, self._engine.shown_tasklists)
+        if dialog.show_dialog():
+            self._engine.select_searched_task(dialog.result_task)
+            self._update_tasklist_treeview()
+
     def _memo_mode_edit_button_clicked(self) -> None:
         self._memo_mode_is_edit = True
         self._update_task_controls()
@@ -616,3 +773,6 @@ class MainWindow:
 
     def show(self) -> None:
         self._root.mainloop()
+        self._async_engine.close()
+        for scheduler in self._idle_schedulers:
+            scheduler.close()
@@ -0,0 +1,41 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Locations of the application files."""
+
+import os
+
+
+def get_db_path():
+    appdata = os.getenv('APPDATA')
+    if appdata is not None:
+        return os.path.join(appdata, 'lpubsppop01', 'my_todo', 'db.sqlite3')
+    return '~/.lpubsppop01/my_todo/db.sqlite3'
+
+
+def get_archive_db_path():
+    appdata = os.getenv('APPDATA')
+    if appdata is not None:
+        return os.path.join(appdata, 'lpubsppop01', 'my_todo', 'archive.sqlite3')
+    return '~/.lpubsppop01/my_todo/archive.sqlite3'
+
+
+def get_shards_dir_path():
+    appdata = os.getenv('APPDATA')
+    if appdata is not None:
+        return os.path.join(appdata, 'lpubsppop01', 'my_todo', 'shards')
+    return '~/.lpubsppop01/my_todo/shards'
+
+
+def get_config_path():
+    appdata = os.getenv('APPDATA')
+    if appdata is not None:
+        return os.path.join(appdata, 'lpubsppop01', 'my_todo', 'config.json')
+    return '~/.lpubsppop01/my_todo/config.json'
+
+
+def get_backup_dir_path():
+    appdata = os.getenv('APPDATA')
+    if appdata is not None:
+        return os.path.join(appdata, 'lpubsppop01', 'my_todo', 'backups')
+    return '~/.lpubsppop01/my_todo/backups'
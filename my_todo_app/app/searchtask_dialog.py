@@ -0,0 +1,129 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Implement dialog to choose one of the tasks found by Search-Task operation."""
+
+import tkinter as tk
+from tkinter import ttk
+from typing import *
+
+from my_todo_app.app.theme import Theme
+from my_todo_app.app.window_utility import show_dialog, get_center_geometry
+from my_todo_app.engine.task import Task, TaskList, TaskSearchResult
+
+
+class SearchTaskDialog:
+    """Dialog to choose one of the tasks found by Search-Task operation."""
+
+    def __init__(self, parent: tk.Tk, theme: Theme, results: List[TaskSearchResult],
+                 tasklists: List[TaskList]) -> None:
+        assert results
+        self._parent: tk.Tk = parent
+        self._theme: Theme = theme
+        self._results: List[TaskSearchResult] = results
+        self._tasklist_names: Dict[str, str] = {t.id: t.name for t in tasklists}
+        self.result_task: Optional[Task] = results[0].task
+        self._ok: bool = False
+        self._layout()
+
+    def _layout(self) -> None:
+        self._dialog = tk.Toplevel(self._parent)
+        self._dialog.title('Search Results')
+        self._dialog.geometry(get_center_geometry(self._parent, 600, 400))
+        self._dialog.grid_rowconfigure(0, weight=1)
+        self._dialog.grid_rowconfigure(1, weight=0)
+        self._dialog.grid_columnconfigure(0, weight=1)
+        self._dialog.bind('<Any-KeyPress>', self._key_pressed)
+
+        STYLE_FRAME = 'dialog.TFrame'
+
+        style = ttk.Style(self._dialog)
+        self._theme.configure_style(style)
+        self._theme.configure_main_frame_style(style, STYLE_FRAME)
+
+        dialog_frame = ttk.Frame(self._dialog, style=STYLE_FRAME)
+        dialog_frame.grid(row=0, column=0, sticky=(tk.N, tk.S, tk.E, tk.W))
+        dialog_frame.grid_rowconfigure(0, weight=1)
+        dialog_frame.grid_columnconfigure(0, weight=1)
+
+        top_frame = ttk.Frame(dialog_frame, style=STYLE_FRAME)
+        top_frame.grid(row=0, column=0, sticky=(tk.N, tk.S, tk.E, tk.W),
+                       padx=(0, self._theme.margin),
+                       pady=(self._theme.margin, self._theme.margin_half))
+        top_frame.grid_rowconfigure(0, weight=1)
+        top_frame.grid_columnconfigure(0, weight=1)
+        top_frame.grid_columnconfigure(1, weight=0)
+
+        self._result_listbox = tk.Listbox(top_frame, exportselection=False, relief=tk.FLAT,
+                                          font=self._theme.normal_font, activestyle=tk.NONE,
+                                          borderwidth=0, highlightthickness=0,
+                                          background=self._theme.main_background,
+                                          foreground=self._theme.main_foreground,
+                                          selectbackground=self._theme.main_background_selected,
+                                          selectforeground=self._theme.main_foreground_selected)
+        self._result_listbox.grid(row=0, column=0, sticky=(tk.N, tk.S, tk.E, tk.W))
+        index = 0
+        for result in self._results:
+            name = result.task.name if result.task.name else 'Empty'
+            tasklist_name = self._tasklist_names.get(result.task.list_id, '')
+            snippet = ' '.join(result.snippet.split())
+            self._result_listbox.insert(index, '{} ({}): {}'.format(name, tasklist_name, snippet))
+            index += 1
+        self._result_listbox.selection_set(0)
+        self._result_listbox.focus_set()
+        self._result_listbox.bind('<Double-Button-1>', self._result_listbox_double_clicked)
+
+        result_listbox_scrollbar = tk.Scrollbar(top_frame, orient=tk.VERTICAL,
+                                                command=self._result_listbox.yview)
+        self._result_listbox['yscrollcommand'] = result_listbox_scrollbar.set
+        result_listbox_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+
+        bottom_frame = ttk.Frame(dialog_frame, style=STYLE_FRAME)
+        bottom_frame.grid(row=1, column=0, sticky=(tk.N, tk.S, tk.E),
+                          padx=(self._theme.margin, self._theme.margin),
+                          pady=(self._theme.margin_half, self._theme.margin))
+        bottom_frame.grid_rowconfigure(0, weight=1)
+        bottom_frame.grid_columnconfigure(0, weight=1)
+
+        ok_button = tk.Button(bottom_frame, text='OK', **self._theme.text_button_kwargs(),
+                              command=self._ok_button_clicked)
+        ok_button.grid(row=0, column=0, sticky=tk.E)
+
+        cancel_button = tk.Button(bottom_frame, text='Cancel', **self._theme.text_button_kwargs(),
+                                  command=self._cancel_button_clicked)
+        cancel_button.grid(row=0, column=1, sticky=tk.E, padx=(self._theme.margin, 0))
+
+    def _key_pressed(self, event) -> None:
+        if event.keysym == 'Return':
+            self._on_ok()
+        elif event.keysym == 'Escape':
+            self._on_cancel()
+
+    # noinspection PyUnusedLocal
+    def _result_listbox_double_clicked(self, event) -> None:
+        self._on_ok()
+
+    def _ok_button_clicked(self) -> None:
+        self._on_ok()
+
+    def _on_ok(self) -> None:
+        self.result_task = self._get_selected_task()
+        self._ok = self.result_task is not None
+        self._dialog.destroy()
+
+    def _get_selected_task(self) -> Optional[Task]:
+        selected_task: Optional[Task] = None
+        selected_indices = self._result_listbox.curselection()
+        if selected_indices:
+            selected_task = self._results[selected_indices[0]].task
+        return selected_task
+
+    def _cancel_button_clicked(self) -> None:
+        self._on_cancel()
+
+    def _on_cancel(self) -> None:
+        self._dialog.destroy()
+
+    def show_dialog(self) -> bool:
+        show_dialog(self._dialog, self._parent)
+        return self._ok
@@ -0,0 +1,159 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Run task engine operations off the UI thread."""
+
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, CancelledError
+from typing import *
+
+from my_todo_app.engine.engine import TaskEngine
+from my_todo_app.engine.task_renormalize import DEFAULT_MAX_KEY_LENGTH
+
+_T = TypeVar('_T')
+
+# Called with the counts of done and all work items
+ProgressCallback = Callable[[int, int], None]
+
+
+class AsyncTaskEngine:
+    """A facade that runs the bulk operations of a task engine on one worker thread.
+
+    Operations run one at a time in submission order and return futures. Completion, error and progress callbacks are
+    not called on the worker thread but on the UI thread: after is a scheduler like tkinter's Misc.after, which the
+    facade uses to poll for finished work while anything is running. The engine must not be used directly while the
+    facade is busy.
+
+    Moving and removing a task write its subtree by one statement, which reports no progress, so they are submitted as
+    not cancellable: they can be cancelled only before they start.
+    """
+
+    def __init__(self, engine: TaskEngine, after: Callable[[int, Callable[[], None]], Any],
+                 poll_interval_ms: int = 20, on_busy_changed: Optional[Callable[[bool], None]] = None):
+        self._engine: TaskEngine = engine
+        self._after: Callable[[int, Callable[[], None]], Any] = after
+        self._poll_interval_ms: int = poll_interval_ms
+        self.on_busy_changed: Optional[Callable[[bool], None]] = on_busy_changed
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1)
+        # Callbacks queued by the worker thread for the UI thread
+        self._callbacks: queue.Queue = queue.Queue()
+        self._cancel_events: Dict[Future, threading.Event] = {}
+        self._uncancellable_futures: Set[Future] = set()
+        self._polling: bool = False
+
+    @property
+    def engine(self) -> TaskEngine:
+        return self._engine
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._cancel_events)
+
+    @property
+    def cancellable(self) -> bool:
+        """Whether any submitted operation can still be cancelled, see cancel."""
+        return any(not f.done() and (f not in self._uncancellable_futures or not f.running())
+                   for f in self._cancel_events)
+
+    def submit(self, operation: Callable[[ProgressCallback], _T],
+               on_done: Optional[Callable[[_T], None]] = None,
+               on_error: Optional[Callable[[BaseException], None]] = None,
+               on_progress: Optional[ProgressCallback] = None, cancellable: bool = True) -> Future:
+        """Run the operation, which is passed a progress callback, on the worker thread.
+
+        on_error is passed the exception the operation raised, a CancelledError if it has been cancelled. An operation
+        that is not cancellable runs to its end once started.
+        """
+        cancel_event = threading.Event()
+
+        def progress(done: int, total: int) -> None:
+            # Raising here aborts the operation, which rolls back its transaction
+            if cancel_event.is_set():
+                raise CancelledError()
+            if on_progress is not None:
+                self._callbacks.put(lambda: on_progress(done, total))
+
+        def run() -> _T:
+            if cancel_event.is_set():
+                raise CancelledError()
+            return operation(progress)
+
+        was_busy = self.busy
+        future = self._executor.submit(run)
+        self._cancel_events[future] = cancel_event
+        if not cancellable:
+            self._uncancellable_futures.add(future)
+        future.add_done_callback(lambda f: self._callbacks.put(lambda: self._finish(f, on_done, on_error)))
+        if not was_busy:
+            self._notify_busy_changed()
+        if not self._polling:
+            self._polling = True
+            self._after(self._poll_interval_ms, self._poll)
+        return future
+
+    def cancel(self, future: Optional[Future] = None) -> None:
+        """Cancel the operation of the future, all submitted operations if no future is passed.
+
+        A running operation stops at its next progress report, unless it has been submitted as not cancellable.
+        """
+        futures = [future] if future is not None else list(self._cancel_events)
+        for f in futures:
+            cancel_event = self._cancel_events.get(f)
+            # Future.cancel fails once the operation has started
+            if cancel_event is not None and (f.cancel() or f not in self._uncancellable_futures):
+                cancel_event.set()
+
+    def close(self) -> None:
+        """Cancel the operations and wait for the running one to stop."""
+        self.cancel()
+        self._executor.shutdown(wait=True)
+
+    def _poll(self) -> None:
+        while True:
+            try:
+                callback = self._callbacks.get_nowait()
+            except queue.Empty:
+                break
+            callback()
+        if self._cancel_events:
+            self._after(self._poll_interval_ms, self._poll)
+        else:
+            self._polling = False
+
+    def _finish(self, future: Future, on_done: Optional[Callable[[Any], None]],
+                on_error: Optional[Callable[[BaseException], None]]) -> None:
+        del self._cancel_events[future]
+        self._uncancellable_futures.discard(future)
+        if not self._cancel_events:
+            self._notify_busy_changed()
+        if future.cancelled():
+            error: Optional[BaseException] = CancelledError()
+        else:
+            error = future.exception()
+        if error is not None:
+            if on_error is not None:
+                on_error(error)
+        elif on_done is not None:
+            on_done(future.result())
+
+    def _notify_busy_changed(self) -> None:
+        if self.on_busy_changed is not None:
+            self.on_busy_changed(self.busy)
+
+    def archive_selected_task(self, **callbacks) -> Future:
+        return self.submit(lambda progress: self._engine.archive_selected_task(progress=progress), **callbacks)
+
+    def unarchive_selected_task(self, **callbacks) -> Future:
+        return self.submit(lambda progress: self._engine.unarchive_selected_task(progress=progress), **callbacks)
+
+    def move_selected_task(self, list_id: str, **callbacks) -> Future:
+        return self.submit(lambda _progress: self._engine.move_selected_task(list_id), cancellable=False,
+                           **callbacks)
+
+    def remove_selected_task(self, **callbacks) -> Future:
+        return self.submit(lambda _progress: self._engine.remove_selected_task(), cancellable=False, **callbacks)
+
+    def renormalize_sort_keys(self, max_key_length: int = DEFAULT_MAX_KEY_LENGTH, **callbacks) -> Future:
+        return self.submit(lambda progress: self._engine.renormalize_sort_keys(max_key_length, progress=progress),
+                           **callbacks)
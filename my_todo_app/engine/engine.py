@@ -10,10 +10,27 @@ from datetime import datetime
 from enum import Enum
 from typing import *
 
-from my_todo_app.engine.task import TaskList, Task, TaskDatabase
+from my_todo_app.engine import order_key, task_renormalize
+from my_todo_app.engine.task import TaskList, Task, TaskDatabase, TaskListStats, TaskSearchResult
 from my_todo_app.engine.tree import TreeTraversal
 
 
+# Changed tasks written between two progress reports of bulk operations
+_PROGRESS_CHUNK_SIZE = 500
+
+_DAY = 24 * 60 * 60
+
+# Age buckets of open tasks reported by default: under a day, a week, 30 days, a year, and older
+DEFAULT_AGE_EDGES: Tuple[int, ...] = (0, _DAY, 7 * _DAY, 30 * _DAY, 365 * _DAY)
+
+# Statistics results kept at most; the cache is emptied when full
+_STATS_CACHE_SIZE = 64
+
+
+def _sort_key_of(task: Optional[Task]) -> Optional[str]:
+    return task.sort_key if task is not None else None
+
+
 class InsertTo(Enum):
     FIRST_SIBLING = 0
     LAST_SIBLING = 1
@@ -36,17 +53,25 @@ class TaskTreeTraversal(TreeTraversal):
 
     def children(self, self_: Any) -> List[Any]:
         self_task: Task = self_
-        return self._db.get_tasks(parent_task_id=self_task.id)
+        return self._db.get_tasks(parent_task_id=self_task.id, with_memo=False)
 
     def parent(self, self_: Any) -> Optional[Any]:
         self_task: Task = self_
         if not self_task.parent_task_id:
             return None
-        parent_task = self._db.get_tasks(id_=self_task.parent_task_id)
+        parent_task = self._db.get_tasks(id_=self_task.parent_task_id, with_memo=False)
         if not parent_task:
             return None
         return parent_task[0]
 
+    def descendants(self, self_: Any) -> List[Any]:
+        self_task: Task = self_
+        return self._db.get_subtree(self_task.id, with_memo=False)[1:]
+
+    def ancestors(self, self_: Any) -> List[Any]:
+        self_task: Task = self_
+        return self._db.get_ancestors(self_task.id, with_memo=False)
+
 
 class TaskEngine:
     """Task management application engine."""
@@ -59,6 +84,7 @@ class TaskEngine:
         self._shown_tasks: List[Task] = []
         self._selected_tasklist: Optional[TaskList] = None
         self._selected_task: Optional[Task] = None
+        self._stats_cache: Dict[Tuple, Any] = {}
         self._update_shown_tasklists()
 
     @property
@@ -98,12 +124,55 @@ class TaskEngine:
         if not matched_tasks:
             raise RuntimeError('Task with passed ID is not shown')
         self._selected_task = matched_tasks[0]
+        self._load_selected_task_memo()
+
+    def search_tasks(self, query: str, limit: int = 50) -> List[TaskSearchResult]:
+        return self._db.search(query, include_archived=self._shows_archive, limit=limit)
+
+    def get_list_stats(self) -> Dict[str, TaskListStats]:
+        """Return the counts of open, completed and archived tasks by list id.
+
+        This and the other statistics are cached until the engine writes a task.
+        """
+        return self._get_stats(('lists',), self._db.get_list_stats)
+
+    def get_completion_stats(self, width: int = _DAY, origin: int = 0, list_id: Optional[str] = None,
+                             since: Optional[int] = None) -> Dict[int, int]:
+        """Return the counts of completed tasks by bucket start, see TaskDatabase.get_completion_stats."""
+        return self._get_stats(('completions', width, origin, list_id, since),
+                               lambda: self._db.get_completion_stats(width=width, origin=origin, list_id=list_id,
+                                                                     since=since))
+
+    def get_age_stats(self, edges: Sequence[int] = DEFAULT_AGE_EDGES, list_id: Optional[str] = None,
+                      now: Optional[int] = None) -> Dict[int, int]:
+        """Return the counts of open tasks by age bucket, see TaskDatabase.get_age_stats.
+
+        Without now, ages are taken at the start of the current minute, so that the result is cached for a minute.
+        """
+        if now is None:
+            now = int(datetime.now().timestamp()) // 60 * 60
+        return self._get_stats(('ages', tuple(edges), list_id, now),
+                               lambda: self._db.get_age_stats(now, edges, list_id=list_id))
+
+    def _get_stats(self, key: Tuple, compute: Callable[[], Dict]) -> Dict:
+        stats = self._stats_cache.get(key)
+        if stats is None:
+            if len(self._stats_cache) >= _STATS_CACHE_SIZE:
+                self._stats_cache.clear()
+            stats = self._stats_cache[key] = compute()
+        return dict(stats)
+
+    def select_searched_task(self, task: Task) -> None:
+        matched_tasklists = [t for t in self._shown_tasklists if t.id == task.list_id]
+        if not matched_tasklists:
+            raise RuntimeError('Task list of passed task is not shown')
+        self._selected_tasklist = matched_tasklists[0]
+        self._selected_task = task
+        self._update_shown_tasks(try_select=_TrySelect.SAME_ID)
 
     def add_tasklist(self, name: str) -> None:
-        new_tasklist = TaskList(str(uuid.uuid4()), name, 0)
-        if self._shown_tasklists:
-            sort_key_max = max([t.sort_key for t in self._shown_tasklists])
-            new_tasklist.sort_key = sort_key_max + 1
+        sort_key_max = max([t.sort_key for t in self._shown_tasklists]) if self._shown_tasklists else None
+        new_tasklist = TaskList(str(uuid.uuid4()), name, order_key.key_between(sort_key_max, None))
         self._selected_tasklist = new_tasklist
         self._db.upsert_tasklist(new_tasklist)
         self._update_shown_tasklists()
@@ -139,11 +208,9 @@ class TaskEngine:
             raise RuntimeError('The selected task list is top one')
 
         selected_index = self._shown_tasklists.index(self._selected_tasklist)
-        if selected_index > 1:
-            self._selected_tasklist.sort_key = (self._shown_tasklists[selected_index - 1].sort_key +
-                                                self._shown_tasklists[selected_index - 2].sort_key) / 2
-        else:
-            self._selected_tasklist.sort_key = self._shown_tasklists[selected_index - 1].sort_key - 1
+        sort_key_after = self._shown_tasklists[selected_index - 2].sort_key if selected_index > 1 else None
+        self._selected_tasklist.sort_key = order_key.key_between(sort_key_after,
+                                                                 self._shown_tasklists[selected_index - 1].sort_key)
         self._db.upsert_tasklist(self._selected_tasklist)
         self._update_shown_tasklists()
 
@@ -161,11 +228,10 @@ class TaskEngine:
             raise RuntimeError('The selected task list is bottom one')
 
         selected_index = self._shown_tasklists.index(self._selected_tasklist)
-        if selected_index < len(self.shown_tasklists) - 2:
-            self._selected_tasklist.sort_key = (self._shown_tasklists[selected_index + 1].sort_key +
-                                                self._shown_tasklists[selected_index + 2].sort_key) / 2
-        else:
-            self._selected_tasklist.sort_key = self._shown_tasklists[selected_index + 1].sort_key + 1
+        sort_key_before = self._shown_tasklists[selected_index + 2].sort_key \
+            if selected_index < len(self.shown_tasklists) - 2 else None
+        self._selected_tasklist.sort_key = order_key.key_between(self._shown_tasklists[selected_index + 1].sort_key,
+                                                                 sort_key_before)
         self._db.upsert_tasklist(self._selected_tasklist)
         self._update_shown_tasklists()
 
@@ -176,7 +242,7 @@ class TaskEngine:
         id_ = str(uuid.uuid4())
         list_id = self._selected_tasklist.id
         timestamp = int(datetime.now().timestamp())
-        new_task = Task(id_, list_id, '', '', '', '', False, False, timestamp, timestamp, 0, 0)
+        new_task = Task(id_, list_id, '', '', '', '', False, False, timestamp, timestamp, 0, order_key.FIRST_KEY)
         if name is not None:
             new_task.name = name
 
@@ -192,38 +258,23 @@ class TaskEngine:
         elif to == InsertTo.FIRST_SIBLING:
             first_sibling = self._db.get_first_task(parent_task_id=self_task.parent_task_id)
             prev_of_that = self._db.get_last_task(sort_key_before=first_sibling.sort_key)
-            if prev_of_that is not None:
-                new_task.sort_key = (prev_of_that.sort_key + first_sibling.sort_key) / 2
-            else:
-                new_task.sort_key = first_sibling.sort_key - 1
+            new_task.sort_key = order_key.key_between(_sort_key_of(prev_of_that), first_sibling.sort_key)
         elif to == InsertTo.LAST_SIBLING:
             last_sibling = self._db.get_last_task(parent_task_id=self_task.parent_task_id)
             next_of_that = self._db.get_first_task(sort_key_after=last_sibling.sort_key)
-            if next_of_that is not None:
-                new_task.sort_key = (last_sibling.sort_key + next_of_that.sort_key) / 2
-            else:
-                new_task.sort_key = last_sibling.sort_key + 1
+            new_task.sort_key = order_key.key_between(last_sibling.sort_key, _sort_key_of(next_of_that))
         elif to == InsertTo.FIRST_CHILD:
             next_of_selected = self._db.get_first_task(sort_key_after=self_task.sort_key)
-            if next_of_selected is not None:
-                new_task.sort_key = (self_task.sort_key + next_of_selected.sort_key) / 2
-            else:
-                new_task.sort_key = self_task.sort_key + 1
+            new_task.sort_key = order_key.key_between(self_task.sort_key, _sort_key_of(next_of_selected))
         elif to == InsertTo.LAST_CHILD:
             next_sibling = self._db.get_first_task(parent_task_id=self_task.parent_task_id,
                                                    sort_key_after=self_task.sort_key)
             last_child = self._db.get_last_task(parent_task_id=self_task.id)
-            if next_sibling is not None:
-                if last_child is not None:
-                    new_task.sort_key = (last_child.sort_key + next_sibling.sort_key) / 2
-                else:
-                    new_task.sort_key = (self_task.sort_key + next_sibling.sort_key) / 2
-            elif last_child is not None:
-                new_task.sort_key = last_child.sort_key + 1
-            else:
-                new_task.sort_key = self_task.sort_key + 1
+            new_task.sort_key = order_key.key_between(_sort_key_of(last_child) or self_task.sort_key,
+                                                      _sort_key_of(next_sibling))
 
         self._selected_task = new_task
+        self._stats_cache.clear()
         self._db.upsert_task(self._selected_task)
         self._update_shown_tasks(try_select=_TrySelect.SAME_ID)
 
@@ -240,6 +291,7 @@ class TaskEngine:
             self._selected_task.completed = completed
             self._selected_task.completed_at = int(datetime.now().timestamp())
         self._selected_task.updated_at = int(datetime.now().timestamp())
+        self._stats_cache.clear()
         self._db.upsert_task(self._selected_task)
         self._update_shown_tasks(try_select=_TrySelect.SAME_ID)
 
@@ -250,17 +302,30 @@ class TaskEngine:
             return False
         return True
 
-    def archive_selected_task(self) -> None:
+    def archive_selected_task(self, progress: Optional[Callable[[int, int], None]] = None) -> None:
+        """Archive the selected task and its descendants.
+
+        progress is called with the counts of written and all changed tasks as the writes go on; an exception raised
+        from it aborts the operation and rolls the writes back.
+        """
         if not self.can_archive_selected_task():
             raise RuntimeError('Can not archive selected task and its descendants')
 
-        target_tasks: List[Task] = self._task_traversal.descendants_and_self(self._selected_task)
-        for target_task in target_tasks:
-            if target_task.archived:
-                continue
-            target_task.archived = True
-            target_task.archived_at = int(datetime.now().timestamp())
-            self._db.upsert_task(target_task)
+        self._stats_cache.clear()
+        try:
+            with self._db.transaction():
+                target_tasks: List[Task] = self._task_traversal.descendants_and_self(self._selected_task)
+                changed_tasks: List[Task] = []
+                for target_task in target_tasks:
+                    if target_task.archived:
+                        continue
+                    target_task.archived = True
+                    changed_tasks.append(target_task)
+                self._upsert_tasks_in_chunks(changed_tasks, progress)
+        except BaseException:
+            # The tasks changed in memory are read again from the rolled back database
+            self._update_shown_tasks(try_select=_TrySelect.SAME_ID)
+            raise
 
         self._update_shown_tasks(try_select=_TrySelect.NEAR_SORT_KEY)
 
@@ -275,19 +340,39 @@ class TaskEngine:
                 return False
         return True
 
-    def unarchive_selected_task(self):
+    def unarchive_selected_task(self, progress: Optional[Callable[[int, int], None]] = None):
+        """Unarchive the selected task and its descendants, reporting progress as archive_selected_task does."""
         if not self.can_unarchive_selected_task():
             raise RuntimeError('Can not unarchive selected task and its descendants')
 
-        target_tasks: List[Task] = self._task_traversal.descendants_and_self(self._selected_task)
-        for target_task in target_tasks:
-            if not target_task.archived:
-                continue
-            target_task.archived = False
-            self._db.upsert_task(target_task)
+        self._stats_cache.clear()
+        try:
+            with self._db.transaction():
+                target_tasks: List[Task] = self._task_traversal.descendants_and_self(self._selected_task)
+                changed_tasks: List[Task] = []
+                for target_task in target_tasks:
+                    if not target_task.archived:
+                        continue
+                    target_task.archived = False
+                    changed_tasks.append(target_task)
+                self._upsert_tasks_in_chunks(changed_tasks, progress)
+        except BaseException:
+            # The tasks changed in memory are read again from the rolled back database
+            self._update_shown_tasks(try_select=_TrySelect.SAME_ID)
+            raise
 
         self._update_shown_tasks(try_select=_TrySelect.SAME_ID)
 
+    def _upsert_tasks_in_chunks(self, tasks: List[Task], progress: Optional[Callable[[int, int], None]]) -> None:
+        if progress is None:
+            self._db.upsert_tasks(tasks)
+            return
+        progress(0, len(tasks))
+        for start in range(0, len(tasks), _PROGRESS_CHUNK_SIZE):
+            chunk = tasks[start:start + _PROGRESS_CHUNK_SIZE]
+            self._db.upsert_tasks(chunk)
+            progress(start + len(chunk), len(tasks))
+
     def can_move_selected_task(self) -> bool:
         if self._selected_task is None:
             return False
@@ -296,33 +381,48 @@ class TaskEngine:
         return True
 
     def move_selected_task(self, list_id: str):
+        """Move the selected task and its descendants to the task list.
+
+        The subtree is written by one statement, which reports no progress in between, unlike archive_selected_task.
+        """
         if self._selected_task is None:
             raise RuntimeError('No task is selected')
         if self._selected_task.parent_task_id:
             raise RuntimeError('Can not move sub task only')
 
-        self._move_task(self._selected_task, list_id)
+        self._selected_task.list_id = list_id
+        self._selected_task.updated_at = int(datetime.now().timestamp())
+        self._stats_cache.clear()
+        try:
+            self._db.move_subtree(self._selected_task.id, list_id, self._selected_task.updated_at)
+        except BaseException:
+            self._update_shown_tasks(try_select=_TrySelect.SAME_ID)
+            raise
         self._update_shown_tasks(try_select=_TrySelect.NEAR_SORT_KEY)
 
-    def _move_task(self, task: Task, list_id: str):
-        task.list_id = list_id
-        task.updated_at = int(datetime.now().timestamp())
-        self._db.upsert_task(task)
-
-        children = self._db.get_tasks(parent_task_id=task.id)
-        for child in children:
-            self._move_task(child, list_id)
-
     def remove_selected_task(self):
+        """Remove the selected task and its descendants by one statement, as move_selected_task does."""
         if self._selected_task is None:
             raise RuntimeError('No task is selected')
 
-        target_tasks: List[Task] = self._task_traversal.descendants_and_self(self._selected_task)
-        for target_task in target_tasks:
-            self._db.delete_task(target_task.id)
+        self._stats_cache.clear()
+        self._db.delete_subtree(self._selected_task.id)
 
         self._update_shown_tasks(try_select=_TrySelect.NEAR_SORT_KEY)
 
+    def renormalize_sort_keys(
+            self, max_key_length: int = task_renormalize.DEFAULT_MAX_KEY_LENGTH,
+            progress: Optional[Callable[[int, int], None]] = None) -> task_renormalize.RenormalizeResult:
+        """Rewrite the sort keys of the task lists with crowded ones, see task_renormalize.
+
+        progress is called as archive_selected_task does; an exception raised from it rolls the keys back.
+        """
+        try:
+            return task_renormalize.renormalize_sort_keys(self._db, max_key_length=max_key_length, progress=progress)
+        finally:
+            # The shown task lists and tasks are read again with their new keys
+            self._reread_shown_tasklists()
+
     def can_up_selected_task(self) -> bool:
         if self._selected_task is None:
             return False
@@ -340,25 +440,8 @@ class TaskEngine:
 
         prev_index = self._get_prev_sibling_task_index()
         assert prev_index is not None
-        next_index = self._get_next_sibling_task_index()
-
-        src_sort_key_after = self._shown_tasks[prev_index].sort_key
-        if next_index is None:
-            src_sort_key_before = self._selected_task.sort_key + 1
-        else:
-            src_sort_key_before = self._shown_tasks[next_index].sort_key
-
-        if prev_index > 0:
-            dest_sort_key_after = self._shown_tasks[prev_index - 1].sort_key
-        else:
-            dest_sort_key_after = self._shown_tasks[prev_index].sort_key - 1
-        dest_sort_key_before = self._shown_tasks[prev_index].sort_key
-
-        target_tasks: List[Task] = self._task_traversal.descendants_and_self(self._selected_task)
-        for target_task in target_tasks:
-            sort_key_ratio = (target_task.sort_key - src_sort_key_after) / (src_sort_key_before - src_sort_key_after)
-            target_task.sort_key = dest_sort_key_after + (dest_sort_key_before - dest_sort_key_after) * sort_key_ratio
-            self._db.upsert_task(target_task)
+        with self._db.transaction():
+            self._swap_subtrees(self._shown_tasks[prev_index], self._selected_task)
 
         self._update_shown_tasks(try_select=_TrySelect.SAME_ID)
 
@@ -379,27 +462,32 @@ class TaskEngine:
 
         next_index = self._get_next_sibling_task_index()
         assert next_index is not None
-        prev_index = self._get_prev_sibling_task_index()
+        with self._db.transaction():
+            self._swap_subtrees(self._selected_task, self._shown_tasks[next_index])
 
-        if prev_index is None:
-            src_sort_key_after = self._selected_task.sort_key - 1
-        else:
-            src_sort_key_after = self._shown_tasks[prev_index].sort_key
-        src_sort_key_before = self._shown_tasks[next_index].sort_key
+        self._update_shown_tasks(try_select=_TrySelect.SAME_ID)
 
-        dest_sort_key_after = self._shown_tasks[next_index].sort_key
-        if next_index < len(self.shown_tasks) - 1:
-            dest_sort_key_before = self._shown_tasks[next_index + 1].sort_key
+    def _swap_subtrees(self, first: Task, second: Task) -> None:
+        """Swap the subtrees of two adjacent sibling tasks, the first one coming before the second one.
+
+        Only the smaller subtree gets new sort keys, either after the other subtree or before it, so a task moved past
+        a sibling writes no more rows than the smaller of the two subtrees has.
+        """
+        first_tasks: List[Task] = self._task_traversal.descendants_and_self(first)
+        second_tasks: List[Task] = self._task_traversal.descendants_and_self(second)
+        if len(first_tasks) <= len(second_tasks):
+            moved_tasks = first_tasks
+            sort_key_after = max(t.sort_key for t in second_tasks)
+            sort_key_before = _sort_key_of(self._db.get_first_task(sort_key_after=sort_key_after))
         else:
-            dest_sort_key_before = self._shown_tasks[next_index].sort_key + 1
-
-        target_tasks: List[Task] = self._task_traversal.descendants_and_self(self._selected_task)
-        for target_task in target_tasks:
-            sort_key_ratio = (target_task.sort_key - src_sort_key_after) / (src_sort_key_before - src_sort_key_after)
-            target_task.sort_key = dest_sort_key_after + (dest_sort_key_before - dest_sort_key_after) * sort_key_ratio
-            self._db.upsert_task(target_task)
-
-        self._update_shown_tasks(try_select=_TrySelect.SAME_ID)
+            moved_tasks = second_tasks
+            sort_key_before = first.sort_key
+            sort_key_after = _sort_key_of(self._db.get_last_task(sort_key_before=sort_key_before))
+        moved_tasks.sort(key=lambda t: t.sort_key)
+        for task, sort_key in zip(moved_tasks, order_key.keys_between(sort_key_after, sort_key_before,
+                                                                      len(moved_tasks))):
+            task.sort_key = sort_key
+        self._db.upsert_tasks(moved_tasks)
 
     def _get_first_sibling_task_index(self):
         first_index = 0
@@ -438,6 +526,22 @@ class TaskEngine:
                 prev_index = i
         return prev_index
 
+    def refresh(self) -> None:
+        """Read the task lists and tasks again with the writes made by others, such as idle jobs and other processes.
+
+        The same task list and task stay selected if they still exist.
+        """
+        self._db.refresh()
+        self._stats_cache.clear()
+        self._reread_shown_tasklists()
+
+    def _reread_shown_tasklists(self) -> None:
+        # The selected task list is read again first, since the next one is selected by its sort key
+        if self._selected_tasklist is not None:
+            tasklists = self._db.get_tasklists(id_=self._selected_tasklist.id)
+            self._selected_tasklist = tasklists[0] if tasklists else None
+        self._update_shown_tasklists()
+
     def _update_shown_tasklists(self):
         self._shown_tasklists = self._db.get_tasklists()
         tasklist_to_select: Optional[TaskList] = None
@@ -455,7 +559,8 @@ class TaskEngine:
             archived: Optional[bool] = None
             if not self._shows_archive:
                 archived = False
-            self._shown_tasks = self._db.get_tasks(list_id=self._selected_tasklist.id, archived=archived)
+            self._shown_tasks = self._db.get_tasks(list_id=self._selected_tasklist.id, archived=archived,
+                                                   with_memo=False)
             task_to_select: Optional[Task] = None
             task_to_select_is_fixed: bool = False
             for task in self._shown_tasks:
@@ -472,6 +577,12 @@ class TaskEngine:
                     else:
                         assert False
             self._selected_task = task_to_select
+            self._load_selected_task_memo()
         else:
             self._shown_tasks = []
             self._selected_task = None
+
+    def _load_selected_task_memo(self):
+        # Shown tasks are loaded without memo, only the selected one needs it
+        if self._selected_task is not None and not self._selected_task.memo_is_loaded:
+            self._selected_task.memo = self._db.get_memo(self._selected_task.id)
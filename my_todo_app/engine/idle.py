@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Run housekeeping jobs in the background while the user is idle."""
+
+import queue
+import threading
+import time
+from typing import *
+
+
+class IdleJobScheduler:
+    """Run a job every interval, once the application has been idle for a while.
+
+    The job runs on a thread of its own and is passed an event that is set when it should stop early. The scheduler
+    polls with after, a scheduler like tkinter's Misc.after, and calls on_done with the job's result or on_error with
+    the exception on the thread that polls. The application calls notify_activity on user input.
+    """
+
+    def __init__(self, job: Callable[[threading.Event], Any], interval_s: float, idle_s: float,
+                 last_run: float = 0, on_done: Optional[Callable[[Any], None]] = None,
+                 on_error: Optional[Callable[[BaseException], None]] = None,
+                 clock: Callable[[], float] = time.time):
+        self._job: Callable[[threading.Event], Any] = job
+        self._interval_s: float = interval_s
+        self._idle_s: float = idle_s
+        self.on_done: Optional[Callable[[Any], None]] = on_done
+        self.on_error: Optional[Callable[[BaseException], None]] = on_error
+        self._clock: Callable[[], float] = clock
+        self._after: Optional[Callable[[int, Callable[[], None]], Any]] = None
+        self._poll_interval_ms: int = 1000
+        self._last_activity: float = clock()
+        self._last_run: float = last_run
+        self._thread: Optional[threading.Thread] = None
+        self._cancel_event: threading.Event = threading.Event()
+        # Results queued by the job thread for the polling thread
+        self._results: queue.Queue = queue.Queue()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, after: Callable[[int, Callable[[], None]], Any], poll_interval_ms: int = 1000) -> None:
+        self._after = after
+        self._poll_interval_ms = poll_interval_ms
+        self._after(self._poll_interval_ms, self._poll)
+
+    def notify_activity(self) -> None:
+        self._last_activity = self._clock()
+
+    def close(self) -> None:
+        """Stop polling, and cancel the running job and wait for it to stop."""
+        self._after = None
+        self._cancel_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _poll(self) -> None:
+        if self._after is None:
+            return
+        try:
+            callback = self._results.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            self._thread.join()
+            self._thread = None
+            callback()
+        now = self._clock()
+        if self._thread is None and now - self._last_run >= self._interval_s \
+                and now - self._last_activity >= self._idle_s:
+            self._last_run = now
+            self._thread = threading.Thread(target=self._run)
+            self._thread.start()
+        self._after(self._poll_interval_ms, self._poll)
+
+    def _run(self) -> None:
+        try:
+            result = self._job(self._cancel_event)
+        except Exception as e:
+            self._results.put(lambda error=e: self.on_error(error) if self.on_error is not None else None)
+        else:
+            self._results.put(lambda: self.on_done(result) if self.on_done is not None else None)
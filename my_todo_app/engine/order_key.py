@@ -0,0 +1,220 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Order keys: strings that sort tasks and task lists, with a key between any two keys.
+
+A key is an integer part and a fraction part, written in base 62 digits that sort in ASCII order. The head character
+of the integer part tells its length: 'a' to 'z' start non-negative integers of 1 to 26 digits and 'Z' to 'A' negative
+ones of 1 to 26 digits, so keys compare as strings the way their values compare. A fraction part never ends with the
+zero digit, so every value has one key.
+
+A key after the last one increments the integer part, so appended keys stay short. A key between two others extends
+the fraction, by a digit per five or six insertions at the same place, so keys never run out of precision as the
+midpoints of floats do.
+"""
+
+from typing import *
+
+DIGITS: str = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+_BASE: int = len(DIGITS)
+_DIGIT_VALUES: Dict[str, int] = {digit: value for value, digit in enumerate(DIGITS)}
+
+_MAX_INTEGER_DIGITS: int = 26
+# The smallest integer part is not a key by itself, so that there is always a key below any key
+_SMALLEST_INTEGER: str = 'A' + DIGITS[0] * _MAX_INTEGER_DIGITS
+
+# The key of zero, given when there are no bounds
+FIRST_KEY: str = 'a' + DIGITS[0]
+
+
+def _integer_length(head: str) -> int:
+    """Return the length of the integer part, head included, that starts with the head."""
+    if 'a' <= head <= 'z':
+        return ord(head) - ord('a') + 2
+    if 'A' <= head <= 'Z':
+        return ord('Z') - ord(head) + 2
+    raise ValueError('Invalid order key head: {!r}'.format(head))
+
+
+def _split(key: str) -> Tuple[str, str]:
+    """Return the integer and fraction parts of the key, or raise ValueError if it is not a key."""
+    if not isinstance(key, str) or not key:
+        raise ValueError('Invalid order key: {!r}'.format(key))
+    length = _integer_length(key[0])
+    integer, fraction = key[:length], key[length:]
+    if len(integer) < length or (integer == _SMALLEST_INTEGER and not fraction) or fraction.endswith(DIGITS[0]) or \
+            any(digit not in _DIGIT_VALUES for digit in key[1:]):
+        raise ValueError('Invalid order key: {!r}'.format(key))
+    return integer, fraction
+
+
+def is_valid_key(key: Any) -> bool:
+    try:
+        _split(key)
+    except ValueError:
+        return False
+    return True
+
+
+def _increment_integer(integer: str) -> Optional[str]:
+    """Return the next integer part, or None after the largest one."""
+    head, digits = integer[0], list(integer[1:])
+    for i in range(len(digits) - 1, -1, -1):
+        value = _DIGIT_VALUES[digits[i]] + 1
+        if value < _BASE:
+            digits[i] = DIGITS[value]
+            return head + ''.join(digits)
+        digits[i] = DIGITS[0]
+    # Every digit carried over: one more digit for a non-negative integer, one less for a negative one
+    if head == 'Z':
+        return FIRST_KEY
+    if head == 'z':
+        return None
+    head = chr(ord(head) + 1)
+    if head > 'a':
+        digits.append(DIGITS[0])
+    else:
+        digits.pop()
+    return head + ''.join(digits)
+
+
+def _decrement_integer(integer: str) -> Optional[str]:
+    """Return the previous integer part, or None before the smallest one."""
+    head, digits = integer[0], list(integer[1:])
+    for i in range(len(digits) - 1, -1, -1):
+        value = _DIGIT_VALUES[digits[i]] - 1
+        if value >= 0:
+            digits[i] = DIGITS[value]
+            return head + ''.join(digits)
+        digits[i] = DIGITS[-1]
+    if head == 'a':
+        return 'Z' + DIGITS[-1]
+    if head == 'A':
+        return None
+    head = chr(ord(head) - 1)
+    if head < 'Z':
+        digits.append(DIGITS[-1])
+    else:
+        digits.pop()
+    return head + ''.join(digits)
+
+
+def _midpoint(lower: str, upper: Optional[str]) -> str:
+    """Return a fraction part between two fraction parts, upper None for one."""
+    prefix = ''
+    if upper is not None:
+        # The common prefix, the lower fraction padded with zeros
+        n = 0
+        while n < len(upper) and (lower[n] if n < len(lower) else DIGITS[0]) == upper[n]:
+            n += 1
+        prefix, lower, upper = upper[:n], lower[n:], upper[n:]
+    lower_digit = _DIGIT_VALUES[lower[0]] if lower else 0
+    upper_digit = _DIGIT_VALUES[upper[0]] if upper is not None else _BASE
+    if upper_digit - lower_digit > 1:
+        return prefix + DIGITS[(lower_digit + upper_digit + 1) // 2]
+    if upper is not None and len(upper) > 1:
+        return prefix + upper[0]
+    # The digits are adjacent: keep the lower one and go between the rest of the lower fraction and its end
+    return prefix + DIGITS[lower_digit] + _midpoint(lower[1:], None)
+
+
+def key_between(lower: Optional[str], upper: Optional[str]) -> str:
+    """Return a key greater than lower and less than upper; None for either is unbounded.
+
+    Raise ValueError if a bound is not a key or lower is not less than upper.
+    """
+    if lower is not None and upper is not None and lower >= upper:
+        raise ValueError('{!r} is not less than {!r}'.format(lower, upper))
+    if lower is None:
+        if upper is None:
+            return FIRST_KEY
+        integer, fraction = _split(upper)
+        if integer == _SMALLEST_INTEGER:
+            return integer + _midpoint('', fraction)
+        if fraction:
+            return integer
+        decremented = _decrement_integer(integer)
+        return decremented + _midpoint('', None) if decremented == _SMALLEST_INTEGER else decremented
+    lower_integer, lower_fraction = _split(lower)
+    if upper is None:
+        incremented = _increment_integer(lower_integer)
+        return lower_integer + _midpoint(lower_fraction, None) if incremented is None else incremented
+    upper_integer, upper_fraction = _split(upper)
+    if lower_integer == upper_integer:
+        return lower_integer + _midpoint(lower_fraction, upper_fraction)
+    incremented = _increment_integer(lower_integer)
+    if incremented < upper:
+        return incremented
+    return lower_integer + _midpoint(lower_fraction, None)
+
+
+def keys_between(lower: Optional[str], upper: Optional[str], count: int) -> List[str]:
+    """Return count ascending keys between lower and upper, as key_between does.
+
+    Unbounded above or below, the keys are consecutive integers. Between two keys they are spread by bisection, so
+    their lengths grow with the logarithm of the count.
+    """
+    if count <= 0:
+        return []
+    if upper is None:
+        keys = [key_between(lower, None)]
+        while len(keys) < count:
+            keys.append(key_between(keys[-1], None))
+        return keys
+    if lower is None:
+        keys = [key_between(None, upper)]
+        while len(keys) < count:
+            keys.append(key_between(None, keys[-1]))
+        keys.reverse()
+        return keys
+    result: List[str] = []
+
+    def bisect(lower_key: str, upper_key: str, n: int) -> None:
+        if n <= 0:
+            return
+        middle_key = key_between(lower_key, upper_key)
+        bisect(lower_key, middle_key, n // 2)
+        result.append(middle_key)
+        bisect(middle_key, upper_key, n - n // 2 - 1)
+
+    bisect(lower, upper, count)
+    return result
+
+
+def _integer_key(value: int) -> str:
+    """Return the integer part of an integer, clamped to the integer parts of 26 digits."""
+    remainder = value if value >= 0 else -value - 1
+    length, span = 1, _BASE
+    while remainder >= span:
+        if length == _MAX_INTEGER_DIGITS:
+            return 'z' + DIGITS[-1] * _MAX_INTEGER_DIGITS if value >= 0 else _SMALLEST_INTEGER[:-1] + DIGITS[1]
+        remainder -= span
+        length += 1
+        span *= _BASE
+    if value < 0:
+        remainder = span - 1 - remainder
+    digits = []
+    for _ in range(length):
+        remainder, digit = divmod(remainder, _BASE)
+        digits.append(DIGITS[digit])
+    head = chr(ord('a') + length - 1) if value >= 0 else chr(ord('Z') - length + 1)
+    return head + ''.join(reversed(digits))
+
+
+def key_from_number(value: float) -> str:
+    """Return a key for a number, so that the keys of numbers sort as the numbers do; for sort keys kept as floats.
+
+    Floats are binary fractions, which base 62 digits write exactly. Numbers beyond the integer parts of 26 digits
+    are clamped, and lose their order among themselves.
+    """
+    if value != value:
+        raise ValueError('NaN has no order key')
+    if value in (float('inf'), float('-inf')):
+        return _integer_key(int(1e50) if value > 0 else -int(1e50))
+    numerator, denominator = float(value).as_integer_ratio()
+    integer, remainder = divmod(numerator, denominator)
+    digits = []
+    while remainder:
+        digit, remainder = divmod(remainder * _BASE, denominator)
+        digits.append(DIGITS[digit])
+    return _integer_key(integer) + ''.join(digits)
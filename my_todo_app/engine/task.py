@@ -5,81 +5,216 @@
 
 from __future__ import annotations
 
+import bisect
+import itertools
+import sys
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
 from typing import *
 
+from my_todo_app.engine.task_columns import TaskColumns
+
+
+def _intern(value: Any) -> Any:
+    # Tasks of a list or a parent share one id string instead of a copy per row read
+    return sys.intern(value) if type(value) is str else value
+
 
 class Task:
-    """A task."""
+    """A task.
+
+    Sort keys are order keys, see order_key, and order the tasks of a list in preorder of their tree.
+    Tasks are equal if all fields are; memos are compared only if both are loaded, so that comparing never queries a
+    database. The hash is that of the id.
+    """
+
+    __slots__ = ('id', 'list_id', 'parent_task_id', 'name', 'tags', '_memo', '_memo_loader', 'completed', 'archived',
+                 'created_at', 'updated_at', 'completed_at', 'sort_key')
 
     def __init__(self, id_: str, list_id: str, parent_task_id: str, name: str, tags: str, memo: str, completed: bool,
-                 archived: bool, created_at: int, updated_at: int, completed_at: int, sort_key: float):
+                 archived: bool, created_at: int, updated_at: int, completed_at: int, sort_key: str):
         self.id: str = id_
-        self.list_id: str = list_id
-        self.parent_task_id: str = parent_task_id
+        self.list_id: str = _intern(list_id)
+        self.parent_task_id: str = _intern(parent_task_id)
         self.name: str = name
         self.tags: str = tags
-        self.memo: str = memo
+        self._memo: Optional[str] = memo
+        self._memo_loader: Optional[Callable[[], str]] = None
         self.completed: bool = completed
         self.archived: bool = archived
         self.created_at: int = created_at
         self.updated_at: int = updated_at
         self.completed_at: int = completed_at
-        self.sort_key: float = sort_key
+        self.sort_key: str = sort_key
 
-    def equals(self, another: Task):
-        if self.id != another.id:
-            return False
-        if self.list_id != another.list_id:
-            return False
-        if self.parent_task_id != another.parent_task_id:
-            return False
-        if self.name != another.name:
-            return False
-        if self.tags != another.tags:
-            return False
-        if self.memo != another.memo:
-            return False
-        if self.completed != another.completed:
-            return False
-        if self.archived != another.archived:
-            return False
-        if self.created_at != another.created_at:
-            return False
-        if self.updated_at != another.updated_at:
-            return False
-        if self.completed_at != another.completed_at:
-            return False
-        if self.sort_key != another.sort_key:
+    @property
+    def memo(self) -> str:
+        if self._memo is None:
+            self._memo = self._memo_loader() if self._memo_loader is not None else ''
+            self._memo_loader = None
+        return self._memo
+
+    @memo.setter
+    def memo(self, value: str) -> None:
+        self._memo = value
+        self._memo_loader = None
+
+    @property
+    def memo_is_loaded(self) -> bool:
+        return self._memo is not None
+
+    def defer_memo(self, loader: Callable[[], str]) -> None:
+        """Drop the memo and load it by the passed function on first access."""
+        self._memo = None
+        self._memo_loader = loader
+
+    def _fields_without_memo(self) -> Tuple:
+        return (self.id, self.list_id, self.parent_task_id, self.name, self.tags, self.completed, self.archived,
+                self.created_at, self.updated_at, self.completed_at, self.sort_key)
+
+    def __eq__(self, another: Any) -> bool:
+        if self is another:
+            return True
+        if not isinstance(another, Task):
+            return NotImplemented
+        if self.id != another.id or self._fields_without_memo() != another._fields_without_memo():
             return False
-        return True
+        return self._memo is None or another._memo is None or self._memo == another._memo
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+    def equals(self, another: Task):
+        return self == another
 
 
 class TaskList:
-    """A task list."""
+    """A task list, ordered by an order key; task lists are equal if all fields are, the hash is that of the id."""
 
-    def __init__(self, id_: str, name: str, sort_key: float):
+    __slots__ = ('id', 'name', 'sort_key')
+
+    def __init__(self, id_: str, name: str, sort_key: str):
         self.id: str = id_
         self.name: str = name
-        self.sort_key: float = sort_key
+        self.sort_key: str = sort_key
+
+    def __eq__(self, another: Any) -> bool:
+        if self is another:
+            return True
+        if not isinstance(another, TaskList):
+            return NotImplemented
+        return self.id == another.id and self.name == another.name and self.sort_key == another.sort_key
+
+    def __hash__(self) -> int:
+        return hash(self.id)
 
     def equals(self, another: TaskList):
-        if self.id != another.id:
-            return False
-        if self.name != another.name:
-            return False
-        if self.sort_key != another.sort_key:
-            return False
-        return True
+        return self == another
+
+
+class TaskSearchResult:
+    """A task matched by a full-text search."""
+
+    def __init__(self, task: Task, rank: float, snippet: str):
+        self.task: Task = task
+        self.rank: float = rank  # Smaller is better
+        self.snippet: str = snippet
+
+
+class TaskChange:
+    """A change of a task or a task list recorded in the change journal."""
+
+    def __init__(self, seq: int, table_name: str, id_: str, operation: str):
+        self.seq: int = seq
+        self.table_name: str = table_name  # 'tasks' or 'tasklists'
+        self.id: str = id_
+        self.operation: str = operation  # 'insert', 'update' or 'delete'
+
+
+class TaskListStats:
+    """The counts of tasks of a task list by state; archived tasks count as archived whether completed or not."""
+
+    def __init__(self, open_count: int = 0, completed_count: int = 0, archived_count: int = 0):
+        self.open_count: int = open_count
+        self.completed_count: int = completed_count
+        self.archived_count: int = archived_count
+
+    @property
+    def total_count(self) -> int:
+        return self.open_count + self.completed_count + self.archived_count
+
+    def add(self, completed: bool, archived: bool, count: int = 1) -> None:
+        if archived:
+            self.archived_count += count
+        elif completed:
+            self.completed_count += count
+        else:
+            self.open_count += count
+
+    def __eq__(self, another: Any) -> bool:
+        if not isinstance(another, TaskListStats):
+            return NotImplemented
+        return (self.open_count, self.completed_count, self.archived_count) == \
+            (another.open_count, another.completed_count, another.archived_count)
+
+    def __repr__(self) -> str:
+        return 'TaskListStats({}, {}, {})'.format(self.open_count, self.completed_count, self.archived_count)
+
+
+def _count_in_buckets(times: Iterable[Tuple[int, int]], width: int, origin: int = 0) -> Dict[int, int]:
+    """Sum counts by times into buckets of the width that start at origin plus a multiple of it, by bucket start."""
+    counts: Dict[int, int] = {}
+    for time_, count in times:
+        start = origin + (time_ - origin) // width * width
+        counts[start] = counts.get(start, 0) + count
+    return {start: count for start, count in sorted(counts.items()) if count}
+
+
+def _count_in_age_buckets(created_ats: Iterable[int], now: int, edges: Sequence[int]) -> Dict[int, int]:
+    """Count ages from now into buckets from each edge up to the next, the last unbounded, by edge."""
+    counts = dict.fromkeys(edges, 0)
+    for created_at in created_ats:
+        position = bisect.bisect_right(edges, now - created_at)
+        if position > 0:
+            counts[edges[position - 1]] += 1
+    return counts
 
 
 class TaskDatabase(metaclass=ABCMeta):
     """A database for task management."""
 
+    def __init__(self):
+        self._transaction_depth: int = 0
+
     @abstractmethod
     def close(self):
         pass
 
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Run the writes in the with block as one transaction.
+
+        Nested blocks join the outermost transaction, which is committed when it exits normally and rolled back when
+        it exits with an exception.
+        """
+        self._transaction_depth += 1
+        if self._transaction_depth == 1:
+            self._begin_transaction()
+        try:
+            yield
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self._rollback_transaction()
+            raise
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self._end_transaction()
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._transaction_depth > 0
+
     @abstractmethod
     def _begin_transaction(self) -> None:
         pass
@@ -88,10 +223,34 @@ class TaskDatabase(metaclass=ABCMeta):
     def _end_transaction(self) -> None:
         pass
 
+    @abstractmethod
+    def _rollback_transaction(self) -> None:
+        pass
+
     @abstractmethod
     def upsert_task(self, task: Task) -> None:
         pass
 
+    def upsert_tasks(self, tasks: Iterable[Task]) -> None:
+        with self.transaction():
+            for task in tasks:
+                self.upsert_task(task)
+
+    def load_tasks(self, tasks: Iterable[Task], chunk_size: int = 10000) -> int:
+        """Upsert many tasks, one transaction per chunk, and return their count.
+
+        The tasks are consumed chunk by chunk, so a generator is never read into memory as a whole. Parents may come
+        after their children.
+        """
+        count = 0
+        iterator = iter(tasks)
+        while True:
+            chunk = list(itertools.islice(iterator, chunk_size))
+            if not chunk:
+                return count
+            self.upsert_tasks(chunk)
+            count += len(chunk)
+
     @abstractmethod
     def upsert_tasklist(self, tasklist: TaskList) -> None:
         pass
@@ -100,25 +259,180 @@ class TaskDatabase(metaclass=ABCMeta):
     def delete_task(self, id_: str) -> None:
         pass
 
+    def delete_tasks(self, ids: Iterable[str]) -> None:
+        with self.transaction():
+            for id_ in ids:
+                self.delete_task(id_)
+
+    def delete_subtree(self, task_id: str) -> None:
+        """Delete the task and its descendants."""
+        with self.transaction():
+            self.delete_tasks([task.id for task in self.get_subtree(task_id, with_memo=False)])
+
+    def move_subtree(self, task_id: str, list_id: str, updated_at: int) -> None:
+        """Move the task and its descendants to the task list."""
+        with self.transaction():
+            tasks = self.get_subtree(task_id, with_memo=False)
+            for task in tasks:
+                task.list_id = list_id
+                task.updated_at = updated_at
+            self.upsert_tasks(tasks)
+
     @abstractmethod
     def delete_tasklist(self, id_: str) -> None:
         pass
 
     @abstractmethod
     def get_tasks(self, id_: Optional[str] = None, list_id: Optional[str] = None, parent_task_id: Optional[str] = None,
-                  completed: Optional[bool] = None, archived: Optional[bool] = None) -> List[Task]:
+                  completed: Optional[bool] = None, archived: Optional[bool] = None,
+                  with_memo: bool = True) -> List[Task]:
+        """Return matched tasks in sort key order; memos are loaded on first access if with_memo is False."""
         pass
 
+    def get_memo(self, id_: str) -> str:
+        tasks = self.get_tasks(id_=id_)
+        return tasks[0].memo if tasks else ''
+
+    def iter_tasks(self, batch_size: int = 1000) -> Iterator[Task]:
+        """Iterate over all tasks with memos, every parent before its children.
+
+        Implementations that can read in batches hold no more than batch_size tasks at a time; this one reads them
+        all at once.
+        """
+        tasks = self.get_tasks()
+        children: Dict[str, List[Task]] = {}
+        for task in tasks:
+            children.setdefault(task.parent_task_id, []).append(task)
+        ids = {task.id for task in tasks}
+        yielded_ids: Set[str] = set()
+        # Tasks whose parent does not exist are roots, so is the first task met of a parent link cycle
+        for root in itertools.chain((t for t in tasks if not t.parent_task_id or t.parent_task_id not in ids), tasks):
+            stack = [root] if root.id not in yielded_ids else []
+            while stack:
+                task = stack.pop()
+                yielded_ids.add(task.id)
+                yield task
+                stack.extend(reversed([t for t in children.get(task.id, []) if t.id not in yielded_ids]))
+
+    def get_subtree(self, task_id: str, with_memo: bool = True) -> List[Task]:
+        """Return the task and its descendants in preorder, children in sort key order."""
+        result: List[Task] = []
+        stack: List[Task] = list(self.get_tasks(id_=task_id, with_memo=with_memo))
+        while stack:
+            task = stack.pop()
+            result.append(task)
+            stack.extend(reversed(self.get_tasks(parent_task_id=task.id, with_memo=with_memo)))
+        return result
+
+    def get_ancestors(self, task_id: str, with_memo: bool = True) -> List[Task]:
+        """Return the ancestors of the task, nearest first."""
+        result: List[Task] = []
+        tasks = self.get_tasks(id_=task_id, with_memo=False)
+        while tasks and tasks[0].parent_task_id:
+            tasks = self.get_tasks(id_=tasks[0].parent_task_id, with_memo=with_memo)
+            result.extend(tasks)
+        return result
+
+    def is_ancestor(self, ancestor_id: str, task_id: str) -> bool:
+        return any(task.id == ancestor_id for task in self.get_ancestors(task_id, with_memo=False))
+
     @abstractmethod
     def get_first_task(self, parent_task_id: Optional[str] = None,
-                       sort_key_after: Optional[float] = None) -> Optional[Task]:
+                       sort_key_after: Optional[str] = None) -> Optional[Task]:
         pass
 
     @abstractmethod
     def get_last_task(self, parent_task_id: Optional[str] = None,
-                      sort_key_before: Optional[float] = None) -> Optional[Task]:
+                      sort_key_before: Optional[str] = None) -> Optional[Task]:
         pass
 
+    def search(self, query: str, list_id: Optional[str] = None, include_archived: bool = False,
+               limit: int = 50) -> List[TaskSearchResult]:
+        """Return tasks whose name, tags or memo contain every word of the query, best match first.
+
+        This implementation scans all tasks; backends with a full-text index override it.
+        """
+        words = [w.lower() for w in query.split()]
+        if not words:
+            return []
+        results = []
+        for task in self.get_tasks(list_id=list_id, archived=None if include_archived else False):
+            fields = [task.name, task.tags, task.memo]
+            if not all(any(w in f.lower() for f in fields if f) for w in words):
+                continue
+            # Rank by the first field that contains the first word: name, tags, then memo
+            field_index = next(i for i, f in enumerate(fields) if f and words[0] in f.lower())
+            matched = fields[field_index]
+            start = matched.lower().index(words[0])
+            snippet = matched[max(0, start - 30):start] + '[' + matched[start:start + len(words[0])] + ']' + \
+                matched[start + len(words[0]):start + len(words[0]) + 30]
+            results.append(TaskSearchResult(task, float(field_index), snippet))
+        results.sort(key=lambda r: r.rank)
+        return results[:limit]
+
+    def get_task_columns(self, use_numpy: Optional[bool] = None) -> TaskColumns:
+        """Return the fields of all tasks as columns for reports, see TaskColumns.
+
+        This implementation reads them as tasks; backends that can read plain rows override it.
+        """
+        return TaskColumns.from_rows(((t.id, t.list_id, t.completed, t.archived, t.created_at, t.updated_at,
+                                       t.completed_at, t.sort_key) for t in self.get_tasks(with_memo=False)),
+                                     use_numpy=use_numpy)
+
+    def get_list_stats(self) -> Dict[str, TaskListStats]:
+        """Return the counts of open, completed and archived tasks by list id.
+
+        This implementation reads all tasks, as do the other statistics; backends that keep aggregates override them.
+        """
+        stats: Dict[str, TaskListStats] = {}
+        for task in self.get_tasks(with_memo=False):
+            stats.setdefault(task.list_id, TaskListStats()).add(task.completed, task.archived)
+        return stats
+
+    def get_completion_stats(self, width: int = 24 * 60 * 60, origin: int = 0, list_id: Optional[str] = None,
+                             since: Optional[int] = None, until: Optional[int] = None) -> Dict[int, int]:
+        """Return the counts of tasks completed in buckets of the width, archived ones included, by bucket start.
+
+        Buckets start at origin plus a multiple of the width, so a local midnight as origin makes local days or
+        weeks. Only completions at or after since and before until are counted, only buckets with any are returned.
+        """
+        completed_ats = (t.completed_at for t in self.get_tasks(list_id=list_id, completed=True, with_memo=False))
+        return _count_in_buckets(((t, 1) for t in completed_ats
+                                  if t > 0 and (since is None or t >= since) and (until is None or t < until)),
+                                 width, origin)
+
+    def get_age_stats(self, now: int, edges: Sequence[int], list_id: Optional[str] = None) -> Dict[int, int]:
+        """Return the counts of open tasks by age, created_at to now, from each edge up to the next, by edge.
+
+        Edges are ascending seconds, the last bucket has no upper bound; tasks younger than the first are not counted.
+        """
+        tasks = self.get_tasks(list_id=list_id, completed=False, archived=False, with_memo=False)
+        return _count_in_age_buckets((t.created_at for t in tasks), now, edges)
+
     @abstractmethod
     def get_tasklists(self, id_: Optional[str] = None) -> List[TaskList]:
         pass
+
+    def changes_since(self, seq: int) -> Optional[List[TaskChange]]:
+        """Return the changes after the sequence number, oldest first.
+
+        None means the changes are not known any more and the caller has to reload everything. A row changed more
+        than once may be reported by its last change only, so read its current state instead of replaying.
+        This implementation keeps no journal.
+        """
+        return None
+
+    def last_change_seq(self) -> int:
+        """Return the sequence number to pass to changes_since after a full load."""
+        return 0
+
+    def compact_changes(self, before_seq: Optional[int] = None) -> None:
+        """Drop changes superseded by a later change of the same row, and every change up to before_seq if passed.
+
+        changes_since returns None for a sequence number before the last dropped change.
+        """
+        pass
+
+    def refresh(self) -> None:
+        """Drop what is held of the stored tasks, so that writes made by others are read; nothing is held here."""
+        pass
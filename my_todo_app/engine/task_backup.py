@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Online backups of a SQLite3 database file, with rotating generations and an idle-time scheduler."""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import *
+
+from my_todo_app.engine.idle import IdleJobScheduler
+
+# Names of backup files are the database file name followed by this and a timestamp
+_BACKUP_NAME_SEPARATOR: str = '.backup-'
+_BACKUP_TIME_FORMAT: str = '%Y%m%d-%H%M%S-%f'
+
+
+class BackupResult:
+    """A finished backup; the size and page count are of both files if the archive database is backed up too."""
+
+    def __init__(self, path: str, size: int, page_count: int, seconds: float, archive_path: Optional[str] = None):
+        self.path: str = path
+        self.archive_path: Optional[str] = archive_path
+        self.size: int = size
+        self.page_count: int = page_count
+        self.seconds: float = seconds
+
+    def __str__(self) -> str:
+        paths = self.path if self.archive_path is None else '{} and {}'.format(self.path, self.archive_path)
+        return 'Backed up to {}: {} bytes in {:.2f} s'.format(paths, self.size, self.seconds)
+
+
+def list_backups(db_path: str, directory: str) -> List[str]:
+    """Return the paths of the backups of the database in the directory, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    prefix = os.path.basename(db_path) + _BACKUP_NAME_SEPARATOR
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.startswith(prefix) and name.endswith('.sqlite3')]
+
+
+def backup_database(db_path: str, directory: str, generations: int = 7, pages_per_step: int = 256,
+                    step_delay_s: float = 0.005, cancel_event: Optional[threading.Event] = None,
+                    archive_path: Optional[str] = None) -> BackupResult:
+    """Copy the database file to a new backup in the directory and remove all but the newest generations.
+
+    The copy is made with the SQLite online backup API on a connection of its own, pages_per_step pages at a time
+    with a pause between steps, so the application keeps reading and writing meanwhile. A write from another
+    connection restarts the copy. Setting cancel_event aborts it with RuntimeError.
+
+    The archive database of the cold-storage mode, if passed, is copied as a second file of the same generation.
+    Both are then copied in one read transaction, so that tasks and parents moved across the files between the two
+    copies are neither lost nor doubled; writes go on meanwhile and are not in the backup.
+    """
+    if generations < 1:
+        raise ValueError('generations must be at least 1')
+    os.makedirs(directory, exist_ok=True)
+    timestamp = datetime.now().strftime(_BACKUP_TIME_FORMAT)
+    copies = [('main', db_path)] + ([('archive', archive_path)] if archive_path is not None else [])
+    paths = [os.path.join(directory, '{}{}{}.sqlite3'.format(os.path.basename(file_path), _BACKUP_NAME_SEPARATOR,
+                                                             timestamp)) for _, file_path in copies]
+    page_count = 0
+    copied_page_count = 0
+
+    def progress(_status: int, remaining: int, total: int) -> None:
+        nonlocal page_count
+        page_count = copied_page_count + total
+        if cancel_event is not None and cancel_event.is_set():
+            raise RuntimeError('Backup cancelled')
+        if remaining:
+            time.sleep(step_delay_s)
+
+    start = time.perf_counter()
+    source = sqlite3.connect(db_path, isolation_level=None)
+    temp_paths = [path + '.tmp' for path in paths]
+    try:
+        if archive_path is not None:
+            source.execute('attach database ? as archive', [archive_path])
+            # Reading both schemas starts the read transaction on both files
+            source.execute('begin')
+            for schema, _ in copies:
+                source.execute('select count(*) from {}.sqlite_master'.format(schema)).fetchone()
+        for (schema, _), temp_path in zip(copies, temp_paths):
+            target = sqlite3.connect(temp_path)
+            try:
+                source.backup(target, pages=pages_per_step, progress=progress, name=schema)
+            finally:
+                target.close()
+            copied_page_count = page_count
+        if source.in_transaction:
+            source.execute('commit')
+        for temp_path, path in zip(temp_paths, paths):
+            os.replace(temp_path, path)
+    except BaseException:
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+    finally:
+        source.close()
+    result = BackupResult(paths[0], sum(os.path.getsize(path) for path in paths), page_count,
+                          time.perf_counter() - start, archive_path=paths[1] if archive_path is not None else None)
+
+    for _, file_path in copies:
+        for old_path in list_backups(file_path, directory)[:-generations]:
+            os.remove(old_path)
+    return result
+
+
+class BackupScheduler(IdleJobScheduler):
+    """Back up a database file every interval, once the application has been idle for a while.
+
+    The archive database of the cold-storage mode is backed up with it if archive_path is passed.
+    """
+
+    def __init__(self, db_path: str, directory: str, interval_s: float = 3600, idle_s: float = 30,
+                 generations: int = 7, pages_per_step: int = 256, archive_path: Optional[str] = None,
+                 on_done: Optional[Callable[[BackupResult], None]] = None,
+                 on_error: Optional[Callable[[BaseException], None]] = None,
+                 clock: Callable[[], float] = time.time):
+        backups = list_backups(db_path, directory)
+        super().__init__(lambda cancel_event: backup_database(db_path, directory, generations=generations,
+                                                              pages_per_step=pages_per_step,
+                                                              cancel_event=cancel_event, archive_path=archive_path),
+                         interval_s, idle_s, last_run=os.path.getmtime(backups[-1]) if backups else 0,
+                         on_done=on_done, on_error=on_error, clock=clock)
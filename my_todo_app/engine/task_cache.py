@@ -0,0 +1,269 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""The caching task database wrapper."""
+
+import copy
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import *
+
+from my_todo_app.engine.task import TaskDatabase, Task, TaskList, TaskListStats, TaskSearchResult, TaskChange
+from my_todo_app.engine.task_columns import TaskColumns
+
+
+class _CacheEntry:
+    """A cached query result and the tasks it depends on."""
+
+    def __init__(self, value: Any, task_ids: Iterable[str], conditions: Dict[str, Any]):
+        self.value: Any = value
+        self.task_ids: FrozenSet[str] = frozenset(task_ids)
+        self.conditions: Dict[str, Any] = {name: value for name, value in conditions.items() if value is not None}
+
+    def may_change_by(self, task: Task) -> bool:
+        """Return whether writing the task can change the result: it is in the result or may join it."""
+        if task.id in self.task_ids:
+            return True
+        return all(getattr(task, name) == value for name, value in self.conditions.items())
+
+
+class CachingTaskDatabase(TaskDatabase):
+    """A database wrapper that caches task and task list queries in a bounded LRU.
+
+    A task write drops only the cached results that contain the task or whose conditions it matches, a task list
+    write drops the cached task lists. Cached tasks are copied out, so callers may modify what they get.
+    """
+
+    def __init__(self, db: TaskDatabase, maxsize: int = 128):
+        super().__init__()
+        self._db: TaskDatabase = db
+        self._maxsize: int = maxsize
+        self._lock: threading.RLock = threading.RLock()
+        self._entries: Dict[Tuple, _CacheEntry] = OrderedDict()
+        self._tasklists: Dict[Optional[str], List[TaskList]] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._seen_change_seq: int = db.last_change_seq()
+
+    def clear_cache(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tasklists.clear()
+
+    def refresh(self) -> None:
+        """Drop the results that changes written by others since the last refresh can affect."""
+        with self._lock:
+            changes = self._db.changes_since(self._seen_change_seq)
+            if changes is None:
+                self.clear_cache()
+                self._seen_change_seq = self._db.last_change_seq()
+                return
+            for change in changes:
+                if change.table_name == 'tasklists':
+                    self._tasklists.clear()
+                    continue
+                self._invalidate_by_task_id(change.id)
+                for task in self._db.get_tasks(id_=change.id, with_memo=False):
+                    self._invalidate_by_task(task)
+            if changes:
+                self._seen_change_seq = changes[-1].seq
+
+    def close(self):
+        self.clear_cache()
+        self._db.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        try:
+            with self._db.transaction():
+                yield
+        except BaseException:
+            # Results read in the transaction may include writes that have been rolled back
+            self.clear_cache()
+            raise
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._db.in_transaction
+
+    # Transactions are delegated to the wrapped database as a whole, see transaction()
+    def _begin_transaction(self) -> None:
+        pass
+
+    def _end_transaction(self) -> None:
+        pass
+
+    def _rollback_transaction(self) -> None:
+        pass
+
+    def _get(self, key: Tuple) -> Optional[_CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def _put(self, key: Tuple, entry: _CacheEntry) -> None:
+        self._entries[key] = entry
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _invalidate_by_task(self, task: Task) -> None:
+        for key in [key for key, entry in self._entries.items() if entry.may_change_by(task)]:
+            del self._entries[key]
+
+    def _invalidate_by_task_id(self, id_: str) -> None:
+        for key in [key for key, entry in self._entries.items() if id_ in entry.task_ids]:
+            del self._entries[key]
+
+    def upsert_task(self, task: Task) -> None:
+        with self._lock:
+            self._db.upsert_task(task)
+            self._invalidate_by_task(task)
+
+    def upsert_tasks(self, tasks: Iterable[Task]) -> None:
+        tasks = list(tasks)
+        with self._lock:
+            self._db.upsert_tasks(tasks)
+            for task in tasks:
+                self._invalidate_by_task(task)
+
+    def load_tasks(self, tasks: Iterable[Task], chunk_size: int = 10000) -> int:
+        # The loaded tasks are not kept to invalidate by
+        with self._lock:
+            try:
+                return self._db.load_tasks(tasks, chunk_size=chunk_size)
+            finally:
+                self._entries.clear()
+
+    def upsert_tasklist(self, tasklist: TaskList) -> None:
+        with self._lock:
+            self._db.upsert_tasklist(tasklist)
+            self._tasklists.clear()
+
+    def delete_task(self, id_: str) -> None:
+        with self._lock:
+            self._db.delete_task(id_)
+            self._invalidate_by_task_id(id_)
+
+    def delete_tasks(self, ids: Iterable[str]) -> None:
+        ids = list(ids)
+        with self._lock:
+            self._db.delete_tasks(ids)
+            for id_ in ids:
+                self._invalidate_by_task_id(id_)
+
+    def delete_subtree(self, task_id: str) -> None:
+        # The descendants are not known here
+        with self._lock:
+            self._db.delete_subtree(task_id)
+            self._entries.clear()
+
+    def move_subtree(self, task_id: str, list_id: str, updated_at: int) -> None:
+        with self._lock:
+            self._db.move_subtree(task_id, list_id, updated_at)
+            self._entries.clear()
+
+    def delete_tasklist(self, id_: str) -> None:
+        with self._lock:
+            self._db.delete_tasklist(id_)
+            self._tasklists.clear()
+
+    def get_tasks(self, id_: Optional[str] = None, list_id: Optional[str] = None, parent_task_id: Optional[str] = None,
+                  completed: Optional[bool] = None, archived: Optional[bool] = None,
+                  with_memo: bool = True) -> List[Task]:
+        key = ('get_tasks', id_, list_id, parent_task_id, completed, archived, with_memo)
+        with self._lock:
+            entry = self._get(key)
+            if entry is None:
+                tasks = self._db.get_tasks(id_=id_, list_id=list_id, parent_task_id=parent_task_id,
+                                           completed=completed, archived=archived, with_memo=with_memo)
+                entry = _CacheEntry(tasks, (t.id for t in tasks),
+                                    {'id': id_, 'list_id': list_id, 'parent_task_id': parent_task_id,
+                                     'completed': completed, 'archived': archived})
+                self._put(key, entry)
+            return [copy.copy(t) for t in entry.value]
+
+    def get_memo(self, id_: str) -> str:
+        key = ('get_memo', id_)
+        with self._lock:
+            entry = self._get(key)
+            if entry is None:
+                entry = _CacheEntry(self._db.get_memo(id_), [id_], {'id': id_})
+                self._put(key, entry)
+            return entry.value
+
+    def get_first_task(self, parent_task_id: Optional[str] = None,
+                       sort_key_after: Optional[str] = None) -> Optional[Task]:
+        key = ('get_first_task', parent_task_id, sort_key_after)
+        with self._lock:
+            entry = self._get(key)
+            if entry is None:
+                task = self._db.get_first_task(parent_task_id=parent_task_id, sort_key_after=sort_key_after)
+                entry = _CacheEntry(task, [task.id] if task is not None else [], {'parent_task_id': parent_task_id})
+                self._put(key, entry)
+            return copy.copy(entry.value)
+
+    def get_last_task(self, parent_task_id: Optional[str] = None,
+                      sort_key_before: Optional[str] = None) -> Optional[Task]:
+        key = ('get_last_task', parent_task_id, sort_key_before)
+        with self._lock:
+            entry = self._get(key)
+            if entry is None:
+                task = self._db.get_last_task(parent_task_id=parent_task_id, sort_key_before=sort_key_before)
+                entry = _CacheEntry(task, [task.id] if task is not None else [], {'parent_task_id': parent_task_id})
+                self._put(key, entry)
+            return copy.copy(entry.value)
+
+    def iter_tasks(self, batch_size: int = 1000) -> Iterator[Task]:
+        return self._db.iter_tasks(batch_size=batch_size)
+
+    def get_subtree(self, task_id: str, with_memo: bool = True) -> List[Task]:
+        return self._db.get_subtree(task_id, with_memo=with_memo)
+
+    def get_ancestors(self, task_id: str, with_memo: bool = True) -> List[Task]:
+        return self._db.get_ancestors(task_id, with_memo=with_memo)
+
+    def is_ancestor(self, ancestor_id: str, task_id: str) -> bool:
+        return self._db.is_ancestor(ancestor_id, task_id)
+
+    def search(self, query: str, list_id: Optional[str] = None, include_archived: bool = False,
+               limit: int = 50) -> List[TaskSearchResult]:
+        return self._db.search(query, list_id=list_id, include_archived=include_archived, limit=limit)
+
+    def get_task_columns(self, use_numpy: Optional[bool] = None) -> TaskColumns:
+        return self._db.get_task_columns(use_numpy=use_numpy)
+
+    def get_list_stats(self) -> Dict[str, TaskListStats]:
+        return self._db.get_list_stats()
+
+    def get_completion_stats(self, width: int = 24 * 60 * 60, origin: int = 0, list_id: Optional[str] = None,
+                             since: Optional[int] = None, until: Optional[int] = None) -> Dict[int, int]:
+        return self._db.get_completion_stats(width=width, origin=origin, list_id=list_id, since=since, until=until)
+
+    def get_age_stats(self, now: int, edges: Sequence[int], list_id: Optional[str] = None) -> Dict[int, int]:
+        return self._db.get_age_stats(now, edges, list_id=list_id)
+
+    def get_tasklists(self, id_: Optional[str] = None) -> List[TaskList]:
+        with self._lock:
+            tasklists = self._tasklists.get(id_)
+            if tasklists is None:
+                self.misses += 1
+                tasklists = self._tasklists[id_] = self._db.get_tasklists(id_=id_)
+            else:
+                self.hits += 1
+            return [TaskList(t.id, t.name, t.sort_key) for t in tasklists]
+
+    def changes_since(self, seq: int) -> Optional[List[TaskChange]]:
+        return self._db.changes_since(seq)
+
+    def last_change_seq(self) -> int:
+        return self._db.last_change_seq()
+
+    def compact_changes(self, before_seq: Optional[int] = None) -> None:
+        self._db.compact_changes(before_seq)
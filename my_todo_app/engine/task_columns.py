@@ -0,0 +1,212 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Task fields as columns of arrays, for reports over many tasks without a Task object per row."""
+
+import array
+import collections
+import functools
+import heapq
+import itertools
+import operator
+from typing import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Numeric columns with their array module type code and NumPy type
+_NUMERIC_COLUMN_TYPES: Dict[str, Tuple[str, str]] = {
+    'list_codes': ('i', 'int32'),
+    'completed': ('b', 'bool'),
+    'archived': ('b', 'bool'),
+    'created_at': ('q', 'int64'),
+    'updated_at': ('q', 'int64'),
+    'completed_at': ('q', 'int64'),
+}
+
+# Columns that can be grouped into buckets of a width
+_TIME_COLUMNS: Tuple[str, ...] = ('created_at', 'updated_at', 'completed_at')
+
+# A row as passed to TaskColumns.from_rows
+TaskColumnsRow = Tuple[str, str, bool, bool, int, int, int, str]
+
+# The NumPy record type of such rows
+_ROW_DTYPE: List[Tuple[str, str]] = [
+    ('id', 'O'), ('list_id', 'O'), ('completed', 'bool'), ('archived', 'bool'), ('created_at', 'int64'),
+    ('updated_at', 'int64'), ('completed_at', 'int64'), ('sort_key', 'O')]
+
+
+class TaskColumns:
+    """The fields of many tasks, one array per field, with filters, group-bys and top-k over whole columns.
+
+    List ids are dictionary encoded: list_codes index list_id_dictionary. Columns are NumPy arrays if NumPy is
+    installed and array.array otherwise, ids and sort keys NumPy object arrays or lists; every operation answers the
+    same either way. Memos, names and tags are not loaded.
+    """
+
+    def __init__(self, ids: Sequence[str], list_id_dictionary: List[str], columns: Dict[str, Any], uses_numpy: bool):
+        self.ids: Sequence[str] = ids
+        self.list_id_dictionary: List[str] = list_id_dictionary
+        self.uses_numpy: bool = uses_numpy
+        self.list_codes: Sequence[int] = columns['list_codes']
+        self.completed: Sequence[bool] = columns['completed']
+        self.archived: Sequence[bool] = columns['archived']
+        self.created_at: Sequence[int] = columns['created_at']
+        self.updated_at: Sequence[int] = columns['updated_at']
+        self.completed_at: Sequence[int] = columns['completed_at']
+        self.sort_key: Sequence[str] = columns['sort_key']
+
+    @staticmethod
+    def from_rows(rows: Iterable[TaskColumnsRow], use_numpy: Optional[bool] = None) -> 'TaskColumns':
+        """Load rows of id, list id, completed, archived, created_at, updated_at, completed_at and sort key.
+
+        NumPy is used if use_numpy is True, or None and NumPy is installed.
+        """
+        uses_numpy = numpy is not None if use_numpy is None else use_numpy
+        if uses_numpy and numpy is None:
+            raise RuntimeError('NumPy is not installed')
+        dictionary: Dict[str, int] = {}
+        if uses_numpy:
+            # Converted in one pass into records, rather than per column through Python lists
+            records = numpy.array(rows if isinstance(rows, list) else list(rows), dtype=_ROW_DTYPE)
+            list_codes = [dictionary.setdefault(list_id, len(dictionary)) for list_id in records['list_id']]
+            columns = {name: records[name].astype(dtype) for name, (_, dtype) in _NUMERIC_COLUMN_TYPES.items()
+                       if name != 'list_codes'}
+            columns['list_codes'] = numpy.array(list_codes, dtype=_NUMERIC_COLUMN_TYPES['list_codes'][1])
+            columns['sort_key'] = records['sort_key'].copy()
+            return TaskColumns(records['id'].copy(), list(dictionary), columns, True)
+        values = list(zip(*rows)) or [()] * 8
+        list_codes = [dictionary.setdefault(list_id, len(dictionary)) for list_id in values[1]]
+        columns = {}
+        for name, column_values in zip(_NUMERIC_COLUMN_TYPES, [list_codes] + values[2:7]):
+            type_code, dtype = _NUMERIC_COLUMN_TYPES[name]
+            columns[name] = array.array(type_code, column_values)
+        columns['sort_key'] = list(values[7])
+        return TaskColumns(list(values[0]), list(dictionary), columns, False)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _columns(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in _NUMERIC_COLUMN_TYPES}
+
+    def _column(self, name: str) -> Sequence:
+        """Return the column to compare or group by values."""
+        if name == 'sort_key':
+            if self.uses_numpy and not isinstance(self.sort_key, numpy.ndarray):
+                # Sort keys that are decoded on access, as those of a snapshot, are decoded once for all
+                self.sort_key = numpy.array(list(self.sort_key), dtype=object)
+            return self.sort_key
+        if name not in _NUMERIC_COLUMN_TYPES:
+            raise ValueError('Unknown column: {}'.format(name))
+        return getattr(self, name)
+
+    def _take(self, selector: Any, is_mask: bool) -> 'TaskColumns':
+        """Return the rows chosen by a mask of booleans, or by a sequence of row numbers in its order."""
+        if self.uses_numpy:
+            columns = {name: column[selector] for name, column in self._columns().items()}
+            columns['sort_key'] = self.sort_key[selector]
+            return TaskColumns(self.ids[selector], self.list_id_dictionary, columns, True)
+        if is_mask:
+            def take(values: Sequence) -> Iterable:
+                return itertools.compress(values, selector)
+        else:
+            def take(values: Sequence) -> Iterable:
+                return (values[i] for i in selector)
+        columns = {name: array.array(column.typecode, take(column)) for name, column in self._columns().items()}
+        columns['sort_key'] = list(take(self.sort_key))
+        return TaskColumns(list(take(self.ids)), self.list_id_dictionary, columns, False)
+
+    def filter(self, list_id: Optional[str] = None, completed: Optional[bool] = None,
+               archived: Optional[bool] = None, **ranges: Tuple[Optional[float], Optional[float]]) -> 'TaskColumns':
+        """Return the rows that match every passed condition.
+
+        A range is passed by column name as (start, end), half-open, either end None for unbounded; for example
+        completed_at=(monday, None).
+        """
+        conditions: List[Tuple[Sequence, Callable[[Any], Any]]] = []
+        if list_id is not None:
+            code = self.list_id_dictionary.index(list_id) if list_id in self.list_id_dictionary else -1
+            conditions.append((self.list_codes, lambda value: value == code))
+        for column, flag in ((self.completed, completed), (self.archived, archived)):
+            if flag is not None:
+                conditions.append((column, lambda value, flag=flag: value == flag))
+        for name, (start, end) in ranges.items():
+            if start is not None:
+                conditions.append((self._column(name), lambda value, start=start: value >= start))
+            if end is not None:
+                conditions.append((self._column(name), lambda value, end=end: value < end))
+
+        if self.uses_numpy:
+            mask = numpy.ones(len(self), dtype=bool)
+            for column, condition in conditions:
+                mask &= condition(column)
+        else:
+            mask = [True] * len(self)
+            for column, condition in conditions:
+                mask = [m and bool(condition(value)) for m, value in zip(mask, column)]
+        return self._take(mask, is_mask=True)
+
+    def _key_column(self, name: str, width: float) -> Sequence:
+        column = self._column('list_codes' if name == 'list_id' else name)
+        if not width or name not in _TIME_COLUMNS:
+            return column
+        if self.uses_numpy:
+            return column // width * width
+        return [value // width * width for value in column]
+
+    def _decode(self, name: str, value: Any) -> Any:
+        if name == 'list_id':
+            return self.list_id_dictionary[int(value)]
+        if name in ('completed', 'archived'):
+            return bool(value)
+        return str(value) if name == 'sort_key' else int(value)
+
+    @staticmethod
+    def _count_numpy(key_columns: List[Any]) -> Optional[List[Tuple[Tuple, int]]]:
+        """Count NumPy key columns, or return None if their combinations do not fit in a 64-bit integer."""
+        if len(key_columns) == 1:
+            keys, counts = numpy.unique(key_columns[0], return_counts=True)
+            return [((key,), int(count)) for key, count in zip(keys, counts)]
+        # Each column factorized and the factors combined into one integer, which unique sorts far faster than rows
+        factors = [numpy.unique(column, return_inverse=True) for column in key_columns]
+        if functools.reduce(operator.mul, (len(values) for values, _ in factors)) >= 2 ** 63:
+            return None
+        codes = numpy.zeros(len(key_columns[0]), dtype='int64')
+        for values, inverse in factors:
+            codes = codes * len(values) + inverse.reshape(-1)
+        codes, counts = numpy.unique(codes, return_counts=True)
+        digits = []
+        for values, _ in reversed(factors):
+            digits.append(values[codes % len(values)])
+            codes = codes // len(values)
+        return list(zip(zip(*reversed(digits)), (int(count) for count in counts)))
+
+    def count_by(self, *names: str, width: float = 0) -> Dict[Any, int]:
+        """Count the rows by the values of the columns, list_id for the list, in ascending order of them.
+
+        Time columns are grouped into buckets of the width if it is not zero, keyed by the start of the bucket. Keys
+        are values for one column and tuples for more.
+        """
+        key_columns = [self._key_column(name, width) for name in names]
+        counted = self._count_numpy(key_columns) if self.uses_numpy and len(self) > 0 else None
+        if counted is None:
+            counted = list(collections.Counter(zip(*key_columns)).items())
+        # Decoded before sorting, so that lists come in the order of their ids rather than their codes
+        counted = sorted((tuple(self._decode(n, v) for n, v in zip(names, key_row)), count)
+                         for key_row, count in counted)
+        return {key if len(names) > 1 else key[0]: count for key, count in counted}
+
+    def top_k(self, name: str, k: int, largest: bool = False) -> 'TaskColumns':
+        """Return the k rows with the smallest values of the column, or the largest, in that order."""
+        column = self._column(name)
+        k = max(0, min(k, len(self)))
+        if self.uses_numpy and name != 'sort_key':
+            keys = -column.astype('float64') if largest else column
+            rows = numpy.argpartition(keys, k - 1)[:k] if 0 < k < len(self) else numpy.arange(len(self))[:k]
+            return self._take(rows[numpy.argsort(keys[rows], kind='stable')], is_mask=False)
+        select = heapq.nlargest if largest else heapq.nsmallest
+        rows = select(k, range(len(self)), key=column.__getitem__)
+        return self._take(numpy.array(rows, dtype='int64') if self.uses_numpy else rows, is_mask=False)
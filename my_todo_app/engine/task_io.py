@@ -0,0 +1,238 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Export and import task lists and tasks as JSON Lines or CSV.
+
+Every record is a task list or a task with all its fields, so ids, parent links and sort keys survive a round trip.
+Task lists are written first, tasks follow with every parent before its children. Sort keys of files written when
+they were numbers are imported as the order keys of those numbers.
+"""
+
+from __future__ import annotations
+
+import collections
+import csv
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+from typing import *
+
+from my_todo_app.engine import order_key
+from my_todo_app.engine.task import TaskDatabase, Task, TaskList
+
+
+class TaskFileFormat(Enum):
+    JSON_LINES = 'jsonl'
+    CSV = 'csv'
+
+    @staticmethod
+    def from_path(path: str) -> TaskFileFormat:
+        return TaskFileFormat.CSV if path.lower().endswith('.csv') else TaskFileFormat.JSON_LINES
+
+
+# Record fields in file order; a record has the fields of its type, CSV rows leave the others empty
+_TASKLIST_FIELDS: List[Tuple[str, type]] = [('id', str), ('name', str), ('sort_key', str)]
+_TASK_FIELDS: List[Tuple[str, type]] = [
+    ('id', str), ('list_id', str), ('parent_task_id', str), ('name', str), ('tags', str), ('memo', str),
+    ('completed', bool), ('archived', bool), ('created_at', int), ('updated_at', int), ('completed_at', int),
+    ('sort_key', str),
+]
+_CSV_FIELDS: List[str] = ['type'] + [name for name, _ in _TASK_FIELDS]
+# Fields that may be missing from an imported record, and their values then
+_FIELD_DEFAULTS: Dict[str, Any] = {
+    'parent_task_id': '', 'tags': '', 'memo': '', 'completed': False, 'archived': False,
+    'created_at': 0, 'updated_at': 0, 'completed_at': 0,
+}
+
+# Records sent to a parser process at a time
+_PARSE_CHUNK_SIZE = 5000
+
+
+def export_tasks(db: TaskDatabase, file: TextIO, format_: TaskFileFormat = TaskFileFormat.JSON_LINES,
+                 batch_size: int = 1000) -> Tuple[int, int]:
+    """Write all task lists and tasks to the text file, and return their counts.
+
+    Tasks are read in batches; open CSV files with newline=''.
+    """
+    tasklists = db.get_tasklists()
+    records = itertools.chain(
+        (('tasklist', [tasklist.id, tasklist.name, tasklist.sort_key]) for tasklist in tasklists),
+        (('task', [task.id, task.list_id, task.parent_task_id, task.name, task.tags, task.memo, task.completed,
+                   task.archived, task.created_at, task.updated_at, task.completed_at, task.sort_key])
+         for task in db.iter_tasks(batch_size=batch_size)))
+    task_count = 0
+    if format_ == TaskFileFormat.CSV:
+        writer = csv.writer(file)
+        writer.writerow(_CSV_FIELDS)
+        for type_, values in records:
+            if type_ == 'tasklist':
+                writer.writerow([type_, values[0], '', '', values[1]] + [''] * 7 + [values[2]])
+            else:
+                writer.writerow([type_] + [int(v) if isinstance(v, bool) else v for v in values])
+                task_count += 1
+    else:
+        for type_, values in records:
+            fields = _TASKLIST_FIELDS if type_ == 'tasklist' else _TASK_FIELDS
+            record = {'type': type_}
+            record.update(zip((name for name, _ in fields), values))
+            file.write(json.dumps(record, ensure_ascii=False))
+            file.write('\n')
+            if type_ == 'task':
+                task_count += 1
+    return len(tasklists), task_count
+
+
+def import_tasks(db: TaskDatabase, file: TextIO, format_: TaskFileFormat = TaskFileFormat.JSON_LINES,
+                 chunk_size: int = 10000, processes: Optional[int] = None) -> Tuple[int, int]:
+    """Upsert the task lists and tasks of the text file, and return their counts.
+
+    Records are validated and parsed by a pool of processes, all of them by default or none if processes is 1, and
+    tasks are loaded chunk by chunk, so memory use does not grow with the file. An invalid record raises
+    RuntimeError; the chunks loaded before it stay. Open CSV files with newline=''.
+    """
+    if format_ == TaskFileFormat.CSV:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            return 0, 0
+        unknown_fields = set(header) - set(_CSV_FIELDS)
+        if unknown_fields:
+            raise RuntimeError('Unknown CSV columns: {}'.format(', '.join(sorted(unknown_fields))))
+        items: Iterator[Any] = (dict(zip(header, row)) for row in reader)
+    else:
+        items = iter(file)
+    chunks = ((number * _PARSE_CHUNK_SIZE + 1, format_, list(chunk))
+              for number, chunk in enumerate(_chunked(items, _PARSE_CHUNK_SIZE)))
+
+    tasklist_count = 0
+
+    def tasks() -> Iterator[Task]:
+        nonlocal tasklist_count
+        for records, error in _parse_in_pool(chunks, processes):
+            for type_, values in records:
+                if type_ == 'tasklist':
+                    # Task lists are few, they are written as they come
+                    db.upsert_tasklist(TaskList(*values))
+                    tasklist_count += 1
+                else:
+                    yield Task(*values)
+            if error is not None:
+                raise RuntimeError(error)
+
+    task_count = db.load_tasks(tasks(), chunk_size=chunk_size)
+    return tasklist_count, task_count
+
+
+def _chunked(items: Iterator[Any], size: int) -> Iterator[List[Any]]:
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _parse_in_pool(chunks: Iterator[Tuple[int, TaskFileFormat, List[Any]]],
+                   processes: Optional[int]) -> Iterator[Tuple[List[Tuple[str, Tuple]], Optional[str]]]:
+    """Parse the chunks in order; no more than two chunks per process are in flight."""
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        for chunk in chunks:
+            yield _parse_chunk(chunk)
+        return
+    with ProcessPoolExecutor(processes) as executor:
+        pending: Deque = collections.deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_parse_chunk, chunk))
+            if len(pending) >= processes * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _parse_chunk(chunk: Tuple[int, TaskFileFormat, List[Any]]) -> Tuple[List[Tuple[str, Tuple]], Optional[str]]:
+    """Return the types and field values of the records in the chunk up to the first invalid one, and its error.
+
+    Run in the parser processes; the records before an invalid one are still loaded.
+    """
+    first_number, format_, items = chunk
+    result = []
+    try:
+        for number, item in enumerate(items, first_number):
+            if format_ == TaskFileFormat.CSV:
+                record = item
+            else:
+                if not item.strip():
+                    continue
+                try:
+                    record = json.loads(item)
+                except ValueError as e:
+                    raise RuntimeError('Record {}: {}'.format(number, e))
+                if not isinstance(record, dict):
+                    raise RuntimeError('Record {}: not an object'.format(number))
+            result.append(_parse_record(number, record, from_text=format_ == TaskFileFormat.CSV))
+    except RuntimeError as e:
+        return result, str(e)
+    return result, None
+
+
+def _parse_record(number: int, record: Dict[str, Any], from_text: bool) -> Tuple[str, Tuple]:
+    type_ = record.get('type')
+    if type_ == 'tasklist':
+        fields = _TASKLIST_FIELDS
+    elif type_ == 'task':
+        fields = _TASK_FIELDS
+    else:
+        raise RuntimeError('Record {}: unknown type {!r}'.format(number, type_))
+    values = []
+    for name, field_type in fields:
+        value = record.get(name)
+        if name == 'sort_key' and value is not None:
+            try:
+                values.append(_parse_sort_key(value))
+            except ValueError:
+                raise RuntimeError('Record {}: {} is not an order key or a number: {!r}'.format(number, name, value))
+            continue
+        if type(value) is field_type:
+            values.append(value)
+            continue
+        if value is None or (from_text and value == '' and name in _FIELD_DEFAULTS):
+            if name not in _FIELD_DEFAULTS:
+                raise RuntimeError('Record {}: {} is missing'.format(number, name))
+            value = _FIELD_DEFAULTS[name]
+        else:
+            try:
+                value = _parse_value(value, field_type, from_text)
+            except ValueError:
+                raise RuntimeError('Record {}: {} is not {}: {!r}'.format(number, name, field_type.__name__, value))
+        values.append(value)
+    if not values[0]:
+        raise RuntimeError('Record {}: id is empty'.format(number))
+    return type_, tuple(values)
+
+
+def _parse_sort_key(value: Any) -> str:
+    if isinstance(value, str):
+        if order_key.is_valid_key(value):
+            return value
+        # No order key reads as a number, they start with a letter
+        return order_key.key_from_number(float(value))
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return order_key.key_from_number(value)
+    raise ValueError()
+
+
+def _parse_value(value: Any, field_type: type, from_text: bool) -> Any:
+    if from_text:
+        if field_type is bool:
+            if value.lower() not in ('0', '1', 'false', 'true'):
+                raise ValueError()
+            return value.lower() in ('1', 'true')
+        return field_type(value)
+    # JSON values must have the type already, flags may be numbers
+    if field_type is bool and value in (0, 1) and not isinstance(value, float):
+        return bool(value)
+    if type(value) is not field_type:
+        raise ValueError()
+    return value
@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Keep a SQLite3 task database small and its query plans good: purge, incremental vacuum and optimize."""
+
+import threading
+import time
+from typing import *
+
+from my_todo_app.engine.idle import IdleJobScheduler
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+# Pages freed by one incremental_vacuum statement, each holds the writer for that long
+_VACUUM_STEP_PAGES: int = 256
+
+
+class MaintenanceResult:
+    """What a maintenance run has done."""
+
+    def __init__(self, purged_task_count: int, reclaimed_page_count: int, page_size: int, analyzed: bool,
+                 seconds: float):
+        self.purged_task_count: int = purged_task_count
+        self.reclaimed_page_count: int = reclaimed_page_count
+        self.page_size: int = page_size
+        self.analyzed: bool = analyzed
+        self.seconds: float = seconds
+
+    def __str__(self) -> str:
+        return 'Purged {} archived tasks, reclaimed {} pages ({} bytes), {} in {:.2f} s'.format(
+            self.purged_task_count, self.reclaimed_page_count, self.reclaimed_page_count * self.page_size,
+            'analyzed' if self.analyzed else 'optimized', self.seconds)
+
+
+def run_maintenance(db: SQLite3TaskDatabase, purge_archived_after_days: int = 0, vacuum_pages: int = 4096,
+                    analyze: bool = False, cancel_event: Optional[threading.Event] = None,
+                    now: Optional[int] = None) -> MaintenanceResult:
+    """Purge old archived tasks if purge_archived_after_days is positive, vacuum, then optimize.
+
+    Every step is a short transaction of its own, so the application can write between them. At most vacuum_pages
+    free pages are reclaimed. Setting cancel_event stops the run after the current step.
+    """
+    start = time.perf_counter()
+
+    def cancelled() -> bool:
+        return cancel_event is not None and cancel_event.is_set()
+
+    purged_task_count = 0
+    if purge_archived_after_days > 0:
+        now = now if now is not None else int(time.time())
+        purged_task_count = db.purge_archived_tasks(now - purge_archived_after_days * 24 * 60 * 60,
+                                                    cancel_event=cancel_event)
+
+    reclaimed_page_count = 0
+    while reclaimed_page_count < vacuum_pages and not cancelled():
+        step_count = db.incremental_vacuum(min(_VACUUM_STEP_PAGES, vacuum_pages - reclaimed_page_count))
+        if step_count == 0:
+            break
+        reclaimed_page_count += step_count
+
+    analyzed = db.optimize(analyze=analyze) if not cancelled() else False
+    return MaintenanceResult(purged_task_count, reclaimed_page_count, db.get_page_counts()[2], analyzed,
+                             time.perf_counter() - start)
+
+
+class MaintenanceScheduler(IdleJobScheduler):
+    """Run maintenance once the application has been idle for a while, then every interval.
+
+    flush is called first on the job thread, such as WriteBehindTaskDatabase.flush for the writes held back in front
+    of the database, so that the purge sees them.
+    """
+
+    def __init__(self, db: SQLite3TaskDatabase, interval_s: float = 24 * 60 * 60, idle_s: float = 60,
+                 purge_archived_after_days: int = 0, vacuum_pages: int = 4096,
+                 flush: Optional[Callable[[], None]] = None,
+                 on_done: Optional[Callable[[MaintenanceResult], None]] = None,
+                 on_error: Optional[Callable[[BaseException], None]] = None,
+                 clock: Callable[[], float] = time.time):
+        def job(cancel_event: threading.Event) -> MaintenanceResult:
+            if flush is not None:
+                flush()
+            return run_maintenance(db, purge_archived_after_days=purge_archived_after_days,
+                                   vacuum_pages=vacuum_pages, cancel_event=cancel_event)
+
+        super().__init__(job, interval_s, idle_s, on_done=on_done, on_error=on_error, clock=clock)
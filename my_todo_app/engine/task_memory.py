@@ -0,0 +1,191 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""The in-memory task database implementation."""
+
+import bisect
+import functools
+from typing import *
+
+from my_todo_app.engine.task import TaskDatabase, Task, TaskList
+
+
+class _SortedIndex:
+    """Ids ordered by sort key; ids with the same sort key keep their insertion order."""
+
+    def __init__(self) -> None:
+        self._keys: List[str] = []
+        self._ids: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ids)
+
+    def add(self, key: str, id_: str) -> None:
+        index = bisect.bisect_right(self._keys, key)
+        self._keys.insert(index, key)
+        self._ids.insert(index, id_)
+
+    def remove(self, key: str, id_: str) -> None:
+        index = bisect.bisect_left(self._keys, key)
+        while self._ids[index] != id_:
+            index += 1
+        del self._keys[index]
+        del self._ids[index]
+
+    def first(self, after: Optional[str] = None) -> Optional[str]:
+        """Return the id of the smallest sort key, greater than after if passed."""
+        index = bisect.bisect_right(self._keys, after) if after is not None else 0
+        return self._ids[index] if index < len(self._ids) else None
+
+    def last(self, before: Optional[str] = None) -> Optional[str]:
+        """Return the id of the largest sort key, less than before if passed."""
+        index = bisect.bisect_left(self._keys, before) if before is not None else len(self._keys)
+        return self._ids[index - 1] if index > 0 else None
+
+
+def _copy_task(task: Task, memo: Optional[str]) -> Task:
+    return Task(task.id, task.list_id, task.parent_task_id, task.name, task.tags, memo, task.completed,
+                task.archived, task.created_at, task.updated_at, task.completed_at, task.sort_key)
+
+
+class InMemoryTaskDatabase(TaskDatabase):
+    """A database for task management that keeps everything in memory.
+
+    Stored objects are never handed out, every read returns copies.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._tasks: Dict[str, Task] = {}
+        self._tasklists: Dict[str, TaskList] = {}
+        self._task_index: _SortedIndex = _SortedIndex()
+        self._list_indexes: Dict[str, _SortedIndex] = {}
+        self._parent_indexes: Dict[str, _SortedIndex] = {}
+        self._tasklist_index: _SortedIndex = _SortedIndex()
+        # Values before the current transaction of the tasks and task lists it has written, None if they were absent
+        self._saved_tasks: Dict[str, Optional[Task]] = {}
+        self._saved_tasklists: Dict[str, Optional[TaskList]] = {}
+
+    def close(self):
+        pass
+
+    def _begin_transaction(self) -> None:
+        self._saved_tasks = {}
+        self._saved_tasklists = {}
+
+    def _end_transaction(self) -> None:
+        self._saved_tasks = {}
+        self._saved_tasklists = {}
+
+    def _rollback_transaction(self) -> None:
+        for id_, task in list(self._saved_tasks.items()):
+            self._put_task(id_, task)
+        for id_, tasklist in list(self._saved_tasklists.items()):
+            self._put_tasklist(id_, tasklist)
+        self._end_transaction()
+
+    def _put_task(self, id_: str, task: Optional[Task]) -> None:
+        """Replace the stored task of the id, removing it if task is None."""
+        old_task = self._tasks.pop(id_, None)
+        if id_ not in self._saved_tasks:
+            self._saved_tasks[id_] = old_task
+        if old_task is not None:
+            self._task_index.remove(old_task.sort_key, id_)
+            self._list_indexes[old_task.list_id].remove(old_task.sort_key, id_)
+            self._parent_indexes[old_task.parent_task_id].remove(old_task.sort_key, id_)
+        if task is not None:
+            self._tasks[id_] = task
+            self._task_index.add(task.sort_key, id_)
+            self._list_indexes.setdefault(task.list_id, _SortedIndex()).add(task.sort_key, id_)
+            self._parent_indexes.setdefault(task.parent_task_id, _SortedIndex()).add(task.sort_key, id_)
+
+    def _put_tasklist(self, id_: str, tasklist: Optional[TaskList]) -> None:
+        """Replace the stored task list of the id, removing it if tasklist is None."""
+        old_tasklist = self._tasklists.pop(id_, None)
+        if id_ not in self._saved_tasklists:
+            self._saved_tasklists[id_] = old_tasklist
+        if old_tasklist is not None:
+            self._tasklist_index.remove(old_tasklist.sort_key, id_)
+        if tasklist is not None:
+            self._tasklists[id_] = tasklist
+            self._tasklist_index.add(tasklist.sort_key, id_)
+
+    def upsert_task(self, task: Task) -> None:
+        with self.transaction():
+            old_task = self._tasks.get(task.id)
+            # The stored memo is kept for a task whose memo has not been loaded
+            if task.memo_is_loaded:
+                memo = task.memo
+            else:
+                memo = old_task.memo if old_task is not None else ''
+            self._put_task(task.id, _copy_task(task, memo))
+
+    def upsert_tasklist(self, tasklist: TaskList) -> None:
+        with self.transaction():
+            self._put_tasklist(tasklist.id, TaskList(tasklist.id, tasklist.name, tasklist.sort_key))
+
+    def delete_task(self, id_: str) -> None:
+        with self.transaction():
+            self._put_task(id_, None)
+
+    def delete_tasklist(self, id_: str) -> None:
+        with self.transaction():
+            self._put_tasklist(id_, None)
+
+    def get_tasks(self, id_: Optional[str] = None, list_id: Optional[str] = None, parent_task_id: Optional[str] = None,
+                  completed: Optional[bool] = None, archived: Optional[bool] = None,
+                  with_memo: bool = True) -> List[Task]:
+        # Start from the narrowest index, then filter by the other conditions
+        if id_ is not None:
+            ids: Iterable[str] = [id_] if id_ in self._tasks else []
+        elif parent_task_id is not None:
+            ids = self._parent_indexes.get(parent_task_id, [])
+        elif list_id is not None:
+            ids = self._list_indexes.get(list_id, [])
+        else:
+            ids = self._task_index
+        tasks = []
+        for task in (self._tasks[i] for i in ids):
+            if list_id is not None and task.list_id != list_id:
+                continue
+            if parent_task_id is not None and task.parent_task_id != parent_task_id:
+                continue
+            if completed is not None and task.completed != completed:
+                continue
+            if archived is not None and task.archived != archived:
+                continue
+            tasks.append(self._copy_out(task, with_memo))
+        return tasks
+
+    def _copy_out(self, task: Task, with_memo: bool = True) -> Task:
+        if with_memo:
+            return _copy_task(task, task.memo)
+        copied_task = _copy_task(task, None)
+        copied_task.defer_memo(functools.partial(self.get_memo, task.id))
+        return copied_task
+
+    def get_memo(self, id_: str) -> str:
+        task = self._tasks.get(id_)
+        return task.memo if task is not None else ''
+
+    def get_first_task(self, parent_task_id: Optional[str] = None,
+                       sort_key_after: Optional[str] = None) -> Optional[Task]:
+        index = self._task_index if parent_task_id is None else self._parent_indexes.get(parent_task_id)
+        id_ = index.first(after=sort_key_after) if index is not None else None
+        return self._copy_out(self._tasks[id_]) if id_ is not None else None
+
+    def get_last_task(self, parent_task_id: Optional[str] = None,
+                      sort_key_before: Optional[str] = None) -> Optional[Task]:
+        index = self._task_index if parent_task_id is None else self._parent_indexes.get(parent_task_id)
+        id_ = index.last(before=sort_key_before) if index is not None else None
+        return self._copy_out(self._tasks[id_]) if id_ is not None else None
+
+    def get_tasklists(self, id_: Optional[str] = None) -> List[TaskList]:
+        if id_ is not None:
+            ids: Iterable[str] = [id_] if id_ in self._tasklists else []
+        else:
+            ids = self._tasklist_index
+        return [TaskList(t.id, t.name, t.sort_key) for t in (self._tasklists[i] for i in ids)]
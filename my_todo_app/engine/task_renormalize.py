@@ -0,0 +1,184 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Rewrite crowded sort keys to short ones: a check for crowded task lists and the rewrite itself.
+
+Order keys grow a digit every few insertions at the same place. Once a task list has keys longer than a limit, the
+keys of its tasks are rewritten to short ones. Sort keys order all tasks of all lists, which the engine relies on to
+find neighboring keys, so a task gets a key between the keys of the tasks of other lists around it: runs of tasks of
+crowded lists are spread between the unchanged keys that bound them. The keys of the other lists are left as they are.
+
+Both read the sort keys as TaskColumns, so that the lengths and the order of all keys are found in one pass over
+arrays; Task objects are read for the tasks of crowded lists only.
+"""
+
+import operator
+import threading
+import time
+from typing import *
+
+from my_todo_app.engine import order_key
+from my_todo_app.engine.idle import IdleJobScheduler
+from my_todo_app.engine.task import TaskList, TaskDatabase
+from my_todo_app.engine.task_columns import TaskColumns
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Keys longer than this are crowded; appended keys stay far shorter, 5 characters for a million tasks
+DEFAULT_MAX_KEY_LENGTH: int = 16
+
+# Tasks written between two checks of the cancel event and progress reports
+_CHUNK_SIZE: int = 500
+
+
+class SortKeyCheckResult:
+    """The task lists found with crowded sort keys."""
+
+    def __init__(self, crowded_list_ids: List[str], max_key_length: int, seconds: float):
+        self.crowded_list_ids: List[str] = crowded_list_ids
+        self.max_key_length: int = max_key_length
+        self.seconds: float = seconds
+
+    def __str__(self) -> str:
+        return 'Found {} task lists with sort keys longer than {} characters in {:.2f} s'.format(
+            len(self.crowded_list_ids), self.max_key_length, self.seconds)
+
+
+class RenormalizeResult:
+    """What a renormalization has done."""
+
+    def __init__(self, crowded_list_ids: List[str], rewritten_key_count: int, seconds: float):
+        self.crowded_list_ids: List[str] = crowded_list_ids
+        self.rewritten_key_count: int = rewritten_key_count
+        self.seconds: float = seconds
+
+    def __str__(self) -> str:
+        return 'Rewrote {} sort keys for {} crowded task lists in {:.2f} s'.format(
+            self.rewritten_key_count, len(self.crowded_list_ids), self.seconds)
+
+
+class _SortedKeys:
+    """The sort keys of task columns in ascending order, with whether each is of a crowded list."""
+
+    def __init__(self, columns: TaskColumns, tasklists: List[TaskList], max_key_length: int):
+        crowded_list_ids = {tasklist.id for tasklist in tasklists if len(tasklist.sort_key) > max_key_length}
+        if columns.uses_numpy:
+            keys = numpy.asarray(columns.sort_key, dtype=str)
+            list_codes = numpy.asarray(columns.list_codes)
+            crowded_codes = numpy.unique(list_codes[numpy.char.str_len(keys) > max_key_length])
+            order = numpy.argsort(keys, kind='stable')
+            self.crowded: Sequence[bool] = numpy.isin(list_codes[order], crowded_codes)
+            self.ids: Sequence[str] = numpy.asarray(columns.ids, dtype=object)[order]
+            self.keys: Sequence[str] = keys[order]
+        else:
+            keys = list(columns.sort_key)
+            crowded_codes = {code for code, key in zip(columns.list_codes, keys) if len(key) > max_key_length}
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            self.crowded = [columns.list_codes[i] in crowded_codes for i in order]
+            self.ids = [columns.ids[i] for i in order]
+            self.keys = [keys[i] for i in order]
+        crowded_list_ids.update(columns.list_id_dictionary[code] for code in crowded_codes)
+        self.crowded_list_ids: List[str] = sorted(crowded_list_ids)
+
+    def runs(self) -> Iterator[Tuple[int, int]]:
+        """Yield the start and end positions of the runs of keys of crowded lists."""
+        if numpy is not None and isinstance(self.crowded, numpy.ndarray):
+            edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([False], self.crowded, [False])).astype('int8')))
+            yield from zip(edges[0::2].tolist(), edges[1::2].tolist())
+            return
+        start = None
+        for position, crowded in enumerate(list(self.crowded) + [False]):
+            if crowded and start is None:
+                start = position
+            elif not crowded and start is not None:
+                yield start, position
+                start = None
+
+    def new_keys(self) -> Dict[str, str]:
+        """Return new keys of the tasks of crowded lists, by task id, spread between the keys around each run."""
+        new_keys = {}
+        for start, end in self.runs():
+            lower = str(self.keys[start - 1]) if start > 0 else None
+            upper = str(self.keys[end]) if end < len(self.keys) else None
+            new_keys.update(zip(self.ids[start:end], order_key.keys_between(lower, upper, end - start)))
+        return new_keys
+
+
+def check_sort_keys(db: TaskDatabase, max_key_length: int = DEFAULT_MAX_KEY_LENGTH) -> SortKeyCheckResult:
+    """Find the task lists whose own sort key or the sort key of any of whose tasks is longer than max_key_length."""
+    start = time.perf_counter()
+    sorted_keys = _SortedKeys(db.get_task_columns(), db.get_tasklists(), max_key_length)
+    return SortKeyCheckResult(sorted_keys.crowded_list_ids, max_key_length, time.perf_counter() - start)
+
+
+def _assign_consecutive_keys(tasklists: List[TaskList]) -> List[TaskList]:
+    """Give the task lists consecutive keys in the order of their keys; return those changed."""
+    tasklists.sort(key=operator.attrgetter('sort_key'))
+    changed_tasklists = []
+    for tasklist, sort_key in zip(tasklists, order_key.keys_between(None, None, len(tasklists))):
+        if tasklist.sort_key != sort_key:
+            tasklist.sort_key = sort_key
+            changed_tasklists.append(tasklist)
+    return changed_tasklists
+
+
+def renormalize_sort_keys(db: TaskDatabase, max_key_length: int = DEFAULT_MAX_KEY_LENGTH,
+                          cancel_event: Optional[threading.Event] = None,
+                          progress: Optional[Callable[[int, int], None]] = None) -> RenormalizeResult:
+    """Rewrite the sort keys of the crowded task lists, see check_sort_keys, in one transaction.
+
+    Task lists get consecutive keys if any of their own keys is crowded. Only the keys that change are written, in
+    chunks; progress is called with the counts of written and all changed tasks after each. Setting cancel_event
+    before the writes leaves the keys as they are; setting it later, or an exception raised from progress, rolls
+    back the writes, with RuntimeError for the event.
+    """
+    start = time.perf_counter()
+    rewritten_key_count = 0
+
+    def cancelled() -> bool:
+        return cancel_event is not None and cancel_event.is_set()
+
+    with db.transaction():
+        tasklists = db.get_tasklists()
+        sorted_keys = _SortedKeys(db.get_task_columns(), tasklists, max_key_length)
+        if sorted_keys.crowded_list_ids and not cancelled():
+            changed_tasklists = []
+            if any(len(tasklist.sort_key) > max_key_length for tasklist in tasklists):
+                changed_tasklists = _assign_consecutive_keys(tasklists)
+                for tasklist in changed_tasklists:
+                    db.upsert_tasklist(tasklist)
+            new_keys = sorted_keys.new_keys()
+            changed_tasks = []
+            for list_id in sorted_keys.crowded_list_ids:
+                for task in db.get_tasks(list_id=list_id, with_memo=False):
+                    if task.id in new_keys and task.sort_key != new_keys[task.id]:
+                        task.sort_key = new_keys[task.id]
+                        changed_tasks.append(task)
+            for chunk_start in range(0, len(changed_tasks), _CHUNK_SIZE):
+                chunk = changed_tasks[chunk_start:chunk_start + _CHUNK_SIZE]
+                db.upsert_tasks(chunk)
+                if progress is not None:
+                    progress(chunk_start + len(chunk), len(changed_tasks))
+                if cancelled():
+                    raise RuntimeError('Renormalization cancelled')
+            rewritten_key_count = len(changed_tasklists) + len(changed_tasks)
+    return RenormalizeResult(sorted_keys.crowded_list_ids, rewritten_key_count, time.perf_counter() - start)
+
+
+class SortKeyCheckScheduler(IdleJobScheduler):
+    """Check for crowded sort keys once the application has been idle for a while, then every interval.
+
+    The check only reads. The keys are to be rewritten by whoever holds tasks with their keys in memory, such as
+    TaskEngine.renormalize_sort_keys, when on_done is passed a result with crowded task lists.
+    """
+
+    def __init__(self, db: TaskDatabase, interval_s: float = 60 * 60, idle_s: float = 60,
+                 max_key_length: int = DEFAULT_MAX_KEY_LENGTH,
+                 on_done: Optional[Callable[[SortKeyCheckResult], None]] = None,
+                 on_error: Optional[Callable[[BaseException], None]] = None,
+                 clock: Callable[[], float] = time.time):
+        super().__init__(lambda cancel_event: check_sort_keys(db, max_key_length=max_key_length),
+                         interval_s, idle_s, on_done=on_done, on_error=on_error, clock=clock)
@@ -0,0 +1,480 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""The sharded task database implementation, which keeps the tasks of each task list in a file of its own."""
+
+import functools
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+from typing import *
+
+from my_todo_app.engine.task import TaskDatabase, Task, TaskList, TaskListStats, TaskSearchResult
+from my_todo_app.engine.task_sqlite3 import SQLite3Profile, SQLite3TaskDatabase, _apply_migrations, \
+    _change_sort_key_columns_to_text, _convert_number_sort_keys, _execute_in, _path_upper_bound
+
+_CATALOG_FILE_NAME: str = 'catalog.sqlite3'
+
+# Shard files are named after the hex of their list id, so that any id makes a valid file name
+_SHARD_FILE_PREFIX: str = 'tasks-'
+_SHARD_FILE_SUFFIX: str = '.sqlite3'
+
+# Catalog schema migrations, applied after those of the task database file, see _MIGRATIONS of task_sqlite3.
+# Never edit a released entry, append a new one instead.
+_CATALOG_MIGRATIONS: List[List[Union[str, Callable[[sqlite3.Cursor], None]]]] = [
+    # 1: Where every task is, so that a query by task or parent opens the one shard it needs
+    #    (catalogs created before schema versioning already have it)
+    [
+        '''
+        create table if not exists task_locations (
+            id text primary key not null,
+            list_id text not null,
+            parent_task_id text,
+            sort_key float
+        )''',
+        'create index if not exists task_locations_parent_sort_key_index on task_locations(parent_task_id, sort_key)',
+        'create index if not exists task_locations_sort_key_index on task_locations(sort_key)',
+    ],
+    # 2: Order keys for the sort keys of locations copied from shards before they were
+    [
+        lambda cursor: _convert_number_sort_keys(cursor, ['task_locations']),
+    ],
+    # 3: Sort keys in a text column, as in the shards
+    [
+        lambda cursor: _change_sort_key_columns_to_text(cursor, ['task_locations']),
+    ],
+]
+
+_SHARD_COLUMNS: str = ('id, list_id, parent_task_id, name, tags, memo, completed, archived, '
+                       'created_at, updated_at, completed_at, sort_key, path, depth, subtree_size')
+
+
+class _CatalogDatabase(SQLite3TaskDatabase):
+    """The task lists of a sharded database and the location of every task; its own tasks table stays empty."""
+
+    def _migrate(self):
+        super()._migrate()
+        _apply_migrations(self._conn, _CATALOG_MIGRATIONS, 'catalog_schema_version')
+
+    def locate(self, ids: List[str]) -> Dict[str, str]:
+        """Return the list ids of the tasks that are known, by task id."""
+        with self._reading() as conn:
+            return dict(_execute_in(conn.cursor(), 'select id, list_id from task_locations where id in ({})', ids))
+
+    def get_child_list_ids(self, parent_task_id: str) -> List[str]:
+        with self._reading() as conn:
+            rows = conn.execute('select distinct list_id from task_locations where parent_task_id = ?',
+                                [parent_task_id]).fetchall()
+        return [row[0] for row in rows]
+
+    def find_first_or_last(self, last: bool, parent_task_id: Optional[str],
+                           sort_key_bound: Optional[str]) -> Optional[Tuple[str, str]]:
+        """Return the id and list id of the first or last task in sort key order, as get_first_task does."""
+        conditions = []
+        select_params: List[Any] = []
+        if parent_task_id is not None:
+            conditions.append('parent_task_id = ?')
+            select_params.append(parent_task_id)
+        if sort_key_bound is not None:
+            conditions.append('sort_key < ?' if last else 'sort_key > ?')
+            select_params.append(sort_key_bound)
+        select_sql = 'select id, list_id from task_locations'
+        if conditions:
+            select_sql += ' where ' + ' and '.join(conditions)
+        select_sql += ' order by sort_key desc limit 1' if last else ' order by sort_key limit 1'
+        with self._reading() as conn:
+            return conn.execute(select_sql, select_params).fetchone()
+
+    def set_locations(self, tasks: Iterable[Task]) -> None:
+        with self.transaction():
+            self._cursor.executemany('insert or replace into task_locations (id, list_id, parent_task_id, sort_key) '
+                                     'values (?, ?, ?, ?)',
+                                     ((t.id, t.list_id, t.parent_task_id, t.sort_key) for t in tasks))
+
+    def remove_locations(self, ids: List[str]) -> None:
+        with self.transaction():
+            _execute_in(self._cursor, 'delete from task_locations where id in ({})', ids)
+
+    def clear_locations(self) -> None:
+        with self.transaction():
+            self._cursor.execute('delete from task_locations')
+
+
+class _ShardDatabase(SQLite3TaskDatabase):
+    """The tasks of one task list of a sharded database."""
+
+    def move_subtree_out(self, task_id: str, target_path: str, catalog_path: str, list_id: str,
+                         updated_at: int) -> None:
+        """Copy the task and its descendants into the shard at target_path, then delete them here.
+
+        The copy, the delete and the new locations in the catalog are one transaction over the three attached files.
+        The task becomes a root of the target shard.
+        """
+        with self._writing():
+            if self.in_transaction or self._conn.in_transaction:
+                raise RuntimeError('Can not move tasks across lists in a transaction')
+            self._conn.execute('attach database ? as target', [target_path])
+            try:
+                self._conn.execute('attach database ? as catalog', [catalog_path])
+                try:
+                    with self.transaction():
+                        self._copy_subtree_out(task_id, list_id, updated_at)
+                finally:
+                    self._conn.execute('detach database catalog')
+            finally:
+                self._conn.execute('detach database target')
+
+    def _copy_subtree_out(self, task_id: str, list_id: str, updated_at: int) -> None:
+        row = self._cursor.execute('select path, depth, subtree_size from tasks where id = ?', [task_id]).fetchone()
+        if row is None:
+            return
+        path, depth, size = row
+        bounds = [path, _path_upper_bound(path)]
+        # Paths lose the ancestors the task leaves behind
+        self._cursor.execute('''
+            insert into target.tasks ({columns})
+            select id, ?, parent_task_id, name, tags, memo, completed, archived,
+                   created_at, ?, completed_at, sort_key, substr(path, ?), depth - ?, subtree_size
+            from main.tasks where path >= ? and path < ?
+        '''.format(columns=_SHARD_COLUMNS), [list_id, updated_at, len(path) - len(task_id), depth] + bounds)
+        self._cursor.execute('update catalog.task_locations set list_id = ? '
+                             'where id in (select id from main.tasks where path >= ? and path < ?)',
+                             [list_id] + bounds)
+        self._cursor.execute('delete from main.tasks where path >= ? and path < ?', bounds)
+        self._add_subtree_size(path, -size)
+
+
+class ShardedTaskDatabase(TaskDatabase):
+    """A task database that keeps the tasks of each task list in a SQLite3 database file of its own.
+
+    The directory holds a catalog with the task lists and the list of every task, and one shard file per task list,
+    so a huge list has its own indexes and write lock, and writing a small list never touches it. A shard is opened
+    when its list is first read or written and closed again once more than max_open_shards are open, so lists that
+    are not in use take neither memory nor page cache. Queries by task or parent are routed through the catalog;
+    queries that name none read every shard in turn. Tree queries stay within the list of the task.
+
+    A transaction spans every file it writes but commits them one by one; a crash in between may leave tasks that
+    the catalog does not know, which rebuild_locations restores. Moving a subtree to another list copies and deletes
+    it in one transaction of its own.
+    """
+
+    def __init__(self, directory: str, profile: SQLite3Profile = SQLite3Profile.BALANCED, max_open_shards: int = 4):
+        super().__init__()
+        self._directory: str = directory
+        self._profile: SQLite3Profile = profile
+        self._max_open_shards: int = max_open_shards
+        self._catalog: _CatalogDatabase = _CatalogDatabase(os.path.join(directory, _CATALOG_FILE_NAME), profile)
+        # Open shards by list id, least recently used first
+        self._shards: OrderedDict = OrderedDict()
+        # Shards in use are not closed; those written in the transaction stay in use until it ends
+        self._use_counts: Dict[str, int] = {}
+        self._shards_lock: threading.RLock = threading.RLock()
+        self._writer_lock: threading.RLock = threading.RLock()
+        self._stack: Optional[ExitStack] = None
+        self._joined_list_ids: Set[str] = set()
+
+    def close(self):
+        with self._shards_lock:
+            for shard in self._shards.values():
+                shard.close()
+            self._shards.clear()
+        self._catalog.close()
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        with self._writer_lock:
+            with super().transaction():
+                yield
+
+    def _begin_transaction(self) -> None:
+        self._stack = ExitStack()
+        # Entered first to commit last, so that a crash can leave unknown tasks but never locations without tasks
+        self._stack.enter_context(self._catalog.transaction())
+
+    def _end_transaction(self) -> None:
+        stack, self._stack = self._stack, None
+        try:
+            stack.close()
+        finally:
+            self._release_joined_shards()
+
+    def _rollback_transaction(self) -> None:
+        stack, self._stack = self._stack, None
+        try:
+            # Called while the exception is handled, which rolls back every joined transaction
+            stack.__exit__(*sys.exc_info())
+        finally:
+            self._release_joined_shards()
+
+    def _shard_path(self, list_id: str) -> str:
+        return os.path.join(self._directory,
+                            _SHARD_FILE_PREFIX + list_id.encode('utf-8').hex() + _SHARD_FILE_SUFFIX)
+
+    def get_shard_list_ids(self) -> List[str]:
+        """Return the ids of the lists that have a shard file."""
+        if not os.path.isdir(self._directory):
+            return []
+        return sorted(bytes.fromhex(name[len(_SHARD_FILE_PREFIX):-len(_SHARD_FILE_SUFFIX)]).decode('utf-8')
+                      for name in os.listdir(self._directory)
+                      if name.startswith(_SHARD_FILE_PREFIX) and name.endswith(_SHARD_FILE_SUFFIX))
+
+    def _acquire_shard(self, list_id: str, create: bool) -> Optional[_ShardDatabase]:
+        with self._shards_lock:
+            shard = self._shards.get(list_id)
+            if shard is None:
+                path = self._shard_path(list_id)
+                if not create and not os.path.exists(path):
+                    return None
+                shard = _ShardDatabase(path, self._profile)
+                self._shards[list_id] = shard
+            self._shards.move_to_end(list_id)
+            self._use_counts[list_id] = self._use_counts.get(list_id, 0) + 1
+            return shard
+
+    def _release_shard(self, list_id: str) -> None:
+        with self._shards_lock:
+            self._use_counts[list_id] -= 1
+            if self._use_counts[list_id] == 0:
+                del self._use_counts[list_id]
+            # Close the least recently used shards that are not in use
+            for open_list_id in list(self._shards):
+                if len(self._shards) <= self._max_open_shards:
+                    break
+                if open_list_id not in self._use_counts:
+                    self._shards.pop(open_list_id).close()
+
+    @contextmanager
+    def _using(self, list_id: str, create: bool = False) -> Iterator[Optional[_ShardDatabase]]:
+        """Keep the shard of the list open in the with block; it is None if the list has none and create is False."""
+        shard = self._acquire_shard(list_id, create)
+        try:
+            yield shard
+        finally:
+            if shard is not None:
+                self._release_shard(list_id)
+
+    def _join(self, list_id: str) -> _ShardDatabase:
+        """Return the shard of the list, creating it, in the current transaction."""
+        if list_id in self._joined_list_ids:
+            return self._shards[list_id]
+        shard = self._acquire_shard(list_id, create=True)
+        self._joined_list_ids.add(list_id)
+        self._stack.enter_context(shard.transaction())
+        return shard
+
+    def _release_joined_shards(self) -> None:
+        list_ids, self._joined_list_ids = self._joined_list_ids, set()
+        for list_id in list_ids:
+            self._release_shard(list_id)
+
+    def _locate(self, ids: List[str]) -> Dict[str, List[str]]:
+        """Group the ids of known tasks by their list id."""
+        list_ids = self._catalog.locate(ids)
+        result: Dict[str, List[str]] = {}
+        for id_ in ids:
+            if id_ in list_ids:
+                result.setdefault(list_ids[id_], []).append(id_)
+        return result
+
+    def _locate_one(self, id_: str) -> Optional[str]:
+        return self._catalog.locate([id_]).get(id_)
+
+    def _defer_memos(self, tasks: Iterable[Task]) -> None:
+        # The shard a task was read from may be closed before its memo is loaded
+        for task in tasks:
+            task.defer_memo(functools.partial(self.get_memo, task.id))
+
+    def upsert_task(self, task: Task) -> None:
+        self.upsert_tasks([task])
+
+    def upsert_tasks(self, tasks: Iterable[Task]) -> None:
+        tasks = list(tasks)
+        with self.transaction():
+            # A task upserted with another list leaves its descendants behind, move_subtree takes them along
+            list_ids = self._catalog.locate([task.id for task in tasks])
+            moved_ids = [task.id for task in tasks if list_ids.get(task.id, task.list_id) != task.list_id]
+            for list_id, ids in self._locate(moved_ids).items():
+                self._join(list_id).delete_tasks(ids)
+            tasks_by_list_id: Dict[str, List[Task]] = {}
+            for task in tasks:
+                tasks_by_list_id.setdefault(task.list_id, []).append(task)
+            for list_id, list_tasks in tasks_by_list_id.items():
+                self._join(list_id).upsert_tasks(list_tasks)
+            self._catalog.set_locations(tasks)
+
+    def upsert_tasklist(self, tasklist: TaskList) -> None:
+        with self.transaction():
+            self._catalog.upsert_tasklist(tasklist)
+
+    def delete_task(self, id_: str) -> None:
+        self.delete_tasks([id_])
+
+    def delete_tasks(self, ids: Iterable[str]) -> None:
+        ids = list(ids)
+        with self.transaction():
+            for list_id, list_ids in self._locate(ids).items():
+                self._join(list_id).delete_tasks(list_ids)
+            self._catalog.remove_locations(ids)
+
+    def delete_subtree(self, task_id: str) -> None:
+        list_id = self._locate_one(task_id)
+        if list_id is None:
+            return
+        with self.transaction():
+            shard = self._join(list_id)
+            ids = [task.id for task in shard.get_subtree(task_id, with_memo=False)]
+            shard.delete_subtree(task_id)
+            self._catalog.remove_locations(ids)
+
+    def move_subtree(self, task_id: str, list_id: str, updated_at: int) -> None:
+        """Move the task and its descendants to the task list; across lists, this can not be part of a transaction."""
+        source_list_id = self._locate_one(task_id)
+        if source_list_id is None:
+            return
+        if source_list_id == list_id:
+            with self.transaction():
+                self._join(list_id).move_subtree(task_id, list_id, updated_at)
+            return
+        with self._writer_lock:
+            if self.in_transaction:
+                raise RuntimeError('Can not move tasks across lists in a transaction')
+            with self._using(list_id, create=True) as target, self._using(source_list_id, create=True) as source:
+                source.move_subtree_out(task_id, target.path, self._catalog.path, list_id, updated_at)
+
+    def delete_tasklist(self, id_: str) -> None:
+        with self.transaction():
+            self._catalog.delete_tasklist(id_)
+
+    def get_tasks(self, id_: Optional[str] = None, list_id: Optional[str] = None, parent_task_id: Optional[str] = None,
+                  completed: Optional[bool] = None, archived: Optional[bool] = None,
+                  with_memo: bool = True) -> List[Task]:
+        if id_ is not None:
+            list_ids = [l for l in [self._locate_one(id_)] if l is not None and list_id in (None, l)]
+        elif list_id is not None:
+            list_ids = [list_id]
+        elif parent_task_id is not None:
+            list_ids = self._catalog.get_child_list_ids(parent_task_id)
+        else:
+            list_ids = self.get_shard_list_ids()
+        tasks: List[Task] = []
+        for shard_list_id in list_ids:
+            with self._using(shard_list_id) as shard:
+                if shard is not None:
+                    tasks.extend(shard.get_tasks(id_=id_, list_id=list_id, parent_task_id=parent_task_id,
+                                                 completed=completed, archived=archived, with_memo=with_memo))
+        if len(list_ids) > 1:
+            tasks.sort(key=lambda task: task.sort_key)
+        if not with_memo:
+            self._defer_memos(tasks)
+        return tasks
+
+    def get_memo(self, id_: str) -> str:
+        list_id = self._locate_one(id_)
+        if list_id is None:
+            return ''
+        with self._using(list_id) as shard:
+            return shard.get_memo(id_) if shard is not None else ''
+
+    def iter_tasks(self, batch_size: int = 1000) -> Iterator[Task]:
+        for list_id in self.get_shard_list_ids():
+            with self._using(list_id) as shard:
+                if shard is not None:
+                    yield from shard.iter_tasks(batch_size)
+
+    def _get_in_list_of(self, task_id: str, default: Any, func: Callable[[_ShardDatabase], Any]) -> Any:
+        list_id = self._locate_one(task_id)
+        if list_id is None:
+            return default
+        with self._using(list_id) as shard:
+            return func(shard) if shard is not None else default
+
+    def get_subtree(self, task_id: str, with_memo: bool = True) -> List[Task]:
+        tasks = self._get_in_list_of(task_id, [], lambda shard: shard.get_subtree(task_id, with_memo=with_memo))
+        if not with_memo:
+            self._defer_memos(tasks)
+        return tasks
+
+    def get_ancestors(self, task_id: str, with_memo: bool = True) -> List[Task]:
+        tasks = self._get_in_list_of(task_id, [], lambda shard: shard.get_ancestors(task_id, with_memo=with_memo))
+        if not with_memo:
+            self._defer_memos(tasks)
+        return tasks
+
+    def is_ancestor(self, ancestor_id: str, task_id: str) -> bool:
+        return self._get_in_list_of(task_id, False, lambda shard: shard.is_ancestor(ancestor_id, task_id))
+
+    def _get_located_task(self, location: Optional[Tuple[str, str]]) -> Optional[Task]:
+        if location is None:
+            return None
+        id_, list_id = location
+        with self._using(list_id) as shard:
+            tasks = shard.get_tasks(id_=id_) if shard is not None else []
+        return tasks[0] if tasks else None
+
+    def get_first_task(self, parent_task_id: Optional[str] = None,
+                       sort_key_after: Optional[str] = None) -> Optional[Task]:
+        return self._get_located_task(self._catalog.find_first_or_last(False, parent_task_id, sort_key_after))
+
+    def get_last_task(self, parent_task_id: Optional[str] = None,
+                      sort_key_before: Optional[str] = None) -> Optional[Task]:
+        return self._get_located_task(self._catalog.find_first_or_last(True, parent_task_id, sort_key_before))
+
+    def search(self, query: str, list_id: Optional[str] = None, include_archived: bool = False,
+               limit: int = 50) -> List[TaskSearchResult]:
+        # Ranks of different shards are compared as they are
+        results: List[TaskSearchResult] = []
+        for shard_list_id in [list_id] if list_id is not None else self.get_shard_list_ids():
+            with self._using(shard_list_id) as shard:
+                if shard is not None:
+                    results.extend(shard.search(query, list_id=list_id, include_archived=include_archived,
+                                                limit=limit))
+        results.sort(key=lambda result: result.rank)
+        results = results[:limit]
+        self._defer_memos(result.task for result in results)
+        return results
+
+    def _map_shards(self, list_id: Optional[str], func: Callable[[_ShardDatabase], Any]) -> List[Any]:
+        """Return the results of the function on the shard of the list, or on every shard if list_id is None."""
+        results = []
+        for shard_list_id in [list_id] if list_id is not None else self.get_shard_list_ids():
+            with self._using(shard_list_id) as shard:
+                if shard is not None:
+                    results.append(func(shard))
+        return results
+
+    def get_list_stats(self) -> Dict[str, TaskListStats]:
+        stats: Dict[str, TaskListStats] = {}
+        for shard_stats in self._map_shards(None, lambda shard: shard.get_list_stats()):
+            stats.update(shard_stats)
+        return stats
+
+    def get_completion_stats(self, width: int = 24 * 60 * 60, origin: int = 0, list_id: Optional[str] = None,
+                             since: Optional[int] = None, until: Optional[int] = None) -> Dict[int, int]:
+        counts: Dict[int, int] = {}
+        for shard_counts in self._map_shards(list_id, lambda shard: shard.get_completion_stats(
+                width=width, origin=origin, list_id=list_id, since=since, until=until)):
+            for start, count in shard_counts.items():
+                counts[start] = counts.get(start, 0) + count
+        return dict(sorted(counts.items()))
+
+    def get_age_stats(self, now: int, edges: Sequence[int], list_id: Optional[str] = None) -> Dict[int, int]:
+        results = self._map_shards(list_id, lambda shard: shard.get_age_stats(now, edges, list_id=list_id))
+        return {edge: sum(counts[edge] for counts in results) for edge in edges}
+
+    def get_tasklists(self, id_: Optional[str] = None) -> List[TaskList]:
+        return self._catalog.get_tasklists(id_=id_)
+
+    def rebuild_locations(self) -> None:
+        """Recompute the location of every task from the shards."""
+        with self.transaction():
+            self._catalog.clear_locations()
+            for list_id in self.get_shard_list_ids():
+                with self._using(list_id) as shard:
+                    self._catalog.set_locations(shard.get_tasks(with_memo=False))
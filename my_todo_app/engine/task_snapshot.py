@@ -0,0 +1,428 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""The binary snapshot file format, its writer and the memory-mapped read-only task database.
+
+A snapshot file is laid out as follows, all integers little-endian:
+
+- header: magic, version and the counts and offsets of the segments below
+- task records: fixed width, ordered by sort key then id
+- task list records: fixed width, ordered by sort key
+- id, list and parent indexes: record numbers (u32) ordered by id, by list id then sort key and by parent id then
+  sort key
+- string heap: UTF-8 ids, names, tags and sort keys, referenced from records by offset and length
+- memo segment: UTF-8 or zlib compressed memos, referenced the same way
+
+Readers look records up by binary search over the mapped file, so opening a snapshot reads the header only.
+"""
+
+import array
+import functools
+import mmap
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import zlib
+from typing import *
+
+from my_todo_app.engine.task import TaskDatabase, Task, TaskList
+from my_todo_app.engine.task_columns import TaskColumns, numpy
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase, _COMPRESSED_MEMO_MARKER, _TASK_COLUMNS
+
+_MAGIC: bytes = b'MYTODOSN'
+_VERSION: int = 2
+
+# magic, version, task count, task list count, then the offsets of the task records, task list records, id index,
+# list index, parent index, string heap and memo segment
+_HEADER = struct.Struct('<8sIQQQQQQQQQ')
+# id, list id, parent task id, name, tags and memo as (offset, length), created_at, updated_at, completed_at,
+# sort_key as (offset, length) and flags
+_TASK_RECORD = struct.Struct('<QIQIQIQIQIQIqqqQIB')
+# id, name and sort_key as (offset, length)
+_TASKLIST_RECORD = struct.Struct('<QIQIQI')
+_INDEX_ITEM = struct.Struct('<I')
+
+_COMPLETED_FLAG = 0x01
+_ARCHIVED_FLAG = 0x02
+_COMPRESSED_MEMO_FLAG = 0x04
+
+# The task record as a NumPy record type, for reading all records at once
+_TASK_RECORD_DTYPE: List[Tuple[str, str]] = [
+    ('id', '<u8'), ('id_length', '<u4'), ('list_id', '<u8'), ('list_id_length', '<u4'),
+    ('parent_task_id', '<u8'), ('parent_task_id_length', '<u4'), ('name', '<u8'), ('name_length', '<u4'),
+    ('tags', '<u8'), ('tags_length', '<u4'), ('memo', '<u8'), ('memo_length', '<u4'), ('created_at', '<i8'),
+    ('updated_at', '<i8'), ('completed_at', '<i8'), ('sort_key', '<u8'), ('sort_key_length', '<u4'),
+    ('flags', 'u1')]
+
+# Field positions in an unpacked task record
+_ID, _LIST_ID, _PARENT_TASK_ID, _NAME, _TAGS, _MEMO = 0, 2, 4, 6, 8, 10
+_CREATED_AT, _UPDATED_AT, _COMPLETED_AT, _SORT_KEY, _FLAGS = 12, 13, 14, 15, 17
+
+
+def write_snapshot(db: SQLite3TaskDatabase, path: str, batch_size: int = 1000) -> None:
+    """Write a snapshot of the database file to the path, replacing the file there when done.
+
+    The tasks, archived ones in the archive database included, are read on a connection of their own, so the
+    snapshot is consistent and writes are not blocked.
+    Memory use does not grow with the database: the heap and the memos are spooled to temporary files and the
+    indexes are sorted by SQLite.
+    """
+    if db.path == ':memory:':
+        raise RuntimeError('Can not snapshot an in-memory database')
+    conn = sqlite3.connect(db.path)
+    try:
+        tasks_sql = 'select {} from main.tasks'.format(_TASK_COLUMNS)
+        if db.archive_path is not None:
+            conn.execute('attach database ? as archive', [db.archive_path])
+            tasks_sql = 'select {0} from main.tasks union all select {0} from archive.tasks'.format(_TASK_COLUMNS)
+        conn.execute('create temp view snapshot_tasks as {}'.format(tasks_sql))
+        conn.execute('begin')
+        # Record numbers are the rowids of this table minus one
+        conn.execute('create temp table snapshot_order (id text, list_id text, parent_task_id text, sort_key text)')
+        conn.execute('insert into temp.snapshot_order select id, list_id, parent_task_id, sort_key '
+                     'from temp.snapshot_tasks order by sort_key, id')
+        task_count = conn.execute('select count(*) from temp.snapshot_order').fetchone()[0]
+        tasklist_count = conn.execute('select count(*) from main.tasklists').fetchone()[0]
+
+        # Offsets of the task records, task list records and the indexes
+        offsets = [_HEADER.size]
+        for size in (task_count * _TASK_RECORD.size, tasklist_count * _TASKLIST_RECORD.size,
+                     task_count * _INDEX_ITEM.size, task_count * _INDEX_ITEM.size):
+            offsets.append(offsets[-1] + size)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file, tempfile.TemporaryFile() as heap, tempfile.TemporaryFile() as memos:
+            file.seek(offsets[0])
+            heap_writer = _HeapWriter(heap)
+            _write_task_records(conn, file, heap_writer, _HeapWriter(memos), batch_size)
+            _write_tasklist_records(conn, file, heap_writer)
+            for order_by in ('id', 'list_id, sort_key, id', 'parent_task_id, sort_key, id'):
+                _write_index(conn, file, order_by, batch_size)
+            heap_offset = file.tell()
+            heap.seek(0)
+            shutil.copyfileobj(heap, file)
+            memo_offset = file.tell()
+            memos.seek(0)
+            shutil.copyfileobj(memos, file)
+            file.seek(0)
+            file.write(_HEADER.pack(_MAGIC, _VERSION, task_count, tasklist_count, *offsets, heap_offset, memo_offset))
+        os.replace(temp_path, path)
+    finally:
+        conn.close()
+
+
+class _HeapWriter:
+    """Appends strings to a heap file and returns their (offset, length)."""
+
+    def __init__(self, file: BinaryIO) -> None:
+        self._file: BinaryIO = file
+        self._offset: int = 0
+        # Task list ids repeat in every task, they are stored once
+        self._shared: Dict[str, Tuple[int, int]] = {}
+
+    def add(self, value: Union[str, bytes]) -> Tuple[int, int]:
+        data = value.encode('utf-8') if isinstance(value, str) else value
+        ref = (self._offset, len(data))
+        self._file.write(data)
+        self._offset += len(data)
+        return ref
+
+    def add_shared(self, value: str) -> Tuple[int, int]:
+        ref = self._shared.get(value)
+        if ref is None:
+            ref = self._shared[value] = self.add(value)
+        return ref
+
+
+def _write_task_records(conn: sqlite3.Connection, file: BinaryIO, heap_writer: _HeapWriter,
+                        memo_writer: _HeapWriter, batch_size: int) -> None:
+    # The same order as snapshot_order, ids are unique
+    cursor = conn.execute('select {} from temp.snapshot_tasks order by sort_key, id'.format(_TASK_COLUMNS))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        for id_, list_id, parent_task_id, name, tags, memo, completed, archived, created_at, updated_at, \
+                completed_at, sort_key in rows:
+            flags = (_COMPLETED_FLAG if completed else 0) | (_ARCHIVED_FLAG if archived else 0)
+            # Compressed memos are copied as they are
+            if isinstance(memo, bytes) and memo.startswith(_COMPRESSED_MEMO_MARKER):
+                memo = memo[len(_COMPRESSED_MEMO_MARKER):]
+                flags |= _COMPRESSED_MEMO_FLAG
+            file.write(_TASK_RECORD.pack(
+                *heap_writer.add(id_), *heap_writer.add_shared(list_id or ''), *heap_writer.add(parent_task_id or ''),
+                *heap_writer.add(name or ''), *heap_writer.add(tags or ''), *memo_writer.add(memo or ''),
+                created_at or 0, updated_at or 0, completed_at or 0, *heap_writer.add(sort_key or ''), flags))
+
+
+def _write_tasklist_records(conn: sqlite3.Connection, file: BinaryIO, heap_writer: _HeapWriter) -> None:
+    for id_, name, sort_key in conn.execute('select id, name, sort_key from main.tasklists order by sort_key, id'):
+        file.write(_TASKLIST_RECORD.pack(*heap_writer.add(id_), *heap_writer.add(name or ''),
+                                         *heap_writer.add(sort_key or '')))
+
+
+def _write_index(conn: sqlite3.Connection, file: BinaryIO, order_by: str, batch_size: int) -> None:
+    cursor = conn.execute('select rowid - 1 from temp.snapshot_order order by {}'.format(order_by))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        items = array.array('I', (row[0] for row in rows))
+        if sys.byteorder != 'little':
+            items.byteswap()
+        file.write(items.tobytes())
+
+
+class SnapshotTaskDatabase(TaskDatabase):
+    """A read-only database over a memory-mapped snapshot file.
+
+    Lookups by id, list and parent are binary searches over the file, only the records they return are decoded.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        with open(path, 'rb') as file:
+            self._mmap: mmap.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._task_count, self._tasklist_count, self._tasks_offset, self._tasklists_offset, \
+            self._id_index_offset, self._list_index_offset, self._parent_index_offset, self._heap_offset, \
+            self._memos_offset = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._mmap.close()
+            raise RuntimeError('Not a snapshot file of version {}: {}'.format(_VERSION, path))
+
+    def close(self):
+        self._mmap.close()
+
+    # Nothing is ever written
+    def _begin_transaction(self) -> None:
+        pass
+
+    def _end_transaction(self) -> None:
+        pass
+
+    def _rollback_transaction(self) -> None:
+        pass
+
+    def _read_only(self, *_args, **_kwargs) -> None:
+        raise RuntimeError('A snapshot is read-only')
+
+    upsert_task = upsert_tasks = load_tasks = upsert_tasklist = _read_only
+    delete_task = delete_tasks = delete_subtree = move_subtree = delete_tasklist = _read_only
+
+    def _record(self, number: int) -> Tuple:
+        return _TASK_RECORD.unpack_from(self._mmap, self._tasks_offset + number * _TASK_RECORD.size)
+
+    def _string(self, record: Tuple, field: int) -> str:
+        offset = self._heap_offset + record[field]
+        return self._mmap[offset:offset + record[field + 1]].decode('utf-8')
+
+    def _key(self, number: int, field: int) -> bytes:
+        record = self._record(number)
+        offset = self._heap_offset + record[field]
+        return self._mmap[offset:offset + record[field + 1]]
+
+    def _index_item(self, index_offset: int, position: int) -> int:
+        return _INDEX_ITEM.unpack_from(self._mmap, index_offset + position * _INDEX_ITEM.size)[0]
+
+    def _equal_range(self, index_offset: int, field: int, value: str) -> Tuple[int, int]:
+        """Return the positions in the index whose records have the value in the field."""
+        key = value.encode('utf-8')
+        lo, hi = 0, self._task_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(self._index_item(index_offset, mid), field) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        start, hi = lo, self._task_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(self._index_item(index_offset, mid), field) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+
+    def _record_numbers(self, id_: Optional[str], list_id: Optional[str],
+                        parent_task_id: Optional[str]) -> Iterable[int]:
+        """Return the record numbers of the narrowest index range, in sort key order."""
+        if id_ is not None:
+            start, stop = self._equal_range(self._id_index_offset, _ID, id_)
+            index_offset = self._id_index_offset
+        elif parent_task_id is not None:
+            start, stop = self._equal_range(self._parent_index_offset, _PARENT_TASK_ID, parent_task_id)
+            index_offset = self._parent_index_offset
+        elif list_id is not None:
+            start, stop = self._equal_range(self._list_index_offset, _LIST_ID, list_id)
+            index_offset = self._list_index_offset
+        else:
+            return range(self._task_count)
+        return [self._index_item(index_offset, position) for position in range(start, stop)]
+
+    def _task(self, record: Tuple, with_memo: bool = True) -> Task:
+        flags = record[_FLAGS]
+        id_ = self._string(record, _ID)
+        task = Task(id_, self._string(record, _LIST_ID), self._string(record, _PARENT_TASK_ID),
+                    self._string(record, _NAME), self._string(record, _TAGS),
+                    self._memo(record) if with_memo else None, bool(flags & _COMPLETED_FLAG),
+                    bool(flags & _ARCHIVED_FLAG), record[_CREATED_AT], record[_UPDATED_AT], record[_COMPLETED_AT],
+                    self._string(record, _SORT_KEY))
+        if not with_memo:
+            task.defer_memo(functools.partial(self.get_memo, id_))
+        return task
+
+    def _memo(self, record: Tuple) -> str:
+        offset = self._memos_offset + record[_MEMO]
+        data = self._mmap[offset:offset + record[_MEMO + 1]]
+        if record[_FLAGS] & _COMPRESSED_MEMO_FLAG:
+            data = zlib.decompress(data)
+        return data.decode('utf-8')
+
+    def get_tasks(self, id_: Optional[str] = None, list_id: Optional[str] = None, parent_task_id: Optional[str] = None,
+                  completed: Optional[bool] = None, archived: Optional[bool] = None,
+                  with_memo: bool = True) -> List[Task]:
+        tasks = []
+        for number in self._record_numbers(id_, list_id, parent_task_id):
+            record = self._record(number)
+            flags = record[_FLAGS]
+            if completed is not None and bool(flags & _COMPLETED_FLAG) != completed:
+                continue
+            if archived is not None and bool(flags & _ARCHIVED_FLAG) != archived:
+                continue
+            if list_id is not None and self._string(record, _LIST_ID) != list_id:
+                continue
+            if parent_task_id is not None and self._string(record, _PARENT_TASK_ID) != parent_task_id:
+                continue
+            tasks.append(self._task(record, with_memo))
+        return tasks
+
+    def get_memo(self, id_: str) -> str:
+        start, stop = self._equal_range(self._id_index_offset, _ID, id_)
+        if start == stop:
+            return ''
+        return self._memo(self._record(self._index_item(self._id_index_offset, start)))
+
+    def _sort_key_bound(self, numbers: Sequence[int], sort_key: str, right: bool) -> int:
+        """Return the first position in numbers whose sort key is greater (or, unless right, equal) than sort_key."""
+        # Order keys are ASCII, so their UTF-8 bytes compare as the strings do
+        sort_key = sort_key.encode('utf-8')
+        lo, hi = 0, len(numbers)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_sort_key = self._key(numbers[mid], _SORT_KEY)
+            if mid_sort_key < sort_key or (right and mid_sort_key == sort_key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _numbers_by_parent(self, parent_task_id: Optional[str]) -> Sequence[int]:
+        if parent_task_id is None:
+            return range(self._task_count)
+        start, stop = self._equal_range(self._parent_index_offset, _PARENT_TASK_ID, parent_task_id)
+        return _IndexRange(self, self._parent_index_offset, start, stop)
+
+    def get_first_task(self, parent_task_id: Optional[str] = None,
+                       sort_key_after: Optional[str] = None) -> Optional[Task]:
+        numbers = self._numbers_by_parent(parent_task_id)
+        position = self._sort_key_bound(numbers, sort_key_after, right=True) if sort_key_after is not None else 0
+        return self._task(self._record(numbers[position])) if position < len(numbers) else None
+
+    def get_last_task(self, parent_task_id: Optional[str] = None,
+                      sort_key_before: Optional[str] = None) -> Optional[Task]:
+        numbers = self._numbers_by_parent(parent_task_id)
+        position = self._sort_key_bound(numbers, sort_key_before, right=False) if sort_key_before is not None \
+            else len(numbers)
+        return self._task(self._record(numbers[position - 1])) if position > 0 else None
+
+    def get_task_columns(self, use_numpy: Optional[bool] = None) -> TaskColumns:
+        """Return the fields of all tasks as columns, see TaskColumns.
+
+        With NumPy the numeric columns are read straight from the mapped records and ids are decoded on access, so
+        the snapshot must stay open while they are used.
+        """
+        uses_numpy = numpy is not None if use_numpy is None else use_numpy
+        if not uses_numpy:
+            return TaskColumns.from_rows(self._column_rows(), use_numpy=False)
+        if numpy is None:
+            raise RuntimeError('NumPy is not installed')
+        records = numpy.frombuffer(self._mmap, dtype=_TASK_RECORD_DTYPE, count=self._task_count,
+                                   offset=self._tasks_offset)
+        # The writer shares list id strings, so a list is one heap offset
+        list_offsets, first_numbers, list_codes = numpy.unique(records['list_id'], return_index=True,
+                                                               return_inverse=True)
+        dictionary = [self._string(self._record(int(number)), _LIST_ID) for number in first_numbers]
+        columns = {
+            'list_codes': list_codes.astype('int32'),
+            'completed': records['flags'] & _COMPLETED_FLAG != 0,
+            'archived': records['flags'] & _ARCHIVED_FLAG != 0,
+            'created_at': records['created_at'].copy(),
+            'updated_at': records['updated_at'].copy(),
+            'completed_at': records['completed_at'].copy(),
+            'sort_key': _HeapStrings(self, records['sort_key'].copy(), records['sort_key_length'].copy()),
+        }
+        ids = _HeapStrings(self, records['id'].copy(), records['id_length'].copy())
+        return TaskColumns(ids, dictionary, columns, True)
+
+    def _column_rows(self) -> Iterable[Tuple]:
+        list_ids: Dict[int, str] = {}
+        records = self._mmap[self._tasks_offset:self._tasks_offset + self._task_count * _TASK_RECORD.size]
+        for record in _TASK_RECORD.iter_unpack(records):
+            list_id = list_ids.get(record[_LIST_ID])
+            if list_id is None:
+                list_id = list_ids[record[_LIST_ID]] = self._string(record, _LIST_ID)
+            flags = record[_FLAGS]
+            yield (self._string(record, _ID), list_id, bool(flags & _COMPLETED_FLAG), bool(flags & _ARCHIVED_FLAG),
+                   record[_CREATED_AT], record[_UPDATED_AT], record[_COMPLETED_AT], self._string(record, _SORT_KEY))
+
+    def get_tasklists(self, id_: Optional[str] = None) -> List[TaskList]:
+        tasklists = []
+        for number in range(self._tasklist_count):
+            record = _TASKLIST_RECORD.unpack_from(self._mmap, self._tasklists_offset + number * _TASKLIST_RECORD.size)
+            tasklist_id = self._string(record, 0)
+            if id_ is not None and tasklist_id != id_:
+                continue
+            tasklists.append(TaskList(tasklist_id, self._string(record, 2), self._string(record, 4)))
+        return tasklists
+
+
+class _IndexRange(Sequence):
+    """The record numbers of a range of an index, read on access."""
+
+    def __init__(self, db: SnapshotTaskDatabase, index_offset: int, start: int, stop: int) -> None:
+        self._db: SnapshotTaskDatabase = db
+        self._index_offset: int = index_offset
+        self._start: int = start
+        self._stop: int = stop
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __getitem__(self, position: int) -> int:
+        return self._db._index_item(self._index_offset, self._start + position)
+
+
+class _HeapStrings(Sequence):
+    """Strings of the heap by arrays of offsets and lengths, decoded on access.
+
+    Indexing by a mask or an array of positions returns the chosen strings, as a NumPy array would.
+    """
+
+    def __init__(self, db: SnapshotTaskDatabase, offsets: Any, lengths: Any) -> None:
+        self._db: SnapshotTaskDatabase = db
+        self._offsets: Any = offsets
+        self._lengths: Any = lengths
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, (int, numpy.integer)):
+            offset = self._db._heap_offset + int(self._offsets[key])
+            return self._db._mmap[offset:offset + int(self._lengths[key])].decode('utf-8')
+        return _HeapStrings(self._db, self._offsets[key], self._lengths[key])
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(len(self)))
@@ -3,28 +3,844 @@
 
 """The SQLite3 based task database implementation."""
 
+import functools
+import itertools
 import os
+import re
 import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+from enum import Enum
 from typing import *
 
-from my_todo_app.engine.task import TaskDatabase, Task, TaskList
+from my_todo_app.engine.order_key import key_from_number
+from my_todo_app.engine.task import TaskDatabase, Task, TaskList, TaskSearchResult, TaskChange, TaskListStats, \
+    _count_in_buckets
+from my_todo_app.engine.task_columns import TaskColumns
+
+
+def _create_tasks_fts(cursor: sqlite3.Cursor) -> None:
+    """Create the full-text index of tasks if the SQLite library is built with FTS5."""
+    try:
+        cursor.execute('''
+            create virtual table tasks_fts using fts5(
+                name, tags, memo, content='tasks', content_rowid='rowid', tokenize='unicode61'
+            )''')
+    except sqlite3.OperationalError:
+        return
+    # Upserts are real updates (not INSERT OR REPLACE), so rowids are stable and these triggers see every change
+    cursor.execute('''
+        create trigger tasks_fts_after_insert after insert on tasks begin
+            insert into tasks_fts (rowid, name, tags, memo) values (new.rowid, new.name, new.tags, new.memo);
+        end''')
+    cursor.execute('''
+        create trigger tasks_fts_after_delete after delete on tasks begin
+            insert into tasks_fts (tasks_fts, rowid, name, tags, memo)
+            values ('delete', old.rowid, old.name, old.tags, old.memo);
+        end''')
+    cursor.execute('''
+        create trigger tasks_fts_after_update after update of name, tags, memo on tasks begin
+            insert into tasks_fts (tasks_fts, rowid, name, tags, memo)
+            values ('delete', old.rowid, old.name, old.tags, old.memo);
+            insert into tasks_fts (rowid, name, tags, memo) values (new.rowid, new.name, new.tags, new.memo);
+        end''')
+    cursor.execute("insert into tasks_fts (tasks_fts) values ('rebuild')")
+
+
+def _compute_task_tree(cursor: sqlite3.Cursor) -> Dict[str, Tuple[str, int, int]]:
+    """Compute path, depth and subtree size of every task from the parent links.
+
+    Tasks whose parent does not exist are roots; so is a task on a parent link cycle, which no root can reach.
+    """
+    parent_ids: Dict[str, str] = dict(cursor.execute('select id, parent_task_id from tasks').fetchall())
+    children: Dict[str, List[str]] = {}
+    for id_, parent_id in parent_ids.items():
+        if parent_id and parent_id in parent_ids:
+            children.setdefault(parent_id, []).append(id_)
+    roots = [id_ for id_, parent_id in parent_ids.items() if not parent_id or parent_id not in parent_ids]
+
+    tree: Dict[str, Tuple[str, int, int]] = {}
+    tree_parent_ids: Dict[str, str] = {}
+    placed_ids: List[str] = []
+    for root_id in itertools.chain(roots, parent_ids):
+        if root_id in tree:
+            continue
+        stack = [(root_id, root_id + _PATH_SEPARATOR, 0)]
+        while stack:
+            id_, path, depth = stack.pop()
+            tree[id_] = (path, depth, 1)
+            placed_ids.append(id_)
+            for child_id in children.get(id_, []):
+                if child_id not in tree:
+                    tree_parent_ids[child_id] = id_
+                    stack.append((child_id, path + child_id + _PATH_SEPARATOR, depth + 1))
+
+    # Every task is placed after its tree parent, so sizes add up from the end
+    for id_ in reversed(placed_ids):
+        parent_id = tree_parent_ids.get(id_)
+        if parent_id is not None:
+            path, depth, size = tree[parent_id]
+            tree[parent_id] = (path, depth, size + tree[id_][2])
+    return tree
+
+
+def _rebuild_task_tree(cursor: sqlite3.Cursor) -> None:
+    """Rewrite path, depth and subtree_size of every task."""
+    tree = _compute_task_tree(cursor)
+    cursor.executemany('update tasks set path = ?, depth = ?, subtree_size = ? where id = ?',
+                       ((path, depth, size, id_) for id_, (path, depth, size) in tree.items()))
+
+
+# Memos of at least this many UTF-8 bytes are stored compressed when that makes them smaller
+_MEMO_COMPRESSION_THRESHOLD: int = 512
+# A compressed memo is a blob of this marker followed by zlib data, a plain memo is text
+_COMPRESSED_MEMO_MARKER: bytes = b'z'
+
+
+def _encode_memo(memo: str) -> Union[str, bytes]:
+    data = memo.encode('utf-8')
+    if len(data) < _MEMO_COMPRESSION_THRESHOLD:
+        return memo
+    compressed = _COMPRESSED_MEMO_MARKER + zlib.compress(data)
+    return compressed if len(compressed) < len(data) else memo
+
+
+def _decode_memo(value: Union[str, bytes, None]) -> Optional[str]:
+    if isinstance(value, bytes):
+        if value.startswith(_COMPRESSED_MEMO_MARKER):
+            return zlib.decompress(value[len(_COMPRESSED_MEMO_MARKER):]).decode('utf-8')
+        return value.decode('utf-8', errors='replace')
+    return value
+
+
+def _compress_memos(cursor: sqlite3.Cursor) -> None:
+    rows = cursor.execute("select id, memo from tasks where typeof(memo) = 'text' and length(cast(memo as blob)) >= ?",
+                          [_MEMO_COMPRESSION_THRESHOLD]).fetchall()
+    cursor.executemany('update tasks set memo = ? where id = ?', ((_encode_memo(memo), id_) for id_, memo in rows))
+
+
+def _drop_tasks_fts(cursor: sqlite3.Cursor) -> None:
+    for trigger_name in ('tasks_fts_after_insert', 'tasks_fts_after_delete', 'tasks_fts_after_update'):
+        cursor.execute('drop trigger if exists {}'.format(trigger_name))
+    cursor.execute('drop view if exists tasks_fts_content')
+    cursor.execute('drop table if exists tasks_fts')
+
+
+def _create_tasks_fts_over_memo_text(cursor: sqlite3.Cursor) -> None:
+    """Create the full-text index of tasks that reads memos through memo_text(), which decompresses them."""
+    try:
+        cursor.execute('''
+            create virtual table tasks_fts using fts5(
+                name, tags, memo, content='tasks_fts_content', content_rowid='task_rowid', tokenize='unicode61'
+            )''')
+    except sqlite3.OperationalError:
+        return
+    # Snippets are built from the content view, so they show plain memos as well
+    cursor.execute('''
+        create view tasks_fts_content as
+        select rowid as task_rowid, name, tags, memo_text(memo) as memo from tasks''')
+    cursor.execute('''
+        create trigger tasks_fts_after_insert after insert on tasks begin
+            insert into tasks_fts (rowid, name, tags, memo)
+            values (new.rowid, new.name, new.tags, memo_text(new.memo));
+        end''')
+    cursor.execute('''
+        create trigger tasks_fts_after_delete after delete on tasks begin
+            insert into tasks_fts (tasks_fts, rowid, name, tags, memo)
+            values ('delete', old.rowid, old.name, old.tags, memo_text(old.memo));
+        end''')
+    cursor.execute('''
+        create trigger tasks_fts_after_update after update of name, tags, memo on tasks begin
+            insert into tasks_fts (tasks_fts, rowid, name, tags, memo)
+            values ('delete', old.rowid, old.name, old.tags, memo_text(old.memo));
+            insert into tasks_fts (rowid, name, tags, memo)
+            values (new.rowid, new.name, new.tags, memo_text(new.memo));
+        end''')
+    cursor.execute("insert into tasks_fts (tasks_fts) values ('rebuild')")
+
+
+# The memo of a row for the full-text index; compressed memos are left to _index_pending_memos
+_FTS_MEMO_SQL = "case when typeof({0}.memo) = 'blob' then '' else {0}.memo end"
+
+
+def _create_tasks_fts_with_plain_memos(cursor: sqlite3.Cursor) -> None:
+    """Create the full-text index of tasks that holds its own copy of plain memos.
+
+    Triggers and views stored in the file use no functions of the application, so any SQLite client can write
+    tasks. The triggers can not decompress memos, they queue those rows in tasks_fts_pending instead.
+    """
+    try:
+        cursor.execute("create virtual table tasks_fts using fts5(name, tags, memo, tokenize='unicode61')")
+    except sqlite3.OperationalError:
+        return
+    cursor.execute('create table tasks_fts_pending (task_rowid integer primary key)')
+    cursor.execute('''
+        create trigger tasks_fts_after_insert after insert on tasks begin
+            insert into tasks_fts (rowid, name, tags, memo) values (new.rowid, new.name, new.tags, {});
+            insert or ignore into tasks_fts_pending (task_rowid) select new.rowid where typeof(new.memo) = 'blob';
+        end'''.format(_FTS_MEMO_SQL.format('new')))
+    cursor.execute('''
+        create trigger tasks_fts_after_delete after delete on tasks begin
+            delete from tasks_fts where rowid = old.rowid;
+        end''')
+    cursor.execute('''
+        create trigger tasks_fts_after_update after update of name, tags, memo on tasks begin
+            update tasks_fts set name = new.name, tags = new.tags, memo = {} where rowid = new.rowid;
+            insert or ignore into tasks_fts_pending (task_rowid) select new.rowid where typeof(new.memo) = 'blob';
+        end'''.format(_FTS_MEMO_SQL.format('new')))
+    _fill_tasks_fts(cursor)
+
+
+def _fill_tasks_fts(cursor: sqlite3.Cursor) -> None:
+    """Write the full-text index of all tasks anew, as after a load or a VACUUM that renumbered rowids."""
+    cursor.execute('delete from tasks_fts')
+    cursor.execute('insert into tasks_fts (rowid, name, tags, memo) select rowid, name, tags, {} from tasks'.format(
+        _FTS_MEMO_SQL.format('tasks')))
+    cursor.execute("insert or ignore into tasks_fts_pending (task_rowid) select rowid from tasks "
+                   "where typeof(memo) = 'blob'")
+    _index_pending_memos(cursor)
+
+
+def _index_pending_memos(cursor: sqlite3.Cursor) -> None:
+    """Write the decompressed memos of the rows queued by the full-text triggers to the full-text index."""
+    rows = cursor.execute('''
+        select task_rowid, memo from tasks_fts_pending join tasks on tasks.rowid = task_rowid''').fetchall()
+    cursor.executemany('update tasks_fts set memo = ? where rowid = ?',
+                       ((_decode_memo(memo), rowid) for rowid, memo in rows))
+    cursor.execute('delete from tasks_fts_pending')
+
+
+# Statistics are kept per hour, so buckets of whole hours in any whole-hour time zone are sums of them
+_STATS_HOUR: int = 60 * 60
+
+# A task is open if neither completed nor archived; the same condition as the partial index over created_at
+_OPEN_TASK_CONDITION: str = 'ifnull(completed, 0) = 0 and ifnull(archived, 0) = 0'
+
+# The aggregates behind the statistics: task counts by list and state, completions by hour and creations of open
+# tasks by hour. Counts that drop to zero are kept, readers skip them.
+_TASK_STATS_TABLE_SQLS: List[str] = [
+    '''
+    create table {schema}.task_stats_counts (
+        list_id text not null,
+        completed integer not null,
+        archived integer not null,
+        count integer not null,
+        primary key (list_id, completed, archived)
+    ) without rowid''',
+    '''
+    create table {schema}.task_stats_completion_hours (
+        hour integer not null,
+        list_id text not null,
+        count integer not null,
+        primary key (hour, list_id)
+    ) without rowid''',
+    '''
+    create table {schema}.task_stats_open_creation_hours (
+        hour integer not null,
+        list_id text not null,
+        count integer not null,
+        primary key (hour, list_id)
+    ) without rowid''',
+]
+
+
+def _task_stats_trigger_body(row: str, sign: int) -> str:
+    """Return the statements that add the task of the trigger row, new or old, to the aggregates or subtract it."""
+    return '''
+        insert into task_stats_counts (list_id, completed, archived, count)
+        values (ifnull({row}.list_id, ''), ifnull({row}.completed, 0) != 0, ifnull({row}.archived, 0) != 0, {sign})
+        on conflict (list_id, completed, archived) do update set count = count + excluded.count;
+        insert into task_stats_completion_hours (hour, list_id, count)
+        select {row}.completed_at / {hour}, ifnull({row}.list_id, ''), {sign}
+        where ifnull({row}.completed, 0) != 0 and {row}.completed_at > 0
+        on conflict (hour, list_id) do update set count = count + excluded.count;
+        insert into task_stats_open_creation_hours (hour, list_id, count)
+        select ifnull({row}.created_at, 0) / {hour}, ifnull({row}.list_id, ''), {sign}
+        where ifnull({row}.completed, 0) = 0 and ifnull({row}.archived, 0) = 0
+        on conflict (hour, list_id) do update set count = count + excluded.count;
+    '''.format(row=row, sign=sign, hour=_STATS_HOUR)
+
+
+def _create_task_stats(cursor: sqlite3.Cursor, schema: str = 'main') -> None:
+    """Create the aggregates of the tasks table of the schema and the triggers that keep them, and fill them."""
+    for sql in _TASK_STATS_TABLE_SQLS:
+        cursor.execute(sql.format(schema=schema))
+    cursor.execute('create trigger {}.tasks_stats_after_insert after insert on tasks begin {} end'.format(
+        schema, _task_stats_trigger_body('new', 1)))
+    cursor.execute('create trigger {}.tasks_stats_after_delete after delete on tasks begin {} end'.format(
+        schema, _task_stats_trigger_body('old', -1)))
+    cursor.execute('''
+        create trigger {}.tasks_stats_after_update
+        after update of list_id, completed, archived, created_at, completed_at on tasks
+        when old.list_id is not new.list_id or old.completed is not new.completed or old.archived is not new.archived
+            or old.created_at is not new.created_at or old.completed_at is not new.completed_at
+        begin {} {} end'''.format(schema, _task_stats_trigger_body('old', -1), _task_stats_trigger_body('new', 1)))
+    _rebuild_task_stats(cursor, schema)
+
+
+def _rebuild_task_stats(cursor: sqlite3.Cursor, schema: str = 'main') -> None:
+    """Recompute the aggregates of the tasks table of the schema, as after a load without the triggers."""
+    cursor.execute('delete from {}.task_stats_counts'.format(schema))
+    cursor.execute('''
+        insert into {0}.task_stats_counts (list_id, completed, archived, count)
+        select ifnull(list_id, ''), ifnull(completed, 0) != 0, ifnull(archived, 0) != 0, count(*) from {0}.tasks
+        group by 1, 2, 3'''.format(schema))
+    cursor.execute('delete from {}.task_stats_completion_hours'.format(schema))
+    cursor.execute('''
+        insert into {0}.task_stats_completion_hours (hour, list_id, count)
+        select completed_at / {1}, ifnull(list_id, ''), count(*) from {0}.tasks
+        where ifnull(completed, 0) != 0 and completed_at > 0 group by 1, 2'''.format(schema, _STATS_HOUR))
+    cursor.execute('delete from {}.task_stats_open_creation_hours'.format(schema))
+    cursor.execute('''
+        insert into {0}.task_stats_open_creation_hours (hour, list_id, count)
+        select ifnull(created_at, 0) / {1}, ifnull(list_id, ''), count(*) from {0}.tasks
+        where {2} group by 1, 2'''.format(schema, _STATS_HOUR, _OPEN_TASK_CONDITION))
+
+
+def _convert_number_sort_keys(cursor: sqlite3.Cursor, tables: Sequence[str] = ('tasks', 'tasklists')) -> None:
+    """Replace the numeric sort keys of the tables, and nulls, by order keys that sort the same way.
+
+    Order keys start with a letter, so the float affinity of the columns keeps them as text. Numbers and nulls sort
+    before any text, so the sort key indexes find them.
+    """
+    for table in tables:
+        rows = cursor.execute("select rowid, sort_key from {} where sort_key is null or sort_key < ''".format(
+            table)).fetchall()
+        cursor.executemany('update {} set sort_key = ? where rowid = ?'.format(table),
+                           ((key_from_number(sort_key or 0), rowid) for rowid, sort_key in rows))
+
+
+def _change_sort_key_columns_to_text(cursor: sqlite3.Cursor, tables: Sequence[str] = ('tasks', 'tasklists')) -> None:
+    """Rebuild the tables whose sort key column is not text with a text one, so that no key is read as a number.
+
+    Rows keep their rowids, which the full-text index refers to; the indexes and triggers of a table are created
+    again, and so are the views of its database, which can not be checked while the table is missing.
+    """
+    for table in tables:
+        schema, _, name = table.rpartition('.')
+        schema = schema or 'main'
+        column_types = dict(row[1:3] for row in cursor.execute('pragma {}.table_info({})'.format(schema, name)))
+        if column_types['sort_key'].lower() == 'text':
+            continue
+        master = '{}.sqlite_master'.format(schema)
+        table_sql = cursor.execute("select sql from {} where type = 'table' and name = ?".format(master),
+                                   [name]).fetchone()[0]
+        dependent_sqls = [row[0] for row in cursor.execute(
+            "select sql from {} where type in ('index', 'trigger') and tbl_name = ? and sql is not null".format(
+                master), [name])]
+        views = cursor.execute("select name, sql from {} where type = 'view'".format(master)).fetchall()
+        for view_name, _ in views:
+            cursor.execute('drop view {}.{}'.format(schema, view_name))
+        column_sqls = re.sub(r'\bsort_key\s+float\b', 'sort_key text', table_sql[table_sql.index('('):],
+                             flags=re.IGNORECASE)
+        cursor.execute('create table {}.new_{} {}'.format(schema, name, column_sqls))
+        cursor.execute('insert into {0}.new_{1} (rowid, {2}) select rowid, {2} from {0}.{1}'.format(
+            schema, name, ', '.join(column_types)))
+        cursor.execute('drop table {}.{}'.format(schema, name))
+        cursor.execute('alter table {0}.new_{1} rename to {1}'.format(schema, name))
+        # The statements as stored name no database, the objects are created in that of the table
+        for sql in dependent_sqls + [view_sql for _, view_sql in views]:
+            cursor.execute(re.sub(r'^(create\s+(?:unique\s+)?(?:index|trigger|view)\s+)', r'\1{}.'.format(schema),
+                                  sql, flags=re.IGNORECASE))
+
+
+# Schema migrations; the N-th entry upgrades a database file from version N-1 to version N.
+# A step is a SQL statement or a function that takes the migration cursor.
+# Never edit a released entry, append a new one instead.
+_MIGRATIONS: List[List[Union[str, Callable[[sqlite3.Cursor], None]]]] = [
+    # 1: Initial tables (files created before schema versioning already have them)
+    [
+        '''
+        create table if not exists tasks (
+            id text primary key not null,
+            list_id text,
+            parent_task_id text,
+            name text,
+            tags text,
+            memo text,
+            completed bool,
+            archived bool,
+            created_at integer,
+            updated_at integer,
+            completed_at integer,
+            sort_key float
+        )''',
+        'create index if not exists task_completed_index on tasks(completed)',
+        '''
+        create table if not exists tasklists (
+            id text primary key not null,
+            name text,
+            sort_key float
+        )''',
+    ],
+    # 2: Indexes for every query shape issued by TaskEngine
+    [
+        'drop index if exists task_completed_index',
+        'create index tasks_list_archived_sort_key_index on tasks(list_id, archived, sort_key)',
+        'create index tasks_active_list_sort_key_index on tasks(list_id, sort_key) where archived = 0',
+        'create index tasks_parent_sort_key_index on tasks(parent_task_id, sort_key)',
+        'create index tasks_sort_key_index on tasks(sort_key)',
+        'create index tasklists_sort_key_index on tasklists(sort_key)',
+    ],
+    # 3: Full-text search over name, tags and memo
+    [
+        _create_tasks_fts,
+    ],
+    # 4: Materialized path of the task tree, so that a subtree is one range of the path index
+    [
+        'alter table tasks add column path text',
+        'alter table tasks add column depth integer',
+        'alter table tasks add column subtree_size integer',
+        'create index tasks_path_index on tasks(path)',
+        _rebuild_task_tree,
+    ],
+    # 5: Compressed large memos; the full-text index is rebuilt over the decompressed memos
+    [
+        _drop_tasks_fts,
+        _compress_memos,
+        _create_tasks_fts_over_memo_text,
+    ],
+    # 6: Change journal; bookkeeping columns of the materialized path are not logged
+    [
+        '''
+        create table changes (
+            seq integer primary key autoincrement,
+            table_name text not null,
+            row_id text not null,
+            operation text not null
+        )''',
+        'create table changes_compacted (seq integer not null)',
+        'insert into changes_compacted (seq) values (0)',
+        '''
+        create trigger tasks_changes_after_insert after insert on tasks begin
+            insert into changes (table_name, row_id, operation) values ('tasks', new.id, 'insert');
+        end''',
+        '''
+        create trigger tasks_changes_after_update after update of
+            list_id, parent_task_id, name, tags, memo, completed, archived, created_at, updated_at, completed_at,
+            sort_key on tasks begin
+            insert into changes (table_name, row_id, operation) values ('tasks', new.id, 'update');
+        end''',
+        '''
+        create trigger tasks_changes_after_delete after delete on tasks begin
+            insert into changes (table_name, row_id, operation) values ('tasks', old.id, 'delete');
+        end''',
+        '''
+        create trigger tasklists_changes_after_insert after insert on tasklists begin
+            insert into changes (table_name, row_id, operation) values ('tasklists', new.id, 'insert');
+        end''',
+        '''
+        create trigger tasklists_changes_after_update after update on tasklists begin
+            insert into changes (table_name, row_id, operation) values ('tasklists', new.id, 'update');
+        end''',
+        '''
+        create trigger tasklists_changes_after_delete after delete on tasklists begin
+            insert into changes (table_name, row_id, operation) values ('tasklists', old.id, 'delete');
+        end''',
+    ],
+    # 7: Aggregates for statistics kept by triggers, and open tasks by creation time for ages to the second
+    [
+        _create_task_stats,
+        'create index tasks_open_created_at_index on tasks(created_at) where ' + _OPEN_TASK_CONDITION,
+    ],
+    # 8: Order keys for sort keys, which never run out of precision as floats do, in text columns
+    [
+        _convert_number_sort_keys,
+        _change_sort_key_columns_to_text,
+    ],
+    # 9: Full-text index with its own plain memos, so the stored schema needs no functions of the application
+    [
+        _drop_tasks_fts,
+        _create_tasks_fts_with_plain_memos,
+    ],
+    # 10: Tasks of a list in sort key order whatever their archived flag, which the partial index could not serve
+    [
+        'drop index if exists tasks_active_list_sort_key_index',
+        'create index tasks_list_sort_key_index on tasks(list_id, sort_key)',
+    ],
+]
+
+
+def _apply_migrations(conn: sqlite3.Connection, migrations: List[List[Union[str, Callable[[sqlite3.Cursor], None]]]],
+                      version_table: str = 'schema_version') -> None:
+    """Run the migrations that the file has not had yet, each in a transaction of its own, see _MIGRATIONS.
+
+    The versions applied are recorded in version_table, so that a file can have more than one list of migrations.
+    """
+    conn.execute('create table if not exists {} (version integer primary key not null)'.format(version_table))
+    conn.commit()
+    row = conn.execute('select max(version) from {}'.format(version_table)).fetchone()
+    for version in range((row[0] or 0) + 1, len(migrations) + 1):
+        cursor = conn.cursor()
+        try:
+            cursor.execute('begin')
+            for step in migrations[version - 1]:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute('insert into {} (version) values (?)'.format(version_table), [version])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+_TASK_COLUMNS: str = ('id, list_id, parent_task_id, name, tags, memo, completed, archived, '
+                      'created_at, updated_at, completed_at, sort_key')
+# Same row layout as _TASK_COLUMNS, memos are loaded on demand
+_MEMO_LESS_TASK_COLUMNS: str = ('id, list_id, parent_task_id, name, tags, null, completed, archived, '
+                                'created_at, updated_at, completed_at, sort_key')
+_TASKLIST_COLUMNS: str = 'id, name, sort_key'
+# The row layout of TaskColumns.from_rows
+_COLUMNAR_TASK_COLUMNS: str = ('id, list_id, ifnull(completed, 0), ifnull(archived, 0), ifnull(created_at, 0), '
+                               "ifnull(updated_at, 0), ifnull(completed_at, 0), ifnull(sort_key, '')")
+
+# A task path is the ids from the root down to the task, each followed by the separator.
+# Ids must not contain the separator; the app uses UUIDs.
+_PATH_SEPARATOR: str = '/'
+_PATH_UPPER_BOUND_SQL: str = "substr(path, 1, length(path) - 1) || '{}'".format(chr(ord(_PATH_SEPARATOR) + 1))
+
+
+def _task_row_factory(_cursor: sqlite3.Cursor, row: Tuple) -> Task:
+    id_, list_id, parent_task_id, name, tags, memo, completed, archived, created_at, updated_at, completed_at, \
+        sort_key = row
+    return Task(id_, list_id, parent_task_id, name, tags, _decode_memo(memo), bool(completed), bool(archived),
+                created_at, updated_at, completed_at, sort_key)
+
+
+def _tasklist_row_factory(_cursor: sqlite3.Cursor, row: Tuple) -> TaskList:
+    id_, name, sort_key = row
+    return TaskList(id_, name, sort_key)
+
+
+@functools.lru_cache(maxsize=None)
+def _select_tasks_sql(has_id: bool, has_list_id: bool, has_parent_task_id: bool,
+                      completed: Optional[bool], archived: Optional[bool], with_memo: bool = True,
+                      table: str = 'tasks', order: bool = True) -> str:
+    conditions = []
+    if has_id:
+        conditions.append('id = ?')
+    if has_list_id:
+        conditions.append('list_id = ?')
+    if has_parent_task_id:
+        conditions.append('parent_task_id = ?')
+    # Flags are embedded as literals, so that the planner sees them when it chooses an index
+    if completed is not None:
+        conditions.append('completed = {}'.format(int(completed)))
+    if archived is not None:
+        conditions.append('archived = {}'.format(int(archived)))
+    select_sql = 'select {} from {}'.format(_TASK_COLUMNS if with_memo else _MEMO_LESS_TASK_COLUMNS, table)
+    if conditions:
+        select_sql += ' where ' + ' and '.join(conditions)
+    return select_sql + ' order by sort_key' if order else select_sql
+
+
+@functools.lru_cache(maxsize=None)
+def _select_tasks_with_archive_sql(has_id: bool, has_list_id: bool, has_parent_task_id: bool,
+                                   completed: Optional[bool], archived: Optional[bool], with_memo: bool = True) -> str:
+    """Return _select_tasks_sql over the active tasks, the archived tasks or the union of both."""
+    # Every task of the main table is active, saying so lets the planner use the (list_id, archived, sort_key) index
+    active_sql = _select_tasks_sql(has_id, has_list_id, has_parent_task_id, completed, False, with_memo,
+                                   table='main.tasks', order=archived is not None)
+    archived_sql = _select_tasks_sql(has_id, has_list_id, has_parent_task_id, completed, None, with_memo,
+                                     table='archive.tasks')
+    if archived is not None:
+        return archived_sql if archived else active_sql
+    # The parameters are passed once per table
+    return '{} union all {}'.format(active_sql, archived_sql)
+
+
+@functools.lru_cache(maxsize=None)
+def _select_subtree_sql(with_memo: bool) -> str:
+    # A subtree is one range of the path index
+    return '''
+        select {columns} from tasks
+        where path >= (select path from tasks where id = ?1)
+          and path < (select {upper_bound} from tasks where id = ?1)
+        order by sort_key
+    '''.format(columns=_TASK_COLUMNS if with_memo else _MEMO_LESS_TASK_COLUMNS,
+               upper_bound=_PATH_UPPER_BOUND_SQL)
+
+
+def _path_upper_bound(path: str) -> str:
+    """Return the smallest string greater than every path that starts with the passed path."""
+    return path[:-1] + chr(ord(_PATH_SEPARATOR) + 1)
+
+
+def _ancestor_ids(path: str) -> List[str]:
+    """Return the ids of the ancestors in the path, root first."""
+    return path.split(_PATH_SEPARATOR)[:-2]
+
+
+def _preorder(tasks: List[Task], root_id: str) -> List[Task]:
+    """Arrange tasks in sort key order into preorder of the tree below the root."""
+    children: Dict[str, List[Task]] = {}
+    root: Optional[Task] = None
+    for task in tasks:
+        if task.id == root_id:
+            root = task
+        else:
+            children.setdefault(task.parent_task_id, []).append(task)
+    if root is None:
+        return []
+    result: List[Task] = []
+    stack: List[Task] = [root]
+    while stack:
+        task = stack.pop()
+        result.append(task)
+        stack.extend(reversed(children.get(task.id, [])))
+    return result
+
+
+class _TaskTreeLoader:
+    """Compute the tree columns of tasks loaded chunk by chunk, holding no more than two chunks.
+
+    A task is placed under its parent if the parent has been stored or has come before it, as in exported files.
+    Anything else, a task stored before the load or a parent that comes after its children, sets needs_rebuild.
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor) -> None:
+        self._cursor: sqlite3.Cursor = cursor
+        # Tree columns of the previous chunk, where most parents outside a chunk are
+        self._previous_tree: Dict[str, List[Any]] = {}
+        self._missing_parent_ids: Set[str] = set()
+        self.needs_rebuild: bool = False
+
+    def place(self, tasks: List[Task]) -> List[List[Any]]:
+        """Return path, depth and subtree size of the tasks, and add them to the sizes of stored ancestors."""
+        ids = [task.id for task in tasks]
+        id_set = set(ids)
+        if len(id_set) < len(ids) or _execute_in(self._cursor, 'select id from tasks where id in ({})', ids):
+            self.needs_rebuild = True
+        known_trees = dict(self._previous_tree)
+        outside_parent_ids = list({task.parent_task_id for task in tasks if task.parent_task_id} - id_set -
+                                  known_trees.keys())
+        for id_, path, depth in _execute_in(self._cursor, 'select id, path, depth from tasks where id in ({})',
+                                            outside_parent_ids):
+            known_trees[id_] = [path, depth, 0]
+
+        tree: Dict[str, List[Any]] = {}
+        stored_size_deltas: Dict[str, int] = {}
+        columns = []
+        for task in tasks:
+            parent_tree = tree.get(task.parent_task_id) or known_trees.get(task.parent_task_id)
+            if parent_tree is not None:
+                path, depth = parent_tree[0] + task.id + _PATH_SEPARATOR, parent_tree[1] + 1
+            else:
+                path, depth = task.id + _PATH_SEPARATOR, 0
+                if task.parent_task_id in id_set:
+                    self.needs_rebuild = True
+                elif task.parent_task_id:
+                    self._missing_parent_ids.add(task.parent_task_id)
+            task_tree = tree[task.id] = [path, depth, 1]
+            columns.append(task_tree)
+            for ancestor_id in _ancestor_ids(path):
+                if ancestor_id in tree:
+                    tree[ancestor_id][2] += 1
+                else:
+                    stored_size_deltas[ancestor_id] = stored_size_deltas.get(ancestor_id, 0) + 1
+        self._cursor.executemany('update tasks set subtree_size = subtree_size + ? where id = ?',
+                                 ((delta, id_) for id_, delta in stored_size_deltas.items()))
+        self._previous_tree = tree
+        return columns
+
+    def finish(self) -> None:
+        """Set needs_rebuild if a parent missing when its children were placed has come later."""
+        if _execute_in(self._cursor, 'select id from tasks where id in ({})', list(self._missing_parent_ids)):
+            self.needs_rebuild = True
+
+
+
+def _qualified_task_columns(table: str, with_memo: bool) -> str:
+    columns = _TASK_COLUMNS.split(', ')
+    return ', '.join('{}.{}'.format(table, c) if with_memo or c != 'memo' else 'null' for c in columns)
+
+
+@functools.lru_cache(maxsize=None)
+def _select_first_or_last_task_sql(last: bool, has_parent_task_id: bool, has_sort_key_bound: bool,
+                                   table: str = 'tasks') -> str:
+    conditions = []
+    if has_parent_task_id:
+        conditions.append('parent_task_id = ?')
+    if has_sort_key_bound:
+        conditions.append('sort_key < ?' if last else 'sort_key > ?')
+    elif not has_parent_task_id:
+        # Every text key is at least '', so the first or last one is a search of the sort key index, not a scan
+        conditions.append("sort_key >= ''")
+    select_sql = 'select {} from {}'.format(_TASK_COLUMNS, table)
+    if conditions:
+        select_sql += ' where ' + ' and '.join(conditions)
+    return select_sql + (' order by sort_key desc limit 1' if last else ' order by sort_key limit 1')
+
+
+@functools.lru_cache(maxsize=None)
+def _select_first_or_last_task_with_archive_sql(last: bool, has_parent_task_id: bool,
+                                                has_sort_key_bound: bool) -> str:
+    # Sort keys of siblings are unique across both tables; the parameters are passed once per table
+    return 'select * from ({}) union all select * from ({}) order by sort_key{} limit 1'.format(
+        _select_first_or_last_task_sql(last, has_parent_task_id, has_sort_key_bound, table='main.tasks'),
+        _select_first_or_last_task_sql(last, has_parent_task_id, has_sort_key_bound, table='archive.tasks'),
+        ' desc' if last else '')
+
+
+def _execute_in(cursor: sqlite3.Cursor, sql: str, ids: List[str]) -> List[Tuple]:
+    """Run the statement, whose placeholder list is {}, for chunks of the ids and return all rows."""
+    rows = []
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        rows.extend(cursor.execute(sql.format(', '.join('?' * len(chunk))), chunk).fetchall())
+    return rows
+
+
+class SQLite3Profile(Enum):
+    """A set of PRAGMA settings applied to every connection."""
+    DURABLE = 0
+    BALANCED = 1
+    FAST = 2
+
+
+# journal_mode is stored in the database file, the others are applied per connection.
+# Negative cache_size is in KiB.
+_PROFILE_PRAGMAS: Dict[SQLite3Profile, List[Tuple[str, Any]]] = {
+    SQLite3Profile.DURABLE: [
+        ('journal_mode', 'wal'),
+        ('synchronous', 'full'),
+        ('cache_size', -8 * 1024),
+        ('mmap_size', 0),
+        ('temp_store', 'default'),
+        ('busy_timeout', 10000),
+    ],
+    SQLite3Profile.BALANCED: [
+        ('journal_mode', 'wal'),
+        ('synchronous', 'normal'),
+        ('cache_size', -32 * 1024),
+        ('mmap_size', 128 * 1024 * 1024),
+        ('temp_store', 'memory'),
+        ('busy_timeout', 5000),
+    ],
+    SQLite3Profile.FAST: [
+        ('journal_mode', 'wal'),
+        ('synchronous', 'off'),
+        ('cache_size', -128 * 1024),
+        ('mmap_size', 1024 * 1024 * 1024),
+        ('temp_store', 'memory'),
+        ('busy_timeout', 5000),
+    ],
+}
+
+
+# The archive database of the cold-storage mode; its tasks have no path, their depth keeps parents before children
+_ARCHIVE_SCHEMA_SQLS: List[str] = [
+    '''
+    create table if not exists archive.tasks (
+        id text primary key not null,
+        list_id text,
+        parent_task_id text,
+        name text,
+        tags text,
+        memo text,
+        completed bool,
+        archived bool,
+        created_at integer,
+        updated_at integer,
+        completed_at integer,
+        sort_key text,
+        depth integer
+    )''',
+    'create index if not exists archive.archived_tasks_list_sort_key_index on tasks(list_id, sort_key)',
+    'create index if not exists archive.archived_tasks_parent_sort_key_index on tasks(parent_task_id, sort_key)',
+    'create index if not exists archive.archived_tasks_sort_key_index on tasks(sort_key)',
+]
+
+
+class _SQLite3ReaderPool:
+    """Hands each thread its own read-only connection."""
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection]) -> None:
+        self._connect: Callable[[], sqlite3.Connection] = connect
+        self._local: threading.local = threading.local()
+        self._lock: threading.Lock = threading.Lock()
+        self._conns: List[sqlite3.Connection] = []
+
+    def get(self) -> sqlite3.Connection:
+        conn: Optional[sqlite3.Connection] = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            conn.execute('pragma query_only = 1')
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+            self._local = threading.local()
 
 
 class SQLite3TaskDatabase(TaskDatabase):
-    """A SQLite3 based database for task management."""
+    """A SQLite3 based database for task management.
 
-    def __init__(self, path: str):
+    If archive_path is passed, archived tasks are kept in that database file, attached as the schema archive, and
+    only active tasks in the main one; upserting a task with another archived flag moves it across. Reads that can
+    return archived tasks read both. A transaction covers both files, but with WAL journals a crash may leave a
+    moved task in both; opening the database again resolves that. With cold_storage off, the tasks of the archive
+    file are moved back into the main one on opening, and the file is detached again.
+    """
+
+    def __init__(self, path: str, profile: SQLite3Profile = SQLite3Profile.BALANCED,
+                 archive_path: Optional[str] = None, cold_storage: bool = True):
         super().__init__()
-        db_exists = os.path.exists(path)
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        self._conn: sqlite3.Connection = sqlite3.connect(path)
+        self._path: str = path
+        self._profile: SQLite3Profile = profile
+        self._archive_path: Optional[str] = archive_path
+        self._cold_storage: bool = cold_storage
+        for file_path in (path, archive_path):
+            if file_path is not None and file_path != ':memory:':
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self._conn: sqlite3.Connection = self._connect()
         self._cursor: Optional[sqlite3.Cursor] = None
-        if not db_exists:
-            self._create_tables()
+        self._home_thread_id: int = threading.get_ident()
+        self._writer_lock: threading.RLock = threading.RLock()
+        self._writer_owner_id: Optional[int] = None
+        self._writer_depth: int = 0
+        self._readers: _SQLite3ReaderPool = _SQLite3ReaderPool(self._connect)
+        self._migrate()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections are shared across threads, access is serialized by the writer lock or the reader pool
+        conn = sqlite3.connect(self._path, check_same_thread=False)
+        # Only for migration 5 and the search of the archive; the stored schema does not use it
+        conn.create_function('memo_text', 1, _decode_memo)
+        schemas = ['main']
+        if self._archive_path is not None:
+            # Attached first, so that journal_mode applies to the archive as well
+            conn.execute('attach database ? as archive', [self._archive_path])
+            schemas.append('archive')
+        for schema in schemas:
+            # Only a file without pages can get auto_vacuum without a VACUUM, and journal_mode writes the first page
+            if conn.execute('pragma {}.page_count'.format(schema)).fetchone()[0] == 0:
+                conn.execute('pragma {}.auto_vacuum = incremental'.format(schema))
+        for name, value in _PROFILE_PRAGMAS[self._profile]:
+            conn.execute('pragma {} = {}'.format(name, value))
+        return conn
 
     def close(self):
+        self._readers.close()
         self._conn.close()
 
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        with self._writing():
+            with super().transaction():
+                yield
+                if self._transaction_depth == 1 and self._has_tasks_fts:
+                    _index_pending_memos(self._cursor)
+
     def _begin_transaction(self):
         self._cursor = self._conn.cursor()
 
@@ -32,198 +848,827 @@ class SQLite3TaskDatabase(TaskDatabase):
         self._conn.commit()
         self._cursor = None
 
-    def _create_tables(self):
-        if self._cursor:
-            cursor = self._cursor
+    def _rollback_transaction(self):
+        self._conn.rollback()
+        self._cursor = None
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        """Hold the single writer connection; writes from other threads wait until it is released."""
+        self._writer_lock.acquire()
+        try:
+            self._writer_owner_id = threading.get_ident()
+            self._writer_depth += 1
+            yield
+        finally:
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer_owner_id = None
+            self._writer_lock.release()
+
+    @contextmanager
+    def _reading(self) -> Iterator[sqlite3.Connection]:
+        """Choose a connection for a read that never waits behind a write of another thread."""
+        if self._writer_owner_id == threading.get_ident() or self._path == ':memory:':
+            # Read own uncommitted writes (an in-memory database can not be shared between connections)
+            with self._writing():
+                yield self._conn
+        elif threading.get_ident() == self._home_thread_id and self._writer_lock.acquire(blocking=False):
+            try:
+                yield self._conn
+            finally:
+                self._writer_lock.release()
         else:
-            cursor = self._conn.cursor()
+            yield self._readers.get()
 
-        cursor.execute('''
-            create table if not exists tasks (
-                id text primary key not null,
-                list_id text,
-                parent_task_id text,
-                name text,
-                tags text,
-                memo text,
-                completed bool,
-                archived bool,
-                created_at integer,
-                updated_at integer,
-                completed_at integer,
-                sort_key float
-            )''')
-        cursor.execute('create index task_completed_index on tasks(completed)')
-        cursor.execute('''
-            create table if not exists tasklists (
-                id text primary key not null,
-                name text,
-                sort_key float
-            )''')
+    @property
+    def path(self) -> str:
+        return self._path
 
-        if not self._cursor:
-            self._conn.commit()
+    @property
+    def archive_path(self) -> Optional[str]:
+        return self._archive_path
+
+    @property
+    def schema_version(self) -> int:
+        row = self._conn.execute('select max(version) from schema_version').fetchone()
+        return row[0] if row[0] is not None else 0
+
+    def _migrate(self):
+        """Upgrade the database file in place to the latest schema version."""
+        _apply_migrations(self._conn, _MIGRATIONS)
+        self._has_tasks_fts = bool(self._conn.execute(
+            "select 1 from sqlite_master where name = 'tasks_fts_pending'").fetchone())
+        if self._has_tasks_fts:
+            # Index the memos that other clients compressed
+            with self.transaction():
+                pass
+        if self._archive_path is not None:
+            with self.transaction():
+                self._cursor.execute('begin')
+                for sql in _ARCHIVE_SCHEMA_SQLS:
+                    self._cursor.execute(sql)
+                if not self._cursor.execute(
+                        "select 1 from archive.sqlite_master where name = 'task_stats_counts'").fetchone():
+                    _create_task_stats(self._cursor, 'archive')
+                _convert_number_sort_keys(self._cursor, ['archive.tasks'])
+                _change_sort_key_columns_to_text(self._cursor, ['archive.tasks'])
+                if self._cold_storage:
+                    self._settle_archive()
+                else:
+                    self._unsettle_archive()
+            if not self._cold_storage:
+                self._conn.execute('detach database archive')
+                self._archive_path = None
+
+    _INSERT_TASK_SQL = '''
+        insert into tasks (list_id, parent_task_id, name, tags, memo, completed, archived,
+                           created_at, updated_at, completed_at, sort_key, id, path, depth, subtree_size)
+        values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    '''
+
+    _UPDATE_TASK_SQL = '''
+        update tasks set list_id = ?, parent_task_id = ?, name = ?, tags = ?, memo = ?, completed = ?, archived = ?,
+                         created_at = ?, updated_at = ?, completed_at = ?, sort_key = ?
+        where id = ?
+    '''
+
+    # Used for tasks whose memo has not been loaded, the stored memo is kept as is
+    _UPDATE_TASK_KEEPING_MEMO_SQL = '''
+        update tasks set list_id = ?, parent_task_id = ?, name = ?, tags = ?, completed = ?, archived = ?,
+                         created_at = ?, updated_at = ?, completed_at = ?, sort_key = ?
+        where id = ?
+    '''
+
+    # Used by load_tasks; the tree columns of a stored task are kept, the tree is rebuilt after such a load
+    _LOAD_TASK_SQL = '''
+        insert into tasks (list_id, parent_task_id, name, tags, memo, completed, archived,
+                           created_at, updated_at, completed_at, sort_key, id, path, depth, subtree_size)
+        values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        on conflict (id) do update set
+            list_id = excluded.list_id, parent_task_id = excluded.parent_task_id, name = excluded.name,
+            tags = excluded.tags, memo = excluded.memo, completed = excluded.completed, archived = excluded.archived,
+            created_at = excluded.created_at, updated_at = excluded.updated_at, completed_at = excluded.completed_at,
+            sort_key = excluded.sort_key
+    '''
 
     def upsert_task(self, task: Task) -> None:
-        if self._cursor:
-            cursor = self._cursor
-        else:
-            cursor = self._conn.cursor()
+        self.upsert_tasks([task])
 
-        upsert_sql = '''
-            insert or replace into tasks (id, list_id, parent_task_id, name, tags, memo, completed, archived,
-                                          created_at, updated_at, completed_at, sort_key)
-            values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-        '''
-        cursor.execute(upsert_sql, [task.id, task.list_id, task.parent_task_id, task.name, task.tags, task.memo,
-                                    task.completed, task.archived, task.created_at, task.updated_at, task.completed_at,
-                                    task.sort_key])
+    def upsert_tasks(self, tasks: Iterable[Task]) -> None:
+        tasks = list(tasks)
+        with self.transaction():
+            if self._archive_path is None:
+                self._upsert_active_tasks(tasks)
+                return
+            archived_ids = {row[0] for row in _execute_in(
+                self._cursor, 'select id from archive.tasks where id in ({})', [task.id for task in tasks])}
+            self._move_from_archive([task.id for task in tasks if task.id in archived_ids and not task.archived])
+            self._update_archived_tasks([task for task in tasks if task.id in archived_ids and task.archived])
+            self._upsert_active_tasks([task for task in tasks if task.id not in archived_ids or not task.archived])
+            self._move_to_archive([task.id for task in tasks if task.id not in archived_ids and task.archived])
 
-        if not self._cursor:
-            self._conn.commit()
+    def _upsert_active_tasks(self, tasks: List[Task]) -> None:
+        """Upsert tasks into the tasks table of the main database."""
+        stored_parent_task_ids = self._get_stored_parent_task_ids([task.id for task in tasks])
+        # Tasks that stay under the same parent keep their path and are updated in batches
+        in_place_tasks = [task for task in tasks if task.id in stored_parent_task_ids and
+                          stored_parent_task_ids[task.id] == task.parent_task_id]
+        self._cursor.executemany(self._UPDATE_TASK_SQL,
+                                 (self._task_to_params(task) for task in in_place_tasks if task.memo_is_loaded))
+        self._cursor.executemany(self._UPDATE_TASK_KEEPING_MEMO_SQL,
+                                 (self._task_to_params(task, with_memo=False)
+                                  for task in in_place_tasks if not task.memo_is_loaded))
+        in_place_ids = {task.id for task in in_place_tasks}
+        for task in tasks:
+            if task.id not in in_place_ids:
+                self._place_task(task, task.id in stored_parent_task_ids)
+                stored_parent_task_ids[task.id] = task.parent_task_id
 
-    def upsert_tasklist(self, tasklist: TaskList) -> None:
-        if self._cursor:
-            cursor = self._cursor
-        else:
-            cursor = self._conn.cursor()
+    _UPDATE_ARCHIVED_TASK_SQL = _UPDATE_TASK_SQL.replace('update tasks', 'update archive.tasks')
+    _UPDATE_ARCHIVED_TASK_KEEPING_MEMO_SQL = _UPDATE_TASK_KEEPING_MEMO_SQL.replace('update tasks',
+                                                                                   'update archive.tasks')
 
-        upsert_sql = '''
-            insert or replace into tasklists (id, name, sort_key)
-            values (?, ?, ?);
-        '''
-        cursor.execute(upsert_sql, [tasklist.id, tasklist.name, tasklist.sort_key])
+    def _update_archived_tasks(self, tasks: List[Task]) -> None:
+        """Update tasks stored in the archive database, which stay archived."""
+        if not tasks:
+            return
+        stored_parent_task_ids = dict(_execute_in(
+            self._cursor, 'select id, parent_task_id from archive.tasks where id in ({})', [t.id for t in tasks]))
+        self._cursor.executemany(self._UPDATE_ARCHIVED_TASK_SQL,
+                                 (self._task_to_params(task) for task in tasks if task.memo_is_loaded))
+        self._cursor.executemany(self._UPDATE_ARCHIVED_TASK_KEEPING_MEMO_SQL,
+                                 (self._task_to_params(task, with_memo=False)
+                                  for task in tasks if not task.memo_is_loaded))
+        self._update_archived_depths([task.id for task in tasks
+                                      if stored_parent_task_ids[task.id] != task.parent_task_id])
+        self._log_changes([task.id for task in tasks], 'update')
 
-        if not self._cursor:
-            self._conn.commit()
+    def _update_archived_depths(self, ids: List[str]) -> None:
+        """Recompute the depths of the archived tasks and their archived descendants from their parents."""
+        visited_ids: Set[str] = set()
+        while ids:
+            visited_ids.update(ids)
+            depths = []
+            for id_, parent_task_id in _execute_in(
+                    self._cursor, 'select id, parent_task_id from archive.tasks where id in ({})', ids):
+                row = self._cursor.execute('select depth from main.tasks where id = ?1 union all '
+                                           'select depth from archive.tasks where id = ?1', [parent_task_id]).fetchone()
+                depths.append((row[0] + 1 if row is not None else 0, id_))
+            self._cursor.executemany('update archive.tasks set depth = ? where id = ?', depths)
+            ids = [row[0] for row in _execute_in(
+                self._cursor, 'select id from archive.tasks where parent_task_id in ({})', ids)
+                if row[0] not in visited_ids]
+
+    def _move_to_archive(self, ids: List[str]) -> None:
+        """Move active-table tasks into the archive database, leaves first so that no subtree is rebased."""
+        if not ids:
+            return
+        rows = _execute_in(self._cursor, 'select id, depth from main.tasks where id in ({})', ids)
+        _execute_in(self._cursor, 'insert or replace into archive.tasks ({}, depth) select {}, depth from main.tasks '
+                    'where id in ({{}})'.format(_TASK_COLUMNS, _TASK_COLUMNS), ids)
+        for id_, _depth in sorted(rows, key=lambda row: row[1], reverse=True):
+            self._delete_active_task(id_)
+        # The journal has logged a delete from the main table, the task is still there to read
+        self._log_changes(ids, 'update')
+
+    def _move_from_archive(self, ids: List[str]) -> None:
+        """Move tasks from the archive database into the active table, parents first."""
+        if not ids:
+            return
+        rows = _execute_in(self._cursor, 'select {}, depth from archive.tasks where id in ({{}})'.format(
+            _TASK_COLUMNS), ids)
+        _execute_in(self._cursor, 'delete from archive.tasks where id in ({})', ids)
+        for row in sorted(rows, key=lambda row: row[-1]):
+            self._place_task(_task_row_factory(None, row[:-1]), False)
+
+    def _settle_archive(self) -> None:
+        """Move archived tasks of the main table to the archive, as after a load or an interrupted move."""
+        self._cursor.execute('delete from archive.tasks where id in (select id from main.tasks where archived = 0)')
+        self._move_to_archive([row[0] for row in
+                               self._cursor.execute('select id from main.tasks where archived = 1').fetchall()])
+
+    def _unsettle_archive(self) -> None:
+        """Move all tasks of the archive back to the main table, as when cold storage has been turned off."""
+        self._cursor.execute('delete from archive.tasks where id in (select id from main.tasks)')
+        self._move_from_archive([row[0] for row in self._cursor.execute('select id from archive.tasks').fetchall()])
+
+    def _log_changes(self, ids: List[str], operation: str) -> None:
+        """Journal changes to the archive database, which has no journal triggers."""
+        self._cursor.executemany("insert into changes (table_name, row_id, operation) values ('tasks', ?, ?)",
+                                 ((id_, operation) for id_ in ids))
+
+    def load_tasks(self, tasks: Iterable[Task], chunk_size: int = 10000) -> int:
+        """Upsert many tasks, one transaction and one executemany per chunk, and return their count.
+
+        The tree columns are computed on the way when every task comes after its parent, as in exported files;
+        otherwise the tree is rebuilt from the parent links at the end, which reads them all into memory. Loading
+        into an empty table builds the indexes and the full-text index once after the first chunk rather than row
+        by row. The tree and the archive are settled at the end even if a chunk fails, the chunks before it stay.
+        """
+        count = 0
+        iterator = iter(tasks)
+        loader = _TaskTreeLoader(self._conn.cursor())
+        try:
+            while True:
+                chunk = list(itertools.islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                with self.transaction():
+                    # Without an explicit begin, sqlite3 would commit the dropped indexes at once
+                    if not self._conn.in_transaction:
+                        self._cursor.execute('begin')
+                    is_empty = count == 0 and self._cursor.execute(
+                        'select not exists (select 1 from tasks)').fetchone()[0]
+                    recreate_sqls = self._drop_task_indexes_and_triggers() if is_empty else []
+                    tree_columns = loader.place(chunk)
+                    self._cursor.executemany(self._LOAD_TASK_SQL, (self._task_to_params(task) + columns
+                                                                   for task, columns in zip(chunk, tree_columns)))
+                    for recreate_sql in recreate_sqls:
+                        self._cursor.execute(recreate_sql)
+                    if recreate_sqls and self._has_tasks_fts:
+                        _fill_tasks_fts(self._cursor)
+                    if recreate_sqls:
+                        _rebuild_task_stats(self._cursor)
+                count += len(chunk)
+        finally:
+            with self.transaction():
+                loader.finish()
+                if loader.needs_rebuild:
+                    _rebuild_task_tree(self._cursor)
+                if self._archive_path is not None:
+                    self._settle_archive()
+        return count
+
+    def _drop_task_indexes_and_triggers(self) -> List[str]:
+        """Drop the secondary indexes, full-text index and statistics triggers of tasks; return the SQL to recreate."""
+        rows = self._cursor.execute("""
+            select type, name, sql from sqlite_master
+            where tbl_name = 'tasks' and sql is not null
+                and (type = 'index' or name glob 'tasks_fts_*' or name glob 'tasks_stats_*')
+        """).fetchall()
+        for type_, name, _sql in rows:
+            self._cursor.execute('drop {} {}'.format(type_, name))
+        return [sql for _type, _name, sql in rows]
+
+    def _get_stored_parent_task_ids(self, ids: List[str]) -> Dict[str, str]:
+        result: Dict[str, str] = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            select_sql = 'select id, parent_task_id from tasks where id in ({})'.format(', '.join('?' * len(chunk)))
+            result.update(self._cursor.execute(select_sql, chunk).fetchall())
+        return result
+
+    def _place_task(self, task: Task, exists: bool) -> None:
+        """Write a task that is new or has got another parent, and move its subtree along."""
+        parent_path, parent_depth = '', -1
+        if task.parent_task_id:
+            row = self._cursor.execute('select path, depth from tasks where id = ?', [task.parent_task_id]).fetchone()
+            if row is not None:
+                parent_path, parent_depth = row
+        if task.id in _ancestor_ids(parent_path + task.id + _PATH_SEPARATOR):
+            raise RuntimeError('Can not place task under itself')
+        path, depth = parent_path + task.id + _PATH_SEPARATOR, parent_depth + 1
+
+        if exists:
+            old_path, old_depth, size = self._cursor.execute(
+                'select path, depth, subtree_size from tasks where id = ?', [task.id]).fetchone()
+            if task.memo_is_loaded:
+                self._cursor.execute(self._UPDATE_TASK_SQL, self._task_to_params(task))
+            else:
+                self._cursor.execute(self._UPDATE_TASK_KEEPING_MEMO_SQL, self._task_to_params(task, with_memo=False))
+            if path != old_path:
+                self._add_subtree_size(old_path, -size)
+                self._rebase_subtree(old_path, path, depth - old_depth)
+                self._add_subtree_size(path, size)
+            return
+
+        self._cursor.execute(self._INSERT_TASK_SQL, self._task_to_params(task) + [path, depth])
+        size = 1
+        # Children stored before their parent have been placed as roots
+        orphans = self._cursor.execute('select id, path, depth, subtree_size from tasks '
+                                       'where parent_task_id = ? and id != ?', [task.id, task.id]).fetchall()
+        for child_id, child_path, child_depth, child_size in orphans:
+            if child_id in _ancestor_ids(path):
+                raise RuntimeError('Can not place task under itself')
+            self._rebase_subtree(child_path, path + child_id + _PATH_SEPARATOR, depth + 1 - child_depth)
+            size += child_size
+        if size > 1:
+            self._cursor.execute('update tasks set subtree_size = ? where id = ?', [size, task.id])
+        self._add_subtree_size(path, size)
+
+    def _add_subtree_size(self, path: str, delta: int) -> None:
+        """Add delta to the subtree sizes of the ancestors in the path."""
+        ancestor_ids = _ancestor_ids(path)
+        for i in range(0, len(ancestor_ids), 500):
+            chunk = ancestor_ids[i:i + 500]
+            update_sql = 'update tasks set subtree_size = subtree_size + ? where id in ({})'.format(
+                ', '.join('?' * len(chunk)))
+            self._cursor.execute(update_sql, [delta] + chunk)
+
+    def _rebase_subtree(self, old_path: str, new_path: str, depth_delta: int) -> None:
+        """Replace the path prefix of the task at old_path and all its descendants."""
+        self._cursor.execute('update tasks set path = ? || substr(path, ?), depth = depth + ? '
+                             'where path >= ? and path < ?',
+                             [new_path, len(old_path) + 1, depth_delta, old_path, _path_upper_bound(old_path)])
+
+    @staticmethod
+    def _task_to_params(task: Task, with_memo: bool = True) -> List[Any]:
+        params = [task.list_id, task.parent_task_id, task.name, task.tags,
+                  task.completed, task.archived, task.created_at, task.updated_at, task.completed_at, task.sort_key,
+                  task.id]
+        if with_memo:
+            params.insert(4, _encode_memo(task.memo) if task.memo_is_loaded else '')
+        return params
+
+    def upsert_tasklist(self, tasklist: TaskList) -> None:
+        with self.transaction():
+            upsert_sql = '''
+                insert into tasklists (id, name, sort_key)
+                values (?, ?, ?)
+                on conflict (id) do update set name = excluded.name, sort_key = excluded.sort_key;
+            '''
+            self._cursor.execute(upsert_sql, [tasklist.id, tasklist.name, tasklist.sort_key])
 
     def delete_task(self, id_: str) -> None:
-        if self._cursor:
-            cursor = self._cursor
-        else:
-            cursor = self._conn.cursor()
+        with self.transaction():
+            if self._archive_path is not None and self._delete_archived_tasks([id_]):
+                return
+            self._delete_active_task(id_)
 
-        delete_sql = 'delete from tasks where id = ?'
-        cursor.execute(delete_sql, [id_])
+    def _delete_active_task(self, id_: str) -> None:
+        row = self._cursor.execute('select path, depth, subtree_size from tasks where id = ?', [id_]).fetchone()
+        if row is None:
+            return
+        path, depth, size = row
+        self._cursor.execute('delete from tasks where id = ?', [id_])
+        self._add_subtree_size(path, -size)
+        # The children become roots, as a task whose parent is missing
+        self._cursor.execute('update tasks set path = substr(path, ?), depth = depth - ? '
+                             'where path > ? and path < ?',
+                             [len(path) + 1, depth + 1, path, _path_upper_bound(path)])
 
-        if not self._cursor:
-            self._conn.commit()
+    def _delete_archived_tasks(self, ids: List[str]) -> List[str]:
+        """Delete tasks from the archive database, and return the ids of those that were there."""
+        deleted_ids = [row[0] for row in _execute_in(self._cursor, 'select id from archive.tasks where id in ({})',
+                                                     ids)]
+        _execute_in(self._cursor, 'delete from archive.tasks where id in ({})', deleted_ids)
+        self._log_changes(deleted_ids, 'delete')
+        return deleted_ids
 
-    def delete_tasklist(self, id_: str) -> None:
-        if self._cursor:
-            cursor = self._cursor
-        else:
-            cursor = self._conn.cursor()
+    def delete_subtree(self, task_id: str) -> None:
+        with self.transaction():
+            if self._archive_path is not None:
+                ids = [task.id for task in self.get_subtree(task_id, with_memo=False)]
+                deleted_ids = set(self._delete_archived_tasks(ids))
+                # Leaves first, so that no subtree is rebased
+                for id_ in reversed(ids):
+                    if id_ not in deleted_ids:
+                        self._delete_active_task(id_)
+                return
+            row = self._cursor.execute('select path, subtree_size from tasks where id = ?', [task_id]).fetchone()
+            if row is None:
+                return
+            path, size = row
+            self._cursor.execute('delete from tasks where path >= ? and path < ?', [path, _path_upper_bound(path)])
+            self._add_subtree_size(path, -size)
 
-        delete_sql = 'delete from tasklists where id = ?'
-        cursor.execute(delete_sql, [id_])
+    def move_subtree(self, task_id: str, list_id: str, updated_at: int) -> None:
+        with self.transaction():
+            if self._archive_path is not None:
+                ids = [task.id for task in self.get_subtree(task_id, with_memo=False)]
+                for table in ('main.tasks', 'archive.tasks'):
+                    for i in range(0, len(ids), 500):
+                        chunk = ids[i:i + 500]
+                        self._cursor.execute('update {} set list_id = ?, updated_at = ? where id in ({})'.format(
+                            table, ', '.join('?' * len(chunk))), [list_id, updated_at] + chunk)
+                self._log_changes([row[0] for row in _execute_in(
+                    self._cursor, 'select id from archive.tasks where id in ({})', ids)], 'update')
+                return
+            row = self._cursor.execute('select path from tasks where id = ?', [task_id]).fetchone()
+            if row is None:
+                return
+            self._cursor.execute('update tasks set list_id = ?, updated_at = ? where path >= ? and path < ?',
+                                 [list_id, updated_at, row[0], _path_upper_bound(row[0])])
 
-        if not self._cursor:
-            self._conn.commit()
+    def delete_tasklist(self, id_: str) -> None:
+        with self.transaction():
+            delete_sql = 'delete from tasklists where id = ?'
+            self._cursor.execute(delete_sql, [id_])
 
     def get_tasks(self, id_: Optional[str] = None, list_id: Optional[str] = None, parent_task_id: Optional[str] = None,
-                  completed: Optional[bool] = None, archived: Optional[bool] = None) -> List[Task]:
-        select_sql = 'select * from tasks'
-        select_params = []
-        if id_ is not None:
-            select_sql += ' and' if select_params else ' where'
-            select_sql += ' id = ?'
-            select_params.append(id_)
-        if list_id is not None:
-            select_sql += ' and' if select_params else ' where'
-            select_sql += ' list_id = ?'
-            select_params.append(list_id)
-        if parent_task_id is not None:
-            select_sql += ' and' if select_params else ' where'
-            select_sql += ' parent_task_id = ?'
-            select_params.append(parent_task_id)
-        if completed is not None:
-            select_sql += ' and' if select_params else ' where'
-            select_sql += ' completed = ?'
-            select_params.append(int(completed))
-        if archived is not None:
-            select_sql += ' and' if select_params else ' where'
-            select_sql += ' archived = ?'
-            select_params.append(int(archived))
-        select_sql += ' order by sort_key'
-        tasks = []
-        for row in self._conn.execute(select_sql, select_params):
-            task = self._row_to_task(row)
-            tasks.append(task)
-        return tasks
+                  completed: Optional[bool] = None, archived: Optional[bool] = None,
+                  with_memo: bool = True) -> List[Task]:
+        select_sql, select_params = self._get_tasks_sql(id_=id_, list_id=list_id, parent_task_id=parent_task_id,
+                                                        completed=completed, archived=archived, with_memo=with_memo)
+        return self._select_tasks(select_sql, select_params, with_memo)
+
+    def _get_tasks_sql(self, id_: Optional[str] = None, list_id: Optional[str] = None,
+                       parent_task_id: Optional[str] = None, completed: Optional[bool] = None,
+                       archived: Optional[bool] = None, with_memo: bool = True) -> Tuple[str, List[Any]]:
+        select_params = [p for p in (id_, list_id, parent_task_id) if p is not None]
+        if self._archive_path is not None:
+            select_sql = _select_tasks_with_archive_sql(id_ is not None, list_id is not None,
+                                                        parent_task_id is not None, completed, archived, with_memo)
+            return select_sql, select_params * 2 if archived is None else select_params
+        select_sql = _select_tasks_sql(id_ is not None, list_id is not None, parent_task_id is not None,
+                                       completed, archived, with_memo)
+        return select_sql, select_params
+
+    def iter_tasks(self, batch_size: int = 1000) -> Iterator[Task]:
+        # Path order puts every parent before its children and is served by the path index
+        with self._reading() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = _task_row_factory
+            cursor.execute('select {} from tasks order by path'.format(_TASK_COLUMNS))
+            while True:
+                tasks = cursor.fetchmany(batch_size)
+                if not tasks:
+                    break
+                yield from tasks
+            if self._archive_path is None:
+                return
+            # Parents of archived tasks are active or less deep
+            cursor.execute('select {} from archive.tasks order by depth'.format(_TASK_COLUMNS))
+            while True:
+                tasks = cursor.fetchmany(batch_size)
+                if not tasks:
+                    return
+                yield from tasks
+
+    def get_memo(self, id_: str) -> str:
+        with self._reading() as conn:
+            row = conn.execute('select memo from tasks where id = ?', [id_]).fetchone()
+            if row is None and self._archive_path is not None:
+                row = conn.execute('select memo from archive.tasks where id = ?', [id_]).fetchone()
+        return _decode_memo(row[0]) if row is not None and row[0] is not None else ''
 
     def get_first_task(self, parent_task_id: Optional[str] = None,
-                       sort_key_after: Optional[float] = None) -> Optional[Task]:
-        select_sql = 'select * from tasks'
-        select_params = []
-        if parent_task_id is not None:
-            select_sql += ' and' if select_params else ' where'
-            select_sql += ' parent_task_id = ?'
-            select_params.append(parent_task_id)
-        if sort_key_after is not None:
-            select_sql += ' and' if select_params else ' where'
-            select_sql += ' sort_key > ?'
-            select_params.append(sort_key_after)
-        select_sql += ' order by sort_key limit 1'
-        tasks = []
-        for row in self._conn.execute(select_sql, select_params):
-            task = self._row_to_task(row)
-            tasks.append(task)
+                       sort_key_after: Optional[str] = None) -> Optional[Task]:
+        select_sql, select_params = self._get_first_task_sql(parent_task_id=parent_task_id,
+                                                             sort_key_after=sort_key_after)
+        tasks = self._select_tasks(select_sql, select_params)
         return tasks[0] if tasks else None
 
+    def _get_first_task_sql(self, parent_task_id: Optional[str] = None,
+                            sort_key_after: Optional[str] = None) -> Tuple[str, List[Any]]:
+        select_params = [p for p in (parent_task_id, sort_key_after) if p is not None]
+        if self._archive_path is not None:
+            return _select_first_or_last_task_with_archive_sql(False, parent_task_id is not None,
+                                                               sort_key_after is not None), select_params * 2
+        select_sql = _select_first_or_last_task_sql(False, parent_task_id is not None, sort_key_after is not None)
+        return select_sql, select_params
+
     def get_last_task(self, parent_task_id: Optional[str] = None,
-                      sort_key_before: Optional[float] = None) -> Optional[Task]:
-        select_sql = 'select * from tasks'
-        select_params = []
-        if parent_task_id is not None:
-            select_sql += ' and' if select_params else ' where'
-            select_sql += ' parent_task_id = ?'
-            select_params.append(parent_task_id)
-        if sort_key_before is not None:
-            select_sql += ' and' if select_params else ' where'
-            select_sql += ' sort_key < ?'
-            select_params.append(sort_key_before)
-        select_sql += ' order by sort_key desc limit 1'
-        tasks = []
-        for row in self._conn.execute(select_sql, select_params):
-            task = self._row_to_task(row)
-            tasks.append(task)
+                      sort_key_before: Optional[str] = None) -> Optional[Task]:
+        select_sql, select_params = self._get_last_task_sql(parent_task_id=parent_task_id,
+                                                            sort_key_before=sort_key_before)
+        tasks = self._select_tasks(select_sql, select_params)
         return tasks[0] if tasks else None
 
+    def _get_last_task_sql(self, parent_task_id: Optional[str] = None,
+                           sort_key_before: Optional[str] = None) -> Tuple[str, List[Any]]:
+        select_params = [p for p in (parent_task_id, sort_key_before) if p is not None]
+        if self._archive_path is not None:
+            return _select_first_or_last_task_with_archive_sql(True, parent_task_id is not None,
+                                                               sort_key_before is not None), select_params * 2
+        select_sql = _select_first_or_last_task_sql(True, parent_task_id is not None, sort_key_before is not None)
+        return select_sql, select_params
+
+    def get_subtree(self, task_id: str, with_memo: bool = True) -> List[Task]:
+        if self._archive_path is not None:
+            return self._get_subtree_with_archive(task_id, with_memo)
+        return _preorder(self._select_tasks(_select_subtree_sql(with_memo), [task_id], with_memo), task_id)
+
+    def _get_subtree_with_archive(self, task_id: str, with_memo: bool) -> List[Task]:
+        # Paths do not cross the databases, the tree is walked one level at a time
+        tasks = self.get_tasks(id_=task_id, with_memo=with_memo)
+        visited_ids = {task_id}
+        parent_ids = [task.id for task in tasks]
+        while parent_ids:
+            children = []
+            for i in range(0, len(parent_ids), 500):
+                chunk = parent_ids[i:i + 500]
+                condition = 'parent_task_id in ({})'.format(', '.join('?' * len(chunk)))
+                select_sql = 'select {columns} from main.tasks where {condition} union all ' \
+                             'select {columns} from archive.tasks where {condition}'.format(
+                                 columns=_TASK_COLUMNS if with_memo else _MEMO_LESS_TASK_COLUMNS, condition=condition)
+                children.extend(t for t in self._select_tasks(select_sql, chunk * 2, with_memo)
+                                if t.id not in visited_ids)
+            visited_ids.update(task.id for task in children)
+            tasks.extend(children)
+            parent_ids = [task.id for task in children]
+        tasks.sort(key=lambda task: task.sort_key)
+        return _preorder(tasks, task_id)
+
+    def get_ancestors(self, task_id: str, with_memo: bool = True) -> List[Task]:
+        if self._archive_path is not None:
+            # An active task may be under an archived one, which its path does not show
+            return super().get_ancestors(task_id, with_memo=with_memo)
+        ancestor_ids = _ancestor_ids(self._get_path(task_id))
+        if not ancestor_ids:
+            return []
+        select_sql = 'select {} from tasks where id in ({}) order by depth desc'.format(
+            _TASK_COLUMNS if with_memo else _MEMO_LESS_TASK_COLUMNS, ', '.join('?' * len(ancestor_ids)))
+        return self._select_tasks(select_sql, ancestor_ids, with_memo)
+
+    def is_ancestor(self, ancestor_id: str, task_id: str) -> bool:
+        if self._archive_path is not None:
+            return super().is_ancestor(ancestor_id, task_id)
+        return ancestor_id in _ancestor_ids(self._get_path(task_id))
+
+    def _get_path(self, task_id: str) -> str:
+        with self._reading() as conn:
+            row = conn.execute('select path from tasks where id = ?', [task_id]).fetchone()
+        return row[0] if row is not None else ''
+
+    def rebuild_tree(self) -> None:
+        """Recompute the materialized paths of all tasks from the parent links."""
+        with self.transaction():
+            _rebuild_task_tree(self._cursor)
+
+    def verify_tree(self) -> List[str]:
+        """Return a description of every task whose path, depth or subtree size disagrees with the parent links."""
+        with self.transaction():
+            expected = _compute_task_tree(self._cursor)
+            rows = self._cursor.execute('select id, path, depth, subtree_size from tasks').fetchall()
+        problems = []
+        for id_, path, depth, size in rows:
+            if (path, depth, size) != expected[id_]:
+                problems.append('Task {}: (path, depth, subtree_size) is {}, expected {}'.format(
+                    id_, (path, depth, size), expected[id_]))
+        return problems
+
+    def _schemas(self) -> List[str]:
+        return ['main'] if self._archive_path is None else ['main', 'archive']
+
+    def optimize(self, analyze: bool = False) -> bool:
+        """Update the statistics of the query planner, and return whether all tables have been analyzed.
+
+        Tables are analyzed from scratch if analyze is set or they have never been; otherwise PRAGMA optimize
+        refreshes the statistics that it finds out of date.
+        """
+        with self.transaction():
+            # Statistics from a sample are as good for the planner and bound the time on a large file
+            self._cursor.execute('pragma analysis_limit = 1000')
+            analyze = analyze or not self._cursor.execute(
+                "select 1 from sqlite_master where name = 'sqlite_stat1'").fetchone()
+            self._cursor.execute('analyze' if analyze else 'pragma optimize')
+        return analyze
+
+    def get_page_counts(self) -> Tuple[int, int, int]:
+        """Return the page count, the free page count and the page size, summed over the database files."""
+        page_count, freelist_count, page_size = 0, 0, 0
+        with self._reading() as conn:
+            for schema in self._schemas():
+                page_count += conn.execute('pragma {}.page_count'.format(schema)).fetchone()[0]
+                freelist_count += conn.execute('pragma {}.freelist_count'.format(schema)).fetchone()[0]
+                page_size = conn.execute('pragma {}.page_size'.format(schema)).fetchone()[0]
+        return page_count, freelist_count, page_size
+
+    def incremental_vacuum(self, max_pages: int) -> int:
+        """Return up to max_pages free pages of each database file to the file system, and return their count.
+
+        Files created before incremental auto_vacuum was the default need enable_incremental_vacuum first.
+        """
+        reclaimed_count = 0
+        with self.transaction():
+            for schema in self._schemas():
+                if self._cursor.execute('pragma {}.auto_vacuum'.format(schema)).fetchone()[0] != 2:
+                    continue
+                before = self._cursor.execute('pragma {}.freelist_count'.format(schema)).fetchone()[0]
+                # Every freed page is a result row, and pages are freed as the rows are stepped through
+                self._cursor.execute('pragma {}.incremental_vacuum({})'.format(schema, int(max_pages))).fetchall()
+                reclaimed_count += before - self._cursor.execute(
+                    'pragma {}.freelist_count'.format(schema)).fetchone()[0]
+        return reclaimed_count
+
+    def enable_incremental_vacuum(self) -> bool:
+        """Switch the database files to incremental auto_vacuum, and return whether any needed it.
+
+        This takes one full VACUUM, which rewrites the file and may renumber rowids, so the full-text index is
+        written anew after it.
+        """
+        with self._writing():
+            self._conn.commit()
+            schemas = [schema for schema in self._schemas()
+                       if self._conn.execute('pragma {}.auto_vacuum'.format(schema)).fetchone()[0] != 2]
+            for schema in schemas:
+                self._conn.execute('pragma {}.auto_vacuum = incremental'.format(schema))
+                self._conn.execute('vacuum {}'.format(schema))
+            if 'main' in schemas and self._has_tasks_fts:
+                _fill_tasks_fts(self._conn.cursor())
+                self._conn.commit()
+        return bool(schemas)
+
+    def purge_archived_tasks(self, before: int, chunk_size: int = 500,
+                             cancel_event: Optional[threading.Event] = None) -> int:
+        """Delete archived tasks last changed before the timestamp, a transaction per chunk, and return their count.
+
+        Leaves go first, a task with any child left is kept, so no task is orphaned. The last change is the latest
+        of the created, updated and completed times.
+        """
+        table = 'archive.tasks' if self._archive_path is not None else 'main.tasks'
+        select_sql = '''
+            select id from {table} as t
+            where archived = 1 and max(created_at, updated_at, completed_at) < ?
+              and not exists (select 1 from main.tasks as c where c.parent_task_id = t.id)
+        '''.format(table=table)
+        if self._archive_path is not None:
+            select_sql += ' and not exists (select 1 from archive.tasks as c where c.parent_task_id = t.id)'
+        select_sql += ' limit ?'
+        count = 0
+        while cancel_event is None or not cancel_event.is_set():
+            with self.transaction():
+                ids = [row[0] for row in self._cursor.execute(select_sql, [before, chunk_size]).fetchall()]
+                if self._archive_path is not None:
+                    self._delete_archived_tasks(ids)
+                else:
+                    for id_ in ids:
+                        self._delete_active_task(id_)
+            count += len(ids)
+            if not ids:
+                break
+        return count
+
+    def search(self, query: str, list_id: Optional[str] = None, include_archived: bool = False,
+               limit: int = 50) -> List[TaskSearchResult]:
+        with self._reading() as conn:
+            fts_exists = conn.execute("select 1 from sqlite_master where name = 'tasks_fts'").fetchone()
+        if not fts_exists:
+            return super().search(query, list_id=list_id, include_archived=include_archived, limit=limit)
+        match = self._to_fts_query(query)
+        if not match:
+            return []
+
+        # Name matches weigh more than tags, tags more than memo
+        select_sql = '''
+            select {columns}, bm25(tasks_fts, 10.0, 5.0, 1.0) as rank,
+                   snippet(tasks_fts, -1, '[', ']', '...', 12)
+            from tasks_fts join tasks as task on task.rowid = tasks_fts.rowid
+            where tasks_fts match ?
+        '''.format(columns=_qualified_task_columns('task', with_memo=False))
+        select_params: List[Any] = [match]
+        if list_id is not None:
+            select_sql += ' and task.list_id = ?'
+            select_params.append(list_id)
+        if not include_archived:
+            select_sql += ' and task.archived = 0'
+        select_sql += ' order by rank limit ?'
+        select_params.append(limit)
+
+        results = []
+        with self._reading() as conn:
+            for row in conn.execute(select_sql, select_params):
+                task = _task_row_factory(None, row[:12])
+                task.defer_memo(functools.partial(self.get_memo, task.id))
+                results.append(TaskSearchResult(task, row[12], row[13]))
+        if include_archived and self._archive_path is not None and len(results) < limit:
+            results.extend(self._search_archive(query, list_id, limit - len(results)))
+        return results
+
+    def _search_archive(self, query: str, list_id: Optional[str], limit: int) -> List[TaskSearchResult]:
+        """Return archived tasks that contain every word of the query, after the full-text matches.
+
+        The archive has no full-text index; it is scanned, as the rarely searched history it is.
+        """
+        conditions = []
+        select_params: List[Any] = []
+        for word in query.split():
+            number = len(select_params) + 1
+            conditions.append("(name like ?{0} escape '\\' or tags like ?{0} escape '\\' "
+                              "or memo_text(memo) like ?{0} escape '\\')".format(number))
+            select_params.append('%{}%'.format(''.join('\\' + c if c in '\\%_' else c for c in word)))
+        if not conditions:
+            return []
+        if list_id is not None:
+            conditions.append('list_id = ?{}'.format(len(select_params) + 1))
+            select_params.append(list_id)
+        select_sql = 'select {} from archive.tasks where {} order by sort_key limit {}'.format(
+            _MEMO_LESS_TASK_COLUMNS, ' and '.join(conditions), int(limit))
+        # Full-text ranks are negative, archived matches come after them
+        return [TaskSearchResult(task, 0.0, task.name) for task in self._select_tasks(select_sql, select_params, False)]
+
     @staticmethod
-    def _row_to_task(row: Any) -> Task:
-        id_: str = row[0]
-        list_id: str = row[1]
-        parent_task_id: str = row[2]
-        name: str = row[3]
-        tags: str = row[4]
-        memo: str = row[5]
-        completed: bool = bool(int(row[6]))
-        archived: bool = bool(int(row[7]))
-        created_at: int = row[8]
-        updated_at: int = row[9]
-        completed_at: int = row[10]
-        sort_key: float = row[11]
-        return Task(id_, list_id, parent_task_id, name, tags, memo, completed, archived,
-                    created_at, updated_at, completed_at, sort_key)
+    def _to_fts_query(query: str) -> str:
+        # Quote every word so user input is never parsed as FTS5 syntax; the last word may still be being typed
+        words = ['"{}"'.format(word.replace('"', '""')) for word in query.split()]
+        if words:
+            words[-1] += '*'
+        return ' '.join(words)
+
+    def _select_tasks(self, select_sql: str, select_params: List[Any], with_memo: bool = True) -> List[Task]:
+        # The statement text of each query shape is fixed, so sqlite3 reuses its prepared statement
+        with self._reading() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = _task_row_factory
+            tasks = cursor.execute(select_sql, select_params).fetchall()
+        if not with_memo:
+            for task in tasks:
+                task.defer_memo(functools.partial(self.get_memo, task.id))
+        return tasks
+
+    def get_task_columns(self, use_numpy: Optional[bool] = None) -> TaskColumns:
+        # Plain rows straight into the columns, no Task object is made
+        select_sql = 'select {} from tasks'.format(_COLUMNAR_TASK_COLUMNS)
+        if self._archive_path is not None:
+            select_sql += ' union all select {} from archive.tasks'.format(_COLUMNAR_TASK_COLUMNS)
+        with self._reading() as conn:
+            return TaskColumns.from_rows(conn.execute(select_sql), use_numpy=use_numpy)
+
+    # Statistics are read from the aggregates kept by triggers, a few rows per list and hour however many tasks
+    def get_list_stats(self) -> Dict[str, TaskListStats]:
+        select_sql = ' union all '.join('select list_id, completed, archived, count from {}.task_stats_counts'
+                                        .format(schema) for schema in self._schemas())
+        stats: Dict[str, TaskListStats] = {}
+        with self._reading() as conn:
+            for list_id, completed, archived, count in conn.execute(select_sql):
+                if count:
+                    stats.setdefault(list_id, TaskListStats()).add(completed, archived, count)
+        return stats
+
+    def get_completion_stats(self, width: int = 24 * 60 * 60, origin: int = 0, list_id: Optional[str] = None,
+                             since: Optional[int] = None, until: Optional[int] = None) -> Dict[int, int]:
+        if all(value is None or value % _STATS_HOUR == 0 for value in (width, origin, since, until)):
+            table, time_column, count_sql, scale = 'task_stats_completion_hours', 'hour', 'sum(count)', _STATS_HOUR
+            conditions = []
+        else:
+            # Not whole hours, counted from the tasks themselves
+            table, time_column, count_sql, scale = 'tasks', 'completed_at', 'count(*)', 1
+            conditions = ['ifnull(completed, 0) != 0', 'completed_at > 0']
+        params: List[Any] = []
+        if list_id is not None:
+            conditions.append('list_id = ?')
+            params.append(list_id)
+        for condition, bound in ((time_column + ' >= ?', since), (time_column + ' < ?', until)):
+            if bound is not None:
+                conditions.append(condition)
+                params.append(bound // scale)
+        where_sql = ' where ' + ' and '.join(conditions) if conditions else ''
+        select_sql = ' union all '.join('select {0} * {1}, {2} from {3}.{4}{5} group by {0}'.format(
+            time_column, scale, count_sql, schema, table, where_sql) for schema in self._schemas())
+        with self._reading() as conn:
+            return _count_in_buckets(conn.execute(select_sql, params * len(self._schemas())), width, origin)
+
+    def get_age_stats(self, now: int, edges: Sequence[int], list_id: Optional[str] = None) -> Dict[int, int]:
+        # Open tasks created at or before now - edge, for each edge: whole hours from the aggregates, summed range by
+        # range from the oldest, and the rest of an hour from the partial index over created_at
+        list_params = [list_id] if list_id is not None else []
+        list_sql = ' and list_id = ?' if list_id is not None else ''
+        cumulative_counts = [0] * len(edges)
+        whole_hours_count, lower_hour = 0, None
+        with self._reading() as conn:
+            for i in reversed(range(len(edges))):
+                bound = now - edges[i]
+                hour = (bound + 1) // _STATS_HOUR
+                range_sql, range_params = ('hour < ?', [hour]) if lower_hour is None else \
+                    ('hour >= ? and hour < ?', [lower_hour, hour])
+                whole_hours_count += conn.execute(
+                    'select ifnull(sum(count), 0) from task_stats_open_creation_hours where {}{}'.format(
+                        range_sql, list_sql), range_params + list_params).fetchone()[0]
+                cumulative_counts[i] = whole_hours_count
+                if hour * _STATS_HOUR <= bound:
+                    cumulative_counts[i] += conn.execute(
+                        'select count(*) from tasks indexed by tasks_open_created_at_index '
+                        'where {} and created_at >= ? and created_at <= ?{}'.format(_OPEN_TASK_CONDITION, list_sql),
+                        [hour * _STATS_HOUR, bound] + list_params).fetchone()[0]
+                lower_hour = hour
+        return {edge: count - (cumulative_counts[i + 1] if i + 1 < len(edges) else 0)
+                for i, (edge, count) in enumerate(zip(edges, cumulative_counts))}
+
+    def changes_since(self, seq: int) -> Optional[List[TaskChange]]:
+        with self._reading() as conn:
+            compacted_seq = conn.execute('select seq from changes_compacted').fetchone()[0]
+            if seq < compacted_seq:
+                return None
+            rows = conn.execute('select seq, table_name, row_id, operation from changes where seq > ? order by seq',
+                                [seq]).fetchall()
+        return [TaskChange(*row) for row in rows]
+
+    def last_change_seq(self) -> int:
+        with self._reading() as conn:
+            row = conn.execute("select seq from sqlite_sequence where name = 'changes'").fetchone()
+        return row[0] if row is not None else 0
+
+    def compact_changes(self, before_seq: Optional[int] = None) -> None:
+        superseded_sql = 'from changes where seq not in (select max(seq) from changes group by table_name, row_id)'
+        with self.transaction():
+            # Readers behind a dropped change would miss it, so they have to resync
+            compacted_seq = self._cursor.execute('select max(seq) ' + superseded_sql).fetchone()[0] or 0
+            self._cursor.execute('delete ' + superseded_sql)
+            if before_seq is not None:
+                self._cursor.execute('delete from changes where seq <= ?', [before_seq])
+                compacted_seq = max(compacted_seq, before_seq)
+            self._cursor.execute('update changes_compacted set seq = max(seq, ?)', [compacted_seq])
 
     def get_tasklists(self, id_: Optional[str] = None) -> List[TaskList]:
-        select_sql = 'select * from tasklists'
+        select_sql = 'select {} from tasklists'.format(_TASKLIST_COLUMNS)
         select_params = []
         if id_ is not None:
-            select_sql += ' and' if select_params else ' where'
-            select_sql += ' id = ?'
+            select_sql += ' where id = ?'
             select_params.append(id_)
         select_sql += ' order by sort_key'
-        tasklists = []
-        for row in self._conn.execute(select_sql, select_params):
-            tasklist = self._row_to_tasklist(row)
-            tasklists.append(tasklist)
-        return tasklists
-
-    @staticmethod
-    def _row_to_tasklist(row: Any) -> TaskList:
-        id_: str = row[0]
-        name: str = row[1]
-        sort_key: float = row[2]
-        return TaskList(id_, name, sort_key)
+        with self._reading() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = _tasklist_row_factory
+            return cursor.execute(select_sql, select_params).fetchall()
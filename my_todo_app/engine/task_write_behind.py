@@ -0,0 +1,265 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""The write-behind task database wrapper."""
+
+import atexit
+import copy
+import functools
+import threading
+from contextlib import contextmanager
+from typing import *
+
+from my_todo_app.engine.task import TaskDatabase, Task, TaskList, TaskListStats, TaskSearchResult, TaskChange
+from my_todo_app.engine.task_columns import TaskColumns
+
+
+class WriteBehindTaskDatabase(TaskDatabase):
+    """A database wrapper that holds task upserts back and writes them in one transaction.
+
+    Repeated upserts of the same task are merged, so editing a task over and over costs one write. Held upserts are
+    flushed when the delay has passed since the first of them, before any other write, before reads that can not
+    see them, and on close or interpreter exit. get_tasks and get_memo read held upserts as they are.
+
+    A flush by the timer that fails keeps the upserts held, calls on_error with the exception on the timer thread
+    (or raises it there), and is tried again after the delay; a flush called directly raises.
+    """
+
+    def __init__(self, db: TaskDatabase, delay: float = 1.0,
+                 on_error: Optional[Callable[[BaseException], None]] = None):
+        super().__init__()
+        self._db: TaskDatabase = db
+        self._delay: float = delay
+        self.on_error: Optional[Callable[[BaseException], None]] = on_error
+        self._lock: threading.RLock = threading.RLock()
+        self._pending_tasks: Dict[str, Task] = {}
+        self._timer: Optional[threading.Timer] = None
+        atexit.register(self.flush)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending_tasks)
+
+    def flush(self) -> None:
+        """Write the held upserts now."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending_tasks:
+                return
+            self._db.upsert_tasks(list(self._pending_tasks.values()))
+            self._pending_tasks.clear()
+
+    def _start_timer(self) -> None:
+        self._timer = threading.Timer(self._delay, self._flush_on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_on_timer(self) -> None:
+        with self._lock:
+            try:
+                self.flush()
+            except Exception as e:
+                error = e
+                if self._timer is None and self._pending_tasks:
+                    self._start_timer()
+            else:
+                return
+        if self.on_error is None:
+            raise error
+        self.on_error(error)
+
+    def close(self):
+        atexit.unregister(self.flush)
+        with self._lock:
+            self.flush()
+            self._db.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        with self._lock:
+            self.flush()
+            with self._db.transaction():
+                yield
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._db.in_transaction
+
+    # Transactions are delegated to the wrapped database as a whole, see transaction()
+    def _begin_transaction(self) -> None:
+        pass
+
+    def _end_transaction(self) -> None:
+        pass
+
+    def _rollback_transaction(self) -> None:
+        pass
+
+    def upsert_task(self, task: Task) -> None:
+        with self._lock:
+            if self._db.in_transaction:
+                # A write in a transaction must commit or roll back with it
+                self._db.upsert_task(task)
+                return
+            held_task = copy.copy(task)
+            pending_task = self._pending_tasks.pop(task.id, None)
+            if pending_task is not None and pending_task.memo_is_loaded and not held_task.memo_is_loaded:
+                held_task.memo = pending_task.memo
+            self._pending_tasks[task.id] = held_task
+            if self._timer is None:
+                self._start_timer()
+
+    def upsert_tasks(self, tasks: Iterable[Task]) -> None:
+        with self._lock:
+            for task in tasks:
+                self.upsert_task(task)
+
+    def load_tasks(self, tasks: Iterable[Task], chunk_size: int = 10000) -> int:
+        with self._lock:
+            self.flush()
+            return self._db.load_tasks(tasks, chunk_size=chunk_size)
+
+    def upsert_tasklist(self, tasklist: TaskList) -> None:
+        with self._lock:
+            self.flush()
+            self._db.upsert_tasklist(tasklist)
+
+    def delete_task(self, id_: str) -> None:
+        with self._lock:
+            self.flush()
+            self._db.delete_task(id_)
+
+    def delete_tasks(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            self.flush()
+            self._db.delete_tasks(ids)
+
+    def delete_subtree(self, task_id: str) -> None:
+        with self._lock:
+            self.flush()
+            self._db.delete_subtree(task_id)
+
+    def move_subtree(self, task_id: str, list_id: str, updated_at: int) -> None:
+        with self._lock:
+            self.flush()
+            self._db.move_subtree(task_id, list_id, updated_at)
+
+    def delete_tasklist(self, id_: str) -> None:
+        with self._lock:
+            self.flush()
+            self._db.delete_tasklist(id_)
+
+    def get_tasks(self, id_: Optional[str] = None, list_id: Optional[str] = None, parent_task_id: Optional[str] = None,
+                  completed: Optional[bool] = None, archived: Optional[bool] = None,
+                  with_memo: bool = True) -> List[Task]:
+        with self._lock:
+            tasks = self._db.get_tasks(id_=id_, list_id=list_id, parent_task_id=parent_task_id,
+                                       completed=completed, archived=archived, with_memo=with_memo)
+            if not self._pending_tasks:
+                return tasks
+
+            def matches(task: Task) -> bool:
+                return all(value is None or getattr(task, name) == value for name, value in (
+                    ('id', id_), ('list_id', list_id), ('parent_task_id', parent_task_id),
+                    ('completed', completed), ('archived', archived)))
+
+            # Replace stored tasks with their held versions, which may have left or joined the result
+            tasks = [task for task in tasks if task.id not in self._pending_tasks]
+            for pending_task in self._pending_tasks.values():
+                if matches(pending_task):
+                    task = copy.copy(pending_task)
+                    if not with_memo:
+                        task.defer_memo(functools.partial(self.get_memo, task.id))
+                    tasks.append(task)
+            tasks.sort(key=lambda t: t.sort_key)
+            return tasks
+
+    def get_memo(self, id_: str) -> str:
+        with self._lock:
+            pending_task = self._pending_tasks.get(id_)
+            if pending_task is not None and pending_task.memo_is_loaded:
+                return pending_task.memo
+            return self._db.get_memo(id_)
+
+    def iter_tasks(self, batch_size: int = 1000) -> Iterator[Task]:
+        with self._lock:
+            self.flush()
+        return self._db.iter_tasks(batch_size=batch_size)
+
+    def get_subtree(self, task_id: str, with_memo: bool = True) -> List[Task]:
+        with self._lock:
+            self.flush()
+            return self._db.get_subtree(task_id, with_memo=with_memo)
+
+    def get_ancestors(self, task_id: str, with_memo: bool = True) -> List[Task]:
+        with self._lock:
+            self.flush()
+            return self._db.get_ancestors(task_id, with_memo=with_memo)
+
+    def is_ancestor(self, ancestor_id: str, task_id: str) -> bool:
+        with self._lock:
+            self.flush()
+            return self._db.is_ancestor(ancestor_id, task_id)
+
+    def get_first_task(self, parent_task_id: Optional[str] = None,
+                       sort_key_after: Optional[str] = None) -> Optional[Task]:
+        with self._lock:
+            self.flush()
+            return self._db.get_first_task(parent_task_id=parent_task_id, sort_key_after=sort_key_after)
+
+    def get_last_task(self, parent_task_id: Optional[str] = None,
+                      sort_key_before: Optional[str] = None) -> Optional[Task]:
+        with self._lock:
+            self.flush()
+            return self._db.get_last_task(parent_task_id=parent_task_id, sort_key_before=sort_key_before)
+
+    def search(self, query: str, list_id: Optional[str] = None, include_archived: bool = False,
+               limit: int = 50) -> List[TaskSearchResult]:
+        with self._lock:
+            self.flush()
+            return self._db.search(query, list_id=list_id, include_archived=include_archived, limit=limit)
+
+    def get_task_columns(self, use_numpy: Optional[bool] = None) -> TaskColumns:
+        with self._lock:
+            self.flush()
+            return self._db.get_task_columns(use_numpy=use_numpy)
+
+    def get_list_stats(self) -> Dict[str, TaskListStats]:
+        with self._lock:
+            self.flush()
+            return self._db.get_list_stats()
+
+    def get_completion_stats(self, width: int = 24 * 60 * 60, origin: int = 0, list_id: Optional[str] = None,
+                             since: Optional[int] = None, until: Optional[int] = None) -> Dict[int, int]:
+        with self._lock:
+            self.flush()
+            return self._db.get_completion_stats(width=width, origin=origin, list_id=list_id, since=since,
+                                                 until=until)
+
+    def get_age_stats(self, now: int, edges: Sequence[int], list_id: Optional[str] = None) -> Dict[int, int]:
+        with self._lock:
+            self.flush()
+            return self._db.get_age_stats(now, edges, list_id=list_id)
+
+    def get_tasklists(self, id_: Optional[str] = None) -> List[TaskList]:
+        return self._db.get_tasklists(id_=id_)
+
+    def changes_since(self, seq: int) -> Optional[List[TaskChange]]:
+        with self._lock:
+            self.flush()
+            return self._db.changes_since(seq)
+
+    def last_change_seq(self) -> int:
+        with self._lock:
+            self.flush()
+            return self._db.last_change_seq()
+
+    def compact_changes(self, before_seq: Optional[int] = None) -> None:
+        with self._lock:
+            self.flush()
+            self._db.compact_changes(before_seq)
+
+    def refresh(self) -> None:
+        self._db.refresh()
@@ -0,0 +1,177 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError
+from typing import *
+from unittest import TestCase
+
+from my_todo_app.engine.async_engine import AsyncTaskEngine
+from my_todo_app.engine.engine import TaskEngine
+from my_todo_app.engine.task import Task
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+
+class _ManualScheduler:
+    """A stand-in for tkinter's after that runs the scheduled callbacks when pumped."""
+
+    def __init__(self):
+        self._callbacks: List[Callable[[], None]] = []
+
+    def after(self, ms: int, callback: Callable[[], None]) -> None:
+        self._callbacks.append(callback)
+
+    def pump(self, async_engine: AsyncTaskEngine) -> None:
+        while self._callbacks:
+            callbacks, self._callbacks = self._callbacks, []
+            for callback in callbacks:
+                callback()
+            if async_engine.busy:
+                time.sleep(0.001)
+
+
+class TestAsyncTaskEngine(TestCase):
+
+    def _create_engine(self, db_path: str, child_count: int) -> TaskEngine:
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        engine = TaskEngine(db)
+        engine.add_tasklist('Inbox')
+        engine.add_task('Parent')
+        parent = engine.selected_task
+        db.upsert_tasks([Task(str(uuid.uuid4()), parent.list_id, parent.id, 'Child {}'.format(i), '', '',
+                              False, False, 0, 0, 0, i) for i in range(child_count)])
+        engine.select_tasklist(parent.list_id)
+        engine.select_task(parent.id)
+        return engine
+
+    def test_archive(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        engine = self._create_engine(db_path, 1200)
+        scheduler = _ManualScheduler()
+        busy_changes = []
+        async_engine = AsyncTaskEngine(engine, scheduler.after, on_busy_changed=busy_changes.append)
+
+        progresses = []
+        results = []
+        future = async_engine.archive_selected_task(on_done=results.append,
+                                                    on_progress=lambda done, total: progresses.append(done))
+        self.assertTrue(async_engine.busy)
+        scheduler.pump(async_engine)
+
+        self.assertTrue(future.done())
+        self.assertEqual([None], results)
+        self.assertEqual([0, 500, 1000, 1201], progresses)
+        self.assertEqual([True, False], busy_changes)
+        self.assertFalse(async_engine.busy)
+        self.assertEqual(0, len(engine.shown_tasks))
+
+        async_engine.close()
+        engine._db.close()
+        os.remove(db_path)
+
+    def test_cancel(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        engine = self._create_engine(db_path, 1200)
+        scheduler = _ManualScheduler()
+        async_engine = AsyncTaskEngine(engine, scheduler.after)
+
+        # Hold the operation after its first chunk has been written
+        first_chunk_written = threading.Event()
+        released = threading.Event()
+
+        def archive(progress):
+            def holding_progress(done, total):
+                if done > 0:
+                    first_chunk_written.set()
+                    released.wait()
+                progress(done, total)
+            engine.archive_selected_task(progress=holding_progress)
+
+        errors = []
+        future = async_engine.submit(archive, on_done=lambda _: self.fail(), on_error=errors.append)
+        queued_future = async_engine.remove_selected_task(on_done=lambda _: self.fail(), on_error=errors.append)
+        first_chunk_written.wait()
+        async_engine.cancel(future)
+        async_engine.cancel(queued_future)
+        released.set()
+        scheduler.pump(async_engine)
+
+        # The written chunk has been rolled back and the queued operation has not run
+        self.assertEqual(2, len(errors))
+        self.assertTrue(all(isinstance(e, CancelledError) for e in errors))
+        self.assertFalse(async_engine.busy)
+        self.assertFalse(engine.selected_task.archived)
+        self.assertEqual(0, len(engine._db.get_tasks(archived=True)))
+        self.assertEqual(1201, len(engine._db.get_tasks()))
+
+        async_engine.close()
+        engine._db.close()
+        os.remove(db_path)
+
+    def test_uncancellable(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        engine = self._create_engine(db_path, 10)
+        scheduler = _ManualScheduler()
+        async_engine = AsyncTaskEngine(engine, scheduler.after)
+
+        # Hold the worker thread so that the removal is still queued
+        held = threading.Event()
+        released = threading.Event()
+
+        def hold(progress):
+            held.set()
+            released.wait()
+
+        async_engine.submit(hold)
+        results = []
+        progresses = []
+        future = async_engine.remove_selected_task(on_done=results.append, on_error=lambda _: self.fail(),
+                                                   on_progress=lambda done, total: progresses.append(done))
+        held.wait()
+        self.assertTrue(async_engine.cancellable)
+        released.set()
+        while not future.running() and not future.done():
+            time.sleep(0.001)
+
+        # Once started, the removal runs to its end
+        async_engine.cancel()
+        self.assertFalse(async_engine.cancellable)
+        scheduler.pump(async_engine)
+        self.assertEqual([None], results)
+        self.assertEqual(0, len(engine._db.get_tasks()))
+        # The removal is one statement, so the window shows it as indeterminate rather than as counts
+        self.assertEqual([], progresses)
+
+        async_engine.close()
+        engine._db.close()
+        os.remove(db_path)
+
+    def test_error(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        engine = self._create_engine(db_path, 0)
+        scheduler = _ManualScheduler()
+        async_engine = AsyncTaskEngine(engine, scheduler.after)
+
+        errors = []
+        async_engine.unarchive_selected_task(on_error=errors.append)
+        scheduler.pump(async_engine)
+        self.assertEqual(1, len(errors))
+        self.assertIsInstance(errors[0], RuntimeError)
+
+        async_engine.close()
+        engine._db.close()
+        os.remove(db_path)
@@ -4,12 +4,17 @@
 import os
 import sys
 from datetime import datetime
-from unittest import TestCase
+from typing import *
+from unittest import TestCase, mock
 
 from freezegun import freeze_time
 
 from my_todo_app.engine.engine import TaskEngine, InsertTo
+from my_todo_app.engine.task import Task, TaskDatabase, TaskListStats
+from my_todo_app.engine.task_cache import CachingTaskDatabase
+from my_todo_app.engine.task_memory import InMemoryTaskDatabase
 from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+from my_todo_app.engine.task_write_behind import WriteBehindTaskDatabase
 
 
 class TestTaskEngine(TestCase):
@@ -481,3 +486,173 @@ class TestTaskEngine(TestCase):
 
         db._conn.close()
         os.remove(db_path)
+
+    def test_sort_keys(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        engine = TaskEngine(db)
+        engine.add_tasklist('Inbox')
+        engine.add_task(name='Task1')
+        task1_id = engine.selected_task.id
+        engine.add_task(name='Task2', to=InsertTo.LAST_SIBLING)
+
+        # Insertions at the same place, far more than float midpoints allow
+        for i in range(200):
+            engine.select_task(task1_id)
+            engine.add_task(name='Sub{}'.format(i), to=InsertTo.FIRST_CHILD)
+        self.assertEqual(['Task1'] + ['Sub{}'.format(i) for i in reversed(range(200))] + ['Task2'],
+                         [t.name for t in engine.shown_tasks])
+        self.assertLess(max(len(t.sort_key) for t in engine.shown_tasks), 50)
+
+        # Moving a task past a sibling gives new keys to the smaller subtree only
+        sort_keys = {t.id: t.sort_key for t in engine.shown_tasks}
+        engine.select_task(engine.shown_tasks[-1].id)
+        engine.up_selected_task()
+        self.assertEqual(['Task2', 'Task1', 'Sub199'], [t.name for t in engine.shown_tasks[:3]])
+        self.assertEqual(['Task2'], [t.name for t in engine.shown_tasks if t.sort_key != sort_keys[t.id]])
+        sort_keys = {t.id: t.sort_key for t in engine.shown_tasks}
+        engine.select_task(task1_id)
+        engine.up_selected_task()
+        self.assertEqual(['Task1', 'Sub199'], [t.name for t in engine.shown_tasks[:2]])
+        self.assertEqual('Task2', engine.shown_tasks[-1].name)
+        self.assertEqual(['Task2'], [t.name for t in engine.shown_tasks if t.sort_key != sort_keys[t.id]])
+
+        db._conn.close()
+        os.remove(db_path)
+
+    def test_memo_loading(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        engine = TaskEngine(db)
+        engine.add_tasklist('Inbox')
+        engine.add_task(name='Task1')
+        engine.edit_selected_task(memo='Memo1')
+        engine.add_task(name='Task2', to=InsertTo.LAST_SIBLING)
+        engine.edit_selected_task(memo='Memo2')
+
+        engine.select_tasklist(engine.shown_tasklists[0].id)
+
+        self.assertEqual(engine.shown_tasks[0], engine.selected_task)
+        self.assertTrue(engine.shown_tasks[0].memo_is_loaded)
+        self.assertFalse(engine.shown_tasks[1].memo_is_loaded)
+
+        engine.select_task(engine.shown_tasks[1].id)
+
+        self.assertTrue(engine.selected_task.memo_is_loaded)
+        self.assertEqual('Memo2', engine.selected_task.memo)
+
+        engine.up_selected_task()
+
+        self.assertEqual('Task2', engine.shown_tasks[0].name)
+        self.assertEqual('Memo1', engine._db.get_memo(engine.shown_tasks[1].id))
+        self.assertEqual('Memo2', engine.selected_task.memo)
+
+        db._conn.close()
+        os.remove(db_path)
+
+    def test_search(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        engine = TaskEngine(db)
+        engine.add_tasklist('Inbox')
+        engine.add_task(name='Task1')
+        engine.add_task(name='Task2', to=InsertTo.LAST_SIBLING)
+        engine.edit_selected_task(memo='Find me')
+        engine.add_tasklist('Next Action')
+        engine.add_task(name='Task3')
+
+        results = engine.search_tasks('find')
+
+        self.assertEqual(1, len(results))
+        self.assertEqual('Task2', results[0].task.name)
+
+        engine.select_searched_task(results[0].task)
+
+        self.assertEqual('Inbox', engine.selected_tasklist.name)
+        self.assertEqual(2, len(engine.shown_tasks))
+        self.assertEqual(engine.shown_tasks[1], engine.selected_task)
+        self.assertEqual('Find me', engine.selected_task.memo)
+
+        db._conn.close()
+        os.remove(db_path)
+
+    def test_stats(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        engine = TaskEngine(db)
+        engine.add_tasklist('Inbox')
+        day = 24 * 60 * 60
+        with freeze_time(datetime(2019, 9, 27, 12, 0, 0)):
+            engine.add_task(name='Task1')
+            engine.add_task(name='Task2', to=InsertTo.LAST_SIBLING)
+        inbox_id = engine.selected_tasklist.id
+        self.assertEqual({inbox_id: TaskListStats(2, 0, 0)}, engine.get_list_stats())
+
+        # Cached until the engine writes
+        engine._db.upsert_task(Task('other', 'someday', '', 'Other', '', '', False, False, 0, 0, 0, 'b00'))
+        self.assertEqual({inbox_id: TaskListStats(2, 0, 0)}, engine.get_list_stats())
+        with freeze_time(datetime(2019, 9, 29, 12, 0, 0)):
+            engine.edit_selected_task(completed=True)
+            self.assertEqual({inbox_id: TaskListStats(1, 1, 0), 'someday': TaskListStats(1, 0, 0)},
+                             engine.get_list_stats())
+            origin = int(datetime(2019, 9, 23).timestamp())
+            self.assertEqual({origin + 6 * day: 1}, engine.get_completion_stats(origin=origin))
+            self.assertEqual({origin: 1}, engine.get_completion_stats(width=7 * day, origin=origin, since=origin))
+            self.assertEqual({0: 0, day: 1, 7 * day: 0, 30 * day: 0, 365 * day: 1}, engine.get_age_stats())
+            self.assertEqual({0: 0, day: 1}, engine.get_age_stats(edges=[0, day], list_id=inbox_id))
+
+        db._conn.close()
+        os.remove(db_path)
+
+
+def _patch_task_engine(test_case: TestCase, create_db: Callable[[SQLite3TaskDatabase], TaskDatabase]) -> None:
+    """Make the tests build their engine over the database that create_db returns for the one they open."""
+    task_engine = TaskEngine
+    patcher = mock.patch(__name__ + '.TaskEngine', lambda db: task_engine(create_db(db)))
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+
+
+class TestTaskEngineOnInMemoryTaskDatabase(TestTaskEngine):
+
+    def setUp(self):
+        # The file the test opens stays empty
+        _patch_task_engine(self, lambda db: InMemoryTaskDatabase())
+
+
+class TestTaskEngineOnWriteBehindTaskDatabase(TestTaskEngine):
+
+    def setUp(self):
+        # A file of its own, since the test closes its file with upserts still held
+        def create_db(db: SQLite3TaskDatabase) -> TaskDatabase:
+            write_behind_path = db.path.replace('.sqlite3', '_write_behind.sqlite3')
+            if os.path.exists(write_behind_path):
+                os.remove(write_behind_path)
+            write_behind_db = WriteBehindTaskDatabase(SQLite3TaskDatabase(write_behind_path), delay=60)
+            self.addCleanup(os.remove, write_behind_path)
+            self.addCleanup(write_behind_db.close)
+            return write_behind_db
+
+        _patch_task_engine(self, create_db)
+
+
+class TestTaskEngineOnCachingTaskDatabase(TestTaskEngine):
+
+    def setUp(self):
+        _patch_task_engine(self, CachingTaskDatabase)
@@ -0,0 +1,64 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import random
+from unittest import TestCase
+
+from my_todo_app.engine.order_key import FIRST_KEY, is_valid_key, key_between, keys_between, key_from_number
+
+
+class TestOrderKey(TestCase):
+
+    def test_key_between(self):
+        self.assertEqual(FIRST_KEY, key_between(None, None))
+        self.assertEqual('a1', key_between('a0', None))
+        self.assertEqual('Zz', key_between(None, 'a0'))
+        self.assertEqual('a0V', key_between('a0', 'a1'))
+        self.assertEqual('b00', key_between('az', None))
+        self.assertRaises(ValueError, key_between, 'a1', 'a0')
+        self.assertRaises(ValueError, key_between, 'a0', 'a0')
+        self.assertRaises(ValueError, key_between, 'first', None)
+
+        # Insertions at random places keep the order, and those at one place grow keys slowly
+        rng = random.Random(0)
+        keys = [FIRST_KEY]
+        for _ in range(1000):
+            i = rng.randrange(len(keys) + 1)
+            keys.insert(i, key_between(keys[i - 1] if i > 0 else None, keys[i] if i < len(keys) else None))
+        self.assertEqual(sorted(keys), keys)
+        self.assertTrue(all(is_valid_key(key) for key in keys))
+        lower, upper = 'a0', 'a1'
+        for _ in range(1000):
+            upper = key_between(lower, upper)
+        self.assertLess(len(upper), 250)
+
+    def test_keys_between(self):
+        self.assertEqual([], keys_between(None, None, 0))
+        self.assertEqual(['a0', 'a1', 'a2'], keys_between(None, None, 3))
+        self.assertEqual(['Zx', 'Zy', 'Zz'], keys_between(None, 'a0', 3))
+        keys = keys_between('a0', 'a1', 100)
+        self.assertEqual(100, len(set(keys)))
+        self.assertEqual(sorted(keys), keys)
+        self.assertLess('a0', keys[0])
+        self.assertLess(keys[-1], 'a1')
+        self.assertLess(max(len(key) for key in keys), 6)
+
+    def test_key_from_number(self):
+        self.assertEqual('a0', key_from_number(0))
+        self.assertEqual('a1V', key_from_number(1.5))
+        self.assertEqual('Zy', key_from_number(-2))
+        numbers = [-1e30, -1e6, -2.5, -1, -1e-9, 0, 1e-9, 0.5, 1, 61, 62, 1e6, 2 ** 53 + 2, 1e30]
+        keys = [key_from_number(number) for number in numbers]
+        self.assertEqual(sorted(keys), keys)
+        self.assertEqual(len(numbers), len(set(keys)))
+        self.assertTrue(all(is_valid_key(key) for key in keys))
+        self.assertRaises(ValueError, key_from_number, float('nan'))
+
+    def test_is_valid_key(self):
+        self.assertTrue(is_valid_key('a0'))
+        self.assertTrue(is_valid_key('Zz1'))
+        self.assertFalse(is_valid_key(''))
+        self.assertFalse(is_valid_key('a'))
+        self.assertFalse(is_valid_key('a00'))
+        self.assertFalse(is_valid_key('first'))
+        self.assertFalse(is_valid_key(1.0))
@@ -3,12 +3,14 @@
 
 import copy
 import os
+import sqlite3
 import sys
+import threading
 import uuid
 from unittest import TestCase
 
-from my_todo_app.engine.task import TaskList, Task
-from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+from my_todo_app.engine.task import TaskList, Task, TaskDatabase, TaskListStats
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase, SQLite3Profile
 
 
 class TestTaskDatabase(TestCase):
@@ -25,8 +27,8 @@ class TestTaskDatabase(TestCase):
         self.assertEqual(0, len(db.get_tasks()))
 
         # Insert 2 task lists
-        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
-        next_action = TaskList(str(uuid.uuid4()), 'Next Action', 10)
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', '0')
+        next_action = TaskList(str(uuid.uuid4()), 'Next Action', '10')
         db.upsert_tasklist(inbox)
         db.upsert_tasklist(next_action)
         tasklists = db.get_tasklists()
@@ -42,7 +44,7 @@ class TestTaskDatabase(TestCase):
         # Reinsert the deleted task list and update it
         db.upsert_tasklist(next_action)
         next_action.name = 'Foo'
-        next_action.sort_key = -10
+        next_action.sort_key = '-10'
         db.upsert_tasklist(next_action)
         tasklists = db.get_tasklists()
         self.assertEqual(2, len(tasklists))
@@ -50,9 +52,9 @@ class TestTaskDatabase(TestCase):
         self.assertTrue(inbox.equals(tasklists[1]))
 
         # Insert 2 tasks and 1 sub task
-        task1 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 1', 'test', '', False, False, 10, 10, 0, 0)
-        task2 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 2', 'test', '', False, False, 10, 10, 0, 1)
-        task2_1 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-1', 'test', '', False, False, 10, 10, 0, 2)
+        task1 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 1', 'test', '', False, False, 10, 10, 0, '0')
+        task2 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 2', 'test', '', False, False, 10, 10, 0, '1')
+        task2_1 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-1', 'test', '', False, False, 10, 10, 0, '2')
         db.upsert_task(task1)
         db.upsert_task(task2)
         db.upsert_task(task2_1)
@@ -145,6 +147,31 @@ class TestTaskDatabase(TestCase):
         sort_key_changed.sort_key = 10
         self.assertFalse(task.equals(sort_key_changed))
 
+        # == is equals, the hash follows the id, and memos are compared only if both are loaded
+        self.assertEqual(task, not_changed)
+        self.assertNotEqual(task, name_changed)
+        self.assertEqual(2, len({task, not_changed, id_changed}))
+        loaded_ids = []
+        deferred = copy.deepcopy(task)
+        deferred.defer_memo(lambda: loaded_ids.append(deferred.id) or '')
+        self.assertNotEqual(deferred, name_changed)
+        self.assertEqual([], loaded_ids)
+        self.assertEqual(deferred, task)
+        self.assertEqual(deferred, memo_changed)
+        self.assertEqual([], loaded_ids)
+        self.assertEqual('', deferred.memo)
+        self.assertNotEqual(deferred, memo_changed)
+        self.assertEqual(TaskList('inbox', 'Inbox', 0), TaskList('inbox', 'Inbox', 0))
+        self.assertNotEqual(TaskList('inbox', 'Inbox', 0), TaskList('inbox', 'Inbox', 1))
+
+        # Tasks have no per-instance dict, and share list and parent ids
+        with self.assertRaises(AttributeError):
+            task.archived_at = 0
+        other = Task(str(uuid.uuid4()), ''.join(['in', 'box']), ''.join(['par', 'ent']), '', '', '', False, False,
+                     0, 0, 0, 0)
+        self.assertIs(other.list_id, Task('', 'inbox', '', '', '', '', False, False, 0, 0, 0, 0).list_id)
+        self.assertIs(other.parent_task_id, sys.intern('parent'))
+
     def test_get_first_last(self):
         class_name = self.__class__.__name__
         func_name = sys._getframe().f_code.co_name
@@ -155,14 +182,14 @@ class TestTaskDatabase(TestCase):
 
         inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
         db.upsert_tasklist(inbox)
-        task1 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 1', 'test', '', False, False, 10, 10, 0, 0)
-        task2 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 2', 'test', '', False, False, 10, 10, 0, 2)
-        task2_1 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-1', 'test', '', False, False, 10, 10, 0, 2.1)
-        task2_2 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-2', 'test', '', False, True, 10, 10, 0, 2.2)
-        task2_3 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-3', 'test', '', False, False, 10, 10, 0, 2.3)
-        task2_4 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-4', 'test', '', False, False, 10, 10, 0, 2.4)
-        task2_5 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-5', 'test', '', False, True, 10, 10, 0, 2.5)
-        task3 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 3', 'test', '', False, False, 10, 10, 0, 3)
+        task1 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 1', 'test', '', False, False, 10, 10, 0, '0')
+        task2 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 2', 'test', '', False, False, 10, 10, 0, '2')
+        task2_1 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-1', 'test', '', False, False, 10, 10, 0, '2.1')
+        task2_2 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-2', 'test', '', False, True, 10, 10, 0, '2.2')
+        task2_3 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-3', 'test', '', False, False, 10, 10, 0, '2.3')
+        task2_4 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-4', 'test', '', False, False, 10, 10, 0, '2.4')
+        task2_5 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-5', 'test', '', False, True, 10, 10, 0, '2.5')
+        task3 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 3', 'test', '', False, False, 10, 10, 0, '3')
         db.upsert_task(task1)
         db.upsert_task(task2)
         db.upsert_task(task2_1)
@@ -183,3 +210,690 @@ class TestTaskDatabase(TestCase):
 
         db.close()
         os.remove(db_path)
+
+    def test_migrate_legacy_file(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+        # Create a file in the layout written before schema versioning
+        conn = sqlite3.connect(db_path)
+        conn.execute('''
+            create table tasks (
+                id text primary key not null, list_id text, parent_task_id text, name text, tags text, memo text,
+                completed bool, archived bool, created_at integer, updated_at integer, completed_at integer,
+                sort_key float
+            )''')
+        conn.execute('create index task_completed_index on tasks(completed)')
+        conn.execute('create table tasklists (id text primary key not null, name text, sort_key float)')
+        conn.execute("insert into tasklists values ('inbox', 'Inbox', 0)")
+        conn.execute("insert into tasks values ('task1', 'inbox', '', 'Task 1', '', 'Memo', 0, 0, 10, 10, 0, 0)")
+        conn.execute("insert into tasks values ('task2', 'inbox', '', 'Task 2', '', ?, 0, 0, 10, 10, 0, 1)",
+                     ['Budget notes\n' * 100])
+        conn.commit()
+        conn.close()
+
+        db = SQLite3TaskDatabase(db_path)
+        index_names = [row[0] for row in db._conn.execute("select name from sqlite_master where type = 'index'")]
+        self.assertNotIn('task_completed_index', index_names)
+        self.assertIn('tasks_list_archived_sort_key_index', index_names)
+        self.assertEqual(1, len(db.get_tasklists()))
+        self.assertEqual('Memo', db.get_tasks(list_id='inbox')[0].memo)
+        self.assertEqual([], db.verify_tree())
+        self.assertIsInstance(db._conn.execute("select memo from tasks where id = 'task2'").fetchone()[0], bytes)
+        self.assertEqual('Budget notes\n' * 100, db.get_memo('task2'))
+        self.assertEqual(['task2'], [r.task.id for r in db.search('budget')])
+        self.assertEqual({'inbox': TaskListStats(2, 0, 0)}, db.get_list_stats())
+        self.assertEqual('a0', db.get_tasklists()[0].sort_key)
+        self.assertEqual(['a0', 'a1'], [t.sort_key for t in db.get_tasks(list_id='inbox')])
+
+        # Sort keys are text, and the indexes and triggers of the rebuilt tables are back
+        for table in ('tasks', 'tasklists'):
+            self.assertEqual('TEXT', dict(row[1:3] for row in db._conn.execute(
+                'pragma table_info({})'.format(table)))['sort_key'])
+        seq = db.last_change_seq()
+        db.upsert_task(Task('task3', 'inbox', '', 'Task 3', '', 'Receipts', False, False, 10, 10, 0, '1e5'))
+        self.assertEqual('1e5', db.get_tasks(id_='task3')[0].sort_key)
+        self.assertEqual(['task3'], [r.task.id for r in db.search('receipts')])
+        self.assertEqual(['task3'], [c.id for c in db.changes_since(seq)])
+        self.assertEqual({'inbox': TaskListStats(3, 0, 0)}, db.get_list_stats())
+        self.assertIn('tasks_sort_key_index', index_names)
+        latest_version = db.schema_version
+        db.close()
+
+        # Reopening does not rerun migrations
+        db = SQLite3TaskDatabase(db_path)
+        self.assertEqual(latest_version, db.schema_version)
+        db.close()
+        os.remove(db_path)
+
+    def test_queries_use_index(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+
+        # Every query shape issued by TaskEngine and TaskTreeTraversal
+        queries = [
+            db._get_tasks_sql(id_='task1'),
+            db._get_tasks_sql(list_id='inbox'),
+            db._get_tasks_sql(list_id='inbox', archived=False),
+            db._get_tasks_sql(parent_task_id='task1'),
+            db._get_first_task_sql(),
+            db._get_first_task_sql(parent_task_id=''),
+            db._get_first_task_sql(sort_key_after='1'),
+            db._get_first_task_sql(parent_task_id='', sort_key_after='1'),
+            db._get_last_task_sql(),
+            db._get_last_task_sql(parent_task_id=''),
+            db._get_last_task_sql(sort_key_before='1'),
+            db._get_last_task_sql(parent_task_id='', sort_key_before='1'),
+        ]
+        for select_sql, select_params in queries:
+            details = [row[3] for row in db._conn.execute('explain query plan ' + select_sql, select_params)]
+            self.assertTrue(any(detail.startswith('SEARCH tasks USING') for detail in details), details)
+            self.assertFalse(any(detail.startswith('SCAN') for detail in details), details)
+            self.assertFalse(any('TEMP B-TREE' in detail for detail in details), details)
+
+        db.close()
+        os.remove(db_path)
+
+    def test_transaction(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        another_conn = sqlite3.connect(db_path)
+
+        def count_committed_tasks() -> int:
+            return another_conn.execute('select count(*) from tasks').fetchone()[0]
+
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        db.upsert_tasklist(inbox)
+        tasks = [Task(str(uuid.uuid4()), inbox.id, '', 'Task {}'.format(i), '', '', False, False, 10, 10, 0, str(i))
+                 for i in range(10)]
+
+        # Writes are committed together when the outermost block exits
+        with db.transaction():
+            db.upsert_tasks(tasks[:5])
+            with db.transaction():
+                db.upsert_task(tasks[5])
+            self.assertTrue(db.in_transaction)
+            self.assertEqual(6, len(db.get_tasks(list_id=inbox.id)))
+            self.assertEqual(0, count_committed_tasks())
+        self.assertFalse(db.in_transaction)
+        self.assertEqual(6, count_committed_tasks())
+
+        # Writes are rolled back when the block raises
+        with self.assertRaises(RuntimeError):
+            with db.transaction():
+                db.upsert_tasks(tasks[6:])
+                db.delete_tasks([t.id for t in tasks[:3]])
+                raise RuntimeError()
+        self.assertFalse(db.in_transaction)
+        self.assertEqual(6, len(db.get_tasks(list_id=inbox.id)))
+
+        # Batched writes outside of a block commit by themselves
+        db.upsert_tasks(tasks[6:])
+        db.delete_tasks([t.id for t in tasks[:3]])
+        self.assertEqual(7, count_committed_tasks())
+        self.assertTrue(tasks[3].equals(db.get_tasks(list_id=inbox.id)[0]))
+
+        another_conn.close()
+        db.close()
+        os.remove(db_path)
+
+    def test_profiles(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        expected_synchronous = {SQLite3Profile.DURABLE: 2, SQLite3Profile.BALANCED: 1, SQLite3Profile.FAST: 0}
+        for profile in SQLite3Profile:
+            if os.path.exists(db_path):
+                os.remove(db_path)
+            db = SQLite3TaskDatabase(db_path, profile=profile)
+            self.assertEqual('wal', db._conn.execute('pragma journal_mode').fetchone()[0])
+            self.assertEqual(expected_synchronous[profile], db._conn.execute('pragma synchronous').fetchone()[0])
+            self.assertEqual(2 if profile != SQLite3Profile.DURABLE else 0,
+                             db._conn.execute('pragma temp_store').fetchone()[0])
+            db.close()
+        os.remove(db_path)
+
+    def test_read_from_another_thread(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        db.upsert_tasklist(inbox)
+        task1 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 1', '', '', False, False, 10, 10, 0, 0)
+        task2 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 2', '', '', False, False, 10, 10, 0, 1)
+        db.upsert_task(task1)
+
+        def count_tasks_in_worker() -> int:
+            counts = []
+            worker = threading.Thread(target=lambda: counts.append(len(db.get_tasks(list_id=inbox.id))))
+            worker.start()
+            worker.join(timeout=5)
+            self.assertFalse(worker.is_alive())
+            return counts[0]
+
+        # A worker thread reads the committed state without waiting for the open write transaction
+        with db.transaction():
+            db.upsert_task(task2)
+            self.assertEqual(2, len(db.get_tasks(list_id=inbox.id)))
+            self.assertEqual(1, count_tasks_in_worker())
+        self.assertEqual(2, count_tasks_in_worker())
+
+        # Writes from a worker thread are serialized with the home thread
+        task3 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 3', '', '', False, False, 10, 10, 0, 2)
+        worker = threading.Thread(target=lambda: db.upsert_task(task3))
+        worker.start()
+        worker.join(timeout=5)
+        self.assertEqual(3, len(db.get_tasks(list_id=inbox.id)))
+
+        db.close()
+        os.remove(db_path)
+
+    def test_memo_less_projection(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        db.upsert_tasklist(inbox)
+        task1 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 1', '', 'Memo 1', False, False, 10, 10, 0, 0)
+        task2 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 2', '', 'Memo 2', False, False, 10, 10, 0, 1)
+        db.upsert_tasks([task1, task2])
+
+        memo_less_tasks = db.get_tasks(list_id=inbox.id, with_memo=False)
+        self.assertFalse(memo_less_tasks[0].memo_is_loaded)
+        self.assertFalse(memo_less_tasks[1].memo_is_loaded)
+        self.assertEqual('Memo 1', db.get_memo(task1.id))
+
+        # Writing a task without loaded memo keeps the stored memo
+        memo_less_tasks[0].name = 'Foo'
+        db.upsert_task(memo_less_tasks[0])
+        memo_less_tasks[1].name = 'Bar'
+        db.upsert_tasks([memo_less_tasks[1]])
+        self.assertFalse(memo_less_tasks[0].memo_is_loaded)
+        tasks = db.get_tasks(list_id=inbox.id)
+        self.assertEqual('Foo', tasks[0].name)
+        self.assertEqual('Memo 1', tasks[0].memo)
+        self.assertEqual('Bar', tasks[1].name)
+        self.assertEqual('Memo 2', tasks[1].memo)
+
+        # The memo is loaded on first access
+        self.assertEqual('Memo 1', memo_less_tasks[0].memo)
+        self.assertTrue(memo_less_tasks[0].memo_is_loaded)
+        memo_less_tasks[1].memo = ''
+        db.upsert_task(memo_less_tasks[1])
+        self.assertEqual('', db.get_memo(task2.id))
+
+        db.close()
+        os.remove(db_path)
+
+    def test_subtree_and_ancestors(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+
+        # Sibling sort keys are not interleaved with descendants on purpose
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        db.upsert_tasklist(inbox)
+        root = Task('root', inbox.id, '', 'Root', '', 'Memo', False, False, 10, 10, 0, '0')
+        a = Task('a', inbox.id, root.id, 'A', '', '', False, False, 10, 10, 0, '5')
+        a1 = Task('a1', inbox.id, a.id, 'A1', '', '', False, False, 10, 10, 0, '2')
+        b = Task('b', inbox.id, root.id, 'B', '', '', False, False, 10, 10, 0, '1')
+        b1 = Task('b1', inbox.id, b.id, 'B1', '', '', False, False, 10, 10, 0, '9')
+        b2 = Task('b2', inbox.id, b.id, 'B2', '', '', False, False, 10, 10, 0, '3')
+        b2_1 = Task('b2_1', inbox.id, b2.id, 'B2-1', '', '', False, False, 10, 10, 0, '4')
+        other = Task('other', inbox.id, '', 'Other', '', '', False, False, 10, 10, 0, '6')
+        db.upsert_tasks([root, a, a1, b, b1, b2, b2_1, other])
+
+        subtree = db.get_subtree(root.id)
+        self.assertEqual(['root', 'b', 'b2', 'b2_1', 'b1', 'a', 'a1'], [t.id for t in subtree])
+        self.assertTrue(root.equals(subtree[0]))
+        self.assertEqual(['root', 'b', 'b2', 'b2_1', 'b1', 'a', 'a1'],
+                         [t.id for t in TaskDatabase.get_subtree(db, root.id)])
+        self.assertEqual(['b2', 'b2_1'], [t.id for t in db.get_subtree(b2.id, with_memo=False)])
+        self.assertEqual([], db.get_subtree('missing'))
+
+        ancestors = db.get_ancestors(b2_1.id, with_memo=False)
+        self.assertEqual(['b2', 'b', 'root'], [t.id for t in ancestors])
+        self.assertFalse(ancestors[2].memo_is_loaded)
+        self.assertEqual('Memo', ancestors[2].memo)
+        self.assertEqual(['b2', 'b', 'root'], [t.id for t in TaskDatabase.get_ancestors(db, b2_1.id)])
+        self.assertEqual([], db.get_ancestors(root.id))
+
+        db.close()
+        os.remove(db_path)
+
+    def test_tree_paths(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+
+        def get_row(id_):
+            return db._conn.execute('select path, depth, subtree_size from tasks where id = ?', [id_]).fetchone()
+
+        # Children stored before their parent are adopted when the parent arrives
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        db.upsert_tasklist(inbox)
+        a1 = Task('a1', inbox.id, 'a', 'A1', '', '', False, False, 10, 10, 0, 2)
+        a = Task('a', inbox.id, 'root', 'A', '', '', False, False, 10, 10, 0, 1)
+        root = Task('root', inbox.id, '', 'Root', '', '', False, False, 10, 10, 0, 0)
+        b = Task('b', inbox.id, 'root', 'B', '', '', False, False, 10, 10, 0, 3)
+        db.upsert_tasks([a1, a, root, b])
+        self.assertEqual(('root/', 0, 4), get_row('root'))
+        self.assertEqual(('root/a/a1/', 2, 1), get_row('a1'))
+        self.assertEqual([], db.verify_tree())
+        self.assertTrue(db.is_ancestor('root', 'a1'))
+        self.assertTrue(db.is_ancestor('a', 'a1'))
+        self.assertFalse(db.is_ancestor('b', 'a1'))
+        self.assertFalse(db.is_ancestor('a1', 'a1'))
+
+        # Reparenting moves the whole subtree
+        a.parent_task_id = 'b'
+        db.upsert_task(a)
+        self.assertEqual(('root/b/', 1, 3), get_row('b'))
+        self.assertEqual(('root/b/a/a1/', 3, 1), get_row('a1'))
+        self.assertEqual([], db.verify_tree())
+        b.parent_task_id = 'a1'
+        with self.assertRaises(RuntimeError):
+            db.upsert_task(b)
+        self.assertEqual([], db.verify_tree())
+
+        # Subtree moves and deletes
+        db.move_subtree('a', 'another', 20)
+        self.assertEqual(['a', 'a1'], [t.id for t in db.get_tasks(list_id='another')])
+        self.assertEqual(20, db.get_tasks(id_='a1')[0].updated_at)
+        db.delete_task('b')
+        self.assertEqual(('a/', 0, 2), get_row('a'))
+        self.assertEqual(('root/', 0, 1), get_row('root'))
+        self.assertEqual([], db.verify_tree())
+        db.delete_subtree('a')
+        self.assertEqual(['root'], [t.id for t in db.get_tasks()])
+
+        # The verifier reports drift and rebuilding repairs it
+        db._conn.execute("update tasks set subtree_size = 5 where id = 'root'")
+        db._conn.commit()
+        self.assertEqual(1, len(db.verify_tree()))
+        db.rebuild_tree()
+        self.assertEqual([], db.verify_tree())
+
+        select_sql = 'explain query plan select * from tasks where path >= ? and path < ?'
+        details = [row[3] for row in db._conn.execute(select_sql, ['root/', 'root0'])]
+        self.assertTrue(any('tasks_path_index' in d for d in details), details)
+
+        db.close()
+        os.remove(db_path)
+
+    def test_memo_compression(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+
+        def get_stored_memo(id_):
+            return db._conn.execute('select memo from tasks where id = ?', [id_]).fetchone()[0]
+
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        db.upsert_tasklist(inbox)
+        large_memo = 'Meeting notes about the quarterly budget review.\n' * 100
+        small = Task('small', inbox.id, '', 'Small', '', 'Short memo', False, False, 10, 10, 0, '0')
+        large = Task('large', inbox.id, '', 'Large', '', large_memo, False, False, 10, 10, 0, '1')
+        db.upsert_tasks([small, large])
+        self.assertEqual('Short memo', get_stored_memo('small'))
+        self.assertIsInstance(get_stored_memo('large'), bytes)
+        self.assertLess(len(get_stored_memo('large')), len(large_memo) / 10)
+        self.assertTrue(large.equals(db.get_tasks(id_='large')[0]))
+        self.assertEqual(large_memo, db.get_memo('large'))
+        self.assertEqual(large_memo, db.get_tasks(id_='large', with_memo=False)[0].memo)
+
+        # Plain rows written before compression coexist with compressed ones
+        db._conn.execute("update tasks set memo = ? where id = 'small'", [large_memo])
+        db._conn.commit()
+        self.assertEqual(large_memo, db.get_memo('small'))
+
+        # The full-text index sees the decompressed memo
+        results = db.search('budget')
+        self.assertEqual(['large', 'small'], sorted(r.task.id for r in results))
+        self.assertIn('[budget]', results[0].snippet)
+        large.memo = 'Nothing here'
+        db.upsert_task(large)
+        self.assertEqual('Nothing here', get_stored_memo('large'))
+        self.assertEqual(['small'], [r.task.id for r in db.search('budget')])
+        db.delete_task('small')
+        self.assertEqual([], db.search('budget'))
+
+        db.close()
+
+    def test_plain_sqlite3_client(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        db.upsert_tasklist(inbox)
+        large_memo = 'Meeting notes about the quarterly budget review.\n' * 100
+        db.upsert_task(Task('large', inbox.id, '', 'Large', '', large_memo, False, False, 10, 10, 0, '0'))
+        db.close()
+
+        # The stored triggers and views need no functions of the application
+        conn = sqlite3.connect(db_path)
+        conn.execute("""
+            insert into tasks (id, list_id, parent_task_id, name, tags, memo, completed, archived,
+                               created_at, updated_at, completed_at, sort_key)
+            values ('plain', ?, '', 'Plain', '', 'Written by hand', 0, 0, 20, 20, 0, '1')""", [inbox.id])
+        conn.execute("update tasks set name = 'Large budget' where id = 'large'")
+        conn.execute("update tasks set memo = 'Written by a plain client' where id = 'plain'")
+        self.assertEqual(1, conn.execute("select count(*) from tasks_fts where tasks_fts match 'client'").fetchone()[0])
+        conn.execute("delete from tasks where id = 'plain'")
+        for row in conn.execute("select type, sql from sqlite_master where sql is not null"):
+            self.assertNotIn('memo_text', row[1])
+        conn.commit()
+        conn.close()
+
+        # Compressed memos stay searchable, and snippets show them as plain text
+        db = SQLite3TaskDatabase(db_path)
+        results = db.search('quarterly')
+        self.assertEqual(['large'], [r.task.id for r in results])
+        self.assertIn('[quarterly]', results[0].snippet)
+        self.assertEqual([], db.search('plain'))
+        db.close()
+        os.remove(db_path)
+
+    def test_change_journal(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+
+        def get_changes(seq):
+            return [(c.table_name, c.id, c.operation) for c in db.changes_since(seq)]
+
+        self.assertEqual(0, db.last_change_seq())
+        inbox = TaskList('inbox', 'Inbox', 0)
+        db.upsert_tasklist(inbox)
+        inbox.name = 'Renamed'
+        db.upsert_tasklist(inbox)
+        root = Task('root', inbox.id, '', 'Root', '', '', False, False, 10, 10, 0, 0)
+        child = Task('child', inbox.id, root.id, 'Child', '', '', False, False, 10, 10, 0, 1)
+        db.upsert_tasks([child, root])
+        self.assertEqual([('tasklists', 'inbox', 'insert'), ('tasklists', 'inbox', 'update'),
+                          ('tasks', 'child', 'insert'), ('tasks', 'root', 'insert')], get_changes(0))
+
+        # Bookkeeping of the tree is not logged, subtree operations log every row
+        seq = db.last_change_seq()
+        db.move_subtree(root.id, 'another', 20)
+        db.delete_subtree(root.id)
+        self.assertEqual([('tasks', 'root', 'update'), ('tasks', 'child', 'update'),
+                          ('tasks', 'root', 'delete'), ('tasks', 'child', 'delete')],
+                         sorted(get_changes(seq), key=lambda c: (c[2] == 'delete', c[1] == 'child')))
+        self.assertEqual([], get_changes(db.last_change_seq()))
+
+        # Compaction keeps the last change of each row, readers behind a dropped change resync,
+        # then it drops everything up to the passed sequence number
+        db.compact_changes()
+        self.assertIsNone(db.changes_since(0))
+        self.assertIsNone(db.changes_since(seq + 1))
+        self.assertEqual([('tasks', 'root', 'delete'), ('tasks', 'child', 'delete')],
+                         sorted(get_changes(seq + 2), key=lambda c: c[1] == 'child'))
+        last_seq = db.last_change_seq()
+        db.compact_changes(before_seq=last_seq)
+        self.assertIsNone(db.changes_since(0))
+        self.assertEqual([], get_changes(last_seq))
+        self.assertEqual(last_seq, db.last_change_seq())
+        db.delete_tasklist(inbox.id)
+        self.assertEqual([('tasklists', 'inbox', 'delete')], get_changes(last_seq))
+        self.assertIsNone(TaskDatabase.changes_since(db, 0))
+
+        db.close()
+        os.remove(db_path)
+
+    def test_search(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        someday = TaskList(str(uuid.uuid4()), 'Someday', 1)
+        db.upsert_tasklist(inbox)
+        db.upsert_tasklist(someday)
+        task1 = Task('task1', inbox.id, '', 'Write report', 'work', 'Quarterly numbers', False, False, 10, 10, 0, 0)
+        task2 = Task('task2', inbox.id, '', 'Buy milk', 'home', 'Ask about the report', False, False, 10, 10, 0, 1)
+        task3 = Task('task3', someday.id, '', 'Read reports', '', '', False, True, 10, 10, 0, 2)
+        db.upsert_tasks([task1, task2, task3])
+
+        # Name matches rank above memo matches, words match by prefix
+        results = db.search('report')
+        self.assertEqual(['task1', 'task2'], [r.task.id for r in results])
+        self.assertIn('[report]', results[1].snippet)
+        self.assertFalse(results[0].task.memo_is_loaded)
+        self.assertEqual('Quarterly numbers', results[0].task.memo)
+        self.assertEqual(['task1', 'task2', 'task3'],
+                         sorted(r.task.id for r in db.search('rep', include_archived=True)))
+        self.assertEqual(['task3'], [r.task.id for r in db.search('report', list_id=someday.id,
+                                                                   include_archived=True)])
+        self.assertEqual(['task1'], [r.task.id for r in db.search('report work')])
+        self.assertEqual(['task1'], [r.task.id for r in db.search('report', limit=1)])
+        self.assertEqual([], db.search('   '))
+        self.assertEqual([], db.search('"milk AND -(NEAR'))
+
+        # The index follows updates and deletes
+        task1.name = 'Write summary'
+        db.upsert_task(task1)
+        memo_less_task2 = db.get_tasks(id_=task2.id, with_memo=False)[0]
+        memo_less_task2.tags = 'errand'
+        db.upsert_task(memo_less_task2)
+        self.assertEqual(['task2'], [r.task.id for r in db.search('report')])
+        self.assertEqual(['task2'], [r.task.id for r in db.search('errand')])
+        db.delete_task(task2.id)
+        self.assertEqual([], db.search('report'))
+        self.assertEqual(['task1'], [r.task.id for r in db.search('summary')])
+
+        # The scanning implementation of the base class finds the same tasks
+        self.assertEqual(['task1'], [r.task.id for r in TaskDatabase.search(db, 'summary')])
+        self.assertEqual(['task3'], [r.task.id for r in TaskDatabase.search(db, 'rep', include_archived=True)])
+
+        db.close()
+        os.remove(db_path)
+
+    def test_stats(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        archive_path = os.path.join(os.path.dirname(__file__), '{}_{}_archive.sqlite3'.format(class_name, func_name))
+        for path in (db_path, archive_path):
+            if os.path.exists(path):
+                os.remove(path)
+        hour, day = 60 * 60, 24 * 60 * 60
+        now = 40 * day + 5 * hour + 17
+
+        def check(db):
+            # Aggregates answer as the base class does by scanning tasks, for buckets of whole hours or not
+            self.assertEqual(TaskDatabase.get_list_stats(db), db.get_list_stats())
+            for kwargs in [{}, {'width': 7 * day, 'origin': 3 * day - 9 * hour}, {'origin': 30 * 60},
+                           {'list_id': 'work', 'since': 10 * day, 'until': 20 * day}, {'since': 10 * day + 1}]:
+                self.assertEqual(TaskDatabase.get_completion_stats(db, **kwargs), db.get_completion_stats(**kwargs))
+            for edges in [[0, day, 7 * day, 30 * day], [30 * 60, 5 * hour + 17]]:
+                for list_id in [None, 'work']:
+                    self.assertEqual(TaskDatabase.get_age_stats(db, now, edges, list_id=list_id),
+                                     db.get_age_stats(now, edges, list_id=list_id))
+
+        # Created one every 7 hours, every third completed 9 hours later, every fifth archived
+        tasks = [Task('task{}'.format(i), ['inbox', 'work'][i % 2], '', 'Task {}'.format(i), '', '', i % 3 == 0,
+                      i % 5 == 0, i * 7 * hour, i * 7 * hour, i * 7 * hour + 9 * hour if i % 3 == 0 else 0, i)
+                 for i in range(120)]
+        db = SQLite3TaskDatabase(db_path)
+        db.load_tasks(tasks[:60])
+        db.upsert_tasks(tasks[60:])
+        self.assertEqual({'inbox': TaskListStats(32, 16, 12), 'work': TaskListStats(32, 16, 12)},
+                         db.get_list_stats())
+        self.assertEqual({0: 1, day: 1, 2 * day: 1}, db.get_completion_stats(until=3 * day))
+        self.assertEqual({0: 9, 10 * day: 55}, db.get_age_stats(now, [0, 10 * day]))
+        check(db)
+
+        # Triggers follow updates, moves and deletes
+        tasks[1].completed, tasks[1].completed_at = True, 20 * hour
+        tasks[2].list_id = 'someday'
+        tasks[3].created_at = 39 * day
+        db.upsert_tasks(tasks[1:4])
+        db.delete_tasks([task.id for task in tasks[100:]])
+        self.assertEqual(TaskListStats(1, 0, 0), db.get_list_stats()['someday'])
+        check(db)
+        db.close()
+
+        # In the cold-storage mode, archived tasks are counted from the archive
+        db = SQLite3TaskDatabase(db_path, archive_path=archive_path)
+        self.assertEqual(20, db._conn.execute('select sum(count) from archive.task_stats_counts').fetchone()[0])
+        check(db)
+        tasks[10].archived = False
+        tasks[11].archived = True
+        db.upsert_tasks(tasks[10:12])
+        check(db)
+
+        db.close()
+        os.remove(db_path)
+        os.remove(archive_path)
+
+    def test_archive_cold_storage(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        archive_path = os.path.join(os.path.dirname(__file__), '{}_{}_archive.sqlite3'.format(class_name, func_name))
+        for path in (db_path, archive_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+        # Archived tasks stored before the cold-storage mode move to the archive on open
+        db = SQLite3TaskDatabase(db_path)
+        root = Task('root', 'inbox', '', 'Root', '', '', False, False, 10, 10, 0, '0')
+        a = Task('a', 'inbox', root.id, 'A', '', 'Old memo', False, True, 10, 10, 0, '1')
+        a1 = Task('a1', 'inbox', a.id, 'A1', '', '', False, True, 10, 10, 0, '2')
+        b = Task('b', 'inbox', root.id, 'B', '', '', False, False, 10, 10, 0, '3')
+        db.upsert_tasks([root, a, a1, b])
+        db.close()
+        db = SQLite3TaskDatabase(db_path, archive_path=archive_path)
+
+        def stored_ids(table):
+            return sorted(row[0] for row in db._conn.execute('select id from {}'.format(table)))
+
+        self.assertEqual(['b', 'root'], stored_ids('main.tasks'))
+        self.assertEqual(['a', 'a1'], stored_ids('archive.tasks'))
+        self.assertEqual([], db.verify_tree())
+        self.assertEqual(['root', 'a', 'a1', 'b'], [t.id for t in db.get_tasks()])
+        self.assertEqual(['root', 'b'], [t.id for t in db.get_tasks(list_id='inbox', archived=False)])
+        self.assertEqual(['a', 'a1'], [t.id for t in db.get_tasks(list_id='inbox', archived=True)])
+        self.assertTrue(a.equals(db.get_tasks(id_=a.id)[0]))
+        self.assertEqual('Old memo', db.get_tasks(id_=a.id, with_memo=False)[0].memo)
+        self.assertEqual(['a', 'b'], [t.id for t in db.get_tasks(parent_task_id=root.id)])
+        self.assertEqual('a', db.get_first_task(parent_task_id=root.id).id)
+        self.assertEqual('a1', db.get_first_task(sort_key_after='1').id)
+        self.assertEqual('a1', db.get_last_task(sort_key_before='3').id)
+        self.assertEqual(['root', 'a', 'a1', 'b'], [t.id for t in db.get_subtree(root.id)])
+        self.assertEqual(['a', 'root'], [t.id for t in db.get_ancestors(a1.id)])
+        self.assertTrue(db.is_ancestor(root.id, a1.id))
+
+        # Unarchiving moves tasks back parents first, archiving moves them out leaves first
+        seq = db.last_change_seq()
+        a.archived = False
+        a1.archived = False
+        a.name = 'A renamed'
+        db.upsert_tasks([a, a1])
+        self.assertEqual(['a', 'a1', 'b', 'root'], stored_ids('main.tasks'))
+        self.assertEqual([], stored_ids('archive.tasks'))
+        self.assertEqual([], db.verify_tree())
+        self.assertEqual(['a', 'root'], [t.id for t in db.get_ancestors(a1.id)])
+        self.assertEqual('Old memo', db.get_memo(a.id))
+        b.archived = True
+        b1 = Task('b1', 'inbox', b.id, 'B1', '', 'New memo', False, True, 10, 10, 0, '4')
+        db.upsert_tasks([b, b1])
+        self.assertEqual(['a', 'a1', 'root'], stored_ids('main.tasks'))
+        self.assertEqual(['b', 'b1'], stored_ids('archive.tasks'))
+        self.assertEqual([], db.verify_tree())
+        self.assertEqual(['root', 'a', 'a1', 'b', 'b1'], [t.id for t in db.iter_tasks()])
+        self.assertTrue({'a', 'a1', 'b', 'b1'} <= {c.id for c in db.changes_since(seq)})
+
+        # Archived tasks can be edited and searched in place, subtree operations reach them
+        b1.name = 'Archived report'
+        db.upsert_task(db.get_tasks(id_=b1.id, with_memo=False)[0])
+        db.upsert_task(b1)
+        self.assertEqual('Archived report', db.get_tasks(id_=b1.id)[0].name)
+        self.assertEqual('New memo', db.get_memo(b1.id))
+        self.assertEqual([], [r.task.id for r in db.search('report')])
+        self.assertEqual(['b1'], [r.task.id for r in db.search('report', include_archived=True)])
+        db.move_subtree(root.id, 'someday', 20)
+        self.assertEqual(['someday'] * 5, [t.list_id for t in db.get_tasks()])
+        db.delete_subtree(root.id)
+        self.assertEqual([], db.get_tasks())
+        self.assertEqual([], stored_ids('archive.tasks'))
+
+        db.close()
+        os.remove(db_path)
+        os.remove(archive_path)
+
+    def test_archive_cold_storage_turned_off(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        archive_path = os.path.join(os.path.dirname(__file__), '{}_{}_archive.sqlite3'.format(class_name, func_name))
+        for path in (db_path, archive_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+        db = SQLite3TaskDatabase(db_path, archive_path=archive_path)
+        root = Task('root', 'inbox', '', 'Root', '', '', False, False, 10, 10, 0, '0')
+        a = Task('a', 'inbox', root.id, 'A', '', 'Archived report', False, True, 10, 10, 0, '1')
+        a1 = Task('a1', 'inbox', a.id, 'A1', '', '', False, True, 10, 10, 0, '2')
+        b = Task('b', 'inbox', root.id, 'B', '', '', False, False, 10, 10, 0, '3')
+        db.upsert_tasks([root, a, a1, b])
+        seq = db.last_change_seq()
+        db.close()
+
+        # The archived tasks come back into the main database, and the archive file is no longer attached
+        db = SQLite3TaskDatabase(db_path, archive_path=archive_path, cold_storage=False)
+        self.assertIsNone(db.archive_path)
+        self.assertEqual(['main'], [row[1] for row in db._conn.execute('pragma database_list')])
+        self.assertEqual(['a', 'a1', 'b', 'root'], sorted(row[0] for row in db._conn.execute('select id from tasks')))
+        self.assertEqual([], db.verify_tree())
+        self.assertEqual(['root', 'a', 'a1', 'b'], [t.id for t in db.get_tasks()])
+        self.assertEqual(['a', 'a1'], [t.id for t in db.get_tasks(list_id='inbox', archived=True)])
+        self.assertTrue(a.equals(db.get_tasks(id_=a.id)[0]))
+        self.assertEqual(['a'], [r.task.id for r in db.search('report', include_archived=True)])
+        self.assertEqual({'a', 'a1'}, {c.id for c in db.changes_since(seq)})
+        db.close()
+
+        # Turning it on again moves them out again
+        db = SQLite3TaskDatabase(db_path, archive_path=archive_path)
+        self.assertEqual(['a', 'a1'], sorted(row[0] for row in db._conn.execute('select id from archive.tasks')))
+        self.assertEqual(['root', 'a', 'a1', 'b'], [t.id for t in db.get_tasks()])
+        db.close()
+        os.remove(db_path)
+        os.remove(archive_path)
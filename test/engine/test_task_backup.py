@@ -0,0 +1,150 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from typing import *
+from unittest import TestCase
+
+from my_todo_app.engine.task import Task, TaskList
+from my_todo_app.engine.task_backup import BackupScheduler, backup_database, list_backups
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+
+class TestTaskBackup(TestCase):
+
+    def _create_db(self, func_name: str) -> Tuple[SQLite3TaskDatabase, str]:
+        class_name = self.__class__.__name__
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        backup_dir = os.path.join(os.path.dirname(__file__), '{}_{}_backups'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        shutil.rmtree(backup_dir, ignore_errors=True)
+        db = SQLite3TaskDatabase(db_path)
+        db.upsert_tasklist(TaskList('inbox', 'Inbox', 0))
+        db.upsert_tasks([Task('task{}'.format(i), 'inbox', '', 'Task {}'.format(i), '', 'memo ' * 100,
+                              False, False, 0, 0, 0, i) for i in range(200)])
+        return db, backup_dir
+
+    def test_backup(self):
+        db, backup_dir = self._create_db(sys._getframe().f_code.co_name)
+        results = []
+        for i in range(3):
+            db.upsert_task(Task('extra{}'.format(i), 'inbox', '', 'Extra', '', '', False, False, 0, 0, 0, -i))
+            results.append(backup_database(db.path, backup_dir, generations=2, pages_per_step=2, step_delay_s=0))
+
+        # The newest generations are kept, each a complete copy at its time
+        self.assertEqual([r.path for r in results[1:]], list_backups(db.path, backup_dir))
+        self.assertFalse(os.path.exists(results[0].path))
+        self.assertEqual(os.path.getsize(results[2].path), results[2].size)
+        self.assertGreater(results[2].page_count, 2)
+        backup = SQLite3TaskDatabase(results[1].path)
+        self.assertEqual(202, len(backup.get_tasks()))
+        self.assertEqual('memo ' * 100, backup.get_tasks(id_='task5')[0].memo)
+        backup.close()
+
+        # A cancelled backup leaves nothing behind
+        cancel_event = threading.Event()
+        cancel_event.set()
+        with self.assertRaises(RuntimeError):
+            backup_database(db.path, backup_dir, pages_per_step=1, cancel_event=cancel_event)
+        self.assertEqual(sorted(os.path.basename(r.path) for r in results[1:]), sorted(os.listdir(backup_dir)))
+        db.close()
+        shutil.rmtree(backup_dir)
+        os.remove(db.path)
+
+    def test_backup_archive(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        archive_path = os.path.join(os.path.dirname(__file__), '{}_{}_archive.sqlite3'.format(class_name, func_name))
+        backup_dir = os.path.join(os.path.dirname(__file__), '{}_{}_backups'.format(class_name, func_name))
+        for path in (db_path, archive_path):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(backup_dir, ignore_errors=True)
+        db = SQLite3TaskDatabase(db_path, archive_path=archive_path)
+        db.upsert_tasklist(TaskList('inbox', 'Inbox', 'a0'))
+        tasks = []
+        for i in range(100):
+            tasks.append(Task('parent{}'.format(i), 'inbox', '', 'Parent', '', 'memo ' * 100, False, False, 0, 0, 0, i))
+            tasks.append(Task('child{}'.format(i), 'inbox', 'parent{}'.format(i), 'Child', '', 'memo ' * 100,
+                              False, i % 2 == 0, 0, 0, 0, i))
+        db.upsert_tasks(tasks)
+
+        # Tasks moved to the archive while the files are copied are in exactly one of them
+        writer = SQLite3TaskDatabase(db_path, archive_path=archive_path)
+        stop_event = threading.Event()
+
+        def archive_children() -> None:
+            for task in tasks[1::4]:
+                if stop_event.is_set():
+                    break
+                task.archived = True
+                writer.upsert_task(task)
+
+        thread = threading.Thread(target=archive_children)
+        thread.start()
+        results = [backup_database(db_path, backup_dir, generations=1, pages_per_step=1, step_delay_s=0.001,
+                                   archive_path=archive_path) for _ in range(2)]
+        stop_event.set()
+        thread.join()
+        writer.close()
+
+        result = results[-1]
+        self.assertEqual([result.path], list_backups(db_path, backup_dir))
+        self.assertEqual([result.archive_path], list_backups(archive_path, backup_dir))
+        self.assertEqual(os.path.getsize(result.path) + os.path.getsize(result.archive_path), result.size)
+        backup = SQLite3TaskDatabase(result.path, archive_path=result.archive_path)
+        self.assertEqual(200, len(backup.get_tasks()))
+        self.assertGreaterEqual(len(backup.get_tasks(archived=True)), 50)
+        self.assertEqual([], backup.verify_tree())
+        backup.close()
+        db.close()
+        shutil.rmtree(backup_dir)
+        for path in (db_path, archive_path):
+            os.remove(path)
+
+    def test_scheduler(self):
+        db, backup_dir = self._create_db(sys._getframe().f_code.co_name)
+        now = 1000.0
+        callbacks: List[Callable[[], None]] = []
+        results = []
+        scheduler = BackupScheduler(db.path, backup_dir, interval_s=100, idle_s=10, on_done=results.append,
+                                    clock=lambda: now)
+        scheduler.start(lambda ms, callback: callbacks.append(callback))
+
+        def pump() -> None:
+            callback = callbacks.pop()
+            callback()
+            while scheduler.running:
+                time.sleep(0.001)
+                callbacks.pop()()
+
+        # Not while the user is active, then once idle, then not again before the interval
+        now += 5
+        scheduler.notify_activity()
+        now += 5
+        pump()
+        self.assertEqual([], results)
+        now += 5
+        pump()
+        self.assertEqual(1, len(results))
+        now += 50
+        pump()
+        self.assertEqual(1, len(results))
+        now += 50
+        pump()
+        self.assertEqual(2, len(results))
+        self.assertEqual([r.path for r in results], list_backups(db.path, backup_dir))
+
+        scheduler.close()
+        callbacks.pop()()
+        self.assertEqual([], callbacks)
+        db.close()
+        shutil.rmtree(backup_dir)
+        os.remove(db.path)
@@ -0,0 +1,172 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import copy
+import os
+import sys
+import uuid
+from unittest import TestCase
+
+from my_todo_app.engine.engine import TaskEngine, InsertTo
+from my_todo_app.engine.task import TaskList, Task
+from my_todo_app.engine.task_cache import CachingTaskDatabase
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+
+class TestCachingTaskDatabase(TestCase):
+
+    def test_invalidation(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = CachingTaskDatabase(SQLite3TaskDatabase(db_path), maxsize=4)
+
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        someday = TaskList(str(uuid.uuid4()), 'Someday', 1)
+        db.upsert_tasklist(inbox)
+        db.upsert_tasklist(someday)
+        task1 = Task('task1', inbox.id, '', 'Task 1', '', 'Memo', False, False, 10, 10, 0, 0)
+        task2 = Task('task2', someday.id, '', 'Task 2', '', '', False, False, 10, 10, 0, 1)
+        db.upsert_tasks([task1, task2])
+
+        self.assertEqual(['task1'], [t.id for t in db.get_tasks(list_id=inbox.id)])
+        self.assertEqual(['task2'], [t.id for t in db.get_tasks(list_id=someday.id)])
+        self.assertEqual((0, 2), (db.hits, db.misses))
+
+        # Results are copied out
+        db.get_tasks(list_id=inbox.id)[0].name = 'Not written'
+        self.assertEqual('Task 1', db.get_tasks(list_id=inbox.id)[0].name)
+        self.assertEqual((2, 2), (db.hits, db.misses))
+
+        # A write drops the results that contain the task or that it may join, and keeps the others
+        task1.name = 'Renamed'
+        db.upsert_task(task1)
+        self.assertEqual('Renamed', db.get_tasks(list_id=inbox.id)[0].name)
+        self.assertEqual(['task2'], [t.id for t in db.get_tasks(list_id=someday.id)])
+        self.assertEqual((3, 3), (db.hits, db.misses))
+        task1.list_id = someday.id
+        db.upsert_task(task1)
+        self.assertEqual([], db.get_tasks(list_id=inbox.id))
+        self.assertEqual(['task1', 'task2'], [t.id for t in db.get_tasks(list_id=someday.id)])
+        self.assertEqual('task1', db.get_first_task().id)
+        db.delete_task(task1.id)
+        self.assertEqual(['task2'], [t.id for t in db.get_tasks(list_id=someday.id)])
+        self.assertEqual('task2', db.get_first_task().id)
+
+        # The least recently used results are evicted
+        for i in range(5):
+            db.get_tasks(list_id='list{}'.format(i))
+        self.assertEqual(4, db.evictions)
+
+        # Results read in a rolled back transaction are dropped
+        with self.assertRaises(RuntimeError):
+            with db.transaction():
+                db.upsert_task(task1)
+                self.assertEqual(['task1', 'task2'], [t.id for t in db.get_tasks(list_id=someday.id)])
+                raise RuntimeError()
+        self.assertEqual(['task2'], [t.id for t in db.get_tasks(list_id=someday.id)])
+
+        db.close()
+        os.remove(db_path)
+
+    def test_switch_tasklists_without_sql(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        sqlite3_db = SQLite3TaskDatabase(db_path)
+        db = CachingTaskDatabase(sqlite3_db)
+        engine = TaskEngine(db)
+        engine.add_tasklist('Inbox')
+        engine.add_task(name='Task1')
+        engine.edit_selected_task(memo='Memo1')
+        engine.add_tasklist('Next Action')
+        engine.add_task(name='Task2')
+        engine.add_task(name='Task3', to=InsertTo.LAST_SIBLING)
+        inbox_id, next_action_id = [t.id for t in engine.shown_tasklists]
+        engine.select_tasklist(inbox_id)
+        engine.select_tasklist(next_action_id)
+
+        statements = []
+        sqlite3_db._conn.set_trace_callback(statements.append)
+        for _ in range(3):
+            engine.select_tasklist(inbox_id)
+            self.assertEqual('Memo1', engine.selected_task.memo)
+            engine.select_tasklist(next_action_id)
+            self.assertEqual(2, len(engine.shown_tasks))
+        self.assertEqual([], statements)
+        sqlite3_db._conn.set_trace_callback(None)
+
+        db.close()
+        os.remove(db_path)
+
+    def test_refresh(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = CachingTaskDatabase(SQLite3TaskDatabase(db_path))
+        another_db = SQLite3TaskDatabase(db_path)
+
+        inbox = TaskList('inbox', 'Inbox', 0)
+        someday = TaskList('someday', 'Someday', 1)
+        db.upsert_tasklist(inbox)
+        db.upsert_tasklist(someday)
+        task1 = Task('task1', inbox.id, '', 'Task 1', '', '', False, False, 10, 10, 0, 0)
+        db.upsert_task(task1)
+        self.assertEqual(['task1'], [t.id for t in db.get_tasks(list_id=inbox.id)])
+        self.assertEqual([], db.get_tasks(list_id=someday.id))
+        self.assertEqual(2, len(db.get_tasklists()))
+
+        # Writes of another connection are applied as deltas
+        task1.list_id = someday.id
+        another_db.upsert_task(task1)
+        another_db.delete_tasklist(inbox.id)
+        self.assertEqual(['task1'], [t.id for t in db.get_tasks(list_id=inbox.id)])
+        db.refresh()
+        self.assertEqual([], db.get_tasks(list_id=inbox.id))
+        self.assertEqual(['task1'], [t.id for t in db.get_tasks(list_id=someday.id)])
+        self.assertEqual(['someday'], [t.id for t in db.get_tasklists()])
+
+        # Compacted changes make the cache start over
+        task1.name = 'Renamed'
+        another_db.upsert_task(task1)
+        another_db.compact_changes(before_seq=another_db.last_change_seq())
+        db.refresh()
+        self.assertEqual('Renamed', db.get_tasks(list_id=someday.id)[0].name)
+
+        another_db.close()
+        db.close()
+        os.remove(db_path)
+
+    def test_engine_refresh(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = CachingTaskDatabase(SQLite3TaskDatabase(db_path))
+        another_db = SQLite3TaskDatabase(db_path)
+        engine = TaskEngine(db)
+        engine.add_tasklist('Inbox')
+        engine.add_task(name='Task1')
+        engine.add_task(name='Task2', to=InsertTo.LAST_SIBLING)
+        engine.select_task(engine.shown_tasks[0].id)
+
+        # The engine sees the writes of another connection once refreshed, with the same task selected
+        task2 = copy.copy(engine.shown_tasks[1])
+        task2.name = 'Renamed'
+        another_db.upsert_task(task2)
+        another_db.upsert_task(Task('task3', task2.list_id, '', 'Task3', '', '', False, False, 0, 0, 0, 'b00'))
+        self.assertEqual(['Task1', 'Task2'], [t.name for t in engine.shown_tasks])
+        engine.refresh()
+        self.assertEqual(['Task1', 'Renamed', 'Task3'], [t.name for t in engine.shown_tasks])
+        self.assertEqual('Task1', engine.selected_task.name)
+
+        another_db.close()
+        db.close()
+        os.remove(db_path)
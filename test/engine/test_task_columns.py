@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+from unittest import TestCase
+
+from my_todo_app.engine import task_columns
+from my_todo_app.engine.order_key import keys_between
+from my_todo_app.engine.task import Task
+from my_todo_app.engine.task_memory import InMemoryTaskDatabase
+from my_todo_app.engine.task_snapshot import SnapshotTaskDatabase, write_snapshot
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+_DAY = 24 * 60 * 60
+
+
+def _tasks():
+    # Created one a day; every third is completed a week later, every fifth is archived; the latest comes first
+    sort_keys = keys_between(None, None, 30)
+    return [Task('task{}'.format(i), ['inbox', 'work'][i % 2], '', 'Task {}'.format(i), '', 'memo', i % 3 == 0,
+                 i % 5 == 0, i * _DAY, i * _DAY, (i + 7) * _DAY if i % 3 == 0 else 0, sort_keys[-1 - i])
+            for i in range(30)]
+
+
+class TestTaskColumns(TestCase):
+
+    def _check(self, columns):
+        self.assertEqual(30, len(columns))
+        self.assertEqual(['inbox', 'work'], sorted(columns.list_id_dictionary))
+
+        open_work = columns.filter(list_id='work', completed=False, archived=False)
+        self.assertEqual(['task1', 'task7', 'task11', 'task13', 'task17', 'task19', 'task23', 'task29'],
+                         sorted(open_work.ids, key=lambda id_: int(id_[4:])))
+        self.assertEqual(0, len(columns.filter(list_id='someday')))
+        self.assertEqual(['task3', 'task6'], sorted(columns.filter(completed_at=(10 * _DAY, 14 * _DAY)).ids))
+        with self.assertRaises(ValueError):
+            columns.filter(name=('a', 'b'))
+        self.assertEqual(['task28', 'task29'], sorted(columns.filter(sort_key=(None, 'a2')).ids))
+
+        # Completions per week per list, and counts by flags
+        completed = columns.filter(completed=True)
+        self.assertEqual({7 * _DAY: 3, 14 * _DAY: 2, 21 * _DAY: 2, 28 * _DAY: 3},
+                         completed.count_by('completed_at', width=7 * _DAY))
+        by_list_week = completed.count_by('list_id', 'completed_at', width=14 * _DAY)
+        self.assertEqual([('inbox', 0), ('inbox', 14 * _DAY), ('inbox', 28 * _DAY)], list(by_list_week)[:3])
+        self.assertEqual(10, sum(by_list_week.values()))
+        self.assertEqual({False: 24, True: 6}, columns.count_by('archived'))
+
+        # Oldest open tasks, and the latest sort keys
+        self.assertEqual(['task1', 'task2', 'task4'], list(columns.filter(completed=False).top_k('created_at', 3).ids))
+        self.assertEqual(['task0', 'task1'], list(columns.top_k('sort_key', 2, largest=True).ids))
+        self.assertEqual(30, len(columns.top_k('sort_key', 100)))
+        self.assertEqual(0, len(columns.top_k('sort_key', 0)))
+        self.assertEqual({}, columns.filter(list_id='someday').count_by('list_id'))
+        self.assertEqual(30, sum(columns.count_by('sort_key').values()))
+
+    def test_columns(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        db.upsert_tasks(_tasks())
+        memory_db = InMemoryTaskDatabase()
+        memory_db.upsert_tasks(_tasks())
+        snapshot_path = db_path + '.snapshot'
+        write_snapshot(db, snapshot_path)
+        snapshot_db = SnapshotTaskDatabase(snapshot_path)
+
+        for source in (db, memory_db, snapshot_db):
+            self._check(source.get_task_columns(use_numpy=False))
+            if task_columns.numpy is not None:
+                self._check(source.get_task_columns())
+            else:
+                with self.assertRaises(RuntimeError):
+                    source.get_task_columns(use_numpy=True)
+        snapshot_db.close()
+        os.remove(snapshot_path)
+        db.close()
+        os.remove(db_path)
@@ -0,0 +1,165 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+from unittest import TestCase
+
+from my_todo_app.engine.task import TaskList, Task
+from my_todo_app.engine.task_io import TaskFileFormat, export_tasks, import_tasks
+from my_todo_app.engine.task_memory import InMemoryTaskDatabase
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+
+class TestTaskIO(TestCase):
+
+    @staticmethod
+    def _create_source() -> InMemoryTaskDatabase:
+        db = InMemoryTaskDatabase()
+        db.upsert_tasklist(TaskList('inbox', 'Inbox', 'a0'))
+        db.upsert_tasklist(TaskList('next_action', 'Next, "Action"', 'a1V'))
+        db.upsert_tasks([
+            Task('task2_1', 'inbox', 'task2', 'Task 2-1', 'a b', 'Line 1\nLine 2, "quoted"', True, False,
+                 10, 20, 30, 'a0F'),
+            Task('task1', 'inbox', '', 'Task 1', '', '', False, False, 10, 10, 0, 'a1'),
+            Task('task2', 'inbox', '', 'Task 2', '', 'ユニコード', False, True, 10, 10, 0, 'Zy'),
+            Task('task2_1_1', 'inbox', 'task2_1', 'Task 2-1-1', '', '', False, False, 10, 10, 0, 'a3'),
+            Task('task3', 'next_action', '', 'Task 3', '', '', False, False, 10, 10, 0, 'a0001'),
+        ])
+        return db
+
+    def test_round_trip(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        source = self._create_source()
+
+        for format_ in TaskFileFormat:
+            for processes in (1, 2):
+                if os.path.exists(db_path):
+                    os.remove(db_path)
+                file = io.StringIO(newline='' if format_ == TaskFileFormat.CSV else None)
+                self.assertEqual((2, 5), export_tasks(source, file, format_))
+                file.seek(0)
+                db = SQLite3TaskDatabase(db_path)
+                self.assertEqual((2, 5), import_tasks(db, file, format_, chunk_size=2, processes=processes))
+
+                # Ids, parent links and sort keys are kept, and the task tree is consistent
+                for expected, actual in zip(source.get_tasklists(), db.get_tasklists()):
+                    self.assertTrue(expected.equals(actual))
+                for expected, actual in zip(source.get_tasks(), db.get_tasks()):
+                    self.assertTrue(expected.equals(actual), actual.id)
+                self.assertEqual(5, len(db.get_tasks()))
+                self.assertEqual(['task2', 'task2_1', 'task2_1_1'], [t.id for t in db.get_subtree('task2')])
+                self.assertEqual([], db.verify_tree())
+
+                # Exported again from SQLite, parents come before their children
+                file = io.StringIO(newline='' if format_ == TaskFileFormat.CSV else None)
+                export_tasks(db, file, format_, batch_size=2)
+                if format_ == TaskFileFormat.JSON_LINES:
+                    ids = [line.split('"id": "')[1].split('"')[0] for line in file.getvalue().splitlines()[2:]]
+                    self.assertLess(ids.index('task2'), ids.index('task2_1'))
+                    self.assertLess(ids.index('task2_1'), ids.index('task2_1_1'))
+                db.close()
+        os.remove(db_path)
+
+    def test_invalid_records(self):
+        db = InMemoryTaskDatabase()
+        cases = [
+            '{"type": "task", "list_id": "inbox", "name": "No id", "sort_key": 0}',
+            '{"type": "task", "id": "task1", "list_id": "inbox", "name": "Task 1", "sort_key": "first"}',
+            '{"type": "task", "id": "task1", "list_id": "inbox", "name": "Task 1", "sort_key": 0, "completed": 2}',
+            '{"type": "note", "id": "note1"}',
+            '["task"]',
+            '{"type": "task",',
+        ]
+        for line in cases:
+            file = io.StringIO('{"type": "tasklist", "id": "inbox", "name": "Inbox", "sort_key": 0}\n\n' + line)
+            with self.assertRaisesRegex(RuntimeError, '^Record 3: '):
+                import_tasks(db, file, processes=1)
+
+        file = io.StringIO('type,id,list_id,name,sort_key,completed\r\ntask,task1,inbox,Task 1,0,yes\r\n',
+                           newline='')
+        with self.assertRaisesRegex(RuntimeError, '^Record 1: completed'):
+            import_tasks(db, file, TaskFileFormat.CSV, processes=1)
+        file = io.StringIO('type,id,owner\r\n', newline='')
+        with self.assertRaisesRegex(RuntimeError, 'owner'):
+            import_tasks(db, file, TaskFileFormat.CSV, processes=1)
+
+        # Optional fields may be left out, and numeric sort keys of older files are read as order keys
+        file = io.StringIO('type,id,list_id,name,sort_key\r\ntask,task1,inbox,Task 1,0\r\n', newline='')
+        self.assertEqual((0, 1), import_tasks(db, file, TaskFileFormat.CSV, processes=1))
+        self.assertTrue(Task('task1', 'inbox', '', 'Task 1', '', '', False, False, 0, 0, 0, 'a0')
+                        .equals(db.get_tasks(id_='task1')[0]))
+        file = io.StringIO('{"type": "task", "id": "task2", "list_id": "inbox", "name": "Task 2", "sort_key": -0.5}')
+        import_tasks(db, file, processes=1)
+        self.assertEqual(['task2', 'task1'], [t.id for t in db.get_tasks(list_id='inbox')])
+
+    def test_invalid_record_after_chunks(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+
+        # Record 32 is invalid; the three chunks of ten tasks before it are committed, the one it is in is not
+        lines = ['{"type": "tasklist", "id": "inbox", "name": "Inbox", "sort_key": 0}']
+        lines += ['{{"type": "task", "id": "task{}", "list_id": "inbox", "name": "Task {}", "sort_key": {}}}'
+                  .format(i, i, i) for i in range(2, 32)]
+        lines += ['{"type": "task", "id": "task32"}']
+        lines += ['{"type": "task", "id": "task33", "list_id": "inbox", "name": "Task 33", "sort_key": 33}']
+        for processes in (1, 2):
+            with self.assertRaisesRegex(RuntimeError, '^Record 32: '):
+                import_tasks(db, io.StringIO('\n'.join(lines)), chunk_size=10, processes=processes)
+            self.assertEqual(['task{}'.format(i) for i in range(2, 32)], [t.id for t in db.get_tasks()])
+            self.assertEqual([], db.verify_tree())
+            self.assertEqual(['task17'], [r.task.id for r in db.search('17')])
+        db.close()
+        os.remove(db_path)
+
+    def test_load_order(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+
+        def schema_names():
+            return sorted(db._conn.execute("select name from sqlite_master where type in ('index', 'trigger')"))
+
+        names = schema_names()
+
+        # Into an empty table, a failed load keeps the chunks before the invalid record and the indexes in place
+        file = io.StringIO('{"type": "task", "id": "task1", "list_id": "inbox", "name": "Task 1", "sort_key": 0}\n'
+                           '{"type": "task", "id": "task2"}\n')
+        with self.assertRaises(RuntimeError):
+            import_tasks(db, file, chunk_size=1, processes=1)
+        self.assertEqual(['task1'], [t.id for t in db.get_tasks()])
+        self.assertEqual(names, schema_names())
+
+        # Children before their parent, across chunks and within one
+        records = [('task1_1_1', 'task1_1'), ('task1_1', 'task1'), ('task1', ''), ('task1_2', 'task1'),
+                   ('task2_1', 'task2'), ('task2', '')]
+        file = io.StringIO(''.join(
+            '{{"type": "task", "id": "{}", "list_id": "inbox", "parent_task_id": "{}", "name": "Task {}", '
+            '"sort_key": {}}}\n'.format(id_, parent_id, id_, i) for i, (id_, parent_id) in enumerate(records)))
+        self.assertEqual((0, 6), import_tasks(db, file, chunk_size=4, processes=1))
+        self.assertEqual([], db.verify_tree())
+        self.assertEqual(['task1', 'task1_1', 'task1_1_1', 'task1_2'], [t.id for t in db.get_subtree('task1')])
+        self.assertEqual(names, schema_names())
+        self.assertEqual(['task2_1'], [r.task.id for r in db.search('task2_1')])
+
+        # Into a table with tasks, stored tasks may be moved and new ones placed under them
+        file = io.StringIO('{"type": "task", "id": "task2", "list_id": "inbox", "parent_task_id": "task1_2", '
+                           '"name": "Task 2", "sort_key": 10}\n'
+                           '{"type": "task", "id": "task2_2", "list_id": "inbox", "parent_task_id": "task2", '
+                           '"name": "Imported", "sort_key": 11}\n')
+        self.assertEqual((0, 2), import_tasks(db, file, processes=1))
+        self.assertEqual([], db.verify_tree())
+        self.assertEqual(['task1_2', 'task2', 'task2_1', 'task2_2'], [t.id for t in db.get_subtree('task1_2')])
+        self.assertEqual(['task2_2'], [r.task.id for r in db.search('Imported')])
+        db.close()
+        os.remove(db_path)
@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import sys
+import time
+from typing import *
+from unittest import TestCase
+
+from my_todo_app.engine.task import Task
+from my_todo_app.engine.task_maintenance import MaintenanceScheduler, run_maintenance
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+from my_todo_app.engine.task_write_behind import WriteBehindTaskDatabase
+
+
+class TestTaskMaintenance(TestCase):
+
+    def test_run_maintenance(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        self.assertEqual(2, db._conn.execute('pragma auto_vacuum').fetchone()[0])
+
+        # Old archived trees, one of them with an active child, and a recent one
+        day = 24 * 60 * 60
+        now = 1000 * day
+        tasks = []
+        for i in range(50):
+            parent_id = 'old{}'.format(i)
+            tasks.append(Task(parent_id, 'inbox', '', 'Old', '', 'x' * 2000, False, True, 0, 0, 0, i))
+            tasks.append(Task(parent_id + '_1', 'inbox', parent_id, 'Old child', '', 'y' * 2000, True, True,
+                              0, 0, 10 * day, i))
+        tasks.append(Task('kept', 'inbox', '', 'Kept', '', '', False, True, 0, 0, 0, 100))
+        tasks.append(Task('kept_1', 'inbox', 'kept', 'Active', '', '', False, False, 0, 0, 0, 101))
+        tasks.append(Task('recent', 'inbox', '', 'Recent', '', '', False, True, 0, now - day, 0, 102))
+        db.upsert_tasks(tasks)
+        page_count, _, _ = db.get_page_counts()
+
+        result = run_maintenance(db, purge_archived_after_days=30, now=now)
+        self.assertEqual(100, result.purged_task_count)
+        self.assertEqual(['kept', 'kept_1', 'recent'], [t.id for t in db.get_tasks()])
+        self.assertEqual([], db.verify_tree())
+        self.assertGreater(result.reclaimed_page_count, 0)
+        new_page_count, freelist_count, _ = db.get_page_counts()
+        self.assertEqual(0, freelist_count)
+        self.assertLess(new_page_count, page_count)
+        self.assertTrue(result.analyzed)
+        self.assertIn('reclaimed {} pages'.format(result.reclaimed_page_count), str(result))
+
+        # Statistics exist now, later runs refresh them only if needed; the vacuum budget is kept
+        db.delete_tasks(['kept_1', 'kept'])
+        db.upsert_tasks(Task('big{}'.format(i), 'inbox', '', 'Big', '', 'z' * 4000, False, False, 0, 0, 0, i)
+                        for i in range(20))
+        db.delete_tasks(['big{}'.format(i) for i in range(20)])
+        result = run_maintenance(db, vacuum_pages=3)
+        self.assertEqual((0, 3, False), (result.purged_task_count, result.reclaimed_page_count, result.analyzed))
+        db.close()
+        os.remove(db_path)
+
+    def test_enable_incremental_vacuum(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        # A file created before incremental auto_vacuum was the default
+        conn = sqlite3.connect(db_path)
+        conn.execute('create table legacy (x)')
+        conn.close()
+        db = SQLite3TaskDatabase(db_path)
+        db.upsert_tasks([Task('task{}'.format(i), 'inbox', '', 'Task {}'.format(i), '', 'memo', False, False,
+                              0, 0, 0, i) for i in range(10)])
+        db.delete_tasks(['task{}'.format(i) for i in range(0, 10, 2)])
+        self.assertEqual(0, db.incremental_vacuum(100))
+
+        self.assertTrue(db.enable_incremental_vacuum())
+        self.assertFalse(db.enable_incremental_vacuum())
+        self.assertEqual(2, db._conn.execute('pragma auto_vacuum').fetchone()[0])
+        # The full-text index follows rowids renumbered by VACUUM
+        self.assertEqual(['task3'], [r.task.id for r in db.search('Task 3')])
+        self.assertEqual(['task1', 'task3', 'task5', 'task7', 'task9'], [t.id for t in db.get_tasks()])
+        db.close()
+        os.remove(db_path)
+
+    def test_scheduler(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        write_behind_db = WriteBehindTaskDatabase(db, delay=60)
+        now = 1000.0
+        callbacks: List[Callable[[], None]] = []
+        results = []
+        scheduler = MaintenanceScheduler(db, interval_s=100, idle_s=10, purge_archived_after_days=30,
+                                         flush=write_behind_db.flush, on_done=results.append, clock=lambda: now)
+        scheduler.start(lambda ms, callback: callbacks.append(callback))
+
+        # An old task archived a moment ago, held back in front of the database, is purged too
+        db.upsert_task(Task('old', 'inbox', '', 'Old', '', '', False, False, 0, 0, 0, 'a0'))
+        write_behind_db.upsert_task(Task('old', 'inbox', '', 'Old', '', '', False, True, 0, 0, 0, 'a0'))
+        self.assertEqual(1, write_behind_db.pending_count)
+        now += 10
+        callbacks.pop()()
+        while scheduler.running:
+            time.sleep(0.001)
+            callbacks.pop()()
+        self.assertEqual(1, results[0].purged_task_count)
+        self.assertEqual(0, write_behind_db.pending_count)
+        self.assertEqual([], write_behind_db.get_tasks())
+
+        scheduler.close()
+        callbacks.pop()()
+        write_behind_db.close()
+        os.remove(db_path)
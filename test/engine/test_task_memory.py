@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import uuid
+from unittest import TestCase
+
+from my_todo_app.engine.task import TaskList, Task
+from my_todo_app.engine.task_memory import InMemoryTaskDatabase
+
+
+class TestInMemoryTaskDatabase(TestCase):
+
+    def test_crud(self):
+        db = InMemoryTaskDatabase()
+
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        next_action = TaskList(str(uuid.uuid4()), 'Next Action', 10)
+        db.upsert_tasklist(inbox)
+        db.upsert_tasklist(next_action)
+        next_action.sort_key = -10
+        db.upsert_tasklist(next_action)
+        tasklists = db.get_tasklists()
+        self.assertEqual(2, len(tasklists))
+        self.assertTrue(next_action.equals(tasklists[0]))
+        self.assertTrue(inbox.equals(db.get_tasklists(id_=inbox.id)[0]))
+
+        task1 = Task('task1', inbox.id, '', 'Task 1', 'test', 'Memo 1', False, False, 10, 10, 0, 0)
+        task2 = Task('task2', inbox.id, '', 'Task 2', 'test', '', False, True, 10, 10, 0, 1)
+        task2_1 = Task('task2_1', inbox.id, task2.id, 'Task 2-1', 'test', '', True, False, 10, 10, 0, 2)
+        db.upsert_tasks([task2_1, task1, task2])
+        self.assertEqual(['task1', 'task2', 'task2_1'], [t.id for t in db.get_tasks(list_id=inbox.id)])
+        self.assertEqual(['task1', 'task2_1'], [t.id for t in db.get_tasks(list_id=inbox.id, archived=False)])
+        self.assertEqual(['task2_1'], [t.id for t in db.get_tasks(parent_task_id=task2.id, completed=True)])
+        self.assertTrue(task1.equals(db.get_tasks(id_=task1.id)[0]))
+
+        # Reads return copies, memos may be loaded on demand
+        db.get_tasks(id_=task1.id)[0].name = 'Changed'
+        self.assertEqual('Task 1', db.get_tasks(id_=task1.id)[0].name)
+        memo_less_task1 = db.get_tasks(id_=task1.id, with_memo=False)[0]
+        self.assertFalse(memo_less_task1.memo_is_loaded)
+        memo_less_task1.list_id = next_action.id
+        db.upsert_task(memo_less_task1)
+        self.assertEqual('Memo 1', db.get_memo(task1.id))
+        self.assertEqual(['task1'], [t.id for t in db.get_tasks(list_id=next_action.id)])
+
+        db.delete_task(task2_1.id)
+        self.assertEqual(['task2'], [t.id for t in db.get_tasks(list_id=inbox.id)])
+        db.delete_tasklist(inbox.id)
+        self.assertEqual(1, len(db.get_tasklists()))
+
+    def test_get_first_last(self):
+        db = InMemoryTaskDatabase()
+
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        db.upsert_tasklist(inbox)
+        task1 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 1', 'test', '', False, False, 10, 10, 0, 0)
+        task2 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 2', 'test', '', False, False, 10, 10, 0, 2)
+        task2_1 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-1', 'test', '', False, False, 10, 10, 0, 2.1)
+        task2_2 = Task(str(uuid.uuid4()), inbox.id, task2.id, 'Task 2-2', 'test', '', False, True, 10, 10, 0, 2.2)
+        task3 = Task(str(uuid.uuid4()), inbox.id, '', 'Task 3', 'test', '', False, False, 10, 10, 0, 3)
+        db.upsert_tasks([task3, task2_2, task1, task2_1, task2])
+
+        self.assertTrue(task1.equals(db.get_first_task()))
+        self.assertTrue(task3.equals(db.get_last_task()))
+        self.assertTrue(task2_1.equals(db.get_first_task(parent_task_id=task2.id)))
+        self.assertTrue(task2_2.equals(db.get_last_task(parent_task_id=task2.id)))
+        self.assertTrue(task2_1.equals(db.get_last_task(sort_key_before=task2_2.sort_key)))
+        self.assertTrue(task2_2.equals(db.get_first_task(sort_key_after=task2_1.sort_key)))
+        self.assertTrue(task1.equals(db.get_last_task(parent_task_id='', sort_key_before=task2.sort_key)))
+        self.assertTrue(task3.equals(db.get_first_task(parent_task_id='', sort_key_after=task2.sort_key)))
+        self.assertIsNone(db.get_first_task(sort_key_after=task3.sort_key))
+        self.assertIsNone(db.get_last_task(parent_task_id='missing'))
+
+        # Moving a task keeps the indexes sorted
+        task1.sort_key = 2.15
+        task1.parent_task_id = task2.id
+        db.upsert_task(task1)
+        self.assertTrue(task2.equals(db.get_first_task()))
+        self.assertEqual([task2_1.id, task1.id, task2_2.id], [t.id for t in db.get_tasks(parent_task_id=task2.id)])
+
+    def test_transaction(self):
+        db = InMemoryTaskDatabase()
+
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        db.upsert_tasklist(inbox)
+        tasks = [Task(str(uuid.uuid4()), inbox.id, '', 'Task {}'.format(i), '', '', False, False, 10, 10, 0, i)
+                 for i in range(10)]
+        db.upsert_tasks(tasks[:5])
+
+        # Writes are rolled back when the block raises
+        with self.assertRaises(RuntimeError):
+            with db.transaction():
+                db.upsert_tasks(tasks[5:])
+                tasks[0].name = 'Renamed'
+                db.upsert_task(tasks[0])
+                db.delete_tasks([t.id for t in tasks[1:3]])
+                db.delete_tasklist(inbox.id)
+                raise RuntimeError()
+        self.assertFalse(db.in_transaction)
+        self.assertEqual(['Task 0', 'Task 1', 'Task 2', 'Task 3', 'Task 4'],
+                         [t.name for t in db.get_tasks(list_id=inbox.id)])
+        self.assertTrue(inbox.equals(db.get_tasklists()[0]))
+        self.assertEqual(tasks[4].id, db.get_last_task().id)
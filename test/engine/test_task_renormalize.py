@@ -0,0 +1,172 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import threading
+import time
+from typing import *
+from unittest import TestCase
+
+from my_todo_app.engine import task_columns
+from my_todo_app.engine.engine import TaskEngine, InsertTo
+from my_todo_app.engine.order_key import key_between
+from my_todo_app.engine.task import Task, TaskList
+from my_todo_app.engine.task_columns import TaskColumns
+from my_todo_app.engine.task_renormalize import SortKeyCheckScheduler, _SortedKeys, check_sort_keys, \
+    renormalize_sort_keys
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+
+class TestTaskRenormalize(TestCase):
+
+    def test_renormalize_sort_keys(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        archive_path = os.path.join(os.path.dirname(__file__), '{}_{}_archive.sqlite3'.format(class_name, func_name))
+        for path in (db_path, archive_path):
+            if os.path.exists(path):
+                os.remove(path)
+        db = SQLite3TaskDatabase(db_path, archive_path=archive_path)
+        db.upsert_tasklist(TaskList('inbox', 'Inbox', 'a0'))
+        db.upsert_tasklist(TaskList('work', 'Work', 'a1'))
+
+        # Children of a task in the inbox each inserted first, between the parent and the work task after it
+        tasks = [Task('work0', 'work', '', 'Work 0', '', '', False, False, 0, 0, 0, 'a0'),
+                 Task('parent', 'inbox', '', 'Parent', '', '', False, False, 0, 0, 0, 'a1'),
+                 Task('work1', 'work', '', 'Work 1', '', '', False, False, 0, 0, 0, 'a2')]
+        sort_key = 'a2'
+        for i in range(100):
+            sort_key = key_between('a1', sort_key)
+            tasks.append(Task('child{}'.format(i), 'inbox', 'parent', 'Child {}'.format(i), '', '', False, i % 3 == 0,
+                              0, 0, 0, sort_key))
+        db.upsert_tasks(tasks)
+        ids = [t.id for t in sorted(db.get_tasks(), key=lambda t: t.sort_key)]
+        inbox_ids = [t.id for t in db.get_tasks(list_id='inbox')]
+
+        check_result = check_sort_keys(db)
+        self.assertEqual(['inbox'], check_result.crowded_list_ids)
+        self.assertIn('Found 1 task lists', str(check_result))
+
+        # Setting the cancel event before the writes leaves the keys
+        cancel_event = threading.Event()
+        cancel_event.set()
+        result = renormalize_sort_keys(db, cancel_event=cancel_event)
+        self.assertEqual((['inbox'], 0), (result.crowded_list_ids, result.rewritten_key_count))
+
+        # The tasks of the inbox are spread between the keys of the work tasks around them, which are kept
+        progress = []
+        result = renormalize_sort_keys(db, progress=lambda done, total: progress.append((done, total)))
+        self.assertEqual(['inbox'], result.crowded_list_ids)
+        self.assertEqual(101, result.rewritten_key_count)
+        self.assertIn('Rewrote 101 sort keys', str(result))
+        self.assertEqual([(101, 101)], progress)
+        tasks = db.get_tasks()
+        self.assertLessEqual(max(len(t.sort_key) for t in tasks), 4)
+        self.assertEqual(['a0', 'a2'], [t.sort_key for t in db.get_tasks(list_id='work')])
+        self.assertEqual(ids, [t.id for t in sorted(tasks, key=lambda t: t.sort_key)])
+        self.assertEqual(inbox_ids, [t.id for t in db.get_tasks(list_id='inbox')])
+        self.assertEqual(34, len(db.get_tasks(archived=True)))
+        self.assertEqual([], db.verify_tree())
+
+        # Every list counts as crowded without a length, then all tasks get consecutive keys, once
+        self.assertEqual([], check_sort_keys(db).crowded_list_ids)
+        result = renormalize_sort_keys(db, max_key_length=0)
+        self.assertEqual(['inbox', 'work'], result.crowded_list_ids)
+        self.assertEqual(ids, [t.id for t in sorted(db.get_tasks(), key=lambda t: t.sort_key)])
+        self.assertEqual(0, renormalize_sort_keys(db, max_key_length=0).rewritten_key_count)
+
+        # Cancelling between the writes rolls them back
+        sort_keys = {t.id: t.sort_key for t in db.get_tasks()}
+        db.upsert_task(Task('work2', 'work', '', 'Work 2', '', '', False, False, 0, 0, 0, 'z' + 'V' * 30))
+        cancel_event = threading.Event()
+        with self.assertRaises(RuntimeError):
+            renormalize_sort_keys(db, max_key_length=0, cancel_event=cancel_event,
+                                  progress=lambda done, total: cancel_event.set())
+        self.assertEqual(sort_keys, {t.id: t.sort_key for t in db.get_tasks() if t.id != 'work2'})
+        self.assertEqual('z' + 'V' * 30, db.get_tasks(id_='work2')[0].sort_key)
+        db.close()
+        for path in (db_path, archive_path):
+            os.remove(path)
+
+    def test_sorted_keys(self):
+        # The same runs and keys with columns of NumPy arrays and of plain arrays
+        sort_key = 'a2'
+        rows = [('work0', 'work', False, False, 0, 0, 0, 'a0'), ('parent', 'inbox', False, False, 0, 0, 0, 'a1'),
+                ('work1', 'work', False, False, 0, 0, 0, 'a2'), ('other', 'other', False, False, 0, 0, 0, 'a3')]
+        for i in range(100):
+            sort_key = key_between('a1', sort_key)
+            rows.append(('child{}'.format(i), 'inbox', False, False, 0, 0, 0, sort_key))
+        rows.append(('last', 'inbox', False, False, 0, 0, 0, 'a4'))
+        tasklists = [TaskList('inbox', 'Inbox', 'a0'), TaskList('work', 'Work', 'a1' + 'V' * 20)]
+        results = []
+        for use_numpy in ([False, True] if task_columns.numpy is not None else [False]):
+            sorted_keys = _SortedKeys(TaskColumns.from_rows(rows, use_numpy=use_numpy), tasklists, 16)
+            results.append((sorted_keys.crowded_list_ids, list(sorted_keys.runs()), sorted_keys.new_keys()))
+        self.assertEqual(['inbox', 'work'], results[0][0])
+        self.assertEqual([(1, 102), (104, 105)], results[0][1])
+        self.assertEqual(102, len(results[0][2]))
+        self.assertEqual(results[0], results[-1])
+
+    def test_engine(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        engine = TaskEngine(db)
+        engine.add_tasklist('Inbox')
+        engine.add_tasklist('Work')
+        engine.add_task(name='Parent')
+        parent_id = engine.selected_task.id
+        for i in range(100):
+            engine.select_task(parent_id)
+            engine.add_task(name='Child {}'.format(i), to=InsertTo.FIRST_CHILD)
+        names = [t.name for t in engine.shown_tasks]
+
+        progress = []
+        result = engine.renormalize_sort_keys(progress=lambda done, total: progress.append((done, total)))
+        self.assertEqual([engine.selected_tasklist.id], result.crowded_list_ids)
+        self.assertEqual([(result.rewritten_key_count, result.rewritten_key_count)], progress)
+        self.assertEqual('Work', engine.selected_tasklist.name)
+        self.assertEqual('Child 99', engine.selected_task.name)
+        self.assertEqual(names, [t.name for t in engine.shown_tasks])
+        self.assertLessEqual(max(len(t.sort_key) for t in engine.shown_tasks), 3)
+
+        # The engine goes on with the new keys
+        engine.select_task(parent_id)
+        engine.add_task(name='Child 100', to=InsertTo.FIRST_CHILD)
+        self.assertEqual(['Parent', 'Child 100', 'Child 99'], [t.name for t in engine.shown_tasks[:3]])
+        db.close()
+        os.remove(db_path)
+
+    def test_scheduler(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        db.upsert_tasklist(TaskList('inbox', 'Inbox', 'a0'))
+        db.upsert_task(Task('task', 'inbox', '', 'Task', '', '', False, False, 0, 0, 0, 'a0' + 'V' * 20))
+        now = 1000.0
+        callbacks: List[Callable[[], None]] = []
+        results = []
+        scheduler = SortKeyCheckScheduler(db, interval_s=100, idle_s=10, on_done=results.append, clock=lambda: now)
+        scheduler.start(lambda ms, callback: callbacks.append(callback))
+
+        # Only checks, the keys are left to the engine
+        now += 10
+        callbacks.pop()()
+        while scheduler.running:
+            time.sleep(0.001)
+            callbacks.pop()()
+        self.assertEqual(['inbox'], [r.crowded_list_ids[0] for r in results])
+        self.assertEqual('a0' + 'V' * 20, db.get_tasks()[0].sort_key)
+
+        scheduler.close()
+        callbacks.pop()()
+        db.close()
+        os.remove(db_path)
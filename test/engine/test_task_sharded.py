@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sqlite3
+import sys
+from unittest import TestCase
+
+from my_todo_app.engine.order_key import key_from_number
+from my_todo_app.engine.task import Task, TaskList, TaskListStats
+from my_todo_app.engine.task_sharded import ShardedTaskDatabase, _CATALOG_MIGRATIONS
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+
+class TestShardedTaskDatabase(TestCase):
+
+    def _create_db(self, func_name: str) -> ShardedTaskDatabase:
+        class_name = self.__class__.__name__
+        directory = os.path.join(os.path.dirname(__file__), '{}_{}'.format(class_name, func_name))
+        shutil.rmtree(directory, ignore_errors=True)
+        db = ShardedTaskDatabase(directory, max_open_shards=2)
+        for i, list_id in enumerate(['inbox', 'next_action', 'someday']):
+            db.upsert_tasklist(TaskList(list_id, list_id.title(), i))
+        db.upsert_tasks([
+            Task('task1', 'inbox', '', 'Task 1', '', 'memo 1', False, False, 0, 0, 0, 1),
+            Task('task1_1', 'inbox', 'task1', 'Task 1-1', '', '', False, False, 0, 0, 0, 2),
+            Task('task1_1_1', 'inbox', 'task1_1', 'Task 1-1-1', '', '', False, True, 0, 0, 0, 3),
+            Task('task2', 'next_action', '', 'Task 2', '', 'memo 2', False, False, 0, 0, 0, 4),
+            Task('task3', 'someday', '', 'Task 3', '', '', True, False, 0, 0, 0, 0),
+        ])
+        return db
+
+    def test_routing(self):
+        db = self._create_db(sys._getframe().f_code.co_name)
+        self.assertEqual(['inbox', 'next_action', 'someday'], db.get_shard_list_ids())
+        self.assertEqual(['inbox', 'next_action', 'someday'], [t.id for t in db.get_tasklists()])
+        self.assertEqual(['task1', 'task1_1', 'task1_1_1'], [t.id for t in db.get_tasks(list_id='inbox')])
+        self.assertEqual(['task1', 'task1_1'], [t.id for t in db.get_tasks(list_id='inbox', archived=False)])
+        self.assertEqual(['task3', 'task1', 'task2'], [t.id for t in db.get_tasks(parent_task_id='')])
+        self.assertEqual(['task3'], [t.id for t in db.get_tasks(completed=True)])
+        self.assertEqual([], db.get_tasks(id_='task2', list_id='inbox'))
+
+        # Lists that are not in use are closed, memos are loaded through the sharded database
+        task2 = db.get_tasks(id_='task2', with_memo=False)[0]
+        db.get_tasks(list_id='inbox')
+        db.get_tasks(list_id='someday')
+        self.assertEqual(['inbox', 'someday'], list(db._shards))
+        self.assertEqual('memo 2', task2.memo)
+
+        self.assertEqual('task3', db.get_first_task().id)
+        self.assertEqual('task2', db.get_first_task(sort_key_after=3).id)
+        self.assertEqual('task1', db.get_last_task(parent_task_id='', sort_key_before=4).id)
+        self.assertEqual('task1_1', db.get_first_task(parent_task_id='task1').id)
+        self.assertEqual(['task1', 'task1_1', 'task1_1_1'], [t.id for t in db.get_subtree('task1')])
+        self.assertEqual(['task1_1', 'task1'], [t.id for t in db.get_ancestors('task1_1_1')])
+        self.assertTrue(db.is_ancestor('task1', 'task1_1_1'))
+        self.assertEqual(['task2'], [r.task.id for r in db.search('memo 2')])
+        self.assertEqual(['task1'], [r.task.id for r in db.search('memo', list_id='inbox')])
+        self.assertEqual(5, len(list(db.iter_tasks())))
+        self.assertEqual({'inbox': TaskListStats(2, 0, 1), 'next_action': TaskListStats(1, 0, 0),
+                          'someday': TaskListStats(0, 1, 0)}, db.get_list_stats())
+        self.assertEqual({0: 0, 10: 3}, db.get_age_stats(10, [0, 10]))
+        self.assertEqual({0: 2}, db.get_age_stats(10, [0], list_id='inbox'))
+
+        # Upserting a task with another list moves it alone
+        db.upsert_task(Task('task2', 'someday', '', 'Task 2', '', 'memo 2', False, False, 0, 0, 0, 4))
+        self.assertEqual(['task3', 'task2'], [t.id for t in db.get_tasks(list_id='someday')])
+        self.assertEqual([], db.get_tasks(list_id='next_action'))
+
+        db.delete_subtree('task1_1')
+        db.delete_task('task3')
+        self.assertEqual(['task1', 'task2'], [t.id for t in db.get_tasks()])
+        self.assertIsNone(db.get_first_task(parent_task_id='task1'))
+
+        # The catalog can be recomputed from the shards
+        db._catalog.clear_locations()
+        self.assertEqual([], db.get_tasks(id_='task1'))
+        db.rebuild_locations()
+        self.assertEqual('memo 1', db.get_memo('task1'))
+        db.close()
+        shutil.rmtree(db.directory)
+
+    def test_move_subtree(self):
+        db = self._create_db(sys._getframe().f_code.co_name)
+        db.move_subtree('task1', 'someday', 100)
+        self.assertEqual([], db.get_tasks(list_id='inbox'))
+        tasks = db.get_tasks(list_id='someday')
+        self.assertEqual(['task3', 'task1', 'task1_1', 'task1_1_1'], [t.id for t in tasks])
+        self.assertEqual(['someday', 100], [tasks[1].list_id, tasks[1].updated_at])
+        self.assertEqual('memo 1', db.get_memo('task1'))
+        self.assertEqual(['task1_1', 'task1'], [t.id for t in db.get_ancestors('task1_1_1')])
+        self.assertEqual(['task1'], [r.task.id for r in db.search('memo 1', list_id='someday')])
+        with db._using('someday') as shard:
+            self.assertEqual([], shard.verify_tree())
+        self.assertEqual({'next_action': TaskListStats(1, 0, 0), 'someday': TaskListStats(2, 1, 1)},
+                         db.get_list_stats())
+
+        # A sub task becomes a root of the other list
+        db.move_subtree('task1_1', 'inbox', 200)
+        self.assertEqual(['task1_1', 'task1_1_1'], [t.id for t in db.get_subtree('task1_1')])
+        self.assertEqual([], db.get_ancestors('task1_1'))
+        self.assertEqual(['task1'], [t.id for t in db.get_subtree('task1')])
+        for list_id in ('inbox', 'someday'):
+            with db._using(list_id) as shard:
+                self.assertEqual([], shard.verify_tree())
+
+        with self.assertRaises(RuntimeError):
+            with db.transaction():
+                db.move_subtree('task1', 'inbox', 300)
+        self.assertEqual('someday', db.get_tasks(id_='task1')[0].list_id)
+
+        # A failed transaction writes no file
+        with self.assertRaises(ValueError):
+            with db.transaction():
+                db.upsert_task(Task('task4', 'next_action', '', 'Task 4', '', '', False, False, 0, 0, 0, 5))
+                db.delete_task('task3')
+                raise ValueError()
+        self.assertEqual([], db.get_tasks(id_='task4'))
+        self.assertEqual(['task3'], [t.id for t in db.get_tasks(id_='task3')])
+        db.close()
+        shutil.rmtree(db.directory)
+
+    def test_catalog_migrations(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        directory = os.path.join(os.path.dirname(__file__), '{}_{}'.format(class_name, func_name))
+        shutil.rmtree(directory, ignore_errors=True)
+
+        # A catalog from before its schema was versioned, with a location of a number sort key
+        catalog_path = os.path.join(directory, 'catalog.sqlite3')
+        SQLite3TaskDatabase(catalog_path).close()
+        conn = sqlite3.connect(catalog_path)
+        conn.execute('create table task_locations (id text primary key not null, list_id text not null, '
+                     'parent_task_id text, sort_key float)')
+        conn.execute("insert into task_locations values ('task1', 'inbox', '', 2.5)")
+        conn.commit()
+        conn.close()
+
+        db = ShardedTaskDatabase(directory)
+        self.assertEqual([(key_from_number(2.5),)], db._catalog._conn.execute(
+            'select sort_key from task_locations').fetchall())
+        self.assertEqual('TEXT', dict(row[1:3] for row in db._catalog._conn.execute(
+            'pragma table_info(task_locations)'))['sort_key'])
+        self.assertEqual((len(_CATALOG_MIGRATIONS),), db._catalog._conn.execute(
+            'select max(version) from catalog_schema_version').fetchone())
+        db.close()
+
+        # Opening it again applies nothing
+        db = ShardedTaskDatabase(directory)
+        self.assertEqual(len(_CATALOG_MIGRATIONS), db._catalog._conn.execute(
+            'select count(*) from catalog_schema_version').fetchone()[0])
+        db.close()
+        shutil.rmtree(directory)
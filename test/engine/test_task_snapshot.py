@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+from unittest import TestCase
+
+from my_todo_app.engine.task import TaskList, Task
+from my_todo_app.engine.task_snapshot import SnapshotTaskDatabase, write_snapshot
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+
+
+class TestTaskSnapshot(TestCase):
+
+    def test_snapshot(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        snapshot_path = os.path.join(os.path.dirname(__file__), '{}_{}.snapshot'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = SQLite3TaskDatabase(db_path)
+        db.upsert_tasklist(TaskList('inbox', 'Inbox', 'a0'))
+        db.upsert_tasklist(TaskList('next_action', 'ネクスト', 'a1'))
+        db.upsert_tasks([
+            Task('task1', 'inbox', '', 'Task 1', 'a', '', False, False, 10, 11, 0, 'a1'),
+            Task('task2', 'inbox', '', 'Task 2', '', 'memo ' * 200, True, False, 10, 11, 12, 'a2'),
+            Task('task2_1', 'inbox', 'task2', 'タスク', 'b c', 'short', False, True, 10, 11, 0, 'a0V'),
+            Task('task2_2', 'inbox', 'task2', 'Task 2-2', '', '', False, False, 10, 11, 0, 'a3'),
+            Task('task3', 'next_action', '', 'Task 3', '', '', False, False, 10, 11, 0, 'Zz'),
+        ])
+        write_snapshot(db, snapshot_path, batch_size=2)
+        # Writes after the snapshot are not in it
+        db.upsert_task(Task('task4', 'inbox', '', 'Task 4', '', '', False, False, 10, 11, 0, 'a4'))
+        db.delete_task('task4')
+
+        snapshot = SnapshotTaskDatabase(snapshot_path)
+        for expected, actual in zip(db.get_tasklists(), snapshot.get_tasklists()):
+            self.assertTrue(expected.equals(actual))
+        self.assertEqual(['next_action'], [t.id for t in snapshot.get_tasklists(id_='next_action')])
+        queries = [{}, {'id_': 'task2_1'}, {'id_': 'nothing'}, {'list_id': 'inbox'}, {'parent_task_id': ''},
+                   {'parent_task_id': 'task2'}, {'parent_task_id': 'task2', 'archived': False},
+                   {'list_id': 'inbox', 'completed': True}, {'list_id': 'next_action', 'parent_task_id': 'task2'}]
+        for query in queries:
+            expected = db.get_tasks(**query)
+            actual = snapshot.get_tasks(**query)
+            self.assertEqual([t.id for t in expected], [t.id for t in actual], query)
+            for expected_task, actual_task in zip(expected, actual):
+                self.assertTrue(expected_task.equals(actual_task), query)
+        task = snapshot.get_tasks(id_='task2', with_memo=False)[0]
+        self.assertFalse(task.memo_is_loaded)
+        self.assertEqual('memo ' * 200, task.memo)
+
+        self.assertEqual('task3', snapshot.get_first_task().id)
+        self.assertEqual('task2_2', snapshot.get_last_task().id)
+        self.assertEqual('task2_1', snapshot.get_first_task(parent_task_id='task2').id)
+        self.assertEqual('task2_2', snapshot.get_first_task(parent_task_id='task2', sort_key_after='a0V').id)
+        self.assertIsNone(snapshot.get_first_task(parent_task_id='task2', sort_key_after='a3'))
+        self.assertEqual('task1', snapshot.get_last_task(parent_task_id='', sort_key_before='a2').id)
+        self.assertIsNone(snapshot.get_last_task(parent_task_id='task1'))
+        self.assertEqual(['task2', 'task2_1', 'task2_2'], [t.id for t in snapshot.get_subtree('task2')])
+
+        with self.assertRaises(RuntimeError):
+            snapshot.upsert_task(task)
+        snapshot.close()
+        db.close()
+        os.remove(snapshot_path)
+        os.remove(db_path)
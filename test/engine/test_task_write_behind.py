@@ -0,0 +1,142 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import sys
+import time
+import uuid
+from unittest import TestCase
+
+from my_todo_app.engine.task import TaskList, Task
+from my_todo_app.engine.task_sqlite3 import SQLite3TaskDatabase
+from my_todo_app.engine.task_write_behind import WriteBehindTaskDatabase
+
+
+class TestWriteBehindTaskDatabase(TestCase):
+
+    def test_coalesce(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = WriteBehindTaskDatabase(SQLite3TaskDatabase(db_path), delay=60)
+        another_conn = sqlite3.connect(db_path)
+
+        def get_committed_names():
+            return [row[0] for row in another_conn.execute('select name from tasks order by sort_key')]
+
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        db.upsert_tasklist(inbox)
+        task1 = Task('task1', inbox.id, '', 'Task 1', '', 'Memo', False, False, 10, 10, 0, 0)
+        task2 = Task('task2', inbox.id, '', 'Task 2', '', '', False, False, 10, 10, 0, 1)
+        db.upsert_tasks([task1, task2])
+        db.flush()
+        self.assertEqual(['Task 1', 'Task 2'], get_committed_names())
+
+        # Repeated upserts are held and merged, reads see them
+        for i in range(5):
+            task1.name = 'Typing {}'.format(i)
+            db.upsert_task(task1)
+        memo_less_task2 = db.get_tasks(id_=task2.id, with_memo=False)[0]
+        memo_less_task2.sort_key = -1
+        db.upsert_task(memo_less_task2)
+        task1.name = 'Changed after upsert'
+        self.assertEqual(2, db.pending_count)
+        self.assertEqual(['Task 1', 'Task 2'], get_committed_names())
+        self.assertEqual(['Task 2', 'Typing 4'], [t.name for t in db.get_tasks(list_id=inbox.id)])
+        self.assertEqual([], db.get_tasks(list_id='another'))
+        self.assertEqual('Memo', db.get_memo(task1.id))
+        self.assertFalse(db.get_tasks(id_=task1.id, with_memo=False)[0].memo_is_loaded)
+
+        # Reads that can not see held upserts flush them first
+        self.assertEqual('task2', db.get_first_task().id)
+        self.assertEqual(0, db.pending_count)
+        self.assertEqual(['Task 2', 'Typing 4'], get_committed_names())
+        self.assertEqual('Memo', db.get_memo(task1.id))
+
+        # Other writes flush held upserts first
+        task1.name = 'Deleted'
+        db.upsert_task(task1)
+        db.delete_task(task1.id)
+        self.assertEqual(['Task 2'], get_committed_names())
+
+        # Held upserts are flushed on close
+        task2.name = 'Closing'
+        db.upsert_task(task2)
+        db.close()
+        self.assertEqual(['Closing'], get_committed_names())
+
+        another_conn.close()
+        os.remove(db_path)
+
+    def test_timer(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        db = WriteBehindTaskDatabase(SQLite3TaskDatabase(db_path), delay=0.05)
+
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', 0)
+        db.upsert_tasklist(inbox)
+        db.upsert_task(Task('task1', inbox.id, '', 'Task 1', '', '', False, False, 10, 10, 0, 0))
+        self.assertEqual(1, db.pending_count)
+        for _ in range(100):
+            if db.pending_count == 0:
+                break
+            time.sleep(0.05)
+        self.assertEqual(0, db.pending_count)
+
+        # Writes in a transaction are not held
+        with db.transaction():
+            db.upsert_task(Task('task2', inbox.id, '', 'Task 2', '', '', False, False, 10, 10, 0, 1))
+            self.assertEqual(0, db.pending_count)
+
+        db.close()
+        os.remove(db_path)
+
+    def test_timer_error(self):
+        class_name = self.__class__.__name__
+        func_name = sys._getframe().f_code.co_name
+        db_path = os.path.join(os.path.dirname(__file__), '{}_{}.sqlite3'.format(class_name, func_name))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        sqlite3_db = SQLite3TaskDatabase(db_path)
+        errors = []
+        db = WriteBehindTaskDatabase(sqlite3_db, delay=0.05, on_error=errors.append)
+
+        # The first two flushes by the timer fail, the upsert is kept and written by the third
+        upsert_tasks = sqlite3_db.upsert_tasks
+        failures = [sqlite3.OperationalError('database is locked')] * 2
+
+        def failing_upsert_tasks(tasks):
+            if failures:
+                raise failures.pop()
+            upsert_tasks(tasks)
+
+        sqlite3_db.upsert_tasks = failing_upsert_tasks
+        inbox = TaskList(str(uuid.uuid4()), 'Inbox', '0')
+        db.upsert_tasklist(inbox)
+        db.upsert_task(Task('task1', inbox.id, '', 'Task 1', '', '', False, False, 10, 10, 0, '0'))
+        for _ in range(100):
+            if db.pending_count == 0:
+                break
+            time.sleep(0.05)
+        self.assertEqual(0, db.pending_count)
+        self.assertEqual(['database is locked'] * 2, [str(e) for e in errors])
+        self.assertEqual(['task1'], [t.id for t in sqlite3_db.get_tasks()])
+
+        # A flush called directly raises
+        failures.append(sqlite3.OperationalError('disk I/O error'))
+        db.upsert_task(Task('task2', inbox.id, '', 'Task 2', '', '', False, False, 10, 10, 0, '1'))
+        with self.assertRaisesRegex(sqlite3.OperationalError, 'disk I/O error'):
+            db.flush()
+        self.assertEqual(1, db.pending_count)
+
+        db.close()
+        db = SQLite3TaskDatabase(db_path)
+        self.assertEqual(['task1', 'task2'], [t.id for t in db.get_tasks()])
+        db.close()
+        os.remove(db_path)